@@ -23,8 +23,9 @@ confidence intervals (percentile bootstrap).
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from py_depthsampling.boot.boot_plot_diff import boot_plot
-# from py_depthsampling.boot.boot_plot_diff_sngl_sub import boot_plot_sngl
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # -----------------------------------------------------------------------------
@@ -92,96 +93,61 @@ varCnfUp = 95.0
 
 # Padding around labelled values on y:
 tplPadY = (0.05, 0.05)
-# ---------------------------1--------------------------------------------------
+
+# Number of CPUs & memory (MB) for all analyses together (`None` for all CPUs
+# & no memory limit):
+varCpuMax = None
+varMemMax = None
+
+# State file for resuming the batch after a crash (records of finished
+# analyses; `None` to always run all analyses):
+strState = None
+# -----------------------------------------------------------------------------
 
 
 # -----------------------------------------------------------------------------
 # *** Loop through ROIs / conditions
 
-# Loop through models, ROIs, hemispheres, and conditions to create plots:
-for idxMtaCn in range(len(lstMetaCon)):  #noqa
-    for idxMdl in range(len(lstMdl)):  #noqa
-        for idxRoi in range(len(lstRoi)):
-            for idxHmsph in range(len(lstHmsph)):
-
-                # Limits of axes need to be adjusted based on ROI,
-                # condition, hemisphere.
-
-                if idxRoi == 0:  # v1
-
-                    if lstMetaCon[idxMtaCn] == 'stimulus':
-                        if lstMdl[idxMdl] == '':
-                            varYmin = -0.5
-                            varYmax = 0.75
-                        if lstMdl[idxMdl] == '_deconv_model_1':
-                            varYmin = -0.5
-                            varYmax = 0.75
-                    if lstMetaCon[idxMtaCn] == 'periphery':
-                        if lstMdl[idxMdl] == '':
-                            varYmin = -0.5
-                            varYmax = 0.75
-                        if lstMdl[idxMdl] == '_deconv_model_1':
-                            varYmin = -0.5
-                            varYmax = 0.75
-
-                elif (idxRoi == 1) or (idxRoi == 3):  # v2 & v3
-
-                    if lstMetaCon[idxMtaCn] == 'stimulus':
-                        if lstMdl[idxMdl] == '':
-                            varYmin = -0.5
-                            varYmax = 0.75
-                        if lstMdl[idxMdl] == '_deconv_model_1':
-                            varYmin = -0.5
-                            varYmax = 0.75
-                    if lstMetaCon[idxMtaCn] == 'periphery':
-                        if lstMdl[idxMdl] == '':
-                            varYmin = -0.5
-                            varYmax = 0.75
-                        if lstMdl[idxMdl] == '_deconv_model_1':
-                            varYmin = -0.5
-                            varYmax = 0.75
-
-                # Create average plots:
-                boot_plot(strPthData.format(lstMetaCon[idxMtaCn],
-                                            lstRoi[idxRoi],
-                                            lstHmsph[idxHmsph],
-                                            '{}',
-                                            lstMdl[idxMdl]),
-                          (strPthPltOt.format(lstMetaCon[idxMtaCn],
-                                              lstRoi[idxRoi],
-                                              lstHmsph[idxHmsph],
-                                              lstMdl[idxMdl])
+# Limits of axes can be adjusted based on draining model (identical for all
+# meta-conditions, ROIs, and hemispheres):
+dicLimY = {'': {'varYmin': -0.5, 'varYmax': 0.75},
+           '_deconv_model_1': {'varYmin': -0.5, 'varYmax': 0.75}}
+
+# One job per meta-condition, model, ROI, and hemisphere (see
+# `py_depthsampling.main.batch`):
+dicSpec = {'jobs': [{
+    'function': 'boot_plot',
+    'params': {'objDpth': strPthData.format('${_strMetaCon}', '${_strRoi}',
+                                            '${_strHmsph}', '{}',
+                                            '${_strMdl}'),
+               'strPath': (strPthPltOt.format('${_strMetaCon}', '${_strRoi}',
+                                              '${_strHmsph}', '${_strMdl}')
                            + strFlTp),
-                          lstCon,
-                          lstConLbl,
-                          varNumIt=varNumIt,
-                          varConLw=varCnfLw,
-                          varConUp=varCnfUp,
-                          strTtl='',
-                          varYmin=varYmin,
-                          varYmax=varYmax,
-                          tplPadY=tplPadY,
-                          strXlabel=strXlabel,
-                          strYlabel=strYlabel,
-                          lgcLgnd=True,
-                          lstDiff=lstDiff,
-                          strParam=strParam)
-
-            # Create single subject plot(s):
-            # boot_plot_sngl(strPthData.format(lstMetaCon[idxMtaCn],
-            #                                  lstRoi[idxRoi],
-            #                                  lstHmsph[idxHmsph],
-            #                                  '{}',
-            #                                  lstMdl[idxMdl]),
-            #                (strPthPtlSnglOt.format(lstRoi[idxRoi],
-            #                                        lstMetaCon[idxMtaCn],
-            #                                        lstHmsph[idxHmsph],
-            #                                        lstMdl[idxMdl],
-            #                                        '{}')
-            #                 + strFlTp),
-            #                lstCon,
-            #                lstConLbl,
-            #                strXlabel='Cortical depth level (equivolume)',
-            #                strYlabel='Subject',
-            #                lstDiff=lstDiff)
+               'lstCon': lstCon,
+               'lstConLbl': lstConLbl,
+               'varNumIt': varNumIt,
+               'varConLw': varCnfLw,
+               'varConUp': varCnfUp,
+               'strTtl': '',
+               'tplPadY': tplPadY,
+               'strXlabel': strXlabel,
+               'strYlabel': strYlabel,
+               'lgcLgnd': True,
+               'lstDiff': lstDiff,
+               'strParam': strParam},
+    'loops': {'_strMetaCon': lstMetaCon,
+              'mdl': [dict(dicLimY[strMdl], _strMdl=strMdl,
+                           _name=(strMdl or 'none'))
+                      for strMdl in lstMdl],
+              '_strRoi': lstRoi,
+              '_strHmsph': lstHmsph}}]}
+
+if __name__ == "__main__":
+
+    # Run analyses (in parallel, within CPU & memory budget):
+    lstRec = run_jobs(expand_jobs(dicSpec), varCpuMax=varCpuMax,
+                      varMemMax=varMemMax, strState=strState)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
 # -----------------------------------------------------------------------------
@@ -19,7 +19,11 @@
 
 import numpy as np
 import multiprocessing as mp
-from ds_crfParBoot02 import crf_par_02
+from ds_crfParBoot02 import crf_par_shm
+from py_depthsampling.main.shm_arrays import shm_create
+from py_depthsampling.main.shm_arrays import shm_free
+from py_depthsampling.main.shm_arrays import shm_get
+from py_depthsampling.main.shm_arrays import shm_put
 
 
 def crf_par_01(aryDpth, vecEmpX, strFunc='power', varNumIt=1000, varPar=10,
@@ -69,7 +73,9 @@ def crf_par_01(aryDpth, vecEmpX, strFunc='power', varNumIt=1000, varPar=10,
     Notes
     -----
     This function parallelises the contrast response function fitting by
-    calling a second-level function using the multiprocessing module.
+    calling a second-level function using the multiprocessing module. The
+    empirical data and the results are exchanged with the parallel processes
+    through shared memory arrays.
 
     Function of the depth sampling pipeline.
     """
@@ -97,15 +103,9 @@ def crf_par_01(aryDpth, vecEmpX, strFunc='power', varNumIt=1000, varPar=10,
 
     print('---Creating parallel processes')
 
-    # Empty list for results:
-    lstOut = [None for i in range(varPar)]
-
     # Empty list for processes:
     lstPrc = [None for i in range(varPar)]
 
-    # Create a queue to put the results in:
-    queOut = mp.Queue()
-
     # List into which the chunks of the randomisation-array for the parallel
     # processes will be put:
     lstRnd = [None for i in range(varPar)]
@@ -130,70 +130,68 @@ def crf_par_01(aryDpth, vecEmpX, strFunc='power', varNumIt=1000, varPar=10,
     # We don't need the original array with the functional data anymore:
     del(aryRnd)
 
-    # Create processes:
-    for idxPrc in range(0, varPar):
-        lstPrc[idxPrc] = mp.Process(target=crf_par_02,
-                                    args=(idxPrc,
-                                          aryDpth,
-                                          vecEmpX,
-                                          strFunc,
-                                          lstRnd[idxPrc],
-                                          varNumX,
-                                          queOut))
-        # Daemon (kills processes when exiting):
-        lstPrc[idxPrc].Daemon = True
-
-    # Start processes:
-    for idxPrc in range(0, varPar):
-        lstPrc[idxPrc].start()
-
-    # Collect results from queue:
-    for idxPrc in range(0, varPar):
-        lstOut[idxPrc] = queOut.get(True)
-
-    # Join processes:
-    for idxPrc in range(0, varPar):
-        lstPrc[idxPrc].join()
-
-    # ------------------------------------------------------------------------
-    # *** Collect results
-
-    print('---Collecting results from parallel processes')
-
-    # List for results from parallel processes, in order to join the results:
-    lstMdlY = [None for i in range(varPar)]
-    lstHlfMax = [None for i in range(varPar)]
-    lstSemi = [None for i in range(varPar)]
-    lstRes = [None for i in range(varPar)]
-
-    # Put output into correct order:
-    for idxPrc in range(0, varPar):
-
-        # Index of results (first item in output list):
-        varTmpIdx = lstOut[idxPrc][0]
-
-        # Put fitting results into list, in correct order:
-        lstMdlY[varTmpIdx] = lstOut[idxPrc][1]
-        lstHlfMax[varTmpIdx] = lstOut[idxPrc][2]
-        lstSemi[varTmpIdx] = lstOut[idxPrc][3]
-        lstRes[varTmpIdx] = lstOut[idxPrc][4]
-
-    # Concatenate output vectors (into the same order as the voxels that were
-    # included in the fitting):
-
-    # Arrays for y-values of fitted function (for each iteration & depth
-    # level):
-    # aryMdlY = np.zeros((varNumIn, varNumIt, varNumDpt, varNumX))
-    # Array for responses at half maximum contrast:
-    # aryHlfMax = np.zeros((varNumIn, varNumIt, varNumDpt))
-    # List of vectors for semisaturation contrast:
-    # arySemi = np.zeros((varNumIn, varNumIt, varNumDpt))
-    # List of arrays for residual variance:
-    # aryRes = np.zeros((varNumIn, varNumIt, varNumCon, varNumDpt))
-    for idxPrc in range(0, varPar):
-        aryMdlY = np.concatenate(lstMdlY, axis=1)
-        aryHlfMax = np.concatenate(lstHlfMax, axis=1)
-        arySemi = np.concatenate(lstSemi, axis=1)
-        aryRes = np.concatenate(lstRes, axis=1)
+    # Number of inputs (ROIs), conditions, and depth levels:
+    varNumIn = aryDpth.shape[0]
+    varNumCon = aryDpth.shape[2]
+    varNumDpt = aryDpth.shape[3]
+
+    # The empirical data are placed in shared memory, and the processes write
+    # their results directly into shared memory arrays (y-values of fitted
+    # function, responses at half maximum contrast, semisaturation contrast,
+    # and residual variance; see `py_depthsampling.main.shm_arrays`):
+    dicShmDpth = shm_put(aryDpth)
+    lstShmOt = [shm_create((varNumIn, varNumIt, varNumDpt, varNumX)),
+                shm_create((varNumIn, varNumIt, varNumDpt)),
+                shm_create((varNumIn, varNumIt, varNumDpt)),
+                shm_create((varNumIn, varNumIt, varNumCon, varNumDpt))]
+
+    try:
+
+        # Create processes:
+        for idxPrc in range(0, varPar):
+            lstPrc[idxPrc] = mp.Process(target=crf_par_shm,
+                                        args=(idxPrc,
+                                              dicShmDpth,
+                                              vecEmpX,
+                                              strFunc,
+                                              lstRnd[idxPrc],
+                                              varNumX,
+                                              lstShmOt,
+                                              int(vecIdxChnks[idxPrc])))
+            # Daemon (kills processes when exiting):
+            lstPrc[idxPrc].Daemon = True
+
+        # Start processes:
+        for idxPrc in range(0, varPar):
+            lstPrc[idxPrc].start()
+
+        # Join processes:
+        for idxPrc in range(0, varPar):
+            lstPrc[idxPrc].join()
+
+        for idxPrc in range(0, varPar):
+            if lstPrc[idxPrc].exitcode != 0:
+                strErrMsg = ('ERROR. CRF fitting failed in parallel process '
+                             + str(idxPrc) + '.')
+                raise ValueError(strErrMsg)
+
+        # --------------------------------------------------------------------
+        # *** Collect results
+
+        print('---Collecting results from parallel processes')
+
+        # Arrays for y-values of fitted function (for each iteration & depth
+        # level), of the form aryMdlY[varNumIn, varNumIt, varNumDpt, varNumX];
+        # for responses at half maximum contrast and for semisaturation
+        # contrast, of the form aryHlfMax[varNumIn, varNumIt, varNumDpt]; and
+        # for residual variance, of the form aryRes[varNumIn, varNumIt,
+        # varNumCon, varNumDpt]:
+        aryMdlY, aryHlfMax, arySemi, aryRes = [shm_get(dicShm)
+                                               for dicShm in lstShmOt]
+
+    finally:
+        shm_free(dicShmDpth)
+        for dicShm in lstShmOt:
+            shm_free(dicShm)
 
     return aryMdlY, aryHlfMax, arySemi, aryRes
@@ -19,6 +19,8 @@
 
 import numpy as np
 from ds_crfFit import crf_fit
+from py_depthsampling.main.shm_arrays import shm_attach
+from py_depthsampling.main.shm_arrays import shm_detach
 
 
 def crf_par_02(idxPrc, aryDpth, vecEmpX, strFunc, aryRnd, varNumX, queOut):
@@ -199,4 +201,59 @@ def crf_par_02(idxPrc, aryDpth, vecEmpX, strFunc, aryRnd, varNumX, queOut):
     # Output list:
     lstOut = [idxPrc, aryMdlY, aryHlfMax, arySemi, aryRes]
 
+    # Return output directly if there is no queue (e.g. when results are
+    # placed in shared memory, see `crf_par_shm`):
+    if queOut is None:
+        return lstOut
+
     queOut.put(lstOut)
+
+
+def crf_par_shm(idxPrc, dicShmDpth, vecEmpX, strFunc, aryRnd, varNumX,
+                lstShmOt, varItSrt):
+    """
+    Parallelised bootstrapping of contrast response function, shared memory.
+
+    Parameters
+    ----------
+    idxPrc : int
+        Process ID of parallel process.
+    dicShmDpth : dict
+        Description of shared memory array with empirical response data, of
+        the form aryDpth[idxRoi, idxSub, idxCon, idxDpt] (see
+        `py_depthsampling.main.shm_arrays`).
+    vecEmpX : np.array
+        Empirical x-values at which model will be fitted (see `crf_par_02`).
+    strFunc : str
+        Which contrast response function to fit (see `crf_par_02`).
+    aryRnd : np.array
+        Array with randomised subject indicies for the iterations of the
+        current process (see `crf_par_02`).
+    varNumX : int
+        Number of x-values for which to solve the function when calculating
+        model fit.
+    lstShmOt : list
+        Descriptions of shared memory arrays for results (aryMdlY, aryHlfMax,
+        arySemi, aryRes, for all iterations, see `crf_par_02`).
+    varItSrt : int
+        Index of first iteration of current process.
+
+    Notes
+    -----
+    The results are written into the shared memory arrays in place (at the
+    iterations of the current process).
+    """
+    aryDpth = shm_attach(dicShmDpth)
+    lstOut = crf_par_02(idxPrc, aryDpth, vecEmpX, strFunc, aryRnd, varNumX,
+                        None)
+    del(aryDpth)
+    shm_detach(dicShmDpth)
+
+    # Number of iterations of current process:
+    varNumIt = aryRnd.shape[0]
+
+    for dicShm, aryTmp in zip(lstShmOt, lstOut[1:]):
+        aryOt = shm_attach(dicShm)
+        aryOt[:, varItSrt:(varItSrt + varNumIt), ...] = aryTmp
+        del(aryOt)
+        shm_detach(dicShm)
@@ -18,12 +18,18 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
-import multiprocessing as mp
 from ds_crfParPerm02 import crf_par_perm_02
+from py_depthsampling.permutation.perm_exec import perm_run
+
+
+# Number of permutations per chunk (CRF fitting is slow, so chunks are small
+# enough to be distributed across processes; fixed, so that the random
+# permutations do not depend on the number of processes):
+VAR_CHNK_CRF = 50
 
 
 def crf_par_perm_01(aryDpth01, aryDpth02, vecEmpX, strFunc='power',
-                    varNumIt=1000, varPar=10, varNumX=1000):
+                    varNumIt=1000, varPar=10, varNumX=1000, varSeed=None):
     """
     Parallelised permutation testing on contrast response function, level 1.
 
@@ -51,6 +57,10 @@ def crf_par_perm_01(aryDpth01, aryDpth02, vecEmpX, strFunc='power',
     varNumX : int
         Number of x-values for which to solve the function when calculating
         model fit.
+    varSeed : int or None
+        Seed for random permutations. If `None`, permutations depend on the
+        global random state (see `perm_exec.perm_run`). With a seed, results
+        do not depend on the number of processes.
 
     Returns
     -------
@@ -72,130 +82,51 @@ def crf_par_perm_01(aryDpth01, aryDpth02, vecEmpX, strFunc='power',
     Notes
     -----
     This function parallelises the contrast response function fitting by
-    calling a second-level function using the multiprocessing module.
+    calling a second-level function on a pool of processes (see
+    `perm_exec.perm_run`).
 
     Function of the depth sampling pipeline.
     """
     # ------------------------------------------------------------------------
-    # *** Prepare resampling
+    # *** Parallelised CRF fitting
 
-    print('---Preparing resampling')
+    print('---Creating parallel processes')
 
     # Get number of subjects from input array:
     varNumSub = aryDpth01.shape[0]
 
-    # Random array that is used to permute V1 and V2 labels within subjects,
-    # of the form aryRnd[idxIteration, idxSub]. For each iteration and subject,
-    # there is either a zero or a one. 'Zero' means that the actual V1 value
-    # gets assigned to the permuted 'V1' group and the actual V2 value gets
-    # assigned to the permuted 'V2' group. 'One' means that the labels are
-    # switched, i.e. the actual V1 label get assignet to the 'V2' group and
-    # vice versa.
-    aryRnd = np.random.randint(0, high=2, size=(varNumIt, varNumSub))
-
-    # ------------------------------------------------------------------------
-    # *** Parallelised CRF fitting
-
-    print('---Creating parallel processes')
-
-    # Empty list for results:
-    lstOut = [None for i in range(varPar)]
-
-    # Empty list for processes:
-    lstPrc = [None for i in range(varPar)]
-
-    # Create a queue to put the results in:
-    queOut = mp.Queue()
-
-    # List into which the chunks of the randomisation-array for the parallel
-    # processes will be put:
-    lstRnd = [None for i in range(varPar)]
-
-    # Vector with the indicies at which the randomisation-array will be
-    # separated in order to be chunked up for the parallel processes:
-    vecIdxChnks = np.linspace(0,
-                              varNumIt,
-                              num=varPar,
-                              endpoint=False)
-    vecIdxChnks = np.hstack((vecIdxChnks, varNumIt))
-
-    # Put randomisation indicies into chunks:
-    for idxChnk in range(0, varPar):
-        # Index of first iteration to be included in current chunk:
-        varTmpChnkSrt = int(vecIdxChnks[idxChnk])
-        # Index of last iteration to be included in current chunk:
-        varTmpChnkEnd = int(vecIdxChnks[(idxChnk+1)])
-        # Put array into list:
-        lstRnd[idxChnk] = aryRnd[varTmpChnkSrt:varTmpChnkEnd, :]
-
-    # We don't need the original randomisation array anymore:
-    del(aryRnd)
-
-    # Create processes:
-    for idxPrc in range(0, varPar):
-        lstPrc[idxPrc] = mp.Process(target=crf_par_perm_02,
-                                    args=(idxPrc,
-                                          aryDpth01,
-                                          aryDpth02,
-                                          vecEmpX,
-                                          strFunc,
-                                          lstRnd[idxPrc],
-                                          varNumX,
-                                          queOut))
-        # Daemon (kills processes when exiting):
-        lstPrc[idxPrc].Daemon = True
-
-    # Start processes:
-    for idxPrc in range(0, varPar):
-        lstPrc[idxPrc].start()
-
-    # Collect results from queue:
-    for idxPrc in range(0, varPar):
-        lstOut[idxPrc] = queOut.get(True)
-
-    # Join processes:
-    for idxPrc in range(0, varPar):
-        lstPrc[idxPrc].join()
+    # Permutations are drawn and fitted in chunks of iterations, on a pool of
+    # parallel processes (see `perm_exec.perm_run`). The permutation matrix of
+    # each chunk is of the form aryRnd[idxIteration, idxSub]. For each
+    # iteration and subject, there is either a zero or a one. 'Zero' means
+    # that the actual V1 value gets assigned to the permuted 'V1' group and the
+    # actual V2 value gets assigned to the permuted 'V2' group. 'One' means
+    # that the labels are switched, i.e. the actual V1 label get assignet to
+    # the 'V2' group and vice versa. Status messages are only printed for the
+    # first chunk.
+    lstOut, _ = perm_run(crf_par_perm_02, varNumSub, varNumIt=varNumIt,
+                         dicKwargs={'aryDpth01': aryDpth01,
+                                    'aryDpth02': aryDpth02,
+                                    'vecEmpX': vecEmpX,
+                                    'strFunc': strFunc,
+                                    'varNumX': varNumX},
+                         varSeed=varSeed, varPar=varPar, varChnk=VAR_CHNK_CRF,
+                         strKeyIdx='idxPrc')
 
     # ------------------------------------------------------------------------
     # *** Collect results
 
     print('---Collecting results from parallel processes')
 
-    # List for results from parallel processes, in order to join the results:
-    lstMdlY = [None for i in range(varPar)]
-    lstHlfMax = [None for i in range(varPar)]
-    lstSemi = [None for i in range(varPar)]
-    lstRes = [None for i in range(varPar)]
-
-    # Put output into correct order:
-    for idxPrc in range(0, varPar):
-
-        # Index of results (first item in output list):
-        varTmpIdx = lstOut[idxPrc][0]
-
-        # Put fitting results into list, in correct order:
-        lstMdlY[varTmpIdx] = lstOut[idxPrc][1]
-        lstHlfMax[varTmpIdx] = lstOut[idxPrc][2]
-        lstSemi[varTmpIdx] = lstOut[idxPrc][3]
-        lstRes[varTmpIdx] = lstOut[idxPrc][4]
-
-    # Concatenate output vectors (into the same order as the voxels that were
-    # included in the fitting):
-
-    # Arrays for y-values of fitted function (for each iteration & depth
-    # level):
-    # aryMdlY = np.zeros((varNumIn, varNumIt, varNumDpt, varNumX))
-    # Array for responses at half maximum contrast:
-    # aryHlfMax = np.zeros((varNumIn, varNumIt, varNumDpt))
-    # List of vectors for semisaturation contrast:
-    # arySemi = np.zeros((varNumIn, varNumIt, varNumDpt))
-    # List of arrays for residual variance:
-    # aryRes = np.zeros((varNumIn, varNumIt, varNumCon, varNumDpt))
-    for idxPrc in range(0, varPar):
-        aryMdlY = np.concatenate(lstMdlY, axis=1)
-        aryHlfMax = np.concatenate(lstHlfMax, axis=1)
-        arySemi = np.concatenate(lstSemi, axis=1)
-        aryRes = np.concatenate(lstRes, axis=1)
+    # Concatenate output arrays (results are returned in chunk order, i.e. in
+    # the order of the iterations). Shape of output arrays:
+    # aryMdlY[idxRoi, idxIteration, idxDpt, idxContrast]
+    # aryHlfMax[idxRoi, idxIteration, idxDpt]
+    # arySemi[idxRoi, idxIteration, idxDpt]
+    # aryRes[idxRoi, idxIteration, idxCondition, idxDpt]
+    aryMdlY = np.concatenate([x[1] for x in lstOut], axis=1)
+    aryHlfMax = np.concatenate([x[2] for x in lstOut], axis=1)
+    arySemi = np.concatenate([x[3] for x in lstOut], axis=1)
+    aryRes = np.concatenate([x[4] for x in lstOut], axis=1)
 
     return aryMdlY, aryHlfMax, arySemi, aryRes
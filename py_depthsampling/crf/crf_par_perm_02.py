@@ -22,7 +22,7 @@ from ds_crfFit import crf_fit
 
 
 def crf_par_perm_02(idxPrc, aryDpth01, aryDpth02, vecEmpX, strFunc, aryRnd,
-                    varNumX, queOut):
+                    varNumX, queOut=None):
     """
     Parallelised permutation testing on contrast response function, level 2.
 
@@ -53,8 +53,8 @@ def crf_par_perm_02(idxPrc, aryDpth01, aryDpth02, vecEmpX, strFunc, aryRnd,
     varNumX : int
         Number of x-values for which to solve the function when calculating
         model fit.
-    queOut : multiprocessing.queues.Queue
-        Queue to put results on.
+    queOut : multiprocessing.queues.Queue or None
+        Queue to put results on. If `None`, results are returned.
 
     Returns
     -------
@@ -236,4 +236,7 @@ def crf_par_perm_02(idxPrc, aryDpth01, aryDpth02, vecEmpX, strFunc, aryRnd,
     # Output list:
     lstOut = [idxPrc, aryMdlY, aryHlfMax, arySemi, aryRes]
 
+    if queOut is None:
+        return lstOut
+
     queOut.put(lstOut)
@@ -36,7 +36,9 @@ according to several criteria:
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from py_depthsampling.main.main import ds_main
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # *****************************************************************************
@@ -153,79 +155,110 @@ lgcNormDiv = False
 # Output path for depth samling results (within subject means):
 strDpthMeans = '/home/john/Dropbox/Kanizsa_Depth_Data/Higher_Level_Analysis/{}/{}_{}.npz'  #noqa
 
-# Maximum number of processes to run in parallel: *** NOT IMPLEMENTED
-# varPar = 10
+# Number of processes per analysis (i.e. per meta-condition, ROI, and
+# condition), and number of CPUs & memory (MB) for all analyses together
+# (`None` for all CPUs & no memory limit):
+varPar = 2
+varCpuMax = None
+varMemMax = None
+
+# State file for resuming the batch after a crash (records of finished
+# analyses; `None` to always run all analyses):
+strState = None
+
+# Resume within analyses, i.e. skip subjects & hemispheres that have been
+# completed with identical parameters and input files in a previous run (see
+# `py_depthsampling.main.checkpoint`):
+lgcResume = False
+
+# Design of each condition, for conversion of parameter estimates to percent
+# signal change (see `py_depthsampling.main.psc`):
+dicDsgn = {'kanizsa_flicker_sst_pe': 'sst',
+           'kanizsa_static_sst_pe': 'sst',
+           'rotated_flicker_sst_pe': 'sst',
+           'rotated_static_sst_pe': 'sst'}
 # *****************************************************************************
 
 
 # *****************************************************************************
 # *** Loop through ROIs / conditions
 
-# Loop through ROIs, hemispheres, and conditions to create plots:
-for idxMtaCn in range(len(lstMetaCon)):  #noqa
-    for idxRoi in range(len(lstRoi)):
-        for idxCon in range(len(lstNstCon)):
-
-            # Limits of axes need to be adjusted based on ROI, condition,
-            # hemisphere.
-
-            # Limits of y-axis for SINGLE SUBJECT PLOTS (list of tuples,
-            # [(Ymin, Ymax)]):
-            lstLimY = [(-2.0, 2.0)] * len(lstSubIds)
-            lstLimY = [(-2.0, 2.0)] * len(lstSubIds)
-
-            # Adjust layout:
-            if 'centre' in lstMetaCon[idxMtaCn]:
-                varAcrSubsYmin = -1.0
-                varAcrSubsYmax = 1.0
-                varNumLblY = 3
-                tplPadY = (0.1, 0.1)
-
-            if 'edge' in lstMetaCon[idxMtaCn]:
-                varAcrSubsYmin = 0.0
-                varAcrSubsYmax = 2.0
-                varNumLblY = 3
-                tplPadY = (0.1, 0.1)
-
-            if 'inducer' in lstMetaCon[idxMtaCn]:
-                varAcrSubsYmin = 0.0
-                varAcrSubsYmax = 6.0
-                varNumLblY = 3
-                tplPadY = (0.1, 0.1)
-
-            if 'background' in lstMetaCon[idxMtaCn]:
-                varAcrSubsYmin = -1.0
-                varAcrSubsYmax = 0.0
-                varNumLblY = 3
-                tplPadY = (0.1, 0.1)
-
-            if 'left_bckg' in lstMetaCon[idxMtaCn]:
-                varAcrSubsYmin = -1.0
-                varAcrSubsYmax = 0.0
-                varNumLblY = 3
-                tplPadY = (0.1, 0.1)
-
-            if 'right_bckg' in lstMetaCon[idxMtaCn]:
-                varAcrSubsYmin = -1.0
-                varAcrSubsYmax = 0.0
-                varNumLblY = 3
-                tplPadY = (0.1, 0.1)
-
-            # Title for mean plot:
-            strTitle = lstRoi[idxRoi].upper()
-
-            # Call main function:
-            ds_main(lstRoi[idxRoi], lstHmsph, lstSubIds, lstNstCon[idxCon],
-                    lstNstConLbl[idxCon], strVtkDpth01, lgcSlct01, strCsvRoi,
-                    varNumHdrRoi, lgcSlct02, strVtkSlct02, varThrSlct02,
-                    lgcSlct03, strVtkSlct03, varThrSlct03, lgcSlct04,
-                    strVtkSlct04, lstThrSlct04[idxMtaCn], varNumDpth,
-                    strPrcdData, varNumLne, strTitle, lstLimY, varAcrSubsYmin,
-                    varAcrSubsYmax, strXlabel, strYlabel,
-                    strPltOtPre.format(lstMetaCon[idxMtaCn], lstRoi[idxRoi]),
-                    strPltOtSuf.format('{}', lstRoi[idxRoi],
-                    lstNstCon[idxCon][0]), varDpi, varNormIdx, lgcNormDiv,
-                    strDpthMeans.format(lstMetaCon[idxMtaCn], lstRoi[idxRoi],
-                    '{}'), strMetaCon=lstMetaCon[idxMtaCn],
-                    varNumLblY=varNumLblY)
+# Limits of y-axis for SINGLE SUBJECT PLOTS (list of tuples, [(Ymin, Ymax)]):
+lstLimY = [(-2.0, 2.0)] * len(lstSubIds)
+
+# Limits of axes need to be adjusted based on meta-condition:
+dicLayout = {'centre': {'varAcrSubsYmin': -1.0, 'varAcrSubsYmax': 1.0},
+             'edge': {'varAcrSubsYmin': 0.0, 'varAcrSubsYmax': 2.0},
+             'inducer': {'varAcrSubsYmin': 0.0, 'varAcrSubsYmax': 6.0},
+             'background': {'varAcrSubsYmin': -1.0, 'varAcrSubsYmax': 0.0},
+             'left_bckg': {'varAcrSubsYmin': -1.0, 'varAcrSubsYmax': 0.0},
+             'right_bckg': {'varAcrSubsYmin': -1.0, 'varAcrSubsYmax': 0.0}}
+
+# Parameters that depend on the meta-condition. The layout is selected if its
+# name is contained in the name of the meta-condition (e.g. 'edge' for
+# 'kanizsa_edge'); if several names are contained, the later ones take
+# precedence.
+dicMtaCn = {}
+for strMtaCn, tplThr in zip(lstMetaCon, lstThrSlct04):
+    dicMtaCn[strMtaCn] = {}
+    for strLyt, dicLyt in dicLayout.items():
+        if strLyt in strMtaCn:
+            dicMtaCn[strMtaCn].update(dicLyt)
+    dicMtaCn[strMtaCn]['tplThrSlct04'] = tplThr
+
+# Job spec with one analysis per meta-condition, ROI, and condition (see
+# `py_depthsampling.main.batch`); placeholders are filled in per analysis:
+dicSpec = {'jobs': [{
+    'function': 'ds_main',
+    'resources': {'cpus': varPar},
+    'params': {'lstHmsph': lstHmsph,
+               'lstSubIds': lstSubIds,
+               'strVtkDpth01': strVtkDpth01,
+               'lgcSlct01': lgcSlct01,
+               'strCsvRoi': strCsvRoi,
+               'varNumHdrRoi': varNumHdrRoi,
+               'lgcSlct02': lgcSlct02,
+               'strVtkSlct02': strVtkSlct02,
+               'varThrSlct02': varThrSlct02,
+               'lgcSlct03': lgcSlct03,
+               'strVtkSlct03': strVtkSlct03,
+               'varThrSlct03': varThrSlct03,
+               'lgcSlct04': lgcSlct04,
+               'strVtkSlct04': strVtkSlct04,
+               'varNumDpth': varNumDpth,
+               'strPrcdData': strPrcdData,
+               'varNumLne': varNumLne,
+               'lstLimY': lstLimY,
+               'strXlabel': strXlabel,
+               'strYlabel': strYlabel,
+               'strPltOtPre': strPltOtPre.format('${strMetaCon}',
+                                                 '${strRoi}'),
+               'strPltOtSuf': strPltOtSuf.format('{}', '${strRoi}',
+                                                 '${_strCon}'),
+               'varDpi': varDpi,
+               'varNormIdx': varNormIdx,
+               'lgcNormDiv': lgcNormDiv,
+               'strDpthMeans': strDpthMeans.format('${strMetaCon}',
+                                                   '${strRoi}', '{}'),
+               'varNumLblY': 3,
+               'varPar': varPar,
+               'dicDsgn': dicDsgn,
+               'lgcResume': lgcResume},
+    'loops': {'strMetaCon': lstMetaCon,
+              'strRoi': lstRoi,
+              'con': [{'lstCon': lstCon, 'lstConLbl': lstConLbl,
+                       '_strCon': lstCon[0], '_name': lstCon[0]}
+                      for lstCon, lstConLbl in zip(lstNstCon, lstNstConLbl)]},
+    'match': {'strMetaCon': dicMtaCn,
+              'strRoi': {strRoi: {'strTitle': strRoi.upper()}
+                         for strRoi in lstRoi}}}]}
+
+if __name__ == "__main__":
+
+    # Run analyses (in parallel, within CPU & memory budget):
+    lstRec = run_jobs(expand_jobs(dicSpec), varCpuMax=varCpuMax,
+                      varMemMax=varMemMax, strState=strState)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
 # *****************************************************************************
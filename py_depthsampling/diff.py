@@ -22,7 +22,9 @@ Plot mean of between stimulus conditions difference, with SEM.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from py_depthsampling.diff.diff_sem import diff_sem
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # -----------------------------------------------------------------------------
@@ -76,66 +78,56 @@ lstDiff = [(0, 1), (0, 2), (2, 1)]
 
 # Padding around labelled values on y:
 tplPadY = (0.0, 0.05)
+
+# Number of CPUs & memory (MB) for all analyses together (`None` for all CPUs
+# & no memory limit):
+varCpuMax = None
+varMemMax = None
+
+# State file for resuming the batch after a crash (records of finished
+# analyses; `None` to always run all analyses):
+strState = None
 # -----------------------------------------------------------------------------
 
 
 # -----------------------------------------------------------------------------
 # *** Loop through ROIs / conditions
 
-# Loop through models, ROIs, hemispheres, and conditions to create plots:
-for idxMtaCn in range(len(lstMetaCon)):  #noqa
-    for idxMdl in range(len(lstMdl)):  #noqa
-        for idxRoi in range(len(lstRoi)):
-
-            # Limits of axes can be adjusted based on ROI, condition,
-            # hemisphere, deconvolution model.
-
-            if lstMdl[idxMdl] == '':
-                varYmin = -0.5
-                varYmax = 0.5
-                varNumLblY = 3
-            if lstMdl[idxMdl] == '_deconv_model_1':
-                varYmin = -0.25
-                varYmax = 0.5
-                varNumLblY = 4
-
-            # Create average plots:
-            diff_sem(strPthData.format(lstMetaCon[idxMtaCn],
-                                       lstRoi[idxRoi],
-                                       '{}',
-                                       lstMdl[idxMdl]),
-                     (strPthPltOt.format(lstMetaCon[idxMtaCn],
-                                         lstRoi[idxRoi],
-                                         lstMdl[idxMdl])
-                      + strFlTp),
-                     lstCon,
-                     lstConLbl,
-                     varYmin=varYmin,
-                     varYmax=varYmax,
-                     tplPadY=tplPadY,
-                     varNumLblY=varNumLblY,
-                     varDpi=varDpi,
-                     strXlabel=strXlabel,
-                     strYlabel=strYlabel,
-                     lgcLgnd=True,
-                     lstDiff=lstDiff,
-                     strParam=strParam)
-
-        # Create single subject plot(s):
-        # boot_plot_sngl(strPthData.format(lstMetaCon[idxMtaCn],
-        #                                  lstRoi[idxRoi],
-        #                                  lstHmsph[idxHmsph],
-        #                                  '{}',
-        #                                  lstMdl[idxMdl]),
-        #                (strPthPtlSnglOt.format(lstRoi[idxRoi],
-        #                                        lstMetaCon[idxMtaCn],
-        #                                        lstHmsph[idxHmsph],
-        #                                        lstMdl[idxMdl],
-        #                                        '{}')
-        #                 + strFlTp),
-        #                lstCon,
-        #                lstConLbl,
-        #                strXlabel='Cortical depth level (equivolume)',
-        #                strYlabel='Subject',
-        #                lstDiff=lstDiff)
+# Limits of axes can be adjusted based on deconvolution model:
+dicLimY = {'': {'varYmin': -0.5, 'varYmax': 0.5, 'varNumLblY': 3},
+           '_deconv_model_1': {'varYmin': -0.25, 'varYmax': 0.5,
+                               'varNumLblY': 4}}
+
+# One job per meta-condition, model, and ROI (see
+# `py_depthsampling.main.batch`):
+dicSpec = {'jobs': [{
+    'function': 'diff_sem',
+    'params': {'objDpth': strPthData.format('${_strMetaCon}', '${_strRoi}',
+                                            '{}', '${_strMdl}'),
+               'strPath': (strPthPltOt.format('${_strMetaCon}', '${_strRoi}',
+                                              '${_strMdl}')
+                           + strFlTp),
+               'lstCon': lstCon,
+               'lstConLbl': lstConLbl,
+               'tplPadY': tplPadY,
+               'varDpi': varDpi,
+               'strXlabel': strXlabel,
+               'strYlabel': strYlabel,
+               'lgcLgnd': True,
+               'lstDiff': lstDiff,
+               'strParam': strParam},
+    'loops': {'_strMetaCon': lstMetaCon,
+              'mdl': [dict(dicLimY[strMdl], _strMdl=strMdl,
+                           _name=(strMdl or 'none'))
+                      for strMdl in lstMdl],
+              '_strRoi': lstRoi}}]}
+
+if __name__ == "__main__":
+
+    # Run analyses (in parallel, within CPU & memory budget):
+    lstRec = run_jobs(expand_jobs(dicSpec), varCpuMax=varCpuMax,
+                      varMemMax=varMemMax, strState=strState)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
 # -----------------------------------------------------------------------------
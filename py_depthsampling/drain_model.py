@@ -95,7 +95,9 @@ Weber, B., Keller, A. L., Reichold, J., & Logothetis, N. K. (2008). The
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from py_depthsampling.drain_model.drain_model_main import drain_model
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 # -----------------------------------------------------------------------------
 # *** Define parameters
@@ -170,58 +172,78 @@ varNseSys = 0.3
 # understimated by 10%, and the deepest signal level will be multiplied by
 # 1.1. (Each factor will be represented by a sepearate line in the plot.)
 lstFctr = [0.0, 0.25, 0.5, 0.75]
+
+# Number of CPUs & memory (MB) for all analyses together (`None` for all CPUs
+# & no memory limit):
+varCpuMax = None
+varMemMax = None
+
+# State file for resuming the batch after a crash (records of finished
+# analyses; `None` to always run all analyses):
+strState = None
 # -----------------------------------------------------------------------------
 
 
 # -----------------------------------------------------------------------------
 # *** Loop through ROIs / conditions
 
-# Loop through models, ROIs, hemispheres, and conditions to create plots:
-for idxMtaCn in range(len(lstMetaCon)):  #noqa
-    for idxMdl in range(len(lstMdl)):  #noqa
-        for idxRoi in range(len(lstRoi)):
-            for idxCon in range(len(lstNstCon)):
-
-                # Limits of axes need to be adjusted based on ROI,
-                # condition, hemisphere.
-
-                if lstMetaCon[idxMtaCn] == 'background':
-                    varAcrSubsYmin01 = -2.0
-                    varAcrSubsYmax01 = 0.0
-                    varAcrSubsYmin02 = -2.0
-                    varAcrSubsYmax02 = 0.0
-                    tplPadY = (0.1, 0.2)
-                    varNumLblY = 3
-
-                if lstMetaCon[idxMtaCn] == 'centre':
-                    varAcrSubsYmin01 = -0.25
-                    varAcrSubsYmax01 = 0.25
-                    varAcrSubsYmin02 = -0.25
-                    varAcrSubsYmax02 = 0.25
-                    tplPadY = (0.2, 0.1)
-                    varNumLblY = 3
-
-                if lstMetaCon[idxMtaCn] == 'edge':
-                    varAcrSubsYmin01 = 0.0
-                    varAcrSubsYmax01 = 2.0
-                    varAcrSubsYmin02 = 0.0
-                    varAcrSubsYmax02 = 2.0
-                    tplPadY = (0.01, 0.1)
-                    varNumLblY = 3
-
-                # Call drain model function:
-                drain_model(lstMdl[idxMdl], lstRoi[idxRoi], None,
-                            strPthPrf.format(lstMetaCon[idxMtaCn],
-                            lstRoi[idxRoi], '{}'),
-                            strPthPrfOt.format(lstMetaCon[idxMtaCn],
-                            lstRoi[idxRoi], '{}', lstMdl[idxMdl]),
-                            strPthPltOt.format(lstMetaCon[idxMtaCn],
-                            lstRoi[idxRoi], lstNstCon[idxCon][0],
-                            str(lstMdl[idxMdl])), strFlTp, varDpi, strXlabel,
-                            strYlabel, lstNstCon[idxCon], lstNstConLbl[idxCon],
-                            varNumIt, varCnfLw, varCnfUp, varNseRndSd,
-                            varNseSys, lstFctr, varAcrSubsYmin01,
-                            varAcrSubsYmax01, varAcrSubsYmin02,
-                            varAcrSubsYmax02, tplPadY=tplPadY,
-                            varNumLblY=varNumLblY)
+# Limits of axes need to be adjusted based on meta-condition:
+dicLayout = {'background': {'varAcrSubsYmin01': -2.0,
+                            'varAcrSubsYmax01': 0.0,
+                            'varAcrSubsYmin02': -2.0,
+                            'varAcrSubsYmax02': 0.0,
+                            'tplPadY': (0.1, 0.2),
+                            'varNumLblY': 3},
+             'centre': {'varAcrSubsYmin01': -0.25,
+                        'varAcrSubsYmax01': 0.25,
+                        'varAcrSubsYmin02': -0.25,
+                        'varAcrSubsYmax02': 0.25,
+                        'tplPadY': (0.2, 0.1),
+                        'varNumLblY': 3},
+             'edge': {'varAcrSubsYmin01': 0.0,
+                      'varAcrSubsYmax01': 2.0,
+                      'varAcrSubsYmin02': 0.0,
+                      'varAcrSubsYmax02': 2.0,
+                      'tplPadY': (0.01, 0.1),
+                      'varNumLblY': 3}}
+
+# One job per meta-condition, model, ROI, and condition (see
+# `py_depthsampling.main.batch`):
+dicSpec = {'jobs': [{
+    'function': 'drain_model',
+    'params': {'strHmsph': None,
+               'strPthPrf': strPthPrf.format('${_strMetaCon}', '${strRoi}',
+                                             '{}'),
+               'strPthPrfOt': strPthPrfOt.format('${_strMetaCon}',
+                                                 '${strRoi}', '{}',
+                                                 '${varMdl}'),
+               'strPthPltOt': strPthPltOt.format('${_strMetaCon}',
+                                                 '${strRoi}', '${_strCon}',
+                                                 '${varMdl}'),
+               'strFlTp': strFlTp,
+               'varDpi': varDpi,
+               'strXlabel': strXlabel,
+               'strYlabel': strYlabel,
+               'varNumIt': varNumIt,
+               'varCnfLw': varCnfLw,
+               'varCnfUp': varCnfUp,
+               'varNseRndSd': varNseRndSd,
+               'varNseSys': varNseSys,
+               'lstFctr': lstFctr},
+    'loops': {'_strMetaCon': lstMetaCon,
+              'varMdl': lstMdl,
+              'strRoi': lstRoi,
+              'con': [{'lstCon': lstCon, 'lstConLbl': lstConLbl,
+                       '_strCon': lstCon[0], '_name': lstCon[0]}
+                      for lstCon, lstConLbl in zip(lstNstCon, lstNstConLbl)]},
+    'match': {'_strMetaCon': dicLayout}}]}
+
+if __name__ == "__main__":
+
+    # Run analyses (in parallel, within CPU & memory budget):
+    lstRec = run_jobs(expand_jobs(dicSpec), varCpuMax=varCpuMax,
+                      varMemMax=varMemMax, strState=strState)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
 # -----------------------------------------------------------------------------
@@ -41,11 +41,19 @@ def ecc_get_data(strVtkEcc, strPrcdData, varNumLne, strVtkParam, varNumDpth,
     # *************************************************************************
     # *** Import data
 
+    # Import ROI definition (csv file, list of vertices). Only the indicies of
+    # the vertices contained in the ROI are needed. Only vertices that are
+    # included in the patch of interest are loaded from the vtk meshes.
+    vecRoiIdx = load_csv_roi(strCsvRoi,
+                             varNumHdrRoi,
+                             strCol='index')
+
     # Import the eccentricity information (one value per depth level):
     aryEcc = load_vtk_multi(strVtkEcc,
                             strPrcdData,
                             varNumLne,
-                            varNumDpth)
+                            varNumDpth,
+                            vecIdx=vecRoiIdx)
     # Get median value across cortical depths:
     vecEcc = np.median(aryEcc, axis=1)
 
@@ -54,29 +62,15 @@ def ecc_get_data(strVtkEcc, strPrcdData, varNumLne, strVtkParam, varNumDpth,
     aryParam = load_vtk_multi(strVtkParam,
                               strPrcdData,
                               varNumLne,
-                              varNumDpth)
-
-    # Import ROI definition (csv file, list of vertices):
-    aryRoiVrtx = load_csv_roi(strCsvRoi,
-                              varNumHdrRoi)
+                              varNumDpth,
+                              vecIdx=vecRoiIdx)
 
     # Import intensity data for vertex selection (e.g. R2 values):
     aryVtkThr = load_vtk_multi(strVtkThr,
                                strPrcdData,
                                varNumLne,
-                               varNumDpth)
-    # *************************************************************************
-
-    # *************************************************************************
-    # *** Select vertices contained within the ROI
-
-    # The second column of the array "aryRoiVrtx" contains the indicies of the
-    # vertices contained in the ROI. We extract that information:
-    vecRoiIdx = aryRoiVrtx[:, 1].astype(np.int64)
-
-    # Selcet vertices that are included in the patch of interest:
-    vecEcc = vecEcc[vecRoiIdx]
-    aryParam = aryParam[vecRoiIdx, :]
+                               varNumDpth,
+                               vecIdx=vecRoiIdx)
     # *************************************************************************
 
     # *************************************************************************
@@ -87,13 +81,9 @@ def ecc_get_data(strVtkEcc, strPrcdData, varNumLne, strVtkParam, varNumDpth,
     # cortical depths:
     vecVtkThr = np.min(aryVtkThr, axis=1)
 
-    # Previously, we selected those vertices in the data array that are
-    # contained within the ROI. In order to apply the intensity-criterion, we
-    # have to extract the data corresponding to the ROI from the intensity
-    # array (extract e.g. R2 data for the ROI).
-
-    # Selcet vertices from patch-selection arrays:
-    vecVtkThr = vecVtkThr[vecRoiIdx]
+    # (The intensity data were loaded for the vertices contained within the
+    # ROI only, so the intensity-criterion can be applied to the data array
+    # directly.)
 
     # Get indicies of vertices with value greater than the intensity
     # criterion:
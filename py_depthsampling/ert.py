@@ -16,7 +16,9 @@ condition) are combined across time and conditions to be plotted and analysed.
 """
 
 
-from py_depthsampling.ert.ert_main_surface import ert_main
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # *****************************************************************************
@@ -100,50 +102,90 @@ strPltOtSuf = '_ert.svg'
 
 # Figure scaling factor:
 varDpi = 100.0
+
+# Number of CPUs & memory (MB) for all analyses together (`None` for all CPUs
+# & no memory limit):
+varCpuMax = None
+varMemMax = None
+
+# State file for resuming the batch after a crash (records of finished
+# analyses; `None` to always run all analyses):
+strState = None
 # *****************************************************************************
 
 
 # *****************************************************************************
 # *** Loop through ROIs / conditions
 
-# Loop through ROIs, hemispheres, and conditions to create plots:
-for idxMtaCn in range(len(lstMtaCn)):
-
-    if lstMtaCn[idxMtaCn] == 'centre':
-        # Limits of y-axis:
-        varAcrSubsYmin = -0.005
-        varAcrSubsYmax = 0.005
-        # Number of labels on y-axis:
-        varYnum = 3
-        # Padding around labelled values on y:
-        tplPadY = (0.003, 0.004)
-
-    if lstMtaCn[idxMtaCn] == 'background':
-        # Limits of y-axis:
-        varAcrSubsYmin = -0.01
-        varAcrSubsYmax = 0.01
-        # Number of labels on y-axis:
-        varYnum = 3
-        # Padding around labelled values on y:
-        tplPadY = (0.005, 0.005)
-
-    if lstMtaCn[idxMtaCn] == 'edge':
-        # Limits of y-axis:
-        varAcrSubsYmin = -0.0
-        varAcrSubsYmax = 0.03
-        # Number of labels on y-axis:
-        varYnum = 4
-        # Padding around labelled values on y:
-        tplPadY = (0.006, 0.006)
-
-    for idxRoi in range(len(lstRoi)):
-
-            # Call main function:
-            ert_main(lstSubIds, lstCon, lstConLbl, lstMtaCn[idxMtaCn],
-                     lstHmsph, lstRoi[idxRoi], strVtkMsk, strVtkPth, varTr,
-                     varNumDpth, varNumVol, varStimStrt, varStimEnd, strPthPic,
-                     lgcPic, strPltOtPre, strPltOtSuf,
-                     varAcrSubsYmin=varAcrSubsYmin,
-                     varAcrSubsYmax=varAcrSubsYmax, tplPadY=tplPadY,
-                     varYnum=varYnum, strXlabel=strXlabel, strYlabel=strYlabel)
+# Limits of y-axis, number of labels on y-axis, and padding around labelled
+# values on y, depending on meta-condition:
+dicLayout = {'centre': {'varAcrSubsYmin': -0.005,
+                        'varAcrSubsYmax': 0.005,
+                        'varYnum': 3,
+                        'tplPadY': (0.003, 0.004)},
+             'background': {'varAcrSubsYmin': -0.01,
+                            'varAcrSubsYmax': 0.01,
+                            'varYnum': 3,
+                            'tplPadY': (0.005, 0.005)},
+             'edge': {'varAcrSubsYmin': -0.0,
+                      'varAcrSubsYmax': 0.03,
+                      'varYnum': 4,
+                      'tplPadY': (0.006, 0.006)}}
+
+# Input jobs, shared by all analyses: if the data are loaded from vtk meshes,
+# the meshes of each subject, hemisphere, and condition are converted into one
+# *.npy file (and deleted) once, before the analyses that use them (see
+# `py_depthsampling.ert.ert_get_sub_data.ert_prepare`).
+if lgcPic:
+    lstInp = []
+else:
+    lstInp = [{'function': 'ert_prepare',
+               'params': {'strVtkPth': strVtkPth,
+                          'varNumVol': varNumVol,
+                          'varNumDpth': varNumDpth,
+                          'strPrcdData': strPrcdData,
+                          'varNumLne': varNumLne},
+               'loops': {'strSubId': lstSubIds,
+                         'strHmsph': lstHmsph,
+                         'strCon': lstCon}}]
+
+# One job per meta-condition and ROI (see `py_depthsampling.main.batch`):
+dicSpec = {'jobs': [{
+    'function': 'ert_main',
+    'params': {'lstSubId': lstSubIds,
+               'lstCon': lstCon,
+               'lstConLbl': lstConLbl,
+               'lstHmsph': lstHmsph,
+               'strVtkMsk': strVtkMsk,
+               'strVtkPth': strVtkPth,
+               'varTr': varTr,
+               'varNumDpth': varNumDpth,
+               'varNumVol': varNumVol,
+               'varStimStrt': varStimStrt,
+               'varStimEnd': varStimEnd,
+               'strPthPic': strPthPic,
+               'lgcPic': lgcPic,
+               'strPltOtPre': strPltOtPre,
+               'strPltOtSuf': strPltOtSuf,
+               'varNumLne': varNumLne,
+               'strPrcdData': strPrcdData,
+               'strXlabel': strXlabel,
+               'strYlabel': strYlabel,
+               'lgcCnvPrct': lgcCnvPrct,
+               'lgcLgnd01': lgcLgnd01,
+               'lgcLgnd02': lgcLgnd02,
+               'varDpi': varDpi},
+    'loops': {'strMtaCn': lstMtaCn,
+              'strRoi': lstRoi},
+    'match': {'strMtaCn': dicLayout},
+    'inputs': lstInp}]}
+
+if __name__ == "__main__":
+
+    # Run analyses (in parallel, within CPU & memory budget):
+    lstRec = run_jobs(expand_jobs(dicSpec), varCpuMax=varCpuMax,
+                      varMemMax=varMemMax, strState=strState)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
 # *****************************************************************************
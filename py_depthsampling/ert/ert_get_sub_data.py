@@ -25,6 +25,7 @@ import os
 import numpy as np
 from py_depthsampling.get_data.load_vtk_single import load_vtk_single
 from py_depthsampling.get_data.load_vtk_multi import load_vtk_multi
+from py_depthsampling.main.checkpoint import save_atomic
 
 
 def ert_get_sub_data(strSubId,
@@ -66,70 +67,15 @@ def ert_get_sub_data(strSubId,
     aryErt = np.zeros((varNumCon, varNumDpth, varNumVol, varNumVrtc),
                       dtype=np.float16)
 
-    # Loading time courses from single vtk files is very slow. The first time
-    # the time courses are accessed, we therefore save the data to disk in form
-    # of a *.npy file, and delete the vtk files. Here, we first check whether
-    # the vtk files are available. If yes, we load them and create a new *.npy
-    # file. In this way, we do not risk loading an outdated *.npy file (because
-    # we only load an *.npy file if no vtk (new) files are available).
+    # Loop through conditions:
+    for idxCon in range(0, varNumCon):
 
-    # Path of vtk file of first volume:
-    strVtkPthTmp = strVtkPth.format(strSubId,
-                                    strHmsph,
-                                    lstCon[0],
-                                    str(0).zfill(3))
-
-    # Check whether first vtk file exists:
-    if os.path.isfile(strVtkPthTmp):
-
-        # Loop through conditions:
-        for idxCon in range(0, varNumCon):
-
-            # Loop through volumes:
-            for idxVol in range(0, varNumVol):
-
-                # Complete file path of current volume:
-                strVtkPthTmp = strVtkPth.format(strSubId,
-                                                strHmsph,
-                                                lstCon[idxCon],
-                                                str(idxVol).zfill(3))
-
-                # Load vtk mesh for current timepoint:
-                aryTmp = load_vtk_multi(strVtkPthTmp,
-                                        strPrcdData,
-                                        varNumLne,
-                                        varNumDpth).astype(np.float16)
-
-                aryErt[idxCon, :, idxVol, :] = aryTmp.T
+        # Convert vtk meshes to *.npy file, if not done before (see
+        # `ert_prepare`), and load *.npy file:
+        strPthNpy = ert_prepare(strSubId, strHmsph, strVtkPth, lstCon[idxCon],
+                                varNumVol, varNumDpth, strPrcdData, varNumLne)
 
-                # Delete vtk file:
-                os.remove(strVtkPthTmp)
-
-            # Save array of current condition to disk (in case data need to be
-            # accessed again (conditions are saved separately because
-            # composition of conditions can change for plot):
-            strPthNpy = os.path.join(os.path.split(strVtkPthTmp)[0],
-                                     ('aryErt_' + lstCon[idxCon] + '.npy'))
-            np.save(strPthNpy, aryErt[idxCon, :, :, :])
-
-    # Vtk file does not exist, attempt loading (previously created) *.npy file:
-    else:
-
-        # Loop through conditions:
-        for idxCon in range(0, varNumCon):
-
-            # Vtk file path of current condition:
-            strVtkPthTmp = strVtkPth.format(strSubId,
-                                            strHmsph,
-                                            lstCon[idxCon],
-                                            str(0).zfill(3))
-
-            # Path of *.npy file to load (file name is hard-coded, not optimal
-            # but still serves the purpose):
-            strPthNpy = os.path.join(os.path.split(strVtkPthTmp)[0],
-                                     ('aryErt_' + lstCon[idxCon] + '.npy'))
-
-            aryErt[idxCon, :, :, :] = np.load(strPthNpy).astype(np.float16)
+        aryErt[idxCon, :, :, :] = np.load(strPthNpy).astype(np.float16)
     # *************************************************************************
 
     # *************************************************************************
@@ -179,3 +125,104 @@ def ert_get_sub_data(strSubId,
 
     return [aryErt, varNumVrtc]
     # *************************************************************************
+
+
+def ert_prepare(strSubId, strHmsph, strVtkPth, strCon, varNumVol, varNumDpth,
+                strPrcdData='SCALARS', varNumLne=2):
+    """
+    Convert vtk meshes of event-related timecourse to *.npy file.
+
+    Loading time courses from single vtk files is very slow. The first time
+    the time courses are accessed, we therefore save the data to disk in form
+    of a *.npy file, and delete the vtk files. Here, we first check whether
+    the vtk files are available. If yes, we load them and create a new *.npy
+    file. In this way, we do not risk loading an outdated *.npy file (because
+    we only load an *.npy file if no vtk (new) files are available).
+
+    The conversion is the same for all ROIs and meta-conditions. When several
+    analyses are run in parallel, it is therefore run once beforehand, as an
+    input job (see `py_depthsampling.main.batch`), so that the analyses do not
+    access the vtk files while they are being deleted.
+
+    Parameters
+    ----------
+    strSubId : str
+        Subject ID.
+    strHmsph : str
+        Hemisphere ('lh' or 'rh').
+    strVtkPth : str
+        Path of vtk meshes (subject ID, hemisphere, condition, and volume index
+        left open).
+    strCon : str
+        Condition.
+    varNumVol : int
+        Number of volumes.
+    varNumDpth : int
+        Number of cortical depth levels.
+    strPrcdData : str
+        Beginning of string preceeding vertex data.
+    varNumLne : int
+        Number of lines between vertex-identification-string and first data
+        point.
+
+    Returns
+    -------
+    strPthNpy : str
+        Path of *.npy file, shape [depth, volume, vertex].
+    """
+    # Path of vtk file of first volume:
+    strVtkPthTmp = strVtkPth.format(strSubId,
+                                    strHmsph,
+                                    strCon,
+                                    str(0).zfill(3))
+
+    # Path of *.npy file (file name is hard-coded, not optimal but still serves
+    # the purpose):
+    strPthNpy = os.path.join(os.path.split(strVtkPthTmp)[0],
+                             ('aryErt_' + strCon + '.npy'))
+
+    # Vtk file does not exist, (previously created) *.npy file is to be used:
+    if not os.path.isfile(strVtkPthTmp):
+        return strPthNpy
+
+    # Array to be filled with data (created when the number of vertices is
+    # known):
+    aryErt = None
+
+    # Load vtk meshes of all volumes:
+    for idxVol in range(0, varNumVol):
+
+        # Complete file path of current volume:
+        strVtkPthTmp = strVtkPth.format(strSubId,
+                                        strHmsph,
+                                        strCon,
+                                        str(idxVol).zfill(3))
+
+        # Load vtk mesh for current timepoint:
+        # (The vtk files are deleted below, so there is no point in caching
+        # the parsed data.)
+        aryTmp = load_vtk_multi(strVtkPthTmp,
+                                strPrcdData,
+                                varNumLne,
+                                varNumDpth,
+                                lgcCache=False).astype(np.float16)
+
+        if aryErt is None:
+            aryErt = np.zeros((varNumDpth, varNumVol, aryTmp.shape[0]),
+                              dtype=np.float16)
+
+        aryErt[:, idxVol, :] = aryTmp.T
+
+    # Save array of current condition to disk (in case data need to be
+    # accessed again (conditions are saved separately because composition of
+    # conditions can change for plot):
+    save_atomic(strPthNpy, aryErt)
+
+    # Delete vtk files (only after the *.npy file is complete):
+    for idxVol in range(0, varNumVol):
+        os.remove(strVtkPth.format(strSubId,
+                                   strHmsph,
+                                   strCon,
+                                   str(idxVol).zfill(3)))
+
+    return strPthNpy
@@ -20,10 +20,17 @@
 import numpy as np  # noqa
 from py_depthsampling.get_data.load_csv_roi import load_csv_roi
 from py_depthsampling.get_data.load_vtk_single import load_vtk_single
-from py_depthsampling.get_data.load_vtk_multi import load_vtk_multi
-from py_depthsampling.main.slct_vrtcs import slct_vrtcs
+from py_depthsampling.get_data.vtk_lazy import LazyVtk
+from py_depthsampling.main.slct_vrtcs import get_slct_obj
+from py_depthsampling.main.slct_vrtcs import slct_idx
+from py_depthsampling.main.dpth_stats import dpth_stats
+from py_depthsampling.main.psc import get_ppheight
+from py_depthsampling.main.psc import psc_cnv
 from py_depthsampling.get_data.vtk_msk import vtk_msk
 from py_depthsampling.plot.plt_dpth_prfl import plt_dpth_prfl
+from py_depthsampling.main.stages import get_stage_key
+from py_depthsampling.main.stages import load_stage
+from py_depthsampling.main.stages import save_stage
 
 
 def acr_subs_get_data(idxPrc,              # Process ID  #noqa
@@ -56,12 +63,23 @@ def acr_subs_get_data(idxPrc,              # Process ID  #noqa
                       strPltOtPre,         # Plot - Output file path prefix
                       strPltOtSuf,         # Plot - Output file path suffix
                       strMetaCon,          # Metacondition (stim/periphery)
-                      queOut):             # Queue for output list
+                      queOut,              # Queue for output list
+                      varNumThr=1,         # Threads for loading vtk files
+                      strEst='mean',       # Estimator ('mean', 'median', ...)
+                      lstDsgn=None):       # Designs (for PSC conversion)
     """
     Obtaining & plotting single subject data for across subject analysis.
 
     This function loads the data for each subject for a multi-subject analysis
-    and passes the data to the parent function for visualisation.
+    and passes the data to the parent function for visualisation. The output
+    list (process ID, depth profiles, number of vertices) is put on `queOut`,
+    or returned if `queOut` is `None`. The depth profiles are the mean over
+    vertices, or the median or trimmed mean (`strEst`, see `dpth_stats`).
+
+    FSL parameter estimates are converted to percent signal change with the
+    peak-peak height of the regressor of the design of each condition
+    (`lstDsgn`, one design per data file, see `py_depthsampling.main.psc`). A
+    `ValueError` is raised if the design of a condition is not specified.
     """
     # Only print status messages if this is the first of several parallel
     # processes:
@@ -69,254 +87,138 @@ def acr_subs_get_data(idxPrc,              # Process ID  #noqa
         print('------Loading single subject data: ' + strSubId)
 
     # *************************************************************************
-    # *** Import data
-
-    # Import CSV file with ROI definition
-    if lgcSlct01:
-        if idxPrc == 0:
-            print('---------Importing CSV file with ROI definition (first '
-                  + 'criterion)')
-        aryRoiVrtx = load_csv_roi(strCsvRoi, varNumHdrRoi)
-    # Otherwise, create dummy vector (for function I/O)
-    else:
-        aryRoiVrtx = 0
-
-    # Import second criterion vtk file (all depth levels)
-    if lgcSlct02:
-        if idxPrc == 0:
-            print('---------Importing second criterion vtk file (all depth '
-                  + 'levels).')
-        arySlct02 = load_vtk_multi(strVtkSlct02,
-                                   strPrcdData,
-                                   varNumLne,
-                                   varNumDpth)
-    # Otherwise, create dummy vector (for function I/O)
+    # *** Pipeline stages
+
+    # The peak-peak height of the regressor depends on the design (i.e.
+    # predictor), see PSC conversion below. Only perform scaling if the data
+    # is from an FSL cope file:
+    lgcPsc = (('cope' in lstVtkDpth01[0]) or ('_pe' in lstVtkDpth01[0]))
+    if lgcPsc:
+        if lstDsgn is None:
+            lstDsgn = [None] * len(lstVtkDpth01)
+        vecPpheight = np.array([get_ppheight(strDsgn, strCon=strVtk)
+                                for strDsgn, strVtk
+                                in zip(lstDsgn, lstVtkDpth01)])
     else:
-        arySlct02 = 0
-
-    # Import third criterion vtk file (all depth levels)
-    if lgcSlct03:
-        if idxPrc == 0:
-            print('---------Importing third criterion vtk file (all depth '
-                  + 'levels).')
-        arySlct03 = load_vtk_multi(strVtkSlct03,
-                                   strPrcdData,
-                                   varNumLne,
-                                   varNumDpth)
-    # Otherwise, create dummy array (for function I/O)
-    else:
-        arySlct03 = 0
-
-    # Import fourth criterion vtk file (one depth level)
-    if lgcSlct04:
-        if idxPrc == 0:
-            print('---------Importing fourth criterion vtk file (one depth '
-                  + 'level).')
-        arySlct04 = load_vtk_multi(strVtkSlct04,
-                                   strPrcdData,
-                                   varNumLne,
-                                   varNumDpth)
-    # Otherwise, create dummy array (for function I/O):
-    else:
-        arySlct04 = 0
-
-    # Import depth data vtk files
-    if idxPrc == 0:
-        print('---------Importing depth data vtk files.')
-    # Number of input files (i.e. number of conditions):
-    varNumCon = len(lstVtkDpth01)
-    # List for input data:
-    lstDpthData01 = [None] * varNumCon
-    # Loop through input data files:
-    for idxIn in range(0, varNumCon):
-        # Import data from file:
-        lstDpthData01[idxIn] = load_vtk_multi(lstVtkDpth01[idxIn],
-                                              strPrcdData,
-                                              varNumLne,
-                                              varNumDpth)
-        if idxPrc == 0:
-            print('------------File ' + str(idxIn + 1) + ' out of '
-                  + str(varNumCon))
-    # *************************************************************************
-
-    # *************************************************************************
-    # *** Convert cope to percent signal change
+        vecPpheight = np.ones(len(lstVtkDpth01))
+
+    # Keys of pipeline stages (see `py_depthsampling.main.stages`). Each key
+    # depends on the parameters of the stage and on the keys of upstream
+    # stages, so that only stages affected by a parameter change are
+    # repeated (if the stage cache is enabled).
+    strKeyLoad = get_stage_key(
+        'load',
+        {'lstVtkDpth01': lstVtkDpth01,
+         'strCsvRoi': (strCsvRoi if lgcSlct01 else None),
+         'varNumHdrRoi': varNumHdrRoi,
+         'strVtkSlct02': (strVtkSlct02 if lgcSlct02 else None),
+         'strVtkSlct03': (strVtkSlct03 if (lgcSlct03 or lgcPsc) else None),
+         'strVtkSlct04': (strVtkSlct04 if lgcSlct04 else None),
+         'strPrcdData': strPrcdData,
+         'varNumLne': varNumLne,
+         'varNumDpth': varNumDpth})
+    strKeyPsc = get_stage_key('psc',
+                              {'lgcPsc': lgcPsc, 'vecPpheight': vecPpheight},
+                              [strKeyLoad])
+    strKeySlct = get_stage_key('slct_vrtcs',
+                               {'lgcSlct01': lgcSlct01,
+                                'lgcSlct02': lgcSlct02,
+                                'varThrSlct02': varThrSlct02,
+                                'lgcSlct03': lgcSlct03,
+                                'varThrSlct03': varThrSlct03,
+                                'lgcSlct04': lgcSlct04,
+                                'tplThrSlct04': tplThrSlct04},
+                               [strKeyPsc])
+    strKeyMean = get_stage_key('depth_means',
+                               {'lgcNormDiv': lgcNormDiv, 'strEst': strEst},
+                               [strKeySlct])
+    strKeyMsk = get_stage_key('vtk_msk',
+                              {'strSubId': strSubId,
+                               'strCsvRoi': strCsvRoi,
+                               'strMetaCon': strMetaCon},
+                              [strKeySlct])
+
+    # Results of previous runs (the vertex selection is only needed for the
+    # vertex mask if the depth means are available):
+    dicMean = load_stage(strKeyMean)
+    dicMsk = load_stage(strKeyMsk)
+    dicSlct = None
+    if (dicMean is not None) and (dicMsk is None):
+        dicSlct = load_stage(strKeySlct)
+
+    # The data only need to be loaded if the depth means need to be
+    # calculated, or if the vertex mask needs to be created and the vertex
+    # selection is not available:
+    lgcLoad = (dicMean is None) or ((dicMsk is None) and (dicSlct is None))
+
+    if lgcLoad:
+
+        aryDpthData01, varNumInc, vecInc = \
+            _load_slct(idxPrc, lstVtkDpth01, varNumDpth, strPrcdData,
+                       varNumLne, lgcSlct01, strCsvRoi, varNumHdrRoi,
+                       lgcSlct02, strVtkSlct02, varThrSlct02, lgcSlct03,
+                       strVtkSlct03, varThrSlct03, lgcSlct04, strVtkSlct04,
+                       tplThrSlct04, lgcPsc, vecPpheight, varNumThr)
+
+        save_stage(strKeySlct, 'slct_vrtcs',
+                   dicRes={'vecInc': vecInc,
+                           'varNumInc': np.array(varNumInc)})
+
+    elif dicSlct is not None:
 
-    # According to the FSL documentation
-    # (https://fsl.fmrib.ox.ac.uk/fsl/fslwiki/FEAT/UserGuide), the PEs can be
-    # scaled to signal change with respect to the mean (over time within
-    # voxel): "This is achieved by scaling the PE or COPE values by (100*) the
-    # peak-peak height of the regressor (or effective regressor in the case of
-    # COPEs) and then by dividing by mean_func (the mean over time of
-    # filtered_func_data)." However, this PSC would be with respect to the
-    # temporal mean, but we are interested in the PSC with respect to
-    # pre-stimulus baseline. Thus, we extract the difference (a scaling
-    # factor) between these two (i.e. temporal mean vs. pre-stimulus baseline)
-    # from the respective FSL design matrix (`design.mat` in the FEAT
-    # directory). The scaling factor is approximately 1.4 (slightly different
-    # values for sustained and transient predictors, but close enough not to
-    # matter). This scaling factor needs to be applied after the procedure
-    # described in the FSL documentation. Thus, the final PSC is calculated as
-    # follows: `(PE * (100 * peak-peak height) / tmean) * 1.4`. The pp-height
-    # is obtained from `design.mat`.
-
-    # Only perform scaling if the data is from an FSL cope file:
-    if (('cope' in lstVtkDpth01[0]) or ('_pe' in lstVtkDpth01[0])):
         if idxPrc == 0:
-            print('---------Convert cope to percent signal change.')
+            print('---------Using vertex selection from previous run.')
 
-        # The peak-peak height depends on the predictor (i.e. condition).
-        if 'sst' in lstVtkDpth01[0]:
-            varPpheight = 1.268049
-        elif 'trn' in lstVtkDpth01[0]:
-            varPpheight = 0.2269044
-        else:
-            if idxPrc == 0:
-                print(('------------WARNING: Cannot determine condition from '
-                       + 'file name, peak-peak height of the regressor is set '
-                       + 'to 1.'))
-            varPpheight = 1.0
-
-        # Loop through input data files:
-        for idxIn in range(0, varNumCon):
-
-            # Get PEs:
-            aryTmp = lstDpthData01[idxIn].astype(np.float64)
-
-            # In order to avoid division by zero, avoid zero-voxels:
-            lgcTmp = np.not_equal(arySlct03, 0.0)
-
-            # Apply PSC scaling, as described above:
-            aryTmp[lgcTmp] = np.multiply(
-                                         np.divide(
-                                                   np.multiply(aryTmp[lgcTmp],
-                                                               (100.0
-                                                                * varPpheight)
-                                                               ),
-                                                   arySlct03[lgcTmp]),
-                                         1.0  # 1.4
-                                         )
-
-            # Put scaled PEs back into list (now PSC with respect to
-            # pre-stimulus baseline):
-            lstDpthData01[idxIn] = aryTmp
+        vecInc = dicSlct['vecInc']
+        varNumInc = dicSlct['varNumInc'][()]
     # *************************************************************************
 
     # *************************************************************************
-    # *** Select vertices
+    # *** Create VTK mesh mask
 
-    lstDpthData01, varNumInc, vecInc = \
-        slct_vrtcs(varNumCon,           # Number of conditions
-                   lstDpthData01,       # List with depth-sampled data I
-                   lgcSlct01,           # Criterion 1 - Yes or no?
-                   aryRoiVrtx,          # Criterion 1 - Data (ROI)
-                   lgcSlct02,           # Criterion 2 - Yes or no?
-                   arySlct02,           # Criterion 2 - Data
-                   varThrSlct02,        # Criterion 2 - Threshold
-                   lgcSlct03,           # Criterion 3 - Yes or no?
-                   arySlct03,           # Criterion 3 - Data
-                   varThrSlct03,        # Criterion 3 - Threshold
-                   lgcSlct04,           # Criterion 4 - Yes or no?
-                   arySlct04,           # Criterion 4 - Data
-                   tplThrSlct04,        # Criterion 4 - Threshold
-                   idxPrc)              # Process ID
-    # *************************************************************************
+    # We would like to be able to visualise the selected vertices on the
+    # cortical surface, i.e. on a vtk mesh (unless the mask has been created
+    # in a previous run).
+    if dicMsk is None:
 
-    # *************************************************************************
-    # *** Create VTK mesh mask
+        if idxPrc == 0:
+            print('---------Creating VTK mesh mask.')
 
-    if idxPrc == 0:
-        print('---------Creating VTK mesh mask.')
+        strVtkMsk = vtk_msk(strSubId,         # Data struc - Subject ID
+                            lstVtkDpth01[0],  # Data struc - Pth first vtk
+                            strPrcdData,      # Data struc - Str. prcd. VTK
+                            varNumLne,        # Data struc - Lns. prcd. VTK
+                            strCsvRoi,        # Data struc - ROI CSV fle
+                            vecInc,           # Vector with included vertices
+                            strMetaCon)       # Metacondition
 
-    # We would like to be able to visualise the selected vertices on the
-    # cortical surface, i.e. on a vtk mesh.
-    vtk_msk(strSubId,         # Data struc - Subject ID
-            lstVtkDpth01[0],  # Data struc - Path first data vtk file
-            strPrcdData,      # Data struc - Str. prcd. VTK data
-            varNumLne,        # Data struc - Lns. prcd. data VTK
-            strCsvRoi,        # Data struc - ROI CSV fle (outpt. naming)
-            vecInc,           # Vector with included vertices
-            strMetaCon)       # Metacondition (stimulus or periphery)
+        save_stage(strKeyMsk, 'vtk_msk', lstOt=[strVtkMsk])
     # *************************************************************************
 
     # *************************************************************************
     # *** Calculate mean & conficende interval
 
-    if idxPrc == 0:
-        print('---------Plot results - mean over vertices.')
-
-    # Prepare arrays for results (mean & confidence interval):
-    aryDpthMean = np.zeros((varNumCon, varNumDpth))
-    aryDpthConf = np.zeros((varNumCon, varNumDpth))
-
-    # Fill array with data - loop through input files:
-    for idxIn in range(0, varNumCon):
-
-        # Loop through depth levels:
-        for idxDpth in range(0, varNumDpth):
-
-            # Avoid warning in case of empty array (i.e. no vertices included
-            # in ROI for current ROI/subject/hemisphere):
-            if np.greater(np.sum(vecInc), 0):
-
-                # Retrieve all vertex data for current input file & current
-                # depth level:
-                aryTmp = lstDpthData01[idxIn][:, idxDpth]
-
-                # Calculate mean over vertices:
-                varTmp = np.mean(aryTmp)
-
-            else:
-
-                # No vertices in ROI:
-                varTmp = 0.0
-
-            # Place mean in array:
-            aryDpthMean[idxIn, idxDpth] = varTmp
-
-            # Calculate 95% confidence interval for the mean, obtained by
-            # multiplying the standard error of the mean (SEM) by 1.96. We
-            # obtain  the SEM by dividing the standard deviation by the
-            # squareroot of the sample size n. We get n by taking 1/8 of the
-            # number of vertices,  which corresponds to the number of voxels in
-            # native resolution.
-            varTmp = np.multiply(np.divide(np.std(aryTmp),
-                                           np.sqrt(aryTmp.size * 0.125)),
-                                 1.96)
-            # Place confidence interval in array:
-            aryDpthConf[idxIn, idxDpth] = varTmp
+    # Number of conditions:
+    varNumCon = len(lstVtkDpth01)
 
-            # Calculate standard error of the mean.
-            # varTmp = np.divide(np.std(aryTmp),
-            #                    np.sqrt(aryTmp.size * 0.125))
-            # Place SEM in array:
-            # aryDpthConf[idxIn, idxDpth] = varTmp
+    if dicMean is None:
 
-            # Calculate standard deviation over vertices:
-            # varTmp = np.std(aryTmp)
+        aryDpthMean, aryDpthConf = _dpth_means(aryDpthData01, lgcNormDiv,
+                                               strEst, idxPrc)
 
-            # Place standard deviation in array:
-            # aryDpthConf[idxIn, idxDpth] = varTmp
+        save_stage(strKeyMean, 'depth_means',
+                   dicRes={'aryDpthMean': aryDpthMean,
+                           'aryDpthConf': aryDpthConf,
+                           'varNumInc': np.array(varNumInc)})
 
-    # Normalise by division:
-    if lgcNormDiv:
+    else:
 
         if idxPrc == 0:
-            print('---------Normalisation by division.')
-
-        # Vector for subtraction:
-        # vecSub = np.array(aryDpthMean[varNormIdx, :], ndmin=2)
-        # Divide all rows by reference row:
-        # aryDpthMean = np.divide(aryDpthMean, vecSub)
+            print('---------Using depth profiles from previous run.')
 
-        # Calculate 'grand mean', i.e. the mean PE across depth levels and
-        # conditions:
-        varGrndMean = np.mean(aryDpthMean)
-        # varGrndMean = np.median(aryDpthMean)
-
-        # Divide all values by the grand mean:
-        aryDpthMean = np.divide(np.absolute(aryDpthMean), varGrndMean)
-        aryDpthConf = np.divide(np.absolute(aryDpthConf), varGrndMean)
+        aryDpthMean = dicMean['aryDpthMean']
+        aryDpthConf = dicMean['aryDpthConf']
+        varNumInc = dicMean['varNumInc'][()]
     # *************************************************************************
 
     # *************************************************************************
@@ -357,5 +259,175 @@ def acr_subs_get_data(idxPrc,              # Process ID  #noqa
               aryDpthMean,
               varNumInc]
 
+    # If no queue is provided, the output list is returned directly (e.g. when
+    # called by a process pool):
+    if queOut is None:
+        return lstOut
+
     queOut.put(lstOut)
     # *************************************************************************
+
+
+def _load_slct(idxPrc, lstVtkDpth01, varNumDpth, strPrcdData, varNumLne,
+               lgcSlct01, strCsvRoi, varNumHdrRoi, lgcSlct02, strVtkSlct02,
+               varThrSlct02, lgcSlct03, strVtkSlct03, varThrSlct03, lgcSlct04,
+               strVtkSlct04, tplThrSlct04, lgcPsc, vecPpheight, varNumThr):
+    """
+    Load data, convert to percent signal change, and select vertices.
+
+    Returns the selected vertex data (shape aryDpthData01[condition, vertex,
+    depth]), the number of selected vertices, and the vertex inclusion vector.
+
+    The vtk files are accessed via lazy handles (see `LazyVtk`). The ROI is
+    applied first; if it contains no vertices, the selection criteria are not
+    loaded. The data and the mean EPI (for the conversion to percent signal
+    change) are only read for the vertices that pass all criteria, and are not
+    read at all if no vertex is left.
+    """
+    # *************************************************************************
+    # *** Lazy handles for vtk files
+
+    # Depth data vtk files, shape [condition, vertex, depth]:
+    hndDpthData01 = LazyVtk(lstVtkDpth01, strPrcdData, varNumLne, varNumDpth,
+                            varNumThr=varNumThr)
+
+    # Third criterion vtk file (mean EPI, all depth levels), needed for the
+    # conversion to percent signal change. For vertex selection, only
+    # summaries across depth levels are needed (see `get_slct_obj`).
+    hndSlct03 = LazyVtk(strVtkSlct03, strPrcdData, varNumLne, varNumDpth)
+
+    # Number of conditions & vertices:
+    varNumCon = len(lstVtkDpth01)
+    varNumVrtx = hndDpthData01.num_vertices()
+    # *************************************************************************
+
+    # *************************************************************************
+    # *** Select vertices
+
+    # Import CSV file with ROI definition (first criterion, cheap to evaluate):
+    if lgcSlct01:
+        if idxPrc == 0:
+            print('---------Importing CSV file with ROI definition (first '
+                  + 'criterion)')
+        vecRoiIdx = load_csv_roi(strCsvRoi, varNumHdrRoi,
+                                 strCol='index').astype(np.int64)
+    else:
+        vecRoiIdx = None
+
+    if (vecRoiIdx is not None) and (vecRoiIdx.shape[0] == 0):
+
+        # Empty ROI, no need to load selection criteria:
+        if idxPrc == 0:
+            print('---------ROI contains no vertices.')
+        vecInc = np.zeros(varNumVrtx, dtype=bool)
+        vecIdxInc = np.zeros(0, dtype=np.int64)
+        varNumInc = 0
+
+    else:
+
+        # Vertex selection object for current subject & hemisphere (summaries
+        # of selection criteria, reused for all ROIs & thresholds):
+        dicVtk = {}
+        if lgcSlct02:
+            dicVtk[2] = strVtkSlct02
+        if lgcSlct03:
+            dicVtk[3] = strVtkSlct03
+        if lgcSlct04:
+            dicVtk[4] = strVtkSlct04
+        dicSlct = get_slct_obj(dicVtk, strPrcdData, varNumLne, varNumDpth,
+                               varNumVrtx, idxPrc=idxPrc)
+
+        vecInc, vecIdxInc, varNumInc = slct_idx(
+            dicSlct,
+            vecRoiIdx=vecRoiIdx,
+            varThrSlct02=(varThrSlct02 if lgcSlct02 else None),
+            varThrSlct03=(varThrSlct03 if lgcSlct03 else None),
+            tplThrSlct04=(tplThrSlct04 if lgcSlct04 else None),
+            idxPrc=idxPrc)
+    # *************************************************************************
+
+    # *************************************************************************
+    # *** Import data
+
+    if varNumInc == 0:
+
+        # Nothing to load:
+        aryDpthData01 = np.zeros((varNumCon, 0, varNumDpth))
+
+    else:
+
+        # Import data of selected vertices from all files into one array
+        # (all conditions at once), shape aryDpthData01[condition, vertex,
+        # depth]:
+        if idxPrc == 0:
+            print('---------Importing depth data vtk files.')
+        aryDpthData01 = hndDpthData01.take(vecIdxInc)
+        if idxPrc == 0:
+            print('------------Loaded ' + str(varNumCon) + ' files.')
+
+    if idxPrc == 0:
+        print('---------Final number of vertices: ' + str(varNumInc))
+    # *************************************************************************
+
+    # *************************************************************************
+    # *** Convert cope to percent signal change
+
+    # Only perform scaling if the data is from an FSL cope file (and the mean
+    # EPI is available). The PSC scaling is applied elementwise, so it only
+    # needs to be applied to the selected vertices. Note that this PSC is with
+    # respect to the temporal mean; the PSC with respect to the pre-stimulus
+    # baseline would differ by a scaling factor of approximately 1.4 (from the
+    # FSL design matrix), which is not applied.
+    if lgcPsc and lgcSlct03 and (0 < varNumInc):
+        if idxPrc == 0:
+            print('---------Convert cope to percent signal change.')
+
+        # Convert all conditions at once (in place), using the mean EPI of
+        # the selected vertices:
+        psc_cnv(aryDpthData01, hndSlct03.take(vecIdxInc), vecPpheight)
+    # *************************************************************************
+
+    return aryDpthData01, varNumInc, vecInc
+
+
+def _dpth_means(aryDpthData01, lgcNormDiv, strEst, idxPrc):
+    """
+    Calculate mean & confidence interval over vertices.
+
+    Returns the mean (or other estimate, see `dpth_stats`) and the 95%
+    confidence interval, shape aryDpthMean[condition, depth].
+    """
+    if idxPrc == 0:
+        print('---------Plot results - mean over vertices.')
+
+    # Mean & 95% confidence interval over vertices, for all conditions and
+    # depth levels at once (shape aryDpthMean[condition, depth]). The
+    # confidence interval is obtained by multiplying the standard error of
+    # the mean by 1.96; the sample size is 1/8 of the number of vertices,
+    # which corresponds to the number of voxels in native resolution. If
+    # there are no vertices in the ROI, mean & confidence interval are zero.
+    dicStats = dpth_stats(aryDpthData01, strEst=strEst)
+    aryDpthMean = dicStats['mean']
+    aryDpthConf = dicStats['ci']
+
+    # Normalise by division:
+    if lgcNormDiv:
+
+        if idxPrc == 0:
+            print('---------Normalisation by division.')
+
+        # Vector for subtraction:
+        # vecSub = np.array(aryDpthMean[varNormIdx, :], ndmin=2)
+        # Divide all rows by reference row:
+        # aryDpthMean = np.divide(aryDpthMean, vecSub)
+
+        # Calculate 'grand mean', i.e. the mean PE across depth levels and
+        # conditions:
+        varGrndMean = np.mean(aryDpthMean)
+        # varGrndMean = np.median(aryDpthMean)
+
+        # Divide all values by the grand mean:
+        aryDpthMean = np.divide(np.absolute(aryDpthMean), varGrndMean)
+        aryDpthConf = np.divide(np.absolute(aryDpthConf), varGrndMean)
+
+    return aryDpthMean, aryDpthConf
@@ -21,11 +21,36 @@ Function of the depth sampling pipeline.
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import csv
+import os
+import warnings
 import numpy as np
 
 
-def load_csv_roi(strCsvRoi, varNumHdrRoi):
+# Cache of parsed ROI definitions (per process). The key contains the
+# modification time and size of the csv file, so that a modified file is
+# parsed again:
+DIC_CSV_ROI = {}
+
+# Maximum number of cached ROI definitions:
+VAR_NUM_CACHE = 256
+
+# Columns of csv files exported from paraview (column 1 contains the vertex
+# indices, columns 2 to 4 contain the vertex coordinates):
+DIC_CSV_COL = {'all': None,
+               'index': 1,
+               'coords': (2, 3, 4)}
+
+
+def _is_numeric(strLne):
+    """Check whether a line of the csv file contains numeric data only."""
+    try:
+        [float(x) for x in strLne.split(',')]
+    except ValueError:
+        return False
+    return True
+
+
+def load_csv_roi(strCsvRoi, varNumHdrRoi, strCol='all', lgcCache=True):
     """
     Function for loading ROI definition from csv file.
 
@@ -35,47 +60,91 @@ def load_csv_roi(strCsvRoi, varNumHdrRoi):
     Therefore, it is important that the ROI is defined on the same vtk mesh
     that is used for further analysis (because only then do the vertex indicies
     in the csv file correspond to those in the vtk meshes).
+
+    Parameters
+    ----------
+    strCsvRoi : str
+        Path of csv file with ROI definition.
+    varNumHdrRoi : int
+        Number of header lines in csv file. An error is raised if the number of
+        non-numeric lines at the beginning of the file differs from this
+        number.
+    strCol : str
+        Which columns to return. 'all' - all columns (float array, shape
+        aryRoiVrtx[vertex, column]); 'index' - only the vertex indices (second
+        column, int64 vector); 'coords' - only the vertex coordinates (columns
+        three to five, float array, shape aryRoiVrtx[vertex, 3]).
+    lgcCache : bool
+        Whether to keep the parsed data in memory, so that the same csv file is
+        only parsed once per process.
+
+    Returns
+    -------
+    aryRoiVrtx : np.array
+        ROI data (see `strCol`). If the result is taken from the cache, the
+        array is read-only.
     """
     # print('---------Importing ROI csv file.')
 
-    # Open file with ROI information:
-    fleCsvRoi = open(strCsvRoi, 'r')
-
-    # Read file  with ROI information:
-    csvIn = csv.reader(fleCsvRoi,
-                       delimiter='\n',
-                       skipinitialspace=True)
-
-    # Create empty list for CSV data:
-    lstCsvRoi = []
-
-    # Loop through csv object to fill list with csv data:
-    for lstTmp in csvIn:
-        for strTmp in lstTmp:
-            lstCsvRoi.append(strTmp[:])
-
-    # Close file:
-    fleCsvRoi.close()
+    if strCol not in DIC_CSV_COL:
+        strErrMsg = ('ERROR. Unknown column selection for ROI csv file: '
+                     + str(strCol) + ' (expected one of '
+                     + ', '.join(DIC_CSV_COL) + ').')
+        raise ValueError(strErrMsg)
 
-    # Next we would like to access the numeric data in the list into which we
-    # placed the vtk data. We skip the header and convert the data to numeric
-    # values.
+    # Cache key:
+    if lgcCache:
+        objStat = os.stat(strCsvRoi)
+        tplKey = (os.path.abspath(strCsvRoi), objStat.st_mtime_ns,
+                  objStat.st_size, varNumHdrRoi, strCol)
+        if tplKey in DIC_CSV_ROI:
+            return DIC_CSV_ROI[tplKey]
 
-    # Number of verticies in the list (i.e. number of elements in the list
-    # minus header):
-    varNumRoiVrtx = len(lstCsvRoi) - varNumHdrRoi
-
-    # Create empty array for ROI vertex data. The second column will contain
-    # the IDs of the vertices contained in the ROI.
-    aryRoiVrtx = np.zeros((varNumRoiVrtx, 5))
-
-    # Loop through list and access numeric vertex data:
-    for idxVrtx in range(0, varNumRoiVrtx):
-        # When indexing the list, we add one because we skip the header:
-        aryRoiVrtx[idxVrtx, :] = lstCsvRoi[(idxVrtx + 1)].split(',')
-
-    # Delete original list:
-    del(lstCsvRoi)
+    # Open file with ROI information:
+    with open(strCsvRoi, 'r') as fleCsvRoi:
+
+        # Check number of header lines (empty lines are skipped, as in the
+        # data):
+        varNumHdrTmp = 0
+        for strLne in fleCsvRoi:
+            strLne = strLne.strip()
+            if not strLne:
+                continue
+            if _is_numeric(strLne):
+                break
+            varNumHdrTmp += 1
+        if varNumHdrTmp != varNumHdrRoi:
+            strErrMsg = ('ERROR. Expected ' + str(varNumHdrRoi)
+                         + ' header line(s) in ROI csv file ' + strCsvRoi
+                         + ', found ' + str(varNumHdrTmp) + '.')
+            raise ValueError(strErrMsg)
+
+        # Read numeric data in one go (only the requested columns). An ROI
+        # csv file without vertices (header only) results in an empty array.
+        fleCsvRoi.seek(0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            aryRoiVrtx = np.loadtxt(fleCsvRoi,
+                                    dtype=np.float64,
+                                    delimiter=',',
+                                    skiprows=varNumHdrRoi,
+                                    usecols=DIC_CSV_COL[strCol],
+                                    ndmin=(1 if strCol == 'index' else 2))
+
+    if strCol == 'all' and aryRoiVrtx.size == 0:
+        # Paraview csv files have five columns:
+        aryRoiVrtx = np.zeros((0, 5))
+    elif strCol == 'coords' and aryRoiVrtx.size == 0:
+        aryRoiVrtx = np.zeros((0, 3))
+    elif strCol == 'index':
+        # Vertex indices:
+        aryRoiVrtx = aryRoiVrtx.astype(np.int64)
+
+    if lgcCache:
+        if VAR_NUM_CACHE <= len(DIC_CSV_ROI):
+            DIC_CSV_ROI.clear()
+        aryRoiVrtx.setflags(write=False)
+        DIC_CSV_ROI[tplKey] = aryRoiVrtx
 
     # Return the vertex array:
     return aryRoiVrtx
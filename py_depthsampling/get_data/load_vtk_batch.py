@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Function of the depth sampling pipeline."""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from py_depthsampling.get_data.load_vtk_multi import load_vtk_multi
+
+
+def load_vtk_batch(lstVtkIn, strPrcdData, varNumLne, varNumDpth, varNumThr=1,
+                   lgcCache=None, vecIdx=None):
+    """
+    Load several vtk files with multiple data points per vertex into one array.
+
+    Parameters
+    ----------
+    lstVtkIn : list
+        Paths of vtk files (e.g. one per condition). All meshes need to have
+        the same number of vertices (i.e. the same topology).
+    strPrcdData : str
+        Beginning of string which precedes vertex data in the vtk files.
+    varNumLne : int
+        Number of lines between vertex-identification-string and first data
+        point.
+    varNumDpth : int
+        Number of data points per vertex (e.g. number of depth levels).
+    varNumThr : int
+        Number of threads for parsing the files. If 1, the files are loaded
+        one after the other.
+    lgcCache : bool or None
+        Whether to use the on-disk cache (see `load_vtk_multi`).
+    vecIdx : np.array or None
+        Indices of vertices to load (see `load_vtk_multi`). If `None`, all
+        vertices are loaded.
+
+    Returns
+    -------
+    aryData : np.array
+        Vertex data, shape aryData[file, vertex, depth]. The array is
+        allocated once, and the data of each file is placed directly into it.
+
+    Notes
+    -----
+    Raises a `ValueError` if the number of vertices differs between files.
+    """
+    varNumCon = len(lstVtkIn)
+
+    # The first file determines the number of vertices:
+    aryTmp = load_vtk_multi(lstVtkIn[0], strPrcdData, varNumLne, varNumDpth,
+                            lgcCache=lgcCache, vecIdx=vecIdx)
+    varNumVrtx = aryTmp.shape[0]
+
+    aryData = np.empty((varNumCon, varNumVrtx, varNumDpth), dtype=np.float64)
+    aryData[0, :, :] = aryTmp
+    del aryTmp
+
+    def load_one(idxCon):
+        """Load one file into the output array."""
+        aryTmp = load_vtk_multi(lstVtkIn[idxCon], strPrcdData, varNumLne,
+                                varNumDpth, lgcCache=lgcCache, vecIdx=vecIdx)
+        if aryTmp.shape[0] != varNumVrtx:
+            strErrMsg = ('ERROR. Number of vertices in vtk file '
+                         + lstVtkIn[idxCon] + ' (' + str(aryTmp.shape[0])
+                         + ') differs from number of vertices in '
+                         + lstVtkIn[0] + ' (' + str(varNumVrtx) + ').')
+            raise ValueError(strErrMsg)
+        aryData[idxCon, :, :] = aryTmp
+
+    if (1 < varNumThr) and (2 < varNumCon):
+        with ThreadPoolExecutor(max_workers=varNumThr) as objPool:
+            # Iterate over results in order to raise exceptions:
+            for _ in objPool.map(load_one, range(1, varNumCon)):
+                pass
+    else:
+        for idxCon in range(1, varNumCon):
+            load_one(idxCon)
+
+    return aryData
@@ -21,70 +21,48 @@ Function of the depth sampling pipeline.
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import csv
-import numpy as np
+from py_depthsampling.get_data.vtk_io import read_vtk_data
+from py_depthsampling.get_data.vtk_cache import read_vtk_data_cached
+from py_depthsampling.get_data.vtk_cache import use_cache
+from py_depthsampling.get_data.vtk_pack import read_vtk_packed
 
 
-def load_vtk_single(strVtkIn, strPrcdData, varNumLne):
+def load_vtk_single(strVtkIn, strPrcdData, varNumLne, lgcCache=None,
+                    vecIdx=None):
     """
     Function for loading vtk file with one data point per vertex.
 
     The vtk file to be loaded is supposed to be a cortex mesh with one value
     per vertex, e.g. statistical parameters for one single cortical depth
     level.
+
+    Parsed data are cached on disk if `lgcCache` is `True`, or if `lgcCache`
+    is `None` and the environment variable `PY_DEPTHSAMPLING_CACHE` is set (see
+    `py_depthsampling.get_data.vtk_cache`). The returned array is writeable in
+    either case. If the vtk file is held by a packed container (see
+    `py_depthsampling.get_data.vtk_pack`), the data are read from the
+    container.
+
+    If `vecIdx` (indices of vertices, e.g. the second column of the array
+    returned by `load_csv_roi`) is provided, only the data of these vertices
+    are returned (and, where possible, read from disk).
     """
     # print('---------Importing vtk file with one value per vertex: '
     #       + strVtkIn)
 
-    # Open vtk file:
-    fleVtkIn = open(strVtkIn, 'r')
-
-    # Read file  vtk file:
-    csvIn = csv.reader(fleVtkIn,
-                       delimiter='\n',
-                       skipinitialspace=True)
-
-    # Create empty list for vertex data:
-    lstVtkData = []
-
-    # Loop through csv object to fill list with vertex data:
-    for lstTmp in csvIn:
-        for strTmp in lstTmp:
-            lstVtkData.append(strTmp[:])
-
-    # Close file:
-    fleVtkIn.close()
-
-    # Get index of string that precedes the vertex data:
-    # varIdxTmp = lstVtkData.index(strPrcdData)
-    for idxSrch in range(0, len(lstVtkData)):
-        if lstVtkData[idxSrch].startswith((strPrcdData)):
-            varIdxTmp = idxSrch
-
-    # Get number of vertices from the line preceding the specified string:
-    strNumDataVrtx = lstVtkData[(varIdxTmp - 1)]
-
-    # The number of vertecies is preceded by the string 'POINT_DATA' in vtk
-    # files. We extract the number behind the string:
-    varNumDataVrtx = int(strNumDataVrtx[11:])
-
-    # Index of first vertex data point:
-    varIdxFrst = varIdxTmp + varNumLne
-
-    # Array for numeric vertex data:
-    vecVtkData = np.zeros((varNumDataVrtx, 1))
-
-    # Get numeric vertex data:
-    for idxData in range(0, varNumDataVrtx):
-
-        # Line of current vertex in csv list:
-        varTmpStrt = varIdxFrst + idxData
-
-        # Put vertex data into array:
-        vecVtkData[idxData, :] = float(lstVtkData[varTmpStrt])
+    # Get numeric vertex data (from packed container, if available):
+    vecVtkData = read_vtk_packed(strVtkIn, strPrcdData, 1,
+                                 vecIdx=vecIdx)
+    if vecVtkData is None:
+        if use_cache(lgcCache):
+            vecVtkData = read_vtk_data_cached(strVtkIn, strPrcdData,
+                                              varNumLne, 1, vecIdx=vecIdx)
+        else:
+            vecVtkData = read_vtk_data(strVtkIn, strPrcdData, varNumLne, 1,
+                                       vecIdx=vecIdx)
 
     # Flatten the array:
-    vecVtkData = vecVtkData.flatten()
+    vecVtkData = vecVtkData.reshape(-1)
 
     # Return vector with vertex data:
     return vecVtkData
@@ -0,0 +1,641 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache for vertex data parsed from vtk meshes.
+
+Parsing vtk meshes is by far the slowest part of loading the data, and the
+same meshes are loaded again on every run (and in every ROI / condition loop).
+Parsed arrays can therefore be stored as `*.npy` files in a cache directory,
+and are read from there when the same mesh is requested again. Cache entries
+are keyed on the path, modification time, and size of the vtk file, and on the
+parameters used for parsing, so that a modified mesh is parsed again. Indices
+of the sections of vtk files (see `vtk_index`) are stored in the same
+directory, in a sub-directory 'index'.
+
+The cache is opt-in. It is used if the environment variable
+`PY_DEPTHSAMPLING_CACHE` is set to a cache directory, or if a loader is called
+with `lgcCache=True` (in which case the cache directory defaults to
+`~/.cache/py_depthsampling/vtk`). Setting the environment variable to `off`
+disables the cache altogether. The total size of the cache is bounded (default
+4096 MB, environment variable `PY_DEPTHSAMPLING_CACHE_MB`); least recently used
+entries are removed first. The cache can be inspected and purged from the
+command line:
+
+    python -m py_depthsampling.get_data.vtk_cache inspect
+    python -m py_depthsampling.get_data.vtk_cache purge [--stale]
+
+The same command line interface inspects and purges the stage cache
+(`--stages`, see `py_depthsampling.main.stages`) and checkpoints (`--ckpt`,
+see `py_depthsampling.main.checkpoint`).
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from py_depthsampling.get_data.vtk_io import read_vtk_data
+from py_depthsampling.get_data.vtk_index import build_vtk_index
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; concurrent cache misses are then parsed by
+    # each process.
+    fcntl = None
+
+# Environment variables for cache directory and maximum cache size (MB):
+STR_ENV_DIR = 'PY_DEPTHSAMPLING_CACHE'
+STR_ENV_SZE = 'PY_DEPTHSAMPLING_CACHE_MB'
+
+# Default maximum cache size (MB):
+VAR_SZE_DEF = 4096
+
+
+def get_cache_root():
+    """
+    Get path of parent directory of all py_depthsampling caches.
+
+    Returns
+    -------
+    strDir : str
+        Path of directory (`~/.cache/py_depthsampling`), which holds the vtk
+        cache, the stage cache (see `py_depthsampling.main.stages`), and
+        checkpoints (see `py_depthsampling.main.checkpoint`) by default.
+    """
+    return os.path.join(os.path.expanduser('~'), '.cache', 'py_depthsampling')
+
+
+def get_cache_dir():
+    """
+    Get path of cache directory.
+
+    Returns
+    -------
+    strDir : str or None
+        Path of cache directory, or `None` if the cache is disabled.
+    """
+    strDir = os.environ.get(STR_ENV_DIR, None)
+    if strDir is None:
+        strDir = os.path.join(get_cache_root(), 'vtk')
+    elif strDir.lower() in ('', '0', 'off', 'none'):
+        strDir = None
+    return strDir
+
+
+def use_cache(lgcCache=None):
+    """
+    Whether to use the cache.
+
+    Parameters
+    ----------
+    lgcCache : bool or None
+        Whether to use the cache. If `None`, the cache is only used if the
+        environment variable `PY_DEPTHSAMPLING_CACHE` is set to a directory.
+
+    Returns
+    -------
+    lgcUse : bool
+        Whether to use the cache (always `False` if the cache is disabled via
+        the environment variable).
+    """
+    if get_cache_dir() is None:
+        return False
+    if lgcCache is None:
+        return os.environ.get(STR_ENV_DIR, None) is not None
+    return bool(lgcCache)
+
+
+def get_cache_size():
+    """Get maximum size of cache (in bytes)."""
+    varSze = float(os.environ.get(STR_ENV_SZE, VAR_SZE_DEF))
+    return int(varSze * 1024 * 1024)
+
+
+def get_cache_key(strVtkIn, strPrcdData, varNumLne, varNumDpth):
+    """
+    Get cache key for vtk file & parsing parameters.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of vtk file.
+    strPrcdData : str
+        Beginning of string preceeding vertex data.
+    varNumLne : int
+        Number of lines between vertex-identification-string and first data
+        point.
+    varNumDpth : int
+        Number of data points per vertex.
+
+    Returns
+    -------
+    strKey : str
+        Hash of absolute path, modification time, and size of the vtk file,
+        and of the parsing parameters.
+    dicMeta : dict
+        Key components (stored alongside the cached array).
+    """
+    objStat = os.stat(strVtkIn)
+    dicMeta = {'path': os.path.abspath(strVtkIn),
+               'mtime_ns': objStat.st_mtime_ns,
+               'size': objStat.st_size,
+               'strPrcdData': strPrcdData,
+               'varNumLne': int(varNumLne),
+               'varNumDpth': int(varNumDpth)}
+    strKey = hashlib.sha1(json.dumps(dicMeta, sort_keys=True).encode('utf-8')
+                          ).hexdigest()
+    return strKey, dicMeta
+
+
+def _save_atomic(strPthOt, objSave):
+    """Save array (or json dict) via temporary file & rename."""
+    strDir = os.path.dirname(strPthOt)
+    varFd, strTmp = tempfile.mkstemp(dir=strDir, suffix='.tmp')
+    try:
+        with os.fdopen(varFd, 'wb') as fleOt:
+            if isinstance(objSave, dict):
+                fleOt.write(json.dumps(objSave, indent=1).encode('utf-8'))
+            else:
+                np.save(fleOt, objSave)
+        os.replace(strTmp, strPthOt)
+    except BaseException:
+        if os.path.isfile(strTmp):
+            os.remove(strTmp)
+        raise
+
+
+def lst_cache(strDir=None):
+    """
+    List cache entries.
+
+    Parameters
+    ----------
+    strDir : str
+        Cache directory (default: `get_cache_dir()`).
+
+    Returns
+    -------
+    lstEnt : list
+        One dict per cache entry (keys: 'key', 'npy', 'bytes', 'last_used',
+        'stale', and the key components, see `get_cache_key`), sorted from
+        least to most recently used.
+    """
+    if strDir is None:
+        strDir = get_cache_dir()
+    if (strDir is None) or (not os.path.isdir(strDir)):
+        return []
+
+    lstEnt = []
+    for strFle in os.listdir(strDir):
+        if not strFle.endswith('.npy'):
+            continue
+        strKey = strFle[:-4]
+        strNpy = os.path.join(strDir, strFle)
+        strJsn = os.path.join(strDir, strKey + '.json')
+        try:
+            with open(strJsn, 'r') as fleJsn:
+                dicEnt = json.load(fleJsn)
+        except (IOError, OSError, ValueError):
+            dicEnt = {'path': None}
+        try:
+            objStat = os.stat(strNpy)
+        except OSError:
+            # Removed by another process in the meantime.
+            continue
+        dicEnt['key'] = strKey
+        dicEnt['npy'] = strNpy
+        dicEnt['bytes'] = objStat.st_size
+        # The modification time of the *.npy file is updated on every cache
+        # hit (access times are not reliable on all file systems):
+        dicEnt['last_used'] = objStat.st_mtime
+        # Entry is stale if the vtk file has been modified or removed:
+        try:
+            strKeyNew = get_cache_key(dicEnt['path'],
+                                      dicEnt['strPrcdData'],
+                                      dicEnt['varNumLne'],
+                                      dicEnt['varNumDpth'])[0]
+            dicEnt['stale'] = (strKeyNew != strKey)
+        except (KeyError, TypeError, OSError):
+            dicEnt['stale'] = True
+        lstEnt.append(dicEnt)
+
+    lstEnt.sort(key=lambda dicEnt: dicEnt['last_used'])
+
+    return lstEnt
+
+
+def _rm_entry(dicEnt):
+    """Remove cache entry (*.npy & *.json file)."""
+    strJsn = dicEnt['npy'][:-4] + '.json'
+    for strPth in (dicEnt['npy'], strJsn):
+        try:
+            os.remove(strPth)
+        except OSError:
+            pass
+
+
+def evict_cache(strDir=None, varSzeMax=None):
+    """
+    Remove least recently used cache entries until cache size is below limit.
+
+    Parameters
+    ----------
+    strDir : str
+        Cache directory (default: `get_cache_dir()`).
+    varSzeMax : int
+        Maximum cache size in bytes (default: `get_cache_size()`).
+
+    Returns
+    -------
+    varNumRm : int
+        Number of removed entries.
+    """
+    if varSzeMax is None:
+        varSzeMax = get_cache_size()
+    lstEnt = lst_cache(strDir)
+    varSze = sum([dicEnt['bytes'] for dicEnt in lstEnt])
+    varNumRm = 0
+    for dicEnt in lstEnt:
+        if varSze <= varSzeMax:
+            break
+        _rm_entry(dicEnt)
+        varSze -= dicEnt['bytes']
+        varNumRm += 1
+    return varNumRm
+
+
+def _lst_index(strDir):
+    """List vtk index files in cache directory (path & staleness)."""
+    strDirIdx = os.path.join(strDir, 'index')
+    if not os.path.isdir(strDirIdx):
+        return []
+    lstIdx = []
+    for strFle in os.listdir(strDirIdx):
+        if not strFle.endswith('.json'):
+            continue
+        strJsn = os.path.join(strDirIdx, strFle)
+        try:
+            with open(strJsn, 'r') as fleJsn:
+                dicIdx = json.load(fleJsn)
+            objStat = os.stat(dicIdx['path'])
+            lgcStale = ((objStat.st_mtime_ns != dicIdx['mtime_ns'])
+                        or (objStat.st_size != dicIdx['size']))
+        except (IOError, OSError, ValueError, KeyError):
+            lgcStale = True
+        lstIdx.append((strJsn, lgcStale))
+    return lstIdx
+
+
+def load_vtk_index(strVtkIn, lgcCache=None):
+    """
+    Load index of vtk file from cache, or build (and cache) it.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of vtk file.
+    lgcCache : bool or None
+        Whether to use the cache (see `use_cache`).
+
+    Returns
+    -------
+    dicIdx : dict
+        Vtk index (see `vtk_index.build_vtk_index`).
+
+    Notes
+    -----
+    The index is keyed on the path, modification time, and size of the vtk
+    file. If the cache is not used, the index is built without being stored.
+    """
+    if not use_cache(lgcCache):
+        return build_vtk_index(strVtkIn)
+    strDir = get_cache_dir()
+
+    objStat = os.stat(strVtkIn)
+    strKey = hashlib.sha1(json.dumps([os.path.abspath(strVtkIn),
+                                      objStat.st_mtime_ns,
+                                      objStat.st_size]).encode('utf-8')
+                          ).hexdigest()
+    strJsn = os.path.join(strDir, 'index', strKey + '.json')
+
+    try:
+        with open(strJsn, 'r') as fleJsn:
+            dicIdx = json.load(fleJsn)
+        if ((dicIdx['mtime_ns'] == objStat.st_mtime_ns)
+                and (dicIdx['size'] == objStat.st_size)):
+            return dicIdx
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    dicIdx = build_vtk_index(strVtkIn)
+    try:
+        if not os.path.isdir(os.path.dirname(strJsn)):
+            os.makedirs(os.path.dirname(strJsn), exist_ok=True)
+        _save_atomic(strJsn, dicIdx)
+    except (IOError, OSError):
+        print(('---------WARNING: Could not write to vtk cache directory: '
+               + strDir))
+
+    return dicIdx
+
+
+def purge_cache(strDir=None, lgcStale=False):
+    """
+    Remove cache entries (and vtk indices).
+
+    Parameters
+    ----------
+    strDir : str
+        Cache directory (default: `get_cache_dir()`).
+    lgcStale : bool
+        If `True`, only remove entries whose vtk file has been modified or
+        removed.
+
+    Returns
+    -------
+    varNumRm : int
+        Number of removed entries.
+    """
+    if strDir is None:
+        strDir = get_cache_dir()
+    if (strDir is None) or (not os.path.isdir(strDir)):
+        return 0
+    varNumRm = 0
+    for dicEnt in lst_cache(strDir):
+        if (not lgcStale) or dicEnt['stale']:
+            _rm_entry(dicEnt)
+            varNumRm += 1
+    for strJsn, lgcStaleIdx in _lst_index(strDir):
+        if (not lgcStale) or lgcStaleIdx:
+            try:
+                os.remove(strJsn)
+            except OSError:
+                pass
+    # Lock files (see `_lock_entry`) of removed entries:
+    strDirLck = os.path.join(strDir, 'lock')
+    if os.path.isdir(strDirLck):
+        setKey = set([dicEnt['key'] for dicEnt in lst_cache(strDir)])
+        for strFle in os.listdir(strDirLck):
+            if strFle[:-len('.lock')] not in setKey:
+                try:
+                    os.remove(os.path.join(strDirLck, strFle))
+                except OSError:
+                    pass
+    return varNumRm
+
+
+@contextlib.contextmanager
+def _lock_entry(strDir, strKey):
+    """
+    Hold exclusive lock on cache entry.
+
+    Processes that miss the same cache entry at the same time (e.g. parallel
+    jobs of a batch, see `py_depthsampling.main.batch`) wait for the first one
+    to parse the vtk file, instead of all parsing it. Lock files are kept in
+    the sub-directory 'lock' of the cache directory.
+    """
+    fleLck = None
+    if fcntl is not None:
+        try:
+            strDirLck = os.path.join(strDir, 'lock')
+            if not os.path.isdir(strDirLck):
+                os.makedirs(strDirLck, exist_ok=True)
+            fleLck = open(os.path.join(strDirLck, strKey + '.lock'), 'w')
+        except (IOError, OSError):
+            fleLck = None
+    try:
+        if fleLck is not None:
+            fcntl.flock(fleLck.fileno(), fcntl.LOCK_EX)
+        yield
+    finally:
+        if fleLck is not None:
+            # Closing the file releases the lock:
+            fleLck.close()
+
+
+def _load_entry(strNpy, vecIdx):
+    """Load (rows of) cache entry into memory, `None` if not cached."""
+    try:
+        aryVtkData = np.load(strNpy, mmap_mode='r')
+        try:
+            # Mark entry as recently used:
+            os.utime(strNpy, None)
+        except OSError:
+            pass
+        # Copy to memory (same kind of array as on a cache miss):
+        if vecIdx is None:
+            return np.array(aryVtkData)
+        return np.asarray(aryVtkData[vecIdx, :])
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def read_vtk_data_cached(strVtkIn, strPrcdData, varNumLne, varNumDpth,
+                         vecIdx=None):
+    """
+    Load vertex data from vtk file, via on-disk cache.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of vtk file.
+    strPrcdData : str
+        Beginning of string preceeding vertex data.
+    varNumLne : int
+        Number of lines between vertex-identification-string and first data
+        point.
+    varNumDpth : int
+        Number of data points per vertex.
+    vecIdx : np.array or None
+        Indices of vertices to return (e.g. vertices contained in a ROI). If
+        `None`, all vertices are returned.
+
+    Returns
+    -------
+    aryVtkData : np.array
+        Vertex data, shape aryVtkData[vertex, depth]. The array is held in
+        memory and is writeable, irrespective of whether it was read from the
+        cache (on a cache hit, only the selected rows are read if `vecIdx` is
+        provided).
+
+    Notes
+    -----
+    If the cache is disabled, or the cache directory cannot be written, the
+    vtk file is parsed with `read_vtk_data`. On a cache miss, the data are
+    located via the (cached) index of the vtk file; concurrent misses of the
+    same entry are parsed only once (see `_lock_entry`). The cache is used
+    irrespective of `use_cache` (callers decide whether to use it).
+    """
+    strDir = get_cache_dir()
+    if strDir is None:
+        return read_vtk_data(strVtkIn, strPrcdData, varNumLne, varNumDpth,
+                             vecIdx=vecIdx)
+
+    strKey, dicMeta = get_cache_key(strVtkIn, strPrcdData, varNumLne,
+                                    varNumDpth)
+    strNpy = os.path.join(strDir, strKey + '.npy')
+
+    # Cache hit:
+    aryVtkData = _load_entry(strNpy, vecIdx)
+    if aryVtkData is not None:
+        return aryVtkData
+
+    # Cache miss (the entry may have been created by another process while
+    # waiting for the lock):
+    with _lock_entry(strDir, strKey):
+        aryVtkData = _load_entry(strNpy, vecIdx)
+        if aryVtkData is not None:
+            return aryVtkData
+        aryVtkData = read_vtk_data(strVtkIn, strPrcdData, varNumLne,
+                                   varNumDpth,
+                                   dicIdx=load_vtk_index(strVtkIn,
+                                                         lgcCache=True))
+        try:
+            if not os.path.isdir(strDir):
+                os.makedirs(strDir, exist_ok=True)
+            dicMeta['created'] = time.time()
+            _save_atomic(os.path.join(strDir, strKey + '.json'), dicMeta)
+            _save_atomic(strNpy, aryVtkData)
+            evict_cache(strDir)
+        except (IOError, OSError):
+            print(('---------WARNING: Could not write to vtk cache directory: '
+                   + strDir))
+
+    # The full array is cached, so that the next call can read any subset of
+    # vertices:
+    if vecIdx is not None:
+        aryVtkData = aryVtkData[vecIdx, :]
+
+    return aryVtkData
+
+
+def main():
+    """Inspect or purge vtk cache (stage cache, checkpoints) from the CLI."""
+    # Imported here, because the stage cache and checkpoints depend on this
+    # module:
+    from py_depthsampling.main.checkpoint import get_ckpt_path
+    from py_depthsampling.main.checkpoint import lst_ckpt
+    from py_depthsampling.main.checkpoint import purge_ckpt
+    from py_depthsampling.main.stages import get_stage_path
+    from py_depthsampling.main.stages import get_stage_size
+    from py_depthsampling.main.stages import lst_stages
+    from py_depthsampling.main.stages import purge_stages
+
+    objParser = argparse.ArgumentParser(
+        description='Inspect or purge the cache of parsed vtk meshes, the '
+                    + 'cache of pipeline stage results, or checkpoints.')
+    objParser.add_argument('command', choices=['inspect', 'purge'])
+    objParser.add_argument('--dir', default=None,
+                           help='Cache directory (default: '
+                                + str(get_cache_dir()) + ').')
+    objParser.add_argument('--stale', action='store_true',
+                           help='Purge: only remove entries whose vtk file '
+                                + 'was modified or removed.')
+    objParser.add_argument('--stages', action='store_true',
+                           help='Inspect or purge the stage cache (default '
+                                + 'directory: ' + get_stage_path() + ').')
+    objParser.add_argument('--ckpt', action='store_true',
+                           help='Inspect or purge checkpoints (default '
+                                + 'directory: ' + str(get_ckpt_path())
+                                + ').')
+    objNspc = objParser.parse_args()
+
+    if objNspc.stages and objNspc.ckpt:
+        objParser.error('--stages cannot be combined with --ckpt.')
+
+    if objNspc.ckpt:
+        if objNspc.stale:
+            objParser.error('--stale cannot be combined with --ckpt.')
+        strDir = (get_ckpt_path() if objNspc.dir is None else objNspc.dir)
+        if objNspc.command == 'inspect':
+            lstEnt = lst_ckpt(strDir)
+            print(('---' + str(len(lstEnt)) + ' checkpoints, '
+                   + str(np.around(sum([dicEnt['bytes'] for dicEnt in lstEnt])
+                                   / 1048576.0, decimals=1))
+                   + ' MB (' + str(strDir) + ')'))
+        else:
+            varNumRm = purge_ckpt(strDir)
+            print('---Removed ' + str(varNumRm) + ' checkpoints.')
+        return
+
+    if objNspc.stages:
+        if objNspc.stale:
+            # Keys of stage results include their inputs, so that outdated
+            # results cannot be told apart (they are evicted when the size
+            # limit is reached):
+            objParser.error('--stale cannot be combined with --stages.')
+        strDir = (get_stage_path() if objNspc.dir is None else objNspc.dir)
+        if objNspc.command == 'inspect':
+            lstEnt = lst_stages(strDir)
+            dicStg = {}
+            for dicEnt in lstEnt:
+                varNum, varSze = dicStg.get(dicEnt['stage'], (0, 0))
+                dicStg[dicEnt['stage']] = (varNum + 1,
+                                           varSze + dicEnt['bytes'])
+            for strStg in sorted(dicStg, key=str):
+                varNum, varSze = dicStg[strStg]
+                print((str(strStg).ljust(16) + str(varNum).rjust(8)
+                       + ' results  '
+                       + str(np.around(varSze / 1048576.0, decimals=1))
+                       + ' MB'))
+            print(('---' + str(len(lstEnt)) + ' stage results, '
+                   + str(np.around(sum([dicEnt['bytes'] for dicEnt in lstEnt])
+                                   / 1048576.0, decimals=1))
+                   + ' MB (limit '
+                   + str(np.around(get_stage_size() / 1048576.0, decimals=1))
+                   + ' MB)'))
+        else:
+            varNumRm = purge_stages(strDir)
+            print('---Removed ' + str(varNumRm) + ' stage results.')
+        return
+
+    if objNspc.command == 'inspect':
+        lstEnt = lst_cache(objNspc.dir)
+        varSze = 0
+        for dicEnt in lstEnt:
+            varSze += dicEnt['bytes']
+            print((time.strftime('%Y-%m-%d %H:%M',
+                                 time.localtime(dicEnt['last_used']))
+                   + '  '
+                   + str(np.around(dicEnt['bytes'] / 1048576.0,
+                                   decimals=1)).rjust(8)
+                   + ' MB  '
+                   + ('stale  ' if dicEnt['stale'] else 'ok     ')
+                   + str(dicEnt.get('path'))))
+        if objNspc.dir is None:
+            strDir = get_cache_dir()
+        else:
+            strDir = objNspc.dir
+        if strDir is not None:
+            print('---' + str(len(_lst_index(strDir))) + ' vtk indices.')
+        print(('---' + str(len(lstEnt)) + ' entries, '
+               + str(np.around(varSze / 1048576.0, decimals=1)) + ' MB (limit '
+               + str(np.around(get_cache_size() / 1048576.0, decimals=1))
+               + ' MB)'))
+    else:
+        varNumRm = purge_cache(objNspc.dir, lgcStale=objNspc.stale)
+        print('---Removed ' + str(varNumRm) + ' entries.')
+
+
+if __name__ == "__main__":
+
+    main()
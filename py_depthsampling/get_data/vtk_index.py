@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Function of the depth sampling pipeline.
+
+Index of the sections of legacy vtk files (byte offsets of POINTS, POLYGONS,
+POINT_DATA, SCALARS, etc.), so that a block of data can be read without
+searching the file for the string preceding it. The index is a plain dict
+(json serialisable); use `vtk_cache.load_vtk_index` to build it once per file
+and load it from the cache afterwards.
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import numpy as np
+from py_depthsampling.get_data.vtk_io import DIC_LGC_TYPE
+from py_depthsampling.get_data.vtk_io import VAR_CHNK
+from py_depthsampling.get_data.vtk_io import find_vtk_block_end
+from py_depthsampling.get_data.vtk_io import get_vtk_format
+from py_depthsampling.get_data.vtk_io import read_vtk_block
+from py_depthsampling.get_data.vtk_xml import read_vtp_data
+
+
+# Keywords of sections of legacy vtk files:
+TPL_LGC_KEY = ('DATASET', 'POINTS', 'VERTICES', 'LINES', 'POLYGONS',
+               'TRIANGLE_STRIPS', 'POINT_DATA', 'CELL_DATA', 'SCALARS',
+               'LOOKUP_TABLE', 'VECTORS', 'NORMALS', 'TEXTURE_COORDINATES',
+               'TENSORS', 'COLOR_SCALARS', 'FIELD')
+
+# Cell sections (followed by the number of cells and the size of the cell
+# array, e.g. 'POLYGONS 504760 2019040'):
+TPL_LGC_CLL = ('VERTICES', 'LINES', 'POLYGONS', 'TRIANGLE_STRIPS')
+
+
+def _skip_empty(fleVtkIn):
+    """Skip empty lines (ASCII files), return offset of next non-empty line."""
+    while True:
+        varOff = fleVtkIn.tell()
+        bytLne = fleVtkIn.readline()
+        if bytLne.strip() or (not bytLne):
+            fleVtkIn.seek(varOff)
+            return varOff
+
+
+def _index_section(fleVtkIn, varOffLne, strFrmt, varNumAtt):
+    """
+    Index section of legacy vtk file.
+
+    Parameters
+    ----------
+    fleVtkIn : file object
+        Vtk file, opened in binary mode.
+    varOffLne : int
+        Byte offset of the line with the section keyword.
+    strFrmt : str
+        'ascii' or 'binary'.
+    varNumAtt : int or None
+        Number of tuples of attribute data (from the last POINT_DATA or
+        CELL_DATA line).
+
+    Returns
+    -------
+    dicSec : dict or None
+        Section entry (see `build_vtk_index`), or `None` if the size of the
+        section is unknown (binary files only).
+    """
+    fleVtkIn.seek(varOffLne)
+    bytLne = fleVtkIn.readline()
+    lstTkn = bytLne.decode('ascii', 'replace').split()
+    strKey = lstTkn[0].upper()
+
+    dicSec = {'keyword': strKey,
+              'line': bytLne.rstrip(b'\r\n').decode('ascii', 'replace'),
+              'offset': varOffLne,
+              'offset_data': None,
+              'offset_end': None}
+
+    # Number of values in the data block of the section:
+    varNumVal = 0
+
+    if strKey == 'POINTS':
+        dicSec['count'] = int(lstTkn[1])
+        dicSec['type'] = lstTkn[2].lower()
+        dicSec['components'] = 3
+        varNumVal = dicSec['count'] * 3
+
+    elif strKey in TPL_LGC_CLL:
+        dicSec['count'] = int(lstTkn[1])
+        dicSec['size'] = int(lstTkn[2])
+        dicSec['type'] = 'int'
+        varNumVal = dicSec['size']
+
+    elif strKey in ('POINT_DATA', 'CELL_DATA'):
+        dicSec['count'] = int(lstTkn[1])
+
+    elif strKey in ('SCALARS', 'VECTORS', 'NORMALS'):
+        dicSec['name'] = lstTkn[1]
+        dicSec['type'] = lstTkn[2].lower()
+        if strKey != 'SCALARS':
+            dicSec['components'] = 3
+        elif 3 < len(lstTkn):
+            dicSec['components'] = int(lstTkn[3])
+        else:
+            dicSec['components'] = 1
+        dicSec['count'] = varNumAtt
+        varNumVal = varNumAtt * dicSec['components']
+
+        # Lookup table following the SCALARS line:
+        if strKey == 'SCALARS':
+            if strFrmt == 'ascii':
+                _skip_empty(fleVtkIn)
+            varOffLut = fleVtkIn.tell()
+            bytLut = fleVtkIn.readline()
+            if bytLut.startswith(b'LOOKUP_TABLE'):
+                dicSec['line_lut'] = bytLut.rstrip(b'\r\n').decode('ascii',
+                                                                   'replace')
+                dicSec['offset_lut'] = varOffLut
+            else:
+                fleVtkIn.seek(varOffLut)
+
+    elif strKey == 'LOOKUP_TABLE':
+        # Colour table (RGBA values):
+        dicSec['name'] = lstTkn[1]
+        dicSec['count'] = int(lstTkn[2])
+        dicSec['components'] = 4
+        if strFrmt == 'binary':
+            dicSec['type'] = 'unsigned_char'
+        else:
+            dicSec['type'] = 'float'
+        varNumVal = dicSec['count'] * 4
+
+    elif strKey != 'DATASET':
+        # Sections of unknown size (e.g. FIELD data). In ASCII files, the
+        # following section is found by its keyword, but binary files cannot
+        # be indexed beyond this point.
+        if strFrmt == 'binary':
+            return None
+
+    if 0 < varNumVal:
+        if strFrmt == 'ascii':
+            dicSec['offset_data'] = _skip_empty(fleVtkIn)
+        else:
+            dicSec['offset_data'] = fleVtkIn.tell()
+            objDtp = np.dtype('>' + DIC_LGC_TYPE[dicSec['type']])
+            dicSec['offset_end'] = find_vtk_block_end(
+                fleVtkIn, dicSec['offset_data'], varNumVal, objDtp=objDtp)
+    else:
+        dicSec['offset_end'] = fleVtkIn.tell()
+
+    return dicSec
+
+
+def _scan_keywords(fleVtkIn, varOffStrt):
+    """
+    Get byte offsets of section keywords in ASCII legacy vtk file.
+
+    Lines starting with an upper case letter are searched for chunk by chunk
+    (numeric data lines are skipped by the regular expression engine), and
+    those starting with a section keyword are returned.
+    """
+    objRgx = re.compile(b'\n[A-Z]')
+    # Offsets of candidate lines:
+    lstCnd = []
+    fleVtkIn.seek(varOffStrt)
+    # Byte offset of the beginning of the current chunk, and the last byte
+    # of the previous chunk (to find line breaks at chunk borders):
+    varOffChnk = varOffStrt
+    bytPrv = b'\n'
+    while True:
+        bytChnk = fleVtkIn.read(VAR_CHNK)
+        if not bytChnk:
+            break
+        bytBuf = bytPrv + bytChnk
+        for objMtch in objRgx.finditer(bytBuf):
+            # Offset of the line (the buffer starts one byte before the
+            # chunk):
+            lstCnd.append(varOffChnk + objMtch.start())
+        varOffChnk += len(bytChnk)
+        bytPrv = bytChnk[-1:]
+
+    # Keep lines starting with a keyword:
+    lstOff = []
+    for varOff in lstCnd:
+        fleVtkIn.seek(varOff)
+        lstTkn = fleVtkIn.read(32).split(None, 1)
+        if lstTkn and (lstTkn[0].decode('ascii', 'replace') in TPL_LGC_KEY):
+            lstOff.append(varOff)
+    return lstOff
+
+
+def build_vtk_index(strVtkIn):
+    """
+    Index sections of legacy vtk file.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of vtk file.
+
+    Returns
+    -------
+    dicIdx : dict
+        Index, with the following keys:
+        'path', 'mtime_ns', 'size' : absolute path, modification time, and
+            size of the vtk file (to detect outdated indices).
+        'format' : 'ascii', 'binary', or 'xml' (XML files are not indexed).
+        'num_vertices' : number of vertices (from the POINTS line).
+        'complete' : whether all sections were indexed (binary files cannot be
+            indexed beyond sections of unknown size, e.g. FIELD data).
+        'sections' : list of sections in order of appearance. Each section is
+            a dict with keys 'keyword' (e.g. 'SCALARS'), 'line' (the line
+            starting with the keyword), 'offset' (byte offset of that line),
+            'offset_data' and 'offset_end' (byte offsets of first byte of the
+            data block and of the first byte following it), and, depending on
+            the section, 'count' (number of points, cells, or tuples),
+            'components', 'type', 'name', 'size' (size of cell array), and
+            'line_lut' & 'offset_lut' (LOOKUP_TABLE line following SCALARS).
+
+    Notes
+    -----
+    In ASCII files, keyword lines are located without parsing the numeric
+    data, and 'offset_end' is the offset of the next section (or the end of
+    the file). In binary files, the sections are walked one by one, and the
+    size of each data block follows from the section line.
+    """
+    objStat = os.stat(strVtkIn)
+    dicIdx = {'path': os.path.abspath(strVtkIn),
+              'mtime_ns': objStat.st_mtime_ns,
+              'size': objStat.st_size,
+              'format': None,
+              'num_vertices': None,
+              'complete': True,
+              'sections': []}
+
+    with open(strVtkIn, 'rb') as fleVtkIn:
+
+        dicIdx['format'] = get_vtk_format(fleVtkIn)
+        if dicIdx['format'] == 'xml':
+            return dicIdx
+
+        # Skip header (version, title, and format):
+        fleVtkIn.seek(0)
+        for idxLne in range(3):
+            fleVtkIn.readline()
+        varOffHdr = fleVtkIn.tell()
+
+        lstSec = dicIdx['sections']
+        varNumAtt = None
+
+        if dicIdx['format'] == 'ascii':
+
+            # Offsets of all keyword lines (LOOKUP_TABLE lines following
+            # SCALARS lines are part of the SCALARS section):
+            for varOff in _scan_keywords(fleVtkIn, varOffHdr):
+                if lstSec and (lstSec[-1].get('offset_lut') == varOff):
+                    continue
+                dicSec = _index_section(fleVtkIn, varOff, 'ascii', varNumAtt)
+                if dicSec['keyword'] in ('POINT_DATA', 'CELL_DATA'):
+                    varNumAtt = dicSec['count']
+                if lstSec and (lstSec[-1]['offset_data'] is not None):
+                    lstSec[-1]['offset_end'] = varOff
+                lstSec.append(dicSec)
+            if lstSec and (lstSec[-1]['offset_data'] is not None):
+                lstSec[-1]['offset_end'] = objStat.st_size
+
+        else:
+
+            varOff = varOffHdr
+            while varOff < objStat.st_size:
+                fleVtkIn.seek(varOff)
+                bytLne = fleVtkIn.readline()
+                if not bytLne.strip():
+                    varOff = fleVtkIn.tell()
+                    continue
+                dicSec = _index_section(fleVtkIn, varOff, 'binary', varNumAtt)
+                if dicSec is None:
+                    dicIdx['complete'] = False
+                    break
+                if dicSec['keyword'] in ('POINT_DATA', 'CELL_DATA'):
+                    varNumAtt = dicSec['count']
+                lstSec.append(dicSec)
+                varOff = dicSec['offset_end']
+
+    for dicSec in lstSec:
+        if dicSec['keyword'] == 'POINTS':
+            dicIdx['num_vertices'] = dicSec['count']
+
+    return dicIdx
+
+
+def get_vtk_section(dicIdx, strKey, strName=None):
+    """
+    Get last section with given keyword (and name) from vtk index.
+
+    Parameters
+    ----------
+    dicIdx : dict
+        Vtk index (see `build_vtk_index`).
+    strKey : str
+        Section keyword, e.g. 'SCALARS' or 'POINTS'.
+    strName : str or None
+        Name of data array (SCALARS, VECTORS, NORMALS). If `None`, the name is
+        not checked.
+
+    Returns
+    -------
+    dicSec : dict or None
+        Section entry, or `None` if there is no such section.
+    """
+    dicOt = None
+    for dicSec in dicIdx['sections']:
+        if dicSec['keyword'] != strKey:
+            continue
+        if (strName is not None) and (dicSec.get('name') != strName):
+            continue
+        dicOt = dicSec
+    return dicOt
+
+
+def read_vtk_array(strVtkIn, strName, varNumDpth=None, dicIdx=None,
+                   vecIdx=None):
+    """
+    Read one named point data array from vtk file.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of vtk file (ASCII or binary legacy format, or XML PolyData).
+    strName : str
+        Name of the array (e.g. 'EmbedVertex' for 'SCALARS EmbedVertex float
+        11').
+    varNumDpth : int or None
+        Number of data points per vertex to return. If `None`, all components
+        are returned.
+    dicIdx : dict or None
+        Vtk index (see `build_vtk_index`). If `None`, the file is indexed.
+    vecIdx : np.array or None
+        Indices of vertices to return. If `None`, all vertices are returned.
+
+    Returns
+    -------
+    aryVtkData : np.array
+        Vertex data, shape aryVtkData[vertex, depth] (float64).
+    """
+    if dicIdx is None:
+        dicIdx = build_vtk_index(strVtkIn)
+
+    if dicIdx['format'] == 'xml':
+        aryVtkData = read_vtp_data(strVtkIn, strName=strName,
+                                   varNumDpth=varNumDpth)
+        if vecIdx is not None:
+            aryVtkData = aryVtkData[vecIdx, :]
+        return aryVtkData
+
+    dicSec = get_vtk_section(dicIdx, 'SCALARS', strName=strName)
+    if dicSec is None:
+        strErrMsg = ('ERROR. Array "' + strName + '" not found in vtk file: '
+                     + strVtkIn)
+        raise ValueError(strErrMsg)
+
+    if dicIdx['format'] == 'binary':
+        objDtp = np.dtype('>' + DIC_LGC_TYPE[dicSec['type']])
+    else:
+        objDtp = None
+
+    with open(strVtkIn, 'rb') as fleVtkIn:
+        aryVtkData = read_vtk_block(fleVtkIn, dicSec['offset_data'],
+                                    dicSec['count'], varNumDpth=varNumDpth,
+                                    objDtp=objDtp,
+                                    varNumCmp=dicSec['components'],
+                                    vecIdx=vecIdx)
+
+    return aryVtkData
@@ -0,0 +1,893 @@
+# -*- coding: utf-8 -*-
+"""
+Function of the depth sampling pipeline.
+
+Low-level reader & writer for vtk meshes. Supported formats are ASCII and
+binary legacy vtk files, and vtk XML PolyData files (see `vtk_xml`).
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import itertools
+import os
+import numpy as np
+from py_depthsampling.get_data.vtk_xml import get_cell_starts
+from py_depthsampling.get_data.vtk_xml import open_output
+from py_depthsampling.get_data.vtk_xml import read_vtp
+from py_depthsampling.get_data.vtk_xml import read_vtp_data
+from py_depthsampling.get_data.vtk_xml import read_vtp_points
+from py_depthsampling.get_data.vtk_xml import write_vtp
+
+
+# Size of chunks (in bytes) in which the vtk file is searched for the string
+# preceding the vertex data:
+VAR_CHNK = 2 ** 23
+
+# Data types of legacy vtk files (binary legacy files are big endian):
+DIC_LGC_TYPE = {'unsigned_char': 'u1',
+                'char': 'i1',
+                'unsigned_short': 'u2',
+                'short': 'i2',
+                'unsigned_int': 'u4',
+                'int': 'i4',
+                'unsigned_long': 'u8',
+                'long': 'i8',
+                'vtktypeuint64': 'u8',
+                'vtktypeint64': 'i8',
+                'float': 'f4',
+                'double': 'f8'}
+
+
+def get_vtk_format(fleVtkIn):
+    """
+    Detect format of vtk file.
+
+    Parameters
+    ----------
+    fleVtkIn : file object
+        Vtk file, opened in binary mode.
+
+    Returns
+    -------
+    strFrmt : str
+        'ascii' or 'binary' (legacy vtk format), or 'xml' (vtk XML format).
+    """
+    fleVtkIn.seek(0)
+    bytHdr = fleVtkIn.read(1024)
+    if bytHdr.lstrip().startswith(b'<'):
+        return 'xml'
+    # The third line of legacy vtk files specifies the format:
+    lstHdr = bytHdr.split(b'\n', 3)
+    if (2 < len(lstHdr)) and (lstHdr[2].strip().upper() == b'BINARY'):
+        return 'binary'
+    return 'ascii'
+
+
+def get_scalars_type(bytLne):
+    """
+    Get data type and number of components from legacy SCALARS line.
+
+    Parameters
+    ----------
+    bytLne : bytes
+        Line of the form 'SCALARS name dataType numComp' (e.g. 'SCALARS
+        EmbedVertex float 11').
+
+    Returns
+    -------
+    objDtp : np.dtype
+        Data type (big endian, as in binary legacy vtk files).
+    varNumCmp : int
+        Number of components per vertex.
+    """
+    lstTkn = bytLne.split()
+    if (len(lstTkn) < 3) or (lstTkn[0].upper() != b'SCALARS'):
+        strErrMsg = ('ERROR. Cannot determine data type of binary vtk data '
+                     + 'from line: ' + bytLne.decode('ascii', 'replace'))
+        raise ValueError(strErrMsg)
+    objDtp = np.dtype('>' + DIC_LGC_TYPE[lstTkn[2].decode('ascii').lower()])
+    if 3 < len(lstTkn):
+        varNumCmp = int(lstTkn[3])
+    else:
+        varNumCmp = 1
+    return objDtp, varNumCmp
+
+
+def rfind_line(fleVtkIn, strStrt, varOffEnd=None):
+    """
+    Find last line starting with given string in vtk file.
+
+    Parameters
+    ----------
+    fleVtkIn : file object
+        Vtk file, opened in binary mode.
+    strStrt : str
+        Beginning of line to search for.
+    varOffEnd : int or None
+        If not `None`, only lines starting before this byte offset are
+        considered.
+
+    Returns
+    -------
+    varOffLne : int or None
+        Byte offset of the line, or `None` if there is no such line.
+
+    Notes
+    -----
+    The file is searched in chunks, without splitting it into lines.
+    Consecutive chunks overlap by the length of the search string, so that
+    matches across chunk borders are found.
+    """
+    bytStrt = b'\n' + strStrt.encode('ascii')
+    varKeep = len(bytStrt) - 1
+
+    # Number of bytes to search:
+    fleVtkIn.seek(0, 2)
+    if varOffEnd is None:
+        varNumRmn = fleVtkIn.tell()
+    else:
+        varNumRmn = min(varOffEnd, fleVtkIn.tell())
+    fleVtkIn.seek(0)
+
+    bytChnk = fleVtkIn.read(min(VAR_CHNK, varNumRmn))
+    varNumRmn -= len(bytChnk)
+
+    # Check whether the very first line starts with the string:
+    if bytChnk.startswith(bytStrt[1:]):
+        varOffLne = 0
+    else:
+        varOffLne = None
+
+    varOffChnk = 0
+    while bytChnk:
+        varIdx = bytChnk.rfind(bytStrt)
+        if varIdx >= 0:
+            # Offset of beginning of line (after newline character):
+            varOffLne = varOffChnk + varIdx + 1
+        if varNumRmn <= 0:
+            break
+        bytNext = fleVtkIn.read(min(VAR_CHNK, varNumRmn))
+        varNumRmn -= len(bytNext)
+        varOffChnk = varOffChnk + len(bytChnk) - varKeep
+        bytChnk = bytChnk[-varKeep:] + bytNext
+
+    return varOffLne
+
+
+def rfind_line_idx(dicIdx, strStrt, varOffEnd=None):
+    """
+    Find last line starting with given string, using vtk index.
+
+    Parameters
+    ----------
+    dicIdx : dict
+        Vtk index (see `vtk_index.build_vtk_index`).
+    strStrt : str
+        Beginning of line to search for.
+    varOffEnd : int or None
+        If not `None`, only lines starting before this byte offset are
+        considered.
+
+    Returns
+    -------
+    varOffLne : int or None
+        Byte offset of the line, or `None` if no indexed line (i.e. section
+        keyword line, or LOOKUP_TABLE line following SCALARS) starts with the
+        string. In that case, the file has to be searched with `rfind_line`.
+    """
+    if not dicIdx['complete']:
+        return None
+    varOffLne = None
+    for dicSec in dicIdx['sections']:
+        for strKeyLne, strKeyOff in (('line', 'offset'),
+                                     ('line_lut', 'offset_lut')):
+            if strKeyLne not in dicSec:
+                continue
+            if not dicSec[strKeyLne].startswith(strStrt):
+                continue
+            if (varOffEnd is not None) and (varOffEnd <= dicSec[strKeyOff]):
+                continue
+            varOffLne = dicSec[strKeyOff]
+    return varOffLne
+
+
+def find_vtk_data(fleVtkIn, strPrcdData, varNumLne, strFrmt='ascii',
+                  dicIdx=None):
+    """
+    Locate block of vertex data in a legacy vtk file.
+
+    Parameters
+    ----------
+    fleVtkIn : file object
+        Vtk file, opened in binary mode (`open(strVtkIn, 'rb')`).
+    strPrcdData : str
+        Beginning of string which precedes vertex data in the vtk file (e.g.
+        'SCALARS').
+    varNumLne : int
+        Number of lines between vertex-identification-string and first data
+        point.
+    strFrmt : str
+        Format of the legacy vtk file, 'ascii' or 'binary' (see
+        `get_vtk_format`).
+    dicIdx : dict or None
+        Vtk index (see `vtk_index.build_vtk_index`). If provided, the lines
+        preceding the data are looked up in the index, instead of searching
+        the file.
+
+    Returns
+    -------
+    varNumDataVrtx : int
+        Number of vertices (read from the line 'POINT_DATA 252382').
+    varOffPrcd : int
+        Byte offset of the line starting with `strPrcdData`.
+    varOffData : int
+        Byte offset of the first line of vertex data.
+
+    Notes
+    -----
+    As in the line-by-line search of the previous implementation, the *last*
+    line starting with `strPrcdData` is used, and in ASCII files, empty lines
+    are not counted when skipping `varNumLne` lines. In ASCII files, the number
+    of vertices is read from the line preceding `strPrcdData`. In binary files,
+    the preceding line may be part of the binary data of another array, and
+    the number of vertices is read from the last line starting with
+    'POINT_DATA' instead (this is also done if an index is provided, which
+    allows for several SCALARS arrays in ASCII files).
+    """
+    varOffPrcd = None
+    if dicIdx is not None:
+        varOffPrcd = rfind_line_idx(dicIdx, strPrcdData)
+    if varOffPrcd is None:
+        varOffPrcd = rfind_line(fleVtkIn, strPrcdData)
+
+    if varOffPrcd is None:
+        strErrMsg = ('ERROR. String "' + strPrcdData + '" not found in vtk '
+                     + 'file.')
+        raise ValueError(strErrMsg)
+
+    varOffNum = None
+    if dicIdx is not None:
+        varOffNum = rfind_line_idx(dicIdx, 'POINT_DATA', varOffEnd=varOffPrcd)
+
+    if (strFrmt == 'binary') or (varOffNum is not None):
+        if varOffNum is None:
+            varOffNum = rfind_line(fleVtkIn, 'POINT_DATA',
+                                   varOffEnd=varOffPrcd)
+        if varOffNum is None:
+            strErrMsg = 'ERROR. String "POINT_DATA" not found in vtk file.'
+            raise ValueError(strErrMsg)
+        fleVtkIn.seek(varOffNum)
+        bytNum = fleVtkIn.readline()
+
+    else:
+        # Get line preceding the specified string (this is supposed to be the
+        # line with the number of vertices, e.g. 'POINT_DATA 252382'). Read
+        # backwards until a non-empty line is found.
+        varWin = 256
+        while True:
+            varStrt = max(0, varOffPrcd - varWin)
+            fleVtkIn.seek(varStrt)
+            lstTmp = [x for x in
+                      fleVtkIn.read(varOffPrcd - varStrt).split(b'\n')
+                      if x.strip()]
+            if (1 < len(lstTmp)) or (varStrt == 0):
+                break
+            varWin *= 4
+        bytNum = lstTmp[-1]
+
+    # The number of vertices follows the string 'POINT_DATA'.
+    varNumDataVrtx = int(bytNum.split()[1])
+
+    # Skip lines between the specified string and the first data point:
+    fleVtkIn.seek(varOffPrcd)
+    varCnt = 0
+    while varCnt < varNumLne:
+        bytLne = fleVtkIn.readline()
+        if not bytLne:
+            strErrMsg = 'ERROR. Unexpected end of vtk file.'
+            raise ValueError(strErrMsg)
+        if bytLne.strip() or (strFrmt == 'binary'):
+            varCnt += 1
+
+    # Skip empty lines preceding the first data point (in ASCII files only,
+    # binary data may start with whitespace bytes):
+    while True:
+        varOffData = fleVtkIn.tell()
+        if strFrmt == 'binary':
+            break
+        bytLne = fleVtkIn.readline()
+        if bytLne.strip() or (not bytLne):
+            break
+
+    return varNumDataVrtx, varOffPrcd, varOffData
+
+
+def read_vtk_block(fleVtkIn, varOffData, varNumDataVrtx, varNumDpth=None,
+                   objDtp=None, varNumCmp=1, vecIdx=None):
+    """
+    Parse block of numeric vertex data from legacy vtk file.
+
+    Parameters
+    ----------
+    fleVtkIn : file object
+        Vtk file, opened in binary mode.
+    varOffData : int
+        Byte offset of the first line of vertex data (see `find_vtk_data`).
+    varNumDataVrtx : int
+        Number of vertices (i.e. number of lines in the data block).
+    varNumDpth : int or None
+        Number of data points per vertex to return. If a line contains more
+        values, only the first `varNumDpth` values are parsed. If `None`, all
+        values are returned.
+    objDtp : np.dtype or None
+        Data type of binary data (see `get_scalars_type`). If `None`, the data
+        block is parsed as text (ASCII legacy format).
+    varNumCmp : int
+        Number of components per vertex of binary data.
+    vecIdx : np.array or None
+        Indices of vertices to return (e.g. vertices contained in a ROI). If
+        `None`, all vertices are returned.
+
+    Returns
+    -------
+    aryVtkData : np.array
+        Vertex data, shape aryVtkData[varNumDataVrtx, varNumDpth] (float64),
+        or aryVtkData[vecIdx.size, varNumDpth] if `vecIdx` is provided.
+
+    Notes
+    -----
+    The numeric block is parsed in one pass by numpy (`np.loadtxt`), directly
+    into a float array. Intermediate lists of strings (one per line of the vtk
+    file) are not created. Binary data are read with `np.fromfile`.
+
+    If `vecIdx` is provided, binary data are memory-mapped, so that only the
+    selected rows are read from disk. In ASCII files, the lines of the data
+    block are split without converting them, and only the selected lines are
+    parsed.
+    """
+    if objDtp is None:
+        # Number of values per line:
+        fleVtkIn.seek(varOffData)
+        varNumCol = len(fleVtkIn.readline().split())
+    else:
+        varNumCol = varNumCmp
+
+    if varNumDpth is None:
+        varNumDpth = varNumCol
+
+    if varNumCol < varNumDpth:
+        strErrMsg = ('ERROR. Expected ' + str(varNumDpth) + ' data points per '
+                     + 'vertex in vtk file, found ' + str(varNumCol) + '.')
+        raise ValueError(strErrMsg)
+
+    if vecIdx is not None:
+        return _read_vtk_rows(fleVtkIn, varOffData, varNumDataVrtx,
+                              varNumDpth, objDtp, varNumCmp, vecIdx)
+
+    fleVtkIn.seek(varOffData)
+
+    if objDtp is None:
+
+        # Parse numeric block (columns beyond `varNumDpth` are skipped):
+        aryVtkData = np.loadtxt(fleVtkIn,
+                                dtype=np.float64,
+                                usecols=range(varNumDpth),
+                                max_rows=varNumDataVrtx,
+                                ndmin=2)
+
+    else:
+
+        aryVtkData = np.fromfile(fleVtkIn, dtype=objDtp,
+                                 count=(varNumDataVrtx * varNumCmp))
+        aryVtkData = aryVtkData.reshape(-1, varNumCmp)
+        aryVtkData = aryVtkData[:, :varNumDpth].astype(np.float64)
+
+    if aryVtkData.shape[0] != varNumDataVrtx:
+        strErrMsg = ('ERROR. Expected ' + str(varNumDataVrtx) + ' vertices in '
+                     + 'vtk file, found ' + str(aryVtkData.shape[0]) + '.')
+        raise ValueError(strErrMsg)
+
+    return aryVtkData
+
+
+def _read_vtk_rows(fleVtkIn, varOffData, varNumDataVrtx, varNumDpth, objDtp,
+                   varNumCmp, vecIdx):
+    """Parse selected rows of block of vertex data (see `read_vtk_block`)."""
+    vecIdx = np.asarray(vecIdx)
+    if vecIdx.dtype == bool:
+        vecIdx = np.flatnonzero(vecIdx)
+
+    if objDtp is not None:
+
+        # Memory map of binary data block:
+        aryMm = np.memmap(fleVtkIn, dtype=objDtp, mode='r', offset=varOffData,
+                          shape=(varNumDataVrtx, varNumCmp))
+        aryVtkData = aryMm[vecIdx, :varNumDpth].astype(np.float64)
+        del aryMm
+        return aryVtkData
+
+    # Lines of ASCII data block (empty lines are skipped, as in `np.loadtxt`):
+    fleVtkIn.seek(varOffData)
+    lstLne = []
+    while len(lstLne) < varNumDataVrtx:
+        lstTmp = list(itertools.islice(fleVtkIn,
+                                       varNumDataVrtx - len(lstLne)))
+        if not lstTmp:
+            break
+        lstLne += [x for x in lstTmp if x.strip()]
+
+    if len(lstLne) != varNumDataVrtx:
+        strErrMsg = ('ERROR. Expected ' + str(varNumDataVrtx) + ' vertices in '
+                     + 'vtk file, found ' + str(len(lstLne)) + '.')
+        raise ValueError(strErrMsg)
+
+    if vecIdx.size == 0:
+        return np.zeros((0, varNumDpth), dtype=np.float64)
+
+    # Last line of file may lack line break:
+    if not lstLne[-1].endswith(b'\n'):
+        lstLne[-1] = lstLne[-1] + b'\n'
+
+    # Only the selected lines are converted to float:
+    bytSel = b''.join([lstLne[idxVrtx] for idxVrtx in vecIdx])
+    aryVtkData = np.loadtxt(io.BytesIO(bytSel),
+                            dtype=np.float64,
+                            usecols=range(varNumDpth),
+                            ndmin=2)
+
+    return aryVtkData
+
+
+def find_vtk_block_end(fleVtkIn, varOffData, varNumDataVrtx, objDtp=None,
+                       varNumCmp=1):
+    """
+    Locate end of block of vertex data in legacy vtk file.
+
+    Parameters
+    ----------
+    fleVtkIn : file object
+        Vtk file, opened in binary mode.
+    varOffData : int
+        Byte offset of the first line of vertex data (see `find_vtk_data`).
+    varNumDataVrtx : int
+        Number of vertices (i.e. number of lines in the data block).
+    objDtp : np.dtype or None
+        Data type of binary data. If `None`, ASCII data are assumed.
+    varNumCmp : int
+        Number of components per vertex of binary data.
+
+    Returns
+    -------
+    varOffEnd : int
+        Byte offset of the first line following the data block.
+
+    Notes
+    -----
+    In ASCII files, line breaks are counted chunk by chunk, the data values
+    are not parsed.
+    """
+    if objDtp is not None:
+        # Binary data are followed by a line break:
+        varOffEnd = varOffData + varNumDataVrtx * varNumCmp * objDtp.itemsize
+        fleVtkIn.seek(varOffEnd)
+        if fleVtkIn.read(1) == b'\n':
+            varOffEnd += 1
+        return varOffEnd
+
+    fleVtkIn.seek(varOffData)
+    varOffChnk = varOffData
+    varNumRmn = varNumDataVrtx
+    while True:
+        bytChnk = fleVtkIn.read(VAR_CHNK)
+        if not bytChnk:
+            # Last line of file without line break:
+            return varOffChnk
+        varNumLb = bytChnk.count(b'\n')
+        if varNumLb < varNumRmn:
+            varNumRmn -= varNumLb
+            varOffChnk += len(bytChnk)
+        else:
+            varIdx = -1
+            for idxLb in range(varNumRmn):
+                varIdx = bytChnk.index(b'\n', varIdx + 1)
+            return varOffChnk + varIdx + 1
+
+
+def read_vtk_data(strVtkIn, strPrcdData, varNumLne, varNumDpth, dicIdx=None,
+                  vecIdx=None):
+    """
+    Read vertex data from vtk file.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of vtk file (ASCII or binary legacy format, or XML PolyData).
+    strPrcdData : str
+        Beginning of string which precedes vertex data in the vtk file (e.g.
+        'SCALARS'). In case of XML files, the point data array with this name
+        is read if present; otherwise the active scalars are read.
+    varNumLne : int
+        Number of lines between vertex-identification-string and first data
+        point (legacy vtk files only).
+    varNumDpth : int
+        Number of data points per vertex to return (e.g. number of cortical
+        depth levels). If a line contains more values, only the first
+        `varNumDpth` values are returned.
+    dicIdx : dict or None
+        Vtk index (see `vtk_index.build_vtk_index`), used to locate the data
+        without searching the file.
+    vecIdx : np.array or None
+        Indices of vertices to return (e.g. vertices contained in a ROI, see
+        `read_vtk_block`). If `None`, all vertices are returned.
+
+    Returns
+    -------
+    aryVtkData : np.array
+        Vertex data, shape aryVtkData[varNumDataVrtx, varNumDpth] (float64),
+        or aryVtkData[vecIdx.size, varNumDpth] if `vecIdx` is provided.
+    """
+    if dicIdx is not None:
+        strFrmt = dicIdx['format']
+    else:
+        with open(strVtkIn, 'rb') as fleVtkIn:
+            strFrmt = get_vtk_format(fleVtkIn)
+
+    if strFrmt == 'xml':
+        aryVtkData = read_vtp_data(strVtkIn, strName=strPrcdData,
+                                   varNumDpth=varNumDpth)
+        if vecIdx is not None:
+            aryVtkData = aryVtkData[vecIdx, :]
+        return aryVtkData
+
+    with open(strVtkIn, 'rb') as fleVtkIn:
+
+        varNumDataVrtx, varOffPrcd, varOffData = \
+            find_vtk_data(fleVtkIn, strPrcdData, varNumLne, strFrmt=strFrmt,
+                          dicIdx=dicIdx)
+
+        if strFrmt == 'binary':
+            fleVtkIn.seek(varOffPrcd)
+            objDtp, varNumCmp = get_scalars_type(fleVtkIn.readline())
+        else:
+            objDtp, varNumCmp = None, 1
+
+        aryVtkData = read_vtk_block(fleVtkIn, varOffData, varNumDataVrtx,
+                                    varNumDpth=varNumDpth, objDtp=objDtp,
+                                    varNumCmp=varNumCmp, vecIdx=vecIdx)
+
+    return aryVtkData
+
+
+def read_vtk_points(strVtkIn, strPrcdCoor='POINTS', varNumLne=1,
+                    dicIdx=None):
+    """
+    Read vertex coordinates from vtk file.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of vtk file (ASCII or binary legacy format, or XML PolyData).
+    strPrcdCoor : string
+        Beginning of string which precedes vertex coordinates in legacy vtk
+        files. The string is supposed to be of the form 'POINTS 252382 float'.
+    varNumLne : int
+        Number of lines between string ('strPrcdCoor') and coordinates
+        (legacy vtk files only).
+    dicIdx : dict or None
+        Vtk index (see `vtk_index.build_vtk_index`), used to locate the
+        coordinates without searching the file.
+
+    Returns
+    -------
+    aryPnts : np.array
+        Vertex coordinates, shape aryPnts[vertex, 3] (float64).
+    """
+    if dicIdx is not None:
+        strFrmt = dicIdx['format']
+    else:
+        with open(strVtkIn, 'rb') as fleVtkIn:
+            strFrmt = get_vtk_format(fleVtkIn)
+
+    if strFrmt == 'xml':
+        return read_vtp_points(strVtkIn)
+
+    with open(strVtkIn, 'rb') as fleVtkIn:
+
+        varOffPrcd = None
+        if dicIdx is not None:
+            varOffPrcd = rfind_line_idx(dicIdx, strPrcdCoor)
+        if varOffPrcd is None:
+            varOffPrcd = rfind_line(fleVtkIn, strPrcdCoor)
+        if varOffPrcd is None:
+            strErrMsg = ('ERROR. String "' + strPrcdCoor + '" not found in '
+                         + 'vtk file.')
+            raise ValueError(strErrMsg)
+
+        fleVtkIn.seek(varOffPrcd)
+        lstTkn = fleVtkIn.readline().split()
+
+        # The string is supposed to be of the form 'POINTS 252382 float'. The
+        # second element is the number of vertices:
+        varNumVrtx = int(lstTkn[1])
+
+        # Skip remaining lines preceding the coordinates:
+        varCnt = 1
+        while varCnt < varNumLne:
+            bytLne = fleVtkIn.readline()
+            if bytLne.strip() or (strFrmt == 'binary'):
+                varCnt += 1
+
+        aryPnts = _read_lgc_values(fleVtkIn, (varNumVrtx * 3), lstTkn[2],
+                                   strFrmt)
+
+    return aryPnts.reshape(varNumVrtx, 3)
+
+
+def _read_lgc_values(fleVtkIn, varNumVal, bytType, strFrmt):
+    """Read block of values from legacy vtk file at current position."""
+    strType = bytType.decode('ascii').lower()
+    if strFrmt == 'binary':
+        aryOt = np.fromfile(fleVtkIn, dtype=('>' + DIC_LGC_TYPE[strType]),
+                            count=varNumVal)
+        # Skip line break following binary data:
+        varPos = fleVtkIn.tell()
+        if fleVtkIn.read(1) != b'\n':
+            fleVtkIn.seek(varPos)
+    else:
+        aryOt = np.fromfile(fleVtkIn, dtype=np.float64, count=varNumVal,
+                            sep=' ')
+    if aryOt.size != varNumVal:
+        strErrMsg = ('ERROR. Expected ' + str(varNumVal) + ' values in vtk '
+                     + 'file, found ' + str(aryOt.size) + '.')
+        raise ValueError(strErrMsg)
+    if DIC_LGC_TYPE[strType].startswith('f'):
+        return aryOt.astype(np.float64)
+    return aryOt.astype(np.int64)
+
+
+def read_vtk_mesh(strVtkIn):
+    """
+    Read vertex coordinates, polygons, and point data from vtk file.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of vtk file (ASCII or binary legacy format, or XML PolyData).
+
+    Returns
+    -------
+    aryPnts : np.array
+        Vertex coordinates, shape aryPnts[vertex, 3].
+    aryPly : np.array
+        Polygons, in legacy vtk cell array layout (for each polygon, the
+        number of points followed by the point indices).
+    dicData : dict
+        Point data arrays (name: array of shape [vertex, components]).
+
+    Notes
+    -----
+    Only polygonal meshes with point data (SCALARS) are supported, which is
+    what is created by CBS tools.
+    """
+    with open(strVtkIn, 'rb') as fleVtkIn:
+        strFrmt = get_vtk_format(fleVtkIn)
+
+    if strFrmt == 'xml':
+        return read_vtp(strVtkIn)
+
+    with open(strVtkIn, 'rb') as fleVtkIn:
+
+        # Skip header (version, title, and format):
+        fleVtkIn.seek(0)
+        for idxLne in range(3):
+            fleVtkIn.readline()
+
+        aryPnts = None
+        aryPly = np.zeros(0, dtype=np.int64)
+        dicData = {}
+        varNumVrtx = None
+
+        while True:
+            bytLne = fleVtkIn.readline()
+            if not bytLne:
+                break
+            lstTkn = bytLne.split()
+            if not lstTkn:
+                continue
+            strKey = lstTkn[0].decode('ascii').upper()
+
+            if strKey == 'DATASET':
+                if lstTkn[1].upper() != b'POLYDATA':
+                    strErrMsg = ('ERROR. Only vtk files with POLYDATA are '
+                                 + 'supported.')
+                    raise ValueError(strErrMsg)
+
+            elif strKey == 'POINTS':
+                varNumVrtx = int(lstTkn[1])
+                aryPnts = _read_lgc_values(fleVtkIn, (varNumVrtx * 3),
+                                           lstTkn[2],
+                                           strFrmt).reshape(varNumVrtx, 3)
+
+            elif strKey == 'POLYGONS':
+                aryPly = _read_lgc_values(fleVtkIn, int(lstTkn[2]), b'int',
+                                          strFrmt)
+
+            elif strKey == 'POINT_DATA':
+                varNumVrtx = int(lstTkn[1])
+
+            elif strKey == 'SCALARS':
+                if 3 < len(lstTkn):
+                    varNumCmp = int(lstTkn[3])
+                else:
+                    varNumCmp = 1
+                # Skip lookup table line:
+                varPos = fleVtkIn.tell()
+                if not fleVtkIn.readline().startswith(b'LOOKUP_TABLE'):
+                    fleVtkIn.seek(varPos)
+                dicData[lstTkn[1].decode('ascii')] = _read_lgc_values(
+                    fleVtkIn, (varNumVrtx * varNumCmp), lstTkn[2],
+                    strFrmt).reshape(varNumVrtx, varNumCmp).astype(np.float64)
+
+            else:
+                strErrMsg = ('ERROR. Unsupported section in vtk file: '
+                             + strKey)
+                raise ValueError(strErrMsg)
+
+    return aryPnts, aryPly, dicData
+
+
+def replace_file(strTmp, strPthOt):
+    """
+    Replace output file by temporary file.
+
+    Parameters
+    ----------
+    strTmp : str
+        Path of temporary file (e.g. created with `tempfile.mkstemp`, i.e.
+        readable by the owner only), in the directory of the output file.
+    strPthOt : str
+        Output path.
+
+    Notes
+    -----
+    The permissions of the temporary file are set to those of the existing
+    output file or, if there is none, to the default permissions of new files
+    (i.e. according to the umask), before the output file is replaced
+    (atomically).
+    """
+    if os.path.isfile(strPthOt):
+        varMode = os.stat(strPthOt).st_mode & 0o7777
+    else:
+        # The umask can only be read by setting it:
+        varUmsk = os.umask(0)
+        os.umask(varUmsk)
+        varMode = 0o666 & ~varUmsk
+    os.chmod(strTmp, varMode)
+    os.replace(strTmp, strPthOt)
+
+
+def write_vtk_mesh(strVtkOt, aryPnts, aryPly, dicData, strFrmt='binary',
+                   strTtl='vtk output', strDtype='double', strEnc='raw',
+                   lgcCmp=True):
+    """
+    Write vertex coordinates, polygons, and point data to vtk file.
+
+    Parameters
+    ----------
+    strVtkOt : str or file object
+        Output path, or file object opened in binary mode (e.g.
+        `io.BytesIO`).
+    aryPnts : np.array
+        Vertex coordinates, shape aryPnts[vertex, 3].
+    aryPly : np.array
+        Polygons, in legacy vtk cell array layout (see `read_vtk_mesh`).
+    dicData : dict
+        Point data arrays (name: array of shape [vertex] or [vertex,
+        components]). Each array is written as a separate SCALARS block.
+    strFrmt : str
+        'ascii' or 'binary' (legacy vtk format, binary data are big endian),
+        or 'xml' (vtk XML PolyData).
+    strTtl : str
+        Title (second line of legacy vtk files).
+    strDtype : str
+        Data type for vertex coordinates and point data, 'float' (float32) or
+        'double' (float64). With 'double', the data are read back exactly;
+        'float' halves the file size but rounds to single precision.
+    strEnc : str
+        Encoding of appended data in XML files, 'raw' or 'base64'.
+    lgcCmp : bool
+        Whether to compress data in XML files (zlib).
+    """
+    if strFrmt == 'xml':
+        write_vtp(strVtkOt, aryPnts, aryPly, dicData, strEnc=strEnc,
+                  lgcCmp=lgcCmp, strDtype=strDtype)
+        return
+
+    varNumVrtx = aryPnts.shape[0]
+    vecStrt = get_cell_starts(aryPly)
+
+    with open_output(strVtkOt) as fleVtkOt:
+
+        fleVtkOt.write(b'# vtk DataFile Version 3.0\n')
+        fleVtkOt.write(strTtl.encode('ascii') + b'\n')
+        fleVtkOt.write(strFrmt.upper().encode('ascii') + b'\n')
+        fleVtkOt.write(b'DATASET POLYDATA\n')
+
+        fleVtkOt.write(('POINTS ' + str(varNumVrtx) + ' ' + strDtype
+                        + '\n').encode('ascii'))
+        _write_lgc_values(fleVtkOt, aryPnts, strDtype, strFrmt)
+
+        if 0 < vecStrt.size:
+            fleVtkOt.write(('POLYGONS ' + str(vecStrt.size) + ' '
+                            + str(aryPly.size) + '\n').encode('ascii'))
+            if strFrmt == 'binary':
+                _write_lgc_values(fleVtkOt, aryPly, 'int', strFrmt)
+            else:
+                # One line per polygon:
+                lstLne = [' '.join([str(x) for x in y]) for y in
+                          np.split(aryPly, vecStrt[1:])]
+                fleVtkOt.write(('\n'.join(lstLne) + '\n').encode('ascii'))
+
+        fleVtkOt.write(('POINT_DATA ' + str(varNumVrtx)
+                        + '\n').encode('ascii'))
+        for strName, aryTmp in dicData.items():
+            aryTmp = np.asarray(aryTmp).reshape(varNumVrtx, -1)
+            fleVtkOt.write(('SCALARS ' + strName + ' ' + strDtype + ' '
+                            + str(aryTmp.shape[1]) + '\n').encode('ascii'))
+            fleVtkOt.write(b'LOOKUP_TABLE default\n')
+            _write_lgc_values(fleVtkOt, aryTmp, strDtype, strFrmt)
+
+
+def _write_lgc_values(fleVtkOt, aryIn, strType, strFrmt):
+    """Write block of values to legacy vtk file (one row per line)."""
+    if strFrmt == 'binary':
+        fleVtkOt.write(np.asarray(aryIn).astype(
+            '>' + DIC_LGC_TYPE[strType]).tobytes())
+        fleVtkOt.write(b'\n')
+    else:
+        # Number of significant digits for exact round trip:
+        strFmt = {'float': '%.9g', 'double': '%.17g', 'int': '%d'}[strType]
+        np.savetxt(fleVtkOt, np.asarray(aryIn).reshape(aryIn.shape[0], -1),
+                   fmt=strFmt, delimiter=' ')
+
+
+def convert_vtk(strVtkIn, strVtkOt, strFrmt='binary', strDtype='double',
+                strEnc='raw', lgcCmp=True):
+    """
+    Convert vtk mesh between ASCII, binary legacy, and XML PolyData formats.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of input vtk file (any supported format).
+    strVtkOt : str
+        Output path (by convention, '*.vtk' for legacy vtk files and '*.vtp'
+        for XML files).
+    strFrmt : str
+        Output format, 'ascii', 'binary', or 'xml'.
+    strDtype : str
+        Data type of output, 'float' or 'double' (see `write_vtk_mesh`).
+    strEnc : str
+        Encoding of appended data in XML files, 'raw' or 'base64'.
+    lgcCmp : bool
+        Whether to compress data in XML files (zlib).
+    """
+    aryPnts, aryPly, dicData = read_vtk_mesh(strVtkIn)
+    write_vtk_mesh(strVtkOt, aryPnts, aryPly, dicData, strFrmt=strFrmt,
+                   strTtl=os.path.splitext(os.path.basename(strVtkIn))[0],
+                   strDtype=strDtype, strEnc=strEnc, lgcCmp=lgcCmp)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy handles for vertex data in vtk files.
+
+A handle describes the vertex data of one vtk file (shape [vertex, depth]) or
+of several vtk files with the same topology (shape [file, vertex, depth]),
+without loading them. Data are only read when they are needed: `take` reads
+the data of a subset of vertices (e.g. the vertices that pass the selection
+criteria; with the on-disk cache or a packed container only these rows are
+read, see `load_vtk_multi`), and indexing the handle (or converting it to an
+array) loads all vertices once. The number of vertices is obtained from the
+(cached) index of the vtk file, without reading the data.
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import numpy as np
+from py_depthsampling.get_data.load_vtk_batch import load_vtk_batch
+from py_depthsampling.get_data.load_vtk_multi import load_vtk_multi
+from py_depthsampling.get_data.vtk_cache import load_vtk_index
+
+
+class LazyVtk(object):
+    """
+    Vertex data of vtk file(s), loaded on first use.
+
+    Parameters
+    ----------
+    objVtkIn : str or list
+        Path of vtk file (data of shape [vertex, depth]), or list of paths of
+        vtk files with the same number of vertices (data of shape [file,
+        vertex, depth]).
+    strPrcdData : str
+        Beginning of string which precedes vertex data in the vtk files.
+    varNumLne : int
+        Number of lines between vertex-identification-string and first data
+        point.
+    varNumDpth : int
+        Number of data points per vertex (e.g. number of depth levels).
+    varNumThr : int
+        Number of threads for loading several files (see `load_vtk_batch`).
+    lgcCache : bool or None
+        Whether to use the on-disk cache (see `load_vtk_multi`).
+    """
+
+    def __init__(self, objVtkIn, strPrcdData, varNumLne, varNumDpth,
+                 varNumThr=1, lgcCache=None):
+        self.objVtkIn = objVtkIn
+        self.strPrcdData = strPrcdData
+        self.varNumLne = varNumLne
+        self.varNumDpth = varNumDpth
+        self.varNumThr = varNumThr
+        self.lgcCache = lgcCache
+        self.lgcBatch = not isinstance(objVtkIn, str)
+        self.aryData = None
+        self.varNumVrtx = None
+
+    @property
+    def loaded(self):
+        """Whether the data of all vertices have been loaded."""
+        return self.aryData is not None
+
+    def _load(self, vecIdx=None):
+        """Read data of all vertices, or of the vertices `vecIdx`."""
+        if self.lgcBatch:
+            return load_vtk_batch(self.objVtkIn, self.strPrcdData,
+                                  self.varNumLne, self.varNumDpth,
+                                  varNumThr=self.varNumThr,
+                                  lgcCache=self.lgcCache, vecIdx=vecIdx)
+        return load_vtk_multi(self.objVtkIn, self.strPrcdData,
+                              self.varNumLne, self.varNumDpth,
+                              lgcCache=self.lgcCache, vecIdx=vecIdx)
+
+    def load(self):
+        """
+        Load data of all vertices (once).
+
+        Returns
+        -------
+        aryData : np.array
+            Vertex data, shape [vertex, depth] or [file, vertex, depth].
+        """
+        if self.aryData is None:
+            self.aryData = self._load()
+        return self.aryData
+
+    def num_vertices(self):
+        """
+        Get number of vertices.
+
+        Returns
+        -------
+        varNumVrtx : int
+            Number of vertices, from the loaded data, or from the index of the
+            (first) vtk file. The data are only loaded if the number of
+            vertices is not part of the index (e.g. xml or packed files).
+        """
+        if self.aryData is not None:
+            return self.aryData.shape[-2]
+        if self.varNumVrtx is None:
+            strVtk = (self.objVtkIn[0] if self.lgcBatch else self.objVtkIn)
+            if os.path.isfile(strVtk):
+                self.varNumVrtx = load_vtk_index(
+                    strVtk, lgcCache=self.lgcCache)['num_vertices']
+            if self.varNumVrtx is None:
+                self.varNumVrtx = self.load().shape[-2]
+        return self.varNumVrtx
+
+    def take(self, vecIdx):
+        """
+        Get data of a subset of vertices.
+
+        Parameters
+        ----------
+        vecIdx : np.array
+            Indices of vertices.
+
+        Returns
+        -------
+        aryOut : np.array
+            Vertex data, shape [len(vecIdx), depth] or [file, len(vecIdx),
+            depth] (a copy, which can be modified in place).
+
+        Notes
+        -----
+        If the data have not been loaded, only the data of the vertices
+        `vecIdx` are read.
+        """
+        vecIdx = np.asarray(vecIdx, dtype=np.int64)
+        if self.aryData is not None:
+            if self.lgcBatch:
+                return self.aryData[:, vecIdx, :]
+            return self.aryData[vecIdx, :]
+        return np.array(self._load(vecIdx=vecIdx))
+
+    def __getitem__(self, objIdx):
+        return self.load()[objIdx]
+
+    def __array__(self, dtype=None, copy=None):
+        aryOut = self.load()
+        if dtype is not None:
+            aryOut = aryOut.astype(dtype)
+        return aryOut
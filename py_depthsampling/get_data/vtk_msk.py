@@ -21,9 +21,28 @@ Function of the depth sampling pipeline.
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import csv
+import io
 import os
-import numpy as np  #noqa
+import tempfile
+import numpy as np
+from py_depthsampling.get_data.vtk_cache import load_vtk_index
+from py_depthsampling.get_data.vtk_io import find_vtk_data
+from py_depthsampling.get_data.vtk_io import find_vtk_block_end
+from py_depthsampling.get_data.vtk_io import get_scalars_type
+from py_depthsampling.get_data.vtk_io import read_vtk_mesh
+from py_depthsampling.get_data.vtk_io import replace_file
+from py_depthsampling.get_data.vtk_io import write_vtk_mesh
+from py_depthsampling.get_data.vtk_pack import read_vtk_packed_mesh
+
+
+def _same_content(strPth, bytCnt):
+    """Check whether file exists with content `bytCnt`."""
+    if not os.path.isfile(strPth):
+        return False
+    if os.path.getsize(strPth) != len(bytCnt):
+        return False
+    with open(strPth, 'rb') as fleIn:
+        return fleIn.read() == bytCnt
 
 
 def vtk_msk(strSubId,        # Data struc - Subject ID
@@ -32,86 +51,180 @@ def vtk_msk(strSubId,        # Data struc - Subject ID
             varNumLne,       # Data struc - Lns. prcd. data VTK
             strCsvRoi,       # Data struc - ROI CSV fle (for output naming)
             vecInc,          # Vertex inclusion vector
-            strMetaCon=''):  # Metacondition (stimulus or periphery)
+            strMetaCon='',   # Metacondition (stimulus or periphery)
+            strFrmtOt=None):  # Output format ('ascii', 'binary', or 'xml')
     """
     Create surface mask for selected vertices.
 
     This function creates a vtk file containing a mask of those vertices that
     have been selected for depth sampling (vtk file that can be opened in
-    paraview).
+    paraview). By default, the mask is saved in the same format as the input
+    vtk file (ASCII or binary legacy vtk, or XML PolyData); a different output
+    format can be specified with `strFrmtOt`.
+
+    `vecInc` is either one vertex inclusion vector (saved as array 'ROI_MASK'),
+    or a dictionary of inclusion vectors (name: vector), which are saved as
+    separate SCALARS arrays in one file.
+
+    If the output format is the same as the input format (legacy vtk files
+    only), the header, vertex coordinates, and polygons are copied from the
+    input file byte by byte (located via the vtk index), without being parsed.
+    If a file with identical content already exists at the output path, it is
+    not overwritten (so that its modification time stays the same).
+
+    Returns the path of the vtk mask.
     """
     # *************************************************************************
     # *** Access vtk data
 
-    # Open file:
-    fleVtkIn = open(strVtkDpth01, 'r')
+    # Masks to save:
+    if isinstance(vecInc, dict):
+        dicMsk = vecInc
+    else:
+        dicMsk = {'ROI_MASK': vecInc}
+
+    # If the vtk file only exists within a packed container (see
+    # `vtk_pack`), the mesh is read from the container:
+    tplMesh = None
+    if not os.path.isfile(strVtkDpth01):
+        tplMesh = read_vtk_packed_mesh(strVtkDpth01)
+
+    if tplMesh is None:
+
+        # Index of the sections of the vtk file (byte offsets, built once per
+        # file and cached):
+        dicIdx = load_vtk_index(strVtkDpth01)
 
-    # Read file:
-    csvIn = csv.reader(fleVtkIn,
-                       delimiter='\n',
-                       skipinitialspace=True)
+        # Format of input file ('ascii', 'binary', or 'xml'):
+        strFrmt = dicIdx['format']
 
-    # Create empty list for vertex data:
-    lstVtkData = []
+    else:
+
+        # Masks of packed meshes are saved as binary vtk files by default:
+        strFrmt = 'binary'
+
+    # Output format:
+    if strFrmtOt is None:
+        strFrmtOt = strFrmt
+
+    # Legacy vtk files are copied byte by byte if the output format is the
+    # same:
+    lgcCopy = ((tplMesh is None) and (strFrmt != 'xml')
+               and (strFrmtOt == strFrmt))
+
+    if lgcCopy:
 
-    # Loop through csv object to fill list with csv data:
-    for lstTmp in csvIn:
-        for strTmp in lstTmp:
-            lstVtkData.append(strTmp[:])
+        # Open file:
+        with open(strVtkDpth01, 'rb') as fleVtkIn:
 
-    # Close file:
-    fleVtkIn.close()
+            # Get byte offsets of string (as specified above) which precedes
+            # the vertex data, and of the first vertex data point:
+            varNumDataVrtx, varOffPrcd, varOffData = \
+                find_vtk_data(fleVtkIn, strPrcdData, varNumLne,
+                              strFrmt=strFrmt, dicIdx=dicIdx)
 
-    # Get index of string (as specified above) which precedes the vertex data:
-    for idxSrch in range(0, len(lstVtkData)):
-        if lstVtkData[idxSrch].startswith((strPrcdData)):
-            varIdxPreData = idxSrch
+            # Data type of binary vertex data:
+            if strFrmt == 'binary':
+                fleVtkIn.seek(varOffPrcd)
+                objDtp, varNumCmp = get_scalars_type(fleVtkIn.readline())
+            else:
+                objDtp, varNumCmp = None, 1
 
-    # Get number of vertices from the line preceding the specified string:
-    strNumDataVrtx = lstVtkData[(varIdxPreData - 1)]
+            # Locate end of vertex data (the data values themselves are not
+            # needed). If the data block is indexed, the offset is taken from
+            # the index:
+            varOffEnd = None
+            for dicSec in dicIdx['sections']:
+                if ((dicSec['offset_data'] == varOffData)
+                        and (dicSec.get('count') == varNumDataVrtx)):
+                    varOffEnd = dicSec['offset_end']
+            if varOffEnd is None:
+                varOffEnd = find_vtk_block_end(fleVtkIn, varOffData,
+                                               varNumDataVrtx, objDtp=objDtp,
+                                               varNumCmp=varNumCmp)
 
-    # The number of vertecies is preceded by the string 'POINT_DATA' in vtk
-    # files. We extract the number behind the string:
-    varNumDataVrtx = int(strNumDataVrtx[11:])
+            # Header & vertex coordinates (everything preceding the data
+            # string):
+            fleVtkIn.seek(0)
+            bytHdr = fleVtkIn.read(varOffPrcd)
+
+            # Lines between data string and first vertex data point:
+            lstPrcd = [x for x in fleVtkIn.read(varOffData - varOffPrcd).split(
+                b'\n') if x.strip()]
+
+            # Anything following the vertex data:
+            fleVtkIn.seek(varOffEnd)
+            bytTail = fleVtkIn.read()
+
+    else:
 
-    # Index of first vertex data point:
-    varIdxFrst = varIdxPreData + varNumLne
+        # The mesh is read and written with the mask(s) as the only point
+        # data array(s):
+        if tplMesh is None:
+            tplMesh = read_vtk_mesh(strVtkDpth01)
+        aryPnts, aryPly, _ = tplMesh
     # *************************************************************************
 
     # *************************************************************************
     # *** Replace vtk data with mask
 
-    # Change header (file name):
-    lstVtkData[1] = (strSubId + '_vertex_inclusion_mask')
-
-    # We change the string that precedes the numerical vertex data. The first
-    # word (probably 'SCALARS') we leave as it is (needs to be supplied as
-    # an input to this function anyways in order to find the numeric data).
-    # Second is the name associated with the data points (that is displayed
-    # in paraview), we give some sensible name. Finally, we specify the
-    # datatype as float (integer type would be sufficient, but we keep it as
-    # float for consistency), followed by the number of data points per vertex
-    # (which is one data point per vertex).
-    lstVtkData[varIdxPreData] = (strPrcdData + ' ROI_MASK ' + 'float 1')
-
-    # Change default lookup table:
-    lstVtkData[(varIdxPreData + 1)] = 'LOOKUP_TABLE viridis'
-
-    # Loop through vertices and replace values:
-    # for idxVrtx in range(varIdxFrst, (varIdxFrst + varNumDataVrtx)):
-    for idxVrtx in range(0, varNumDataVrtx):
-
-        # If the vertex with the current index is supposed to be included, we
-        # set its value to one:
-        if vecInc[idxVrtx]:
-            # Since the header and the section with the vertex coordinates
-            # precedes the numeric vertex data, we have to add the row number
-            # of the first numeric data point to the index:
-            lstVtkData[(idxVrtx + varIdxFrst)] = '1.0'
-        # If the current vertex is not to be included, we set its value to
-        # zero:
-        else:
-            lstVtkData[(idxVrtx + varIdxFrst)] = '0.0'
+    if lgcCopy:
+
+        # Change header (file name). The file name is on the second line of
+        # the vtk file, the remainder of the header is copied as is:
+        lstHdr = bytHdr.split(b'\n', 2)
+        lstHdr[1] = (strSubId + '_vertex_inclusion_mask').encode('ascii')
+        bytHdr = b'\n'.join(lstHdr)
+
+        # List of byte strings to write (the mask data are inserted in place
+        # of the original vertex data):
+        lstOt = [bytHdr]
+
+        for strName, vecTmp in dicMsk.items():
+
+            # We change the string that precedes the numerical vertex data.
+            # The first word (probably 'SCALARS') we leave as it is (needs to
+            # be supplied as an input to this function anyways in order to
+            # find the numeric data). Second is the name associated with the
+            # data points (that is displayed in paraview), we give some
+            # sensible name. Finally, we specify the datatype as float
+            # (integer type would be sufficient, but we keep it as float for
+            # consistency), followed by the number of data points per vertex
+            # (which is one data point per vertex).
+            lstPrcd[0] = (strPrcdData + ' ' + strName + ' float 1').encode(
+                'ascii')
+
+            # Change default lookup table:
+            if 1 < len(lstPrcd):
+                lstPrcd[1] = b'LOOKUP_TABLE viridis'
+
+            lstOt.append(b'\n'.join(lstPrcd) + b'\n')
+
+            vecTmp = np.asarray(vecTmp, dtype=bool)
+            if vecTmp.size != varNumDataVrtx:
+                strErrMsg = ('ERROR. Mask "' + strName + '" has '
+                             + str(vecTmp.size) + ' elements, vtk mesh has '
+                             + str(varNumDataVrtx) + ' vertices.')
+                raise ValueError(strErrMsg)
+
+            if strFrmt == 'ascii':
+
+                # Vertex data - one line per vertex, '1.0' if the vertex with
+                # the current index is supposed to be included, '0.0'
+                # otherwise. The lines are created as a byte array (four
+                # bytes per line) and written to disk in one go.
+                aryMsk = np.empty((varNumDataVrtx, 4), dtype=np.uint8)
+                aryMsk[:, :] = np.frombuffer(b'0.0\n', dtype=np.uint8)[None, :]
+                aryMsk[vecTmp, 0] = ord('1')
+                lstOt.append(aryMsk.tobytes())
+
+            else:
+
+                # Binary legacy vtk data are big endian, followed by a line
+                # break:
+                lstOt.append(vecTmp.astype('>f4').tobytes() + b'\n')
+
+        lstOt.append(bytTail)
     # *************************************************************************
 
     # *************************************************************************
@@ -125,24 +238,51 @@ def vtk_msk(strSubId,        # Data struc - Subject ID
     # vertex inclusion mask, e.g. V1 or V2):
     strRoi = os.path.splitext(os.path.split(strCsvRoi)[-1])[0]
 
+    # File extension:
+    if strFrmtOt == 'xml':
+        strExt = '.vtp'
+    else:
+        strExt = '.vtk'
+
     # Add output file name:
     if strMetaCon == '':
         strVtkOt = (strVtkOt + '/' + strSubId + '_vertex_inclusion_mask_'
-                    + strRoi + '.vtk')
+                    + strRoi + strExt)
     else:
         strVtkOt = (strVtkOt + '/' + strSubId + '_vertex_inclusion_mask_'
-                    + strRoi + '_' + strMetaCon + '.vtk')
-
-    # Create output csv object:
-    objCsvOt = open(strVtkOt, 'w')
+                    + strRoi + '_' + strMetaCon + strExt)
 
-    # Save manipulated list to disk:
-    csvOt = csv.writer(objCsvOt, lineterminator='\n')
+    # Content of the mask file:
+    if lgcCopy:
+        bytOt = b''.join(lstOt)
+    else:
+        objBuf = io.BytesIO()
+        write_vtk_mesh(objBuf, aryPnts, aryPly,
+                       {strName: np.asarray(vecTmp, dtype=np.float32)
+                        for strName, vecTmp in dicMsk.items()},
+                       strFrmt=strFrmtOt,
+                       strTtl=(strSubId + '_vertex_inclusion_mask'),
+                       strDtype='float')
+        bytOt = objBuf.getvalue()
+        del(objBuf)
 
-    # Write output list data to file (row by row):
-    for strTmp in lstVtkData:
-        csvOt.writerow([strTmp])
+    # An existing file with identical content is kept (it is compared before
+    # anything is written):
+    if _same_content(strVtkOt, bytOt):
+        return strVtkOt
 
-    # Close:
-    objCsvOt.close()
+    # Otherwise, the mask is written to a temporary file, which replaces the
+    # output file once complete (with the permissions of the existing output
+    # file, or the default permissions, see `replace_file`):
+    varFd, strTmp = tempfile.mkstemp(dir=os.path.dirname(strVtkOt),
+                                     suffix=strExt)
+    try:
+        with os.fdopen(varFd, 'wb') as fleVtkOt:
+            fleVtkOt.write(bytOt)
+        replace_file(strTmp, strVtkOt)
+    finally:
+        if os.path.isfile(strTmp):
+            os.remove(strTmp)
     # *************************************************************************
+
+    return strVtkOt
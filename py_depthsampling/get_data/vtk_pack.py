@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""
+Packed container for all vtk meshes of one subject / hemisphere.
+
+Depth-sampled data are usually stored as many small vtk files per subject and
+hemisphere (parameter estimates and z-statistics per condition, pRF
+parameters, mean EPI, event-related time courses). On network storage,
+opening and closing these files dominates loading time. Here, all vtk meshes
+within a directory are packed into one chunked, compressed HDF5 file
+(`vtk_pack.h5`). Point data arrays are addressable by the path of the original
+vtk file (relative to the directory of the container), and the topology
+(vertex coordinates and polygons) is stored only once for all meshes that
+share it.
+
+The loaders (`load_vtk_multi`, `load_vtk_single`, and `load_vtk_batch`) read
+from a container transparently: if a container in the directory of the vtk
+file (or in one of its two parent directories) contains the requested file,
+the data are read from the container. Only the chunks containing the
+requested vertices are read if a subset of vertices is requested. The
+container is not used if the original vtk file exists and has been modified
+after packing. Set the environment variable `PY_DEPTHSAMPLING_PACK` to `off`
+to ignore containers.
+
+Containers are created from the command line:
+
+    python -m py_depthsampling.get_data.vtk_pack pack /path/to/sub/cbs/lh
+    python -m py_depthsampling.get_data.vtk_pack list /path/to/vtk_pack.h5
+
+`h5py` is an optional dependency, only needed for this module.
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import glob
+import hashlib
+import os
+import tempfile
+import numpy as np
+from py_depthsampling.get_data.vtk_index import build_vtk_index
+from py_depthsampling.get_data.vtk_io import read_vtk_mesh
+from py_depthsampling.get_data.vtk_io import replace_file
+from py_depthsampling.get_data.vtk_xml import read_vtp_active
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+# File name of container:
+STR_PCK = 'vtk_pack.h5'
+
+# Environment variable for disabling containers:
+STR_ENV_PCK = 'PY_DEPTHSAMPLING_PACK'
+
+# Number of parent directories that are searched for a container:
+VAR_NUM_UP = 2
+
+# Number of vertices per chunk:
+VAR_CHNK_VRTX = 4096
+
+
+def _check_h5py():
+    """Raise an error if h5py is not available."""
+    if h5py is None:
+        strErrMsg = ('ERROR. h5py is required for packed vtk containers '
+                     + '(pip install h5py).')
+        raise ImportError(strErrMsg)
+
+
+def pack_vtk(strDir, strPattern='**/*.vtk', strPckOt=None, lgcCmp=True):
+    """
+    Pack vtk meshes within a directory into one container.
+
+    Parameters
+    ----------
+    strDir : str
+        Directory containing vtk files (e.g. all files of one subject and
+        hemisphere).
+    strPattern : str
+        Glob pattern of vtk files to pack, relative to `strDir` (recursive).
+    strPckOt : str or None
+        Path of container. If `None`, the container is created in `strDir`
+        (required for transparent loading).
+    lgcCmp : bool
+        Whether to compress the point data (gzip).
+
+    Returns
+    -------
+    strPckOt : str
+        Path of container.
+
+    Notes
+    -----
+    All point data arrays of each vtk file are stored (as float64, i.e. the
+    type returned by the loaders). An existing container is replaced.
+    """
+    _check_h5py()
+
+    if strPckOt is None:
+        strPckOt = os.path.join(strDir, STR_PCK)
+
+    lstVtk = sorted(glob.glob(os.path.join(strDir, strPattern),
+                              recursive=True))
+
+    print('-Packing ' + str(len(lstVtk)) + ' vtk files into ' + strPckOt)
+
+    if lgcCmp:
+        dicCmp = {'compression': 'gzip', 'compression_opts': 4,
+                  'shuffle': True}
+    else:
+        dicCmp = {}
+
+    # The container is written to a temporary file, which replaces an
+    # existing container once complete:
+    varFd, strTmp = tempfile.mkstemp(dir=os.path.dirname(
+        os.path.abspath(strPckOt)), suffix='.h5')
+    os.close(varFd)
+
+    try:
+        with h5py.File(strTmp, 'w') as objPck:
+
+            objPck.attrs['version'] = 2
+
+            for strVtk in lstVtk:
+
+                # Key of vtk file (path relative to directory of container):
+                strKey = _get_key(strVtk, os.path.dirname(
+                    os.path.abspath(strPckOt)))
+
+                aryPnts, aryPly, dicData = read_vtk_mesh(strVtk)
+
+                # Topology is stored once for all meshes with identical
+                # vertex coordinates and polygons:
+                objHsh = hashlib.sha1()
+                objHsh.update(np.ascontiguousarray(aryPnts).tobytes())
+                objHsh.update(np.ascontiguousarray(aryPly).tobytes())
+                strTpl = objHsh.hexdigest()
+                if ('topology/' + strTpl) not in objPck:
+                    objGrp = objPck.create_group('topology/' + strTpl)
+                    objGrp.create_dataset('points', data=aryPnts, **dicCmp)
+                    objGrp.create_dataset('polygons', data=aryPly, **dicCmp)
+
+                objGrp = objPck.create_group('data/' + strKey)
+                objStat = os.stat(strVtk)
+                objGrp.attrs['topology'] = strTpl
+                objGrp.attrs['mtime_ns'] = objStat.st_mtime_ns
+                objGrp.attrs['size'] = objStat.st_size
+                objGrp.attrs['names'] = list(dicData.keys())
+
+                # Information for selecting the array to read in the same way
+                # as from the vtk file (see `_select_array`):
+                dicIdx = build_vtk_index(strVtk)
+                objGrp.attrs['format'] = dicIdx['format']
+                if dicIdx['format'] == 'xml':
+                    objGrp.attrs['active'] = (read_vtp_active(strVtk) or '')
+                else:
+                    dicSec = {}
+                    for dicTmp in dicIdx['sections']:
+                        if dicTmp['keyword'] == 'SCALARS':
+                            dicSec[dicTmp['name']] = dicTmp
+                    objGrp.attrs['lines'] = [
+                        dicSec[strName]['line'] for strName in dicData.keys()]
+                    objGrp.attrs['lines_lut'] = [
+                        dicSec[strName].get('line_lut', '')
+                        for strName in dicData.keys()]
+
+                for strName, aryData in dicData.items():
+                    varChnk = min(VAR_CHNK_VRTX, max(aryData.shape[0], 1))
+                    objGrp.create_dataset(
+                        strName, data=aryData.astype(np.float64),
+                        chunks=(varChnk, aryData.shape[1]), **dicCmp)
+
+        replace_file(strTmp, strPckOt)
+
+    finally:
+        if os.path.isfile(strTmp):
+            os.remove(strTmp)
+
+    return strPckOt
+
+
+def _get_key(strVtkIn, strDir):
+    """Key of vtk file in container (relative path, '/' separated)."""
+    strKey = os.path.relpath(os.path.abspath(strVtkIn), strDir)
+    return strKey.replace(os.sep, '/')
+
+
+def find_vtk_pack(strVtkIn):
+    """
+    Find container holding a vtk file.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of (original) vtk file.
+
+    Returns
+    -------
+    tplPck : tuple or None
+        Path of container and key of vtk file within container. `None` if no
+        container holds the vtk file, if h5py is not available, if containers
+        are disabled, or if the original vtk file has been modified after
+        packing.
+    """
+    if (h5py is None) or (os.environ.get(STR_ENV_PCK, '') == 'off'):
+        return None
+
+    strDir = os.path.dirname(os.path.abspath(strVtkIn))
+
+    for idxUp in range(VAR_NUM_UP + 1):
+
+        strPck = os.path.join(strDir, STR_PCK)
+
+        if os.path.isfile(strPck):
+            strKey = _get_key(strVtkIn, strDir)
+            with h5py.File(strPck, 'r') as objPck:
+                if ('data/' + strKey) in objPck:
+                    objAttr = objPck['data/' + strKey].attrs
+                    # Ignore container if the original file has been
+                    # modified:
+                    if os.path.isfile(strVtkIn):
+                        objStat = os.stat(strVtkIn)
+                        if ((objStat.st_mtime_ns != objAttr['mtime_ns'])
+                                or (objStat.st_size != objAttr['size'])):
+                            return None
+                    return strPck, strKey
+
+        strDir = os.path.dirname(strDir)
+
+    return None
+
+
+def _select_array(objGrp, strPrcdData):
+    """
+    Select point data array of vtk file in container.
+
+    Parameters
+    ----------
+    objGrp : h5py.Group
+        Group of vtk file in container.
+    strPrcdData : str
+        Beginning of string which precedes vertex data in the vtk file (e.g.
+        'SCALARS'), or name of array in case of XML files.
+
+    Returns
+    -------
+    strName : str
+        Name of array.
+
+    Notes
+    -----
+    The array is selected as by `vtk_io.read_vtk_data`. For legacy vtk files,
+    the last array whose 'SCALARS' line (or the 'LOOKUP_TABLE' line following
+    it, in ASCII files) starts with `strPrcdData` is selected. For XML files,
+    the array named `strPrcdData` is selected, or, if there is none, the
+    active scalars or the last array. Containers created by previous versions
+    do not contain the lines of legacy vtk files, which are then assumed to
+    start with 'SCALARS' followed by the name of the array.
+    """
+    objAttr = objGrp.attrs
+    lstNames = list(objAttr['names'])
+
+    if objAttr.get('format', '') == 'xml':
+        if strPrcdData in lstNames:
+            return strPrcdData
+        if objAttr.get('active', '') in lstNames:
+            return objAttr['active']
+        return lstNames[-1]
+
+    if 'lines' in objAttr:
+        lstLne = list(objAttr['lines'])
+        lstLut = list(objAttr['lines_lut'])
+    else:
+        lstLne = ['SCALARS ' + strName for strName in lstNames]
+        lstLut = [''] * len(lstNames)
+
+    # Matching lines, in the order of the vtk file (name of array, line):
+    lstMtch = []
+    for strName, strLne, strLut in zip(lstNames, lstLne, lstLut):
+        for strTmp in (strLne, strLut):
+            if strTmp and strTmp.startswith(strPrcdData):
+                lstMtch.append((strName, strTmp))
+    if not lstMtch:
+        strErrMsg = ('ERROR. String "' + strPrcdData + '" not found in vtk '
+                     + 'file.')
+        raise ValueError(strErrMsg)
+
+    strName, strLne = lstMtch[-1]
+
+    # The data type of binary data is read from the 'SCALARS' line:
+    if ((objAttr.get('format', '') == 'binary')
+            and strLne.startswith('LOOKUP_TABLE')):
+        strErrMsg = ('ERROR. Cannot determine data type of binary vtk data '
+                     + 'from line: ' + strLne)
+        raise ValueError(strErrMsg)
+
+    return strName
+
+
+def _read_rows(objDset, vecIdx, varNumCol):
+    """Read rows of dataset (first columns), only reading needed chunks."""
+    varNumVrtx = objDset.shape[0]
+
+    if vecIdx.dtype == bool:
+        vecIdx = np.where(vecIdx)[0]
+    vecIdx = np.asarray(vecIdx, dtype=np.int64).reshape(-1)
+
+    if (0 < vecIdx.size) and ((np.min(vecIdx) < 0)
+                              or (varNumVrtx <= np.max(vecIdx))):
+        strErrMsg = ('ERROR. Vertex index out of range (number of vertices: '
+                     + str(varNumVrtx) + ').')
+        raise ValueError(strErrMsg)
+
+    aryOut = np.empty((vecIdx.size, varNumCol), dtype=objDset.dtype)
+
+    if vecIdx.size == 0:
+        return aryOut
+
+    if objDset.chunks is None:
+        varChnk = varNumVrtx
+    else:
+        varChnk = objDset.chunks[0]
+
+    # Sorted indices, and position of each index in the output:
+    vecOrd = np.argsort(vecIdx, kind='stable')
+    vecSrt = vecIdx[vecOrd]
+
+    # Runs of consecutive chunks that contain requested vertices:
+    vecChnk = np.unique(vecSrt // varChnk)
+    vecBrk = np.where(np.diff(vecChnk) > 1)[0] + 1
+    for vecRun in np.split(vecChnk, vecBrk):
+        varStrt = int(vecRun[0]) * varChnk
+        varStop = min((int(vecRun[-1]) + 1) * varChnk, varNumVrtx)
+        varPos0 = np.searchsorted(vecSrt, varStrt, side='left')
+        varPos1 = np.searchsorted(vecSrt, varStop, side='left')
+        aryOut[vecOrd[varPos0:varPos1], :] = \
+            objDset[varStrt:varStop, :varNumCol][
+                (vecSrt[varPos0:varPos1] - varStrt), :]
+
+    return aryOut
+
+
+def read_vtk_packed(strVtkIn, strPrcdData, varNumDpth, vecIdx=None):
+    """
+    Read vertex data of a vtk file from a container.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of (original) vtk file.
+    strPrcdData : str
+        Beginning of string which precedes vertex data in the vtk file (e.g.
+        'SCALARS'; see `vtk_io.read_vtk_data`).
+    varNumDpth : int
+        Number of data points per vertex to return (e.g. number of depth
+        levels). If more values per vertex are stored, only the first
+        `varNumDpth` values are returned.
+    vecIdx : np.array or None
+        Indices of vertices to read. If `None`, all vertices are read.
+
+    Returns
+    -------
+    aryVtkData : np.array or None
+        Vertex data, shape aryVtkData[vertex, depth]. `None` if the vtk file
+        is not held by a container (see `find_vtk_pack`).
+
+    Notes
+    -----
+    The point data array is selected in the same way as from the vtk file
+    (see `_select_array`), so that the same data are returned whether or not
+    the vtk file is packed.
+    """
+    tplPck = find_vtk_pack(strVtkIn)
+    if tplPck is None:
+        return None
+
+    strPck, strKey = tplPck
+
+    with h5py.File(strPck, 'r') as objPck:
+
+        objGrp = objPck['data/' + strKey]
+        objDset = objGrp[_select_array(objGrp, strPrcdData)]
+
+        if objDset.shape[1] < varNumDpth:
+            strErrMsg = ('ERROR. Expected ' + str(varNumDpth) + ' data '
+                         + 'points per vertex in ' + strVtkIn + ', found '
+                         + str(objDset.shape[1]) + '.')
+            raise ValueError(strErrMsg)
+
+        if vecIdx is None:
+            aryVtkData = objDset[:, :varNumDpth]
+        else:
+            aryVtkData = _read_rows(objDset, np.asarray(vecIdx), varNumDpth)
+
+    return aryVtkData
+
+
+def read_vtk_packed_mesh(strVtkIn):
+    """
+    Read vertex coordinates, polygons, and point data from a container.
+
+    Parameters
+    ----------
+    strVtkIn : str
+        Path of (original) vtk file.
+
+    Returns
+    -------
+    tplMesh : tuple or None
+        Vertex coordinates, polygons, and point data (see `read_vtk_mesh`).
+        `None` if the vtk file is not held by a container.
+    """
+    tplPck = find_vtk_pack(strVtkIn)
+    if tplPck is None:
+        return None
+
+    strPck, strKey = tplPck
+
+    with h5py.File(strPck, 'r') as objPck:
+        objGrp = objPck['data/' + strKey]
+        objTpl = objPck['topology/' + objGrp.attrs['topology']]
+        aryPnts = objTpl['points'][()]
+        aryPly = objTpl['polygons'][()]
+        dicData = {}
+        for strName in objGrp.attrs['names']:
+            dicData[strName] = objGrp[strName][()]
+
+    return aryPnts, aryPly, dicData
+
+
+def lst_vtk_pack(strPck):
+    """
+    List vtk files held by a container.
+
+    Parameters
+    ----------
+    strPck : str
+        Path of container.
+
+    Returns
+    -------
+    lstEnt : list
+        One dictionary per vtk file (key, number of vertices, point data
+        arrays, and topology).
+    """
+    _check_h5py()
+
+    lstEnt = []
+
+    def visit(strName, objItm):
+        if isinstance(objItm, h5py.Group) and ('names' in objItm.attrs):
+            lstNames = list(objItm.attrs['names'])
+            lstEnt.append({'key': strName,
+                           'names': lstNames,
+                           'num_vertices': objItm[lstNames[-1]].shape[0],
+                           'topology': objItm.attrs['topology']})
+
+    with h5py.File(strPck, 'r') as objPck:
+        objPck['data'].visititems(visit)
+
+    return lstEnt
+
+
+def main():
+    """Create or list vtk containers from the command line."""
+    objParser = argparse.ArgumentParser(
+        description='Pack vtk meshes into one container per directory.')
+    objParser.add_argument('command', choices=['pack', 'list'])
+    objParser.add_argument('path',
+                           help='Pack: directory with vtk files. List: path '
+                                + 'of container.')
+    objParser.add_argument('--pattern', default='**/*.vtk',
+                           help='Pack: glob pattern of vtk files (relative '
+                                + 'to directory).')
+    objNspc = objParser.parse_args()
+
+    if objNspc.command == 'pack':
+        strPck = pack_vtk(objNspc.path, strPattern=objNspc.pattern)
+        print('---Container size: '
+              + str(np.around(os.path.getsize(strPck) / 1048576.0,
+                              decimals=1))
+              + ' MB')
+    else:
+        lstEnt = lst_vtk_pack(objNspc.path)
+        for dicEnt in lstEnt:
+            print((str(dicEnt['num_vertices']).rjust(10) + '  '
+                   + dicEnt['topology'][:8] + '  ' + dicEnt['key'] + '  ('
+                   + ', '.join(dicEnt['names']) + ')'))
+        print('---' + str(len(lstEnt)) + ' vtk files.')
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""
+Function of the depth sampling pipeline.
+
+Reader & writer for vtk XML PolyData files (*.vtp).
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import contextlib
+import re
+import zlib
+import xml.etree.ElementTree as ET
+import numpy as np
+
+
+# Data types of vtk XML files:
+DIC_XML_TYPE = {'Int8': 'i1',
+                'UInt8': 'u1',
+                'Int16': 'i2',
+                'UInt16': 'u2',
+                'Int32': 'i4',
+                'UInt32': 'u4',
+                'Int64': 'i8',
+                'UInt64': 'u8',
+                'Float32': 'f4',
+                'Float64': 'f8'}
+
+# Size of blocks for zlib compression (same as vtk default):
+VAR_BLCK = 2 ** 15
+
+
+def get_cell_starts(aryPly):
+    """
+    Get indices of first element of each cell in legacy vtk cell array.
+
+    Parameters
+    ----------
+    aryPly : np.array
+        Cell array in legacy vtk layout, i.e. for each cell (e.g. triangle),
+        the number of points followed by the point indices (e.g. `[3, 0, 1,
+        2, 3, 2, 1, 4, ...]`).
+
+    Returns
+    -------
+    vecStrt : np.array
+        Indices (within `aryPly`) of the number of points of each cell.
+    """
+    varSze = aryPly.size
+    if varSze == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Meshes usually consist of triangles only, in which case the cell starts
+    # do not have to be searched one by one:
+    varNumPnt = int(aryPly[0])
+    if (varSze % (varNumPnt + 1)) == 0:
+        vecStrt = np.arange(0, varSze, (varNumPnt + 1), dtype=np.int64)
+        if np.all(np.equal(aryPly[vecStrt], varNumPnt)):
+            return vecStrt
+
+    lstStrt = []
+    varIdx = 0
+    while varIdx < varSze:
+        lstStrt.append(varIdx)
+        varIdx += int(aryPly[varIdx]) + 1
+    return np.array(lstStrt, dtype=np.int64)
+
+
+def _b64_len(varNumByte):
+    """Number of base64 characters needed to encode `varNumByte` bytes."""
+    return 4 * ((varNumByte + 2) // 3)
+
+
+def _decode_raw(bytApp, varOff, objDtpHdr, lgcCmp):
+    """Decode binary array (raw, i.e. not base64 encoded) at offset."""
+    varSzeHdr = objDtpHdr.itemsize
+    varNumBlk = int(np.frombuffer(bytApp, dtype=objDtpHdr, count=1,
+                                  offset=varOff)[0])
+    if not lgcCmp:
+        varStrt = varOff + varSzeHdr
+        return bytes(bytApp[varStrt:(varStrt + varNumBlk)])
+
+    # Compressed data - header: number of blocks, size of uncompressed block,
+    # size of last uncompressed block, size of each compressed block.
+    vecHdr = np.frombuffer(bytApp, dtype=objDtpHdr, count=(3 + varNumBlk),
+                           offset=varOff)
+    varStrt = varOff + varSzeHdr * (3 + varNumBlk)
+    lstBlk = []
+    for varSzeBlk in vecHdr[3:]:
+        varSzeBlk = int(varSzeBlk)
+        lstBlk.append(zlib.decompress(bytApp[varStrt:(varStrt + varSzeBlk)]))
+        varStrt += varSzeBlk
+    return b''.join(lstBlk)
+
+
+def _decode_b64(bytB64, objDtpHdr, lgcCmp):
+    """Decode base64 encoded binary array."""
+    varSzeHdr = objDtpHdr.itemsize
+    varNumBlk = int(np.frombuffer(
+        base64.b64decode(bytB64[:_b64_len(varSzeHdr)])[:varSzeHdr],
+        dtype=objDtpHdr)[0])
+
+    if not lgcCmp:
+        # Header and data are encoded together:
+        varNumByte = varSzeHdr + varNumBlk
+        bytDec = base64.b64decode(bytB64[:_b64_len(varNumByte)])
+        return bytDec[varSzeHdr:varNumByte]
+
+    # Header and data of compressed arrays are encoded separately:
+    varSzeHdr = varSzeHdr * (3 + varNumBlk)
+    varLenHdr = _b64_len(varSzeHdr)
+    vecHdr = np.frombuffer(base64.b64decode(bytB64[:varLenHdr])[:varSzeHdr],
+                           dtype=objDtpHdr)
+    vecSzeBlk = vecHdr[3:].astype(np.int64)
+    bytDec = base64.b64decode(
+        bytB64[varLenHdr:(varLenHdr + _b64_len(int(np.sum(vecSzeBlk))))])
+    lstBlk = []
+    varStrt = 0
+    for varSzeBlk in vecSzeBlk:
+        lstBlk.append(zlib.decompress(bytDec[varStrt:(varStrt + varSzeBlk)]))
+        varStrt += varSzeBlk
+    return b''.join(lstBlk)
+
+
+class _VtpFile(object):
+    """Parsed header & appended data section of a vtk XML PolyData file."""
+
+    def __init__(self, strVtpIn):
+        with open(strVtpIn, 'rb') as fleVtpIn:
+            bytVtp = fleVtpIn.read()
+
+        # Binary appended data (following an underscore) is not valid XML, and
+        # is separated from the XML header before parsing.
+        varIdxApp = bytVtp.find(b'<AppendedData')
+        if varIdxApp < 0:
+            self.bytApp = None
+            self.strEnc = None
+            objRoot = ET.fromstring(bytVtp)
+        else:
+            varIdxTag = bytVtp.index(b'>', varIdxApp)
+            objMtch = re.search(b'encoding="([a-z0-9]+)"',
+                                bytVtp[varIdxApp:varIdxTag])
+            self.strEnc = objMtch.group(1).decode('ascii')
+            varIdxStrt = bytVtp.index(b'_', varIdxTag) + 1
+            self.bytApp = memoryview(bytVtp)[varIdxStrt:]
+            objRoot = ET.fromstring(bytVtp[:varIdxApp] + b'</VTKFile>')
+
+        if objRoot.get('type') != 'PolyData':
+            strErrMsg = ('ERROR. Only vtk XML files of type PolyData are '
+                         + 'supported.')
+            raise ValueError(strErrMsg)
+
+        if objRoot.get('compressor', '') == '':
+            self.lgcCmp = False
+        elif objRoot.get('compressor') == 'vtkZLibDataCompressor':
+            self.lgcCmp = True
+        else:
+            strErrMsg = ('ERROR. Unsupported compressor: '
+                         + objRoot.get('compressor'))
+            raise ValueError(strErrMsg)
+
+        if objRoot.get('byte_order', 'LittleEndian') == 'BigEndian':
+            self.strOrd = '>'
+        else:
+            self.strOrd = '<'
+        self.objDtpHdr = np.dtype(
+            self.strOrd + DIC_XML_TYPE[objRoot.get('header_type', 'UInt32')])
+
+        self.objPce = objRoot.find('PolyData/Piece')
+        self.varNumVrtx = int(self.objPce.get('NumberOfPoints'))
+
+    def get_array(self, objArr):
+        """Decode DataArray element, return array of shape (tuples, comp.)."""
+        objDtp = np.dtype(self.strOrd + DIC_XML_TYPE[objArr.get('type')])
+        varNumCmp = int(objArr.get('NumberOfComponents', '1'))
+        strFrmt = objArr.get('format')
+
+        if strFrmt == 'ascii':
+            aryOt = np.array(objArr.text.split(),
+                             dtype=objDtp.newbyteorder('='))
+        else:
+            if strFrmt == 'binary':
+                bytDec = _decode_b64(objArr.text.strip().encode('ascii'),
+                                     self.objDtpHdr, self.lgcCmp)
+            elif self.strEnc == 'raw':
+                bytDec = _decode_raw(self.bytApp, int(objArr.get('offset')),
+                                     self.objDtpHdr, self.lgcCmp)
+            else:
+                varOff = int(objArr.get('offset'))
+                bytDec = _decode_b64(self.bytApp[varOff:],
+                                     self.objDtpHdr, self.lgcCmp)
+            aryOt = np.frombuffer(bytDec, dtype=objDtp)
+
+        return aryOt.reshape(-1, varNumCmp)
+
+    def get_point_arrays(self):
+        """Get point data arrays (DataArray elements) and active scalars."""
+        objPntDat = self.objPce.find('PointData')
+        if objPntDat is None:
+            return [], None
+        return objPntDat.findall('DataArray'), objPntDat.get('Scalars')
+
+
+def read_vtp_data(strVtpIn, strName=None, varNumDpth=None):
+    """
+    Read vertex data from vtk XML PolyData file.
+
+    Parameters
+    ----------
+    strVtpIn : str
+        Path of vtp file.
+    strName : str or None
+        Name of point data array to read. If there is no array with this name,
+        the active scalars (or, if not defined, the last point data array) are
+        read.
+    varNumDpth : int or None
+        Number of data points per vertex to return. If `None`, all components
+        are returned.
+
+    Returns
+    -------
+    aryVtkData : np.array
+        Vertex data, shape aryVtkData[varNumVrtx, varNumDpth] (float64).
+    """
+    objVtp = _VtpFile(strVtpIn)
+    lstArr, strActv = objVtp.get_point_arrays()
+    if len(lstArr) == 0:
+        strErrMsg = 'ERROR. No point data found in vtp file.'
+        raise ValueError(strErrMsg)
+
+    dicArr = dict([(x.get('Name'), x) for x in lstArr])
+    if strName in dicArr:
+        objArr = dicArr[strName]
+    elif strActv in dicArr:
+        objArr = dicArr[strActv]
+    else:
+        objArr = lstArr[-1]
+
+    aryVtkData = objVtp.get_array(objArr)
+
+    if varNumDpth is not None:
+        if aryVtkData.shape[1] < varNumDpth:
+            strErrMsg = ('ERROR. Expected ' + str(varNumDpth) + ' data points '
+                         + 'per vertex in vtp file, found '
+                         + str(aryVtkData.shape[1]) + '.')
+            raise ValueError(strErrMsg)
+        aryVtkData = aryVtkData[:, :varNumDpth]
+
+    return np.array(aryVtkData, dtype=np.float64)
+
+
+def read_vtp_active(strVtpIn):
+    """
+    Get name of active scalars of vtk XML PolyData file.
+
+    Parameters
+    ----------
+    strVtpIn : str
+        Path of vtp file.
+
+    Returns
+    -------
+    strActv : str or None
+        Name of the active scalars (see `read_vtp_data`), or `None` if not
+        defined.
+    """
+    return _VtpFile(strVtpIn).get_point_arrays()[1]
+
+
+def read_vtp(strVtpIn):
+    """
+    Read vertex coordinates, polygons, and point data from vtp file.
+
+    Parameters
+    ----------
+    strVtpIn : str
+        Path of vtp file.
+
+    Returns
+    -------
+    aryPnts : np.array
+        Vertex coordinates, shape aryPnts[vertex, 3].
+    aryPly : np.array
+        Polygons, in legacy vtk cell array layout (see `get_cell_starts`).
+    dicData : dict
+        Point data arrays (name: array of shape [vertex, components]).
+    """
+    objVtp = _VtpFile(strVtpIn)
+
+    aryPnts = np.array(
+        objVtp.get_array(objVtp.objPce.find('Points/DataArray')),
+        dtype=np.float64)
+
+    objPly = objVtp.objPce.find('Polys')
+    if objPly is None:
+        aryPly = np.zeros(0, dtype=np.int64)
+    else:
+        dicPly = dict([(x.get('Name'), x) for x in
+                       objPly.findall('DataArray')])
+        vecCon = objVtp.get_array(dicPly['connectivity']).astype(
+            np.int64).flatten()
+        vecOff = objVtp.get_array(dicPly['offsets']).astype(
+            np.int64).flatten()
+        # Number of points per polygon:
+        vecNumPnt = np.diff(np.concatenate(([0], vecOff)))
+        aryPly = np.insert(vecCon, (vecOff - vecNumPnt), vecNumPnt)
+
+    dicData = {}
+    lstArr, _ = objVtp.get_point_arrays()
+    for objArr in lstArr:
+        dicData[objArr.get('Name')] = np.array(objVtp.get_array(objArr),
+                                               dtype=np.float64)
+
+    return aryPnts, aryPly, dicData
+
+
+def read_vtp_points(strVtpIn):
+    """Read vertex coordinates from vtp file, shape aryPnts[vertex, 3]."""
+    objVtp = _VtpFile(strVtpIn)
+    return np.array(objVtp.get_array(objVtp.objPce.find('Points/DataArray')),
+                    dtype=np.float64)
+
+
+def _encode(aryIn, strEnc, lgcCmp):
+    """Encode array for appended data section (UInt64 header)."""
+    bytIn = aryIn.tobytes()
+    if not lgcCmp:
+        bytHdr = np.array([len(bytIn)], dtype='<u8').tobytes()
+        if strEnc == 'raw':
+            return bytHdr + bytIn
+        return base64.b64encode(bytHdr + bytIn)
+
+    lstBlk = [zlib.compress(bytIn[idx:(idx + VAR_BLCK)])
+              for idx in range(0, len(bytIn), VAR_BLCK)]
+    if len(bytIn) == 0:
+        varLst = 0
+    else:
+        varLst = len(bytIn) - VAR_BLCK * (len(lstBlk) - 1)
+    bytHdr = np.array(([len(lstBlk), VAR_BLCK, varLst]
+                       + [len(x) for x in lstBlk]), dtype='<u8').tobytes()
+    if strEnc == 'raw':
+        return bytHdr + b''.join(lstBlk)
+    return base64.b64encode(bytHdr) + base64.b64encode(b''.join(lstBlk))
+
+
+def open_output(strPthOt):
+    """
+    Open output file for writing in binary mode.
+
+    Parameters
+    ----------
+    strPthOt : str or file object
+        Output path, or file object opened in binary mode (which is used as
+        is, and not closed on exit).
+
+    Returns
+    -------
+    objCtx : context manager
+        Context manager returning the file object.
+    """
+    if hasattr(strPthOt, 'write'):
+        return contextlib.nullcontext(strPthOt)
+    return open(strPthOt, 'wb')
+
+
+def write_vtp(strVtpOt, aryPnts, aryPly, dicData, strEnc='raw', lgcCmp=True,
+              strDtype='double'):
+    """
+    Write vtk XML PolyData file with appended binary data.
+
+    Parameters
+    ----------
+    strVtpOt : str or file object
+        Output path, or file object opened in binary mode (see
+        `open_output`).
+    aryPnts : np.array
+        Vertex coordinates, shape aryPnts[vertex, 3].
+    aryPly : np.array
+        Polygons, in legacy vtk cell array layout (see `get_cell_starts`).
+    dicData : dict
+        Point data arrays (name: array of shape [vertex] or [vertex,
+        components]).
+    strEnc : str
+        Encoding of appended data, 'raw' or 'base64'.
+    lgcCmp : bool
+        Whether to compress data (zlib).
+    strDtype : str
+        Data type for vertex coordinates and point data, 'float' (float32) or
+        'double' (float64). Single precision halves the file size, but values
+        are rounded.
+    """
+    strType = {'float': 'Float32', 'double': 'Float64'}[strDtype]
+    objDtp = np.dtype('<' + DIC_XML_TYPE[strType])
+    varNumVrtx = aryPnts.shape[0]
+
+    # Polygons (connectivity & offsets):
+    vecStrt = get_cell_starts(aryPly)
+    vecNumPnt = aryPly[vecStrt]
+    vecCon = np.delete(aryPly, vecStrt).astype('<i8')
+    vecOff = np.cumsum(vecNumPnt).astype('<i8')
+
+    # Arrays to write - name, type, number of components, data:
+    lstArr = []
+    for strName, aryTmp in dicData.items():
+        aryTmp = np.asarray(aryTmp).reshape(varNumVrtx, -1)
+        lstArr.append((strName, strType, aryTmp.shape[1],
+                       aryTmp.astype(objDtp)))
+    lstArr.append((None, strType, 3, aryPnts.astype(objDtp)))
+    lstArr.append(('connectivity', 'Int64', 1, vecCon))
+    lstArr.append(('offsets', 'Int64', 1, vecOff))
+
+    # Encode data & get offsets within appended data section:
+    lstEnc = [_encode(x[3], strEnc, lgcCmp) for x in lstArr]
+    lstTag = []
+    varOff = 0
+    for idxArr in range(len(lstArr)):
+        strName, strTypeTmp, varNumCmp, _ = lstArr[idxArr]
+        strTag = '<DataArray type="' + strTypeTmp + '"'
+        if strName is not None:
+            strTag += ' Name="' + strName + '"'
+        strTag += (' NumberOfComponents="' + str(varNumCmp) + '"'
+                   + ' format="appended" offset="' + str(varOff) + '"/>')
+        lstTag.append(strTag)
+        varOff += len(lstEnc[idxArr])
+
+    varNumData = len(dicData)
+    lstXml = ['<?xml version="1.0"?>',
+              ('<VTKFile type="PolyData" version="1.0" '
+               + 'byte_order="LittleEndian" header_type="UInt64"'
+               + (' compressor="vtkZLibDataCompressor"' if lgcCmp else '')
+               + '>'),
+              '  <PolyData>',
+              ('    <Piece NumberOfPoints="' + str(varNumVrtx) + '" '
+               + 'NumberOfVerts="0" NumberOfLines="0" NumberOfStrips="0" '
+               + 'NumberOfPolys="' + str(vecStrt.size) + '">')]
+    if 0 < varNumData:
+        lstXml.append('      <PointData Scalars="' + lstArr[varNumData - 1][0]
+                      + '">')
+        lstXml += ['        ' + x for x in lstTag[:varNumData]]
+        lstXml.append('      </PointData>')
+    lstXml += ['      <Points>',
+               '        ' + lstTag[varNumData],
+               '      </Points>',
+               '      <Polys>',
+               '        ' + lstTag[varNumData + 1],
+               '        ' + lstTag[varNumData + 2],
+               '      </Polys>',
+               '    </Piece>',
+               '  </PolyData>',
+               '  <AppendedData encoding="' + strEnc + '">',
+               '   _']
+
+    with open_output(strVtpOt) as fleVtpOt:
+        fleVtpOt.write('\n'.join(lstXml).encode('ascii'))
+        for bytTmp in lstEnc:
+            fleVtpOt.write(bytTmp)
+        fleVtpOt.write(b'\n  </AppendedData>\n</VTKFile>\n')
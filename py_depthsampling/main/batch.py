@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration-driven batch runner for analysis functions.
+
+A job spec (json, or yaml if PyYAML is installed) describes one or several
+analyses. Each analysis names a function (e.g. 'ds_main', or a full import
+path such as 'py_depthsampling.main.main.ds_main'), its parameters, and the
+loops over which it is run, for instance:
+
+    {"budget": {"cpus": 8, "memory": 16000},
+     "jobs": [
+        {"function": "ds_main",
+         "resources": {"cpus": 2, "memory": 2000},
+         "params": {"strRoi": "v1",
+                    "strPltOtPre": "/plots/${strMetaCon}_${strRoi}_",
+                    ...},
+         "loops": {"strMetaCon": ["centre", "edge"],
+                   "strRoi": ["v1", "v2"],
+                   "con": [{"lstCon": ["a", "b"], "_strCon": "a"}]},
+         "match": {"strMetaCon": {"centre": {"varAcrSubsYmin": -1.0},
+                                  "edge": {"varAcrSubsYmin": 0.0}}}}]}
+
+The loops are expanded into one job per combination of loop values (in
+order). A scalar loop value is assigned to the parameter with the name of
+the loop; a dict loop value sets several parameters at once (its entry
+'_name', if any, is used in the name of the job). `match` sets
+parameters depending on the value of a scalar loop. Placeholders of the form
+`${name}` in string parameters are replaced by the (scalar) parameters of the
+job; parameters starting with an underscore are only used for placeholders
+and are not passed to the function. Identical jobs (same function and
+parameters) are only run once.
+
+Jobs are run by a pool of worker processes, such that the CPUs and memory
+(MB) declared for the running jobs (`resources`) stay within the global
+budget. Results of finished jobs (status and run time) are appended to a
+state file (json lines); when the same spec is run again, jobs that are
+recorded as done are skipped (resume after a crash). The key of a job
+includes the modification time and size of parameters that are paths of
+existing files, so that such jobs are repeated if these files change. Paths
+with `{}` placeholders that are only filled in by the function (e.g. the
+subject ID in the paths of `ds_main`) are not files, and changes of the files
+they refer to are not detected; use `--no-resume` to repeat these jobs.
+
+Different jobs often read the same inputs, which are shared between jobs in
+two ways:
+
+- Vtk meshes (e.g. the depth-sampled data of all subjects, which are loaded
+  again for every meta-condition, ROI, or condition). Unless the vtk cache has
+  been configured explicitly (see `py_depthsampling.get_data.vtk_cache`),
+  `run_jobs` points the vtk cache of all jobs to a temporary directory for the
+  duration of the batch, so that each vtk mesh is parsed only once (by the
+  first job that needs it, while other jobs that need it wait), and read from
+  the parsed copy by all other jobs and worker processes. The temporary
+  directory is removed after the batch. Use `--no-share` to parse inputs
+  separately in each job.
+- Input jobs, which prepare inputs (e.g. convert files) before the jobs that
+  need them. An analysis can list input analyses (with 'function', 'params',
+  'loops', and 'resources', like the analysis itself) under 'inputs'; their
+  placeholders can also refer to the (scalar) parameters of the job that
+  needs them. Input jobs that are needed by several jobs (same function and
+  parameters) are only run once. For instance:
+
+    {"function": "ert_main",
+     ...
+     "inputs": [{"function": "ert_prepare",
+                 "params": {"strVtkPth": "/data/{}/{}/{}/vol_{}.vtk", ...},
+                 "loops": {"strSubId": ["01", "02"],
+                           "strHmsph": ["lh", "rh"],
+                           "strCon": ["a", "b"]}}]}
+
+The value returned by the function of a job is included in its record (see
+`run_jobs`), but not in the state file. Scripts that combine the results of
+several jobs (e.g. tables of p-values) therefore run their jobs without
+resume.
+
+From the command line:
+
+    python -m py_depthsampling.main.batch spec.json --cpus 8 --memory 16000
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import importlib
+import itertools
+import json
+import os
+import shutil
+import string
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from py_depthsampling.get_data.vtk_cache import STR_ENV_DIR
+from py_depthsampling.get_data.vtk_cache import get_cache_root
+from py_depthsampling.main.stages import get_stage_key
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+# Functions that can be referred to by short name in job specs:
+DIC_FUNC = {'ds_main': 'py_depthsampling.main.main.ds_main',
+            'drain_model': ('py_depthsampling.drain_model.drain_model_main.'
+                            + 'drain_model'),
+            'boot_plot': 'py_depthsampling.boot.boot_plot_diff.boot_plot',
+            'diff_sem': 'py_depthsampling.diff.diff_sem.diff_sem',
+            'permute': 'py_depthsampling.permutation.perm_main.permute',
+            'perm_plot': 'py_depthsampling.permutation.perm_jobs.perm_plot',
+            'perm_max_prf': ('py_depthsampling.permutation.perm_jobs.'
+                             + 'perm_max_prf'),
+            'perm_max_ert': ('py_depthsampling.permutation.perm_jobs.'
+                             + 'perm_max_ert'),
+            'peak_diff': ('py_depthsampling.permutation.peak_pos_perm_diff.'
+                          + 'peak_diff'),
+            'project': 'py_depthsampling.project.project_main.project',
+            'ert_main': 'py_depthsampling.ert.ert_main_surface.ert_main',
+            'ert_prepare': ('py_depthsampling.ert.ert_get_sub_data.'
+                            + 'ert_prepare')}
+
+
+def load_spec(strSpec):
+    """
+    Load job spec from json or yaml file.
+
+    Parameters
+    ----------
+    strSpec : str
+        Path of job spec ('.json', '.yaml', or '.yml').
+
+    Returns
+    -------
+    dicSpec : dict
+        Job spec. A spec with a single analysis (i.e. without 'jobs' entry)
+        is converted into a spec with a list of analyses. If no state file is
+        specified, the state file is placed next to the spec.
+    """
+    with open(strSpec, 'r') as fleSpec:
+        if strSpec.lower().endswith(('.yaml', '.yml')):
+            if yaml is None:
+                strErrMsg = ('ERROR. Reading yaml job specs requires PyYAML, '
+                             + 'which is not installed.')
+                raise ValueError(strErrMsg)
+            dicSpec = yaml.safe_load(fleSpec)
+        else:
+            dicSpec = json.load(fleSpec)
+
+    if 'jobs' not in dicSpec:
+        dicSpec = {'jobs': [dicSpec]}
+
+    if 'state' not in dicSpec:
+        dicSpec['state'] = os.path.splitext(strSpec)[0] + '.state.jsonl'
+
+    return dicSpec
+
+
+def _get_func(strFunc):
+    """Import function by short name (see `DIC_FUNC`) or import path."""
+    strPth = DIC_FUNC.get(strFunc, strFunc)
+    strMdl, _, strName = strPth.rpartition('.')
+    if not strMdl:
+        strErrMsg = 'ERROR. Unknown function in job spec: ' + str(strFunc)
+        raise ValueError(strErrMsg)
+    return getattr(importlib.import_module(strMdl), strName)
+
+
+def _fill(objVal, dicSub):
+    """Replace `${name}` placeholders in (nested) string parameters."""
+    if isinstance(objVal, str):
+        return string.Template(objVal).safe_substitute(dicSub)
+    elif isinstance(objVal, list):
+        return [_fill(objTmp, dicSub) for objTmp in objVal]
+    elif isinstance(objVal, dict):
+        return {strKey: _fill(objTmp, dicSub)
+                for strKey, objTmp in objVal.items()}
+    return objVal
+
+
+def _iter_ana(dicAna, dicOut):
+    """
+    Iterate over loop combinations of an analysis.
+
+    Yields the names of the loop values (list) and the parameters of each job
+    (dict, including spec-only parameters). `dicOut` holds placeholder values
+    from outside of the analysis (i.e. the scalar parameters of the job of
+    which the analysis is an input).
+    """
+    dicLoop = dicAna.get('loops', {})
+    lstLoop = list(dicLoop.keys())
+
+    for tplVal in itertools.product(*[dicLoop[strLoop]
+                                      for strLoop in lstLoop]):
+
+        # Parameters of current job:
+        dicPrm = dict(dicAna.get('params', {}))
+        lstName = []
+        for strLoop, objVal in zip(lstLoop, tplVal):
+            if isinstance(objVal, dict):
+                dicPrm.update(objVal)
+                lstName.append(str(objVal.get(
+                    '_name', dicLoop[strLoop].index(objVal))))
+            else:
+                dicPrm[strLoop] = objVal
+                dicPrm.update(dicAna.get('match', {}).get(
+                    strLoop, {}).get(str(objVal), {}))
+                lstName.append(str(objVal))
+
+        # Replace placeholders by scalar parameters:
+        dicSub = dict(dicOut)
+        dicSub.update(_get_scalar(dicPrm))
+
+        yield lstName, _fill(dicPrm, dicSub)
+
+
+def _get_scalar(dicPrm):
+    """Scalar parameters (which can be used as placeholders)."""
+    return {strKey: objVal for strKey, objVal in dicPrm.items()
+            if isinstance(objVal, (str, int, float))}
+
+
+def _make_job(dicAna, lstName, dicPrm, lstAftr):
+    """Create job (see `expand_jobs`) from parameters of loop combination."""
+    # Parameters for function (without spec-only variables):
+    dicPrm = {strKey: objVal for strKey, objVal in dicPrm.items()
+              if not strKey.startswith('_')}
+
+    dicRes = dicAna.get('resources', {})
+
+    return {'name': '/'.join([dicAna['function']] + lstName),
+            'key': get_stage_key('job', {'function': dicAna['function'],
+                                         'params': dicPrm}),
+            'function': dicAna['function'],
+            'params': dicPrm,
+            'cpus': int(dicRes.get('cpus', 1)),
+            'memory': float(dicRes.get('memory', 0.0)),
+            'after': lstAftr,
+            'input': False}
+
+
+def expand_jobs(dicSpec):
+    """
+    Expand job spec into list of jobs.
+
+    Parameters
+    ----------
+    dicSpec : dict
+        Job spec (see module docstring, and `load_spec`).
+
+    Returns
+    -------
+    lstJobs : list
+        Jobs (dicts with 'name', 'key', 'function', 'params', 'cpus',
+        'memory', 'after' (keys of the input jobs of the job), and 'input'
+        (whether the job is an input job)), in the order of the loops. Input
+        jobs are placed before the first job that needs them. Identical jobs
+        (including input jobs shared by several jobs) are only included once.
+    """
+    # Jobs by key (in order of insertion):
+    dicJobs = {}
+
+    for dicAna in dicSpec['jobs']:
+        for lstName, dicPrm in _iter_ana(dicAna, {}):
+
+            # Input jobs of current job (placeholders are replaced by the
+            # scalar parameters of the current job):
+            lstAftr = []
+            for dicInp in dicAna.get('inputs', []):
+                for lstNameInp, dicPrmInp in _iter_ana(dicInp,
+                                                       _get_scalar(dicPrm)):
+                    dicJob = _make_job(dicInp, lstNameInp, dicPrmInp, [])
+                    dicJob['input'] = True
+                    dicJobs.setdefault(dicJob['key'], dicJob)
+                    if dicJob['key'] not in lstAftr:
+                        lstAftr.append(dicJob['key'])
+
+            dicJob = _make_job(dicAna, lstName, dicPrm, lstAftr)
+            dicJobs.setdefault(dicJob['key'], dicJob)
+
+    return list(dicJobs.values())
+
+
+def load_state(strState):
+    """
+    Load records of finished jobs from state file.
+
+    Parameters
+    ----------
+    strState : str or None
+        Path of state file (json lines).
+
+    Returns
+    -------
+    dicState : dict
+        Latest record for each job key. Incomplete lines (e.g. after a crash
+        while writing) are ignored.
+    """
+    dicState = {}
+    if (strState is None) or (not os.path.isfile(strState)):
+        return dicState
+    with open(strState, 'r') as fleState:
+        for strLne in fleState:
+            try:
+                dicRec = json.loads(strLne)
+            except ValueError:
+                continue
+            dicState[dicRec['key']] = dicRec
+    return dicState
+
+
+def _save_record(strState, dicRec):
+    """Append record of finished job (without its result) to state file."""
+    if strState is None:
+        return
+    dicRec = {strKey: objVal for strKey, objVal in dicRec.items()
+              if strKey != 'result'}
+    with open(strState, 'a') as fleState:
+        fleState.write(json.dumps(dicRec) + '\n')
+        fleState.flush()
+        os.fsync(fleState.fileno())
+
+
+def _run_job(strFunc, dicPrm):
+    """Run one job, return run time, error message (if any), and result."""
+    varTme = time.perf_counter()
+    objRes = None
+    try:
+        objRes = _get_func(strFunc)(**dicPrm)
+        strErr = None
+    except Exception:
+        strErr = traceback.format_exc()
+    return time.perf_counter() - varTme, strErr, objRes
+
+
+def _share_inputs(lgcShare):
+    """
+    Point vtk cache to temporary directory shared by the jobs of a batch.
+
+    Parameters
+    ----------
+    lgcShare : bool
+        Whether inputs are to be shared between jobs.
+
+    Returns
+    -------
+    strDir : str or None
+        Path of temporary cache directory (to be removed after the batch), or
+        `None` if inputs are not shared, or if the vtk cache has already been
+        configured with the environment variable `PY_DEPTHSAMPLING_CACHE`.
+    """
+    if (not lgcShare) or (STR_ENV_DIR in os.environ):
+        return None
+    strRoot = get_cache_root()
+    if not os.path.isdir(strRoot):
+        os.makedirs(strRoot)
+    strDir = tempfile.mkdtemp(prefix='batch_', dir=strRoot)
+    os.environ[STR_ENV_DIR] = strDir
+    return strDir
+
+
+def run_jobs(lstJobs, varCpuMax=None, varMemMax=None, strState=None,
+             lgcResume=True, lgcShare=True):
+    """
+    Run jobs in parallel within CPU & memory budget.
+
+    Parameters
+    ----------
+    lstJobs : list
+        Jobs (see `expand_jobs`).
+    varCpuMax : int or None
+        Number of CPUs available for all jobs (default: number of CPUs). If
+        1, jobs are run one after the other in the current process.
+    varMemMax : float or None
+        Memory (MB) available for all jobs. If `None`, memory is not limited.
+    strState : str or None
+        Path of state file for job records (see `load_state`).
+    lgcResume : bool
+        Whether to skip jobs that are recorded as done in the state file.
+    lgcShare : bool
+        Whether vtk meshes read by several jobs are parsed only once (see
+        module docstring). Only applies if more than one job is run.
+
+    Returns
+    -------
+    lstRec : list
+        Records of the jobs run in this call (dicts with 'key', 'name',
+        'status' ('done' or 'failed'), 'start', 'time' (s), 'error', and
+        'result' (value returned by the function, `None` if failed)).
+
+    Notes
+    -----
+    A job that needs more CPUs or memory than the budget is run on its own.
+    Failed jobs do not stop the other jobs; they are run again on resume.
+    Input jobs are run (irrespective of the state file) if any job that needs
+    them is run, and before that job. If an input job fails, the jobs that
+    need it fail without being run.
+    """
+    if varCpuMax is None:
+        varCpuMax = os.cpu_count() or 1
+
+    if lgcResume:
+        dicState = load_state(strState)
+        setTodo = set([dicJob['key'] for dicJob in lstJobs
+                       if (not dicJob['input'])
+                       and (dicState.get(dicJob['key'], {}).get('status')
+                            != 'done')])
+    else:
+        setTodo = set([dicJob['key'] for dicJob in lstJobs
+                       if not dicJob['input']])
+
+    # Input jobs of the jobs to be run:
+    for dicJob in lstJobs:
+        if dicJob['key'] in setTodo:
+            setTodo.update(dicJob['after'])
+
+    lstTodo = [dicJob for dicJob in lstJobs if dicJob['key'] in setTodo]
+
+    print('---Running ' + str(len(lstTodo)) + ' of ' + str(len(lstJobs))
+          + ' jobs.')
+
+    lstRec = []
+
+    # Names of jobs, and keys of jobs that have finished / failed in this call:
+    dicName = {dicJob['key']: dicJob['name'] for dicJob in lstJobs}
+    setFin = set()
+    setFld = set()
+
+    def get_status(dicJob):
+        """Status of input jobs ('wait', 'ready', or error message)."""
+        for strKey in dicJob['after']:
+            if (strKey in setTodo) and (strKey not in setFin):
+                return 'wait'
+        lstFld = [dicName[strKey] for strKey in dicJob['after']
+                  if strKey in setFld]
+        if lstFld:
+            return 'ERROR. Input job(s) failed: ' + ', '.join(lstFld) + '\n'
+        return 'ready'
+
+    def finish(dicJob, varStrt, varTme, strErr, objRes):
+        """Record finished job."""
+        dicRec = {'key': dicJob['key'],
+                  'name': dicJob['name'],
+                  'status': ('done' if strErr is None else 'failed'),
+                  'start': varStrt,
+                  'time': varTme,
+                  'error': strErr,
+                  'result': objRes}
+        _save_record(strState, dicRec)
+        lstRec.append(dicRec)
+        setFin.add(dicJob['key'])
+        if strErr is not None:
+            setFld.add(dicJob['key'])
+        print('------' + dicRec['status'] + ' (' + str(round(varTme, 1))
+              + ' s): ' + dicJob['name'])
+        if strErr is not None:
+            print(strErr)
+
+    strShr = _share_inputs(lgcShare and (1 < len(lstTodo)))
+    try:
+        if varCpuMax == 1:
+            # Input jobs precede the jobs that need them:
+            for dicJob in lstTodo:
+                varStrt = time.time()
+                strStat = get_status(dicJob)
+                if strStat == 'ready':
+                    finish(dicJob, varStrt, *_run_job(dicJob['function'],
+                                                      dicJob['params']))
+                else:
+                    finish(dicJob, varStrt, 0.0, strStat, None)
+        else:
+            _run_pool(lstTodo, varCpuMax, varMemMax, get_status, finish)
+    finally:
+        if strShr is not None:
+            os.environ.pop(STR_ENV_DIR)
+            shutil.rmtree(strShr, ignore_errors=True)
+
+    return lstRec
+
+
+def _run_pool(lstTodo, varCpuMax, varMemMax, funcStat, funcFnsh):
+    """Run jobs in pool of worker processes (see `run_jobs`)."""
+    # Running jobs (future: [job, start time]):
+    dicRun = {}
+
+    with ProcessPoolExecutor(max_workers=varCpuMax) as objPool:
+
+        while lstTodo or dicRun:
+
+            # Start jobs whose inputs are ready (in order) as long as they fit
+            # into the budget:
+            varCpu = sum([lstTmp[0]['cpus'] for lstTmp in dicRun.values()])
+            varMem = sum([lstTmp[0]['memory'] for lstTmp in dicRun.values()])
+            idxJob = 0
+            while idxJob < len(lstTodo):
+                dicJob = lstTodo[idxJob]
+                strStat = funcStat(dicJob)
+                if strStat == 'wait':
+                    idxJob += 1
+                    continue
+                if strStat != 'ready':
+                    # Input job failed:
+                    lstTodo.pop(idxJob)
+                    funcFnsh(dicJob, time.time(), 0.0, strStat, None)
+                    continue
+                lgcFit = ((varCpu + dicJob['cpus']) <= varCpuMax) and (
+                    (varMemMax is None)
+                    or ((varMem + dicJob['memory']) <= varMemMax))
+                if (not lgcFit) and dicRun:
+                    break
+                lstTodo.pop(idxJob)
+                objFtr = objPool.submit(_run_job, dicJob['function'],
+                                        dicJob['params'])
+                dicRun[objFtr] = [dicJob, time.time()]
+                varCpu += dicJob['cpus']
+                varMem += dicJob['memory']
+
+            if not dicRun:
+                continue
+
+            setDone, _ = wait(list(dicRun.keys()), return_when=FIRST_COMPLETED)
+            for objFtr in setDone:
+                dicJob, varStrt = dicRun.pop(objFtr)
+                try:
+                    varTme, strErr, objRes = objFtr.result()
+                except Exception:
+                    # E.g. worker process terminated abruptly:
+                    varTme = time.time() - varStrt
+                    strErr = traceback.format_exc()
+                    objRes = None
+                funcFnsh(dicJob, varStrt, varTme, strErr, objRes)
+
+
+def check_jobs(lstRec):
+    """
+    List failed jobs, and exit with status 1 if any job failed.
+
+    Parameters
+    ----------
+    lstRec : list
+        Records of jobs (see `run_jobs`). Errors of failed jobs have already
+        been printed by `run_jobs`.
+    """
+    lstFld = [dicRec['name'] for dicRec in lstRec
+              if dicRec['status'] != 'done']
+    if lstFld:
+        print('---' + str(len(lstFld)) + ' of ' + str(len(lstRec))
+              + ' jobs failed:')
+        for strName in lstFld:
+            print('------' + strName)
+        sys.exit(1)
+
+
+def run_spec(strSpec, varCpuMax=None, varMemMax=None, lgcResume=True,
+             lgcShare=True):
+    """
+    Load, expand, and run job spec.
+
+    Parameters
+    ----------
+    strSpec : str
+        Path of job spec (see `load_spec`).
+    varCpuMax : int or None
+        Number of CPUs (overrides the budget of the spec).
+    varMemMax : float or None
+        Memory in MB (overrides the budget of the spec).
+    lgcResume : bool
+        Whether to skip jobs that are recorded as done in the state file.
+    lgcShare : bool
+        Whether vtk meshes read by several jobs are parsed only once.
+
+    Returns
+    -------
+    lstRec : list
+        Records of the jobs run (see `run_jobs`).
+    """
+    dicSpec = load_spec(strSpec)
+    dicBdg = dicSpec.get('budget', {})
+    if varCpuMax is None:
+        varCpuMax = dicBdg.get('cpus')
+    if varMemMax is None:
+        varMemMax = dicBdg.get('memory')
+    return run_jobs(expand_jobs(dicSpec), varCpuMax=varCpuMax,
+                    varMemMax=varMemMax, strState=dicSpec['state'],
+                    lgcResume=lgcResume, lgcShare=lgcShare)
+
+
+def main():
+    """Run job spec from the command line."""
+    objParser = argparse.ArgumentParser(
+        description='Run analyses described by a job spec (json or yaml).')
+    objParser.add_argument('spec', help='Path of job spec.')
+    objParser.add_argument('--cpus', type=int, default=None,
+                           help='Number of CPUs for all jobs.')
+    objParser.add_argument('--memory', type=float, default=None,
+                           help='Memory (MB) for all jobs.')
+    objParser.add_argument('--no-resume', action='store_true',
+                           help='Run all jobs, including finished ones.')
+    objParser.add_argument('--no-share', action='store_true',
+                           help='Parse inputs separately in each job.')
+    objParser.add_argument('--list', action='store_true',
+                           help='Only list the jobs of the spec.')
+    objNspc = objParser.parse_args()
+
+    if objNspc.list:
+        dicSpec = load_spec(objNspc.spec)
+        dicState = load_state(dicSpec['state'])
+        for dicJob in expand_jobs(dicSpec):
+            dicRec = dicState.get(dicJob['key'], {})
+            print(dicRec.get('status', 'todo').ljust(8)
+                  + str(round(dicRec.get('time', 0.0), 1)).rjust(10)
+                  + '  ' + dicJob['name'])
+        return
+
+    lstRec = run_spec(objNspc.spec, varCpuMax=objNspc.cpus,
+                      varMemMax=objNspc.memory,
+                      lgcResume=(not objNspc.no_resume),
+                      lgcShare=(not objNspc.no_share))
+
+    check_jobs(lstRec)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoint store for completed units of work.
+
+Long runs (e.g. `ds_main` over many subjects, or the visual field projection
+over several ROIs and conditions) record each completed unit of work (e.g.
+one subject, hemisphere, ROI, and condition) in a checkpoint, together with
+its results (arrays) and output files. When the run is repeated after a
+crash, completed units are skipped.
+
+A checkpoint is identified by the unit (a dict, e.g. `{'subject': ...,
+'hemisphere': ..., 'roi': ..., 'condition': ...}`) and by a hash of the
+parameters that the results depend on (input files are represented by their
+path, modification time, and size, see `py_depthsampling.main.stages`).
+Hence, a checkpoint is not used if a parameter or input file has changed, and
+neither if one of its output files has been modified or removed.
+
+Each checkpoint is a single npz file, which is written to a temporary file and
+renamed, so that a crash never leaves an incomplete checkpoint. Parallel
+processes write separate files and do not need to be synchronised.
+
+Checkpoints are only used when resuming is requested (e.g. `ds_main` with
+`lgcResume=True`); otherwise all units are run again. In contrast to the stage
+cache (see `py_depthsampling.main.stages`), which skips individual pipeline
+stages whose inputs have not changed, checkpoints only serve to resume an
+interrupted run, and are kept separately. Checkpoints are stored in
+`~/.cache/py_depthsampling/checkpoints`; the environment variable
+`PY_DEPTHSAMPLING_CKPT` can be set to another directory, or to `off` in order
+to disable checkpoints altogether. Checkpoints can be inspected and purged
+with the command line interface of the vtk cache:
+
+    python -m py_depthsampling.get_data.vtk_cache inspect --ckpt
+    python -m py_depthsampling.get_data.vtk_cache purge --ckpt
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from py_depthsampling.get_data.vtk_cache import get_cache_root
+from py_depthsampling.main.stages import get_stage_key
+
+
+# Environment variable for checkpoint directory:
+STR_ENV_CKPT = 'PY_DEPTHSAMPLING_CKPT'
+
+# Name of entry with meta data (unit, output files) in checkpoint files:
+STR_CKPT_META = 'ckpt_meta'
+
+
+def get_ckpt_path():
+    """
+    Get path of checkpoint directory (whether or not checkpoints are used).
+
+    Returns
+    -------
+    strDir : str or None
+        Directory set with the environment variable `PY_DEPTHSAMPLING_CKPT`,
+        or `~/.cache/py_depthsampling/checkpoints`. `None` if checkpoints are
+        disabled via the environment variable.
+    """
+    strDir = os.environ.get(STR_ENV_CKPT, None)
+    if strDir is None:
+        return os.path.join(get_cache_root(), 'checkpoints')
+    elif strDir.lower() in ('', '0', 'off', 'none'):
+        return None
+    return strDir
+
+
+def get_ckpt_dir(lgcResume=False):
+    """
+    Get path of checkpoint directory.
+
+    Parameters
+    ----------
+    lgcResume : bool
+        Whether resuming has been requested.
+
+    Returns
+    -------
+    strDir : str or None
+        Path of checkpoint directory, or `None` if resuming has not been
+        requested, or if checkpoints are disabled.
+    """
+    if not lgcResume:
+        return None
+    return get_ckpt_path()
+
+
+def get_ckpt_key(dicUnit, dicPrm):
+    """
+    Get key of checkpoint.
+
+    Parameters
+    ----------
+    dicUnit : dict
+        Unit of work (e.g. subject, hemisphere, ROI, and condition).
+    dicPrm : dict
+        Parameters that the results of the unit depend on (paths of input
+        files, thresholds, etc.).
+
+    Returns
+    -------
+    strKey : str
+        Key of checkpoint (sha1 hex digest).
+    """
+    return get_stage_key('checkpoint', {'unit': dicUnit, 'params': dicPrm})
+
+
+def ckpt_load(dicUnit, dicPrm, lgcResume=False):
+    """
+    Load results of completed unit of work.
+
+    Parameters
+    ----------
+    dicUnit : dict
+        Unit of work (see `get_ckpt_key`).
+    dicPrm : dict
+        Parameters of unit (see `get_ckpt_key`).
+    lgcResume : bool
+        Whether resuming has been requested (otherwise, `None` is returned).
+
+    Returns
+    -------
+    dicRes : dict or None
+        Arrays saved for unit (empty dict if the unit only writes output
+        files). `None` if the unit has not been completed with the same
+        parameters, if one of its output files has been modified or removed,
+        or if checkpoints are not used.
+    """
+    strDir = get_ckpt_dir(lgcResume=lgcResume)
+    if strDir is None:
+        return None
+
+    strPth = os.path.join(strDir, get_ckpt_key(dicUnit, dicPrm) + '.npz')
+
+    try:
+        with np.load(strPth) as objNpz:
+            dicRes = {strName: objNpz[strName] for strName in objNpz.files}
+        dicMeta = json.loads(str(dicRes.pop(STR_CKPT_META)))
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+    # Check output files:
+    for strOt, varMtime, varSze in dicMeta['outputs']:
+        try:
+            objStat = os.stat(strOt)
+        except OSError:
+            return None
+        if (objStat.st_mtime_ns != varMtime) or (objStat.st_size != varSze):
+            return None
+
+    return dicRes
+
+
+def ckpt_save(dicUnit, dicPrm, dicRes=None, lstOt=None, lgcResume=False):
+    """
+    Record completed unit of work.
+
+    Parameters
+    ----------
+    dicUnit : dict
+        Unit of work (see `get_ckpt_key`).
+    dicPrm : dict
+        Parameters of unit (see `get_ckpt_key`).
+    dicRes : dict or None
+        Results of unit (name: array).
+    lstOt : list or None
+        Paths of output files written by the unit (have to exist).
+    lgcResume : bool
+        Whether resuming has been requested (otherwise, nothing is saved).
+
+    Notes
+    -----
+    Nothing is saved if checkpoints are not used.
+    """
+    strDir = get_ckpt_dir(lgcResume=lgcResume)
+    if strDir is None:
+        return
+
+    if not os.path.isdir(strDir):
+        os.makedirs(strDir, exist_ok=True)
+
+    lstOtStat = []
+    for strOt in (lstOt or []):
+        objStat = os.stat(strOt)
+        lstOtStat.append([os.path.abspath(strOt), objStat.st_mtime_ns,
+                          objStat.st_size])
+
+    dicMeta = {'unit': dicUnit,
+               'outputs': lstOtStat,
+               'time': time.time()}
+
+    dicSave = dict(dicRes or {})
+    dicSave[STR_CKPT_META] = np.array(json.dumps(dicMeta, default=str))
+
+    varFd, strTmp = tempfile.mkstemp(dir=strDir, suffix='.tmp')
+    try:
+        with os.fdopen(varFd, 'wb') as fleOt:
+            np.savez(fleOt, **dicSave)
+        os.replace(strTmp,
+                   os.path.join(strDir,
+                                get_ckpt_key(dicUnit, dicPrm) + '.npz'))
+    except BaseException:
+        if os.path.isfile(strTmp):
+            os.remove(strTmp)
+        raise
+
+
+def save_atomic(strPthOt, *args, **kwargs):
+    """
+    Save arrays to npy or npz file via temporary file & rename.
+
+    Parameters
+    ----------
+    strPthOt : str
+        Output path.
+    *args
+        Single array to save with `np.save` (the '.npy' extension is appended
+        to the path if needed, as by `np.save`).
+    **kwargs
+        Arrays to save with `np.savez` (name: array; the '.npz' extension is
+        appended to the path if needed, as by `np.savez`).
+
+    Returns
+    -------
+    strPthOt : str
+        Path of saved file.
+    """
+    strExt = ('.npy' if args else '.npz')
+    if not strPthOt.endswith(strExt):
+        strPthOt = strPthOt + strExt
+    strDir = os.path.dirname(os.path.abspath(strPthOt))
+    varFd, strTmp = tempfile.mkstemp(dir=strDir, suffix='.tmp')
+    try:
+        with os.fdopen(varFd, 'wb') as fleOt:
+            if args:
+                np.save(fleOt, args[0])
+            else:
+                np.savez(fleOt, **kwargs)
+        os.replace(strTmp, strPthOt)
+    except BaseException:
+        if os.path.isfile(strTmp):
+            os.remove(strTmp)
+        raise
+    return strPthOt
+
+
+def lst_ckpt(strDir=None):
+    """
+    List checkpoints.
+
+    Parameters
+    ----------
+    strDir : str or None
+        Checkpoint directory (default: `get_ckpt_path()`).
+
+    Returns
+    -------
+    lstEnt : list
+        One dict per checkpoint (keys: 'path', 'bytes', 'time'), sorted from
+        oldest to newest.
+    """
+    if strDir is None:
+        strDir = get_ckpt_path()
+    if (strDir is None) or (not os.path.isdir(strDir)):
+        return []
+    lstEnt = []
+    for strFle in os.listdir(strDir):
+        if not strFle.endswith('.npz'):
+            continue
+        strPth = os.path.join(strDir, strFle)
+        try:
+            objStat = os.stat(strPth)
+        except OSError:
+            continue
+        lstEnt.append({'path': strPth,
+                       'bytes': objStat.st_size,
+                       'time': objStat.st_mtime})
+    lstEnt.sort(key=lambda dicEnt: dicEnt['time'])
+    return lstEnt
+
+
+def purge_ckpt(strDir=None):
+    """
+    Remove all checkpoints.
+
+    Parameters
+    ----------
+    strDir : str or None
+        Checkpoint directory (default: `get_ckpt_path()`).
+
+    Returns
+    -------
+    varNumRm : int
+        Number of removed checkpoints.
+    """
+    if strDir is None:
+        strDir = get_ckpt_path()
+    if (strDir is None) or (not os.path.isdir(strDir)):
+        return 0
+    varNumRm = 0
+    for strFle in os.listdir(strDir):
+        if not strFle.endswith(('.npz', '.tmp')):
+            continue
+        try:
+            os.remove(os.path.join(strDir, strFle))
+        except OSError:
+            continue
+        if strFle.endswith('.npz'):
+            varNumRm += 1
+    return varNumRm
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Function of the depth sampling pipeline."""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+
+# Efficiency of the median relative to the mean (normal distribution); the
+# standard error of the median is approximately sqrt(pi / 2) times the
+# standard error of the mean:
+VAR_MDN_EFF = np.sqrt(np.pi / 2.0)
+
+
+def dpth_stats(aryData, strEst='mean', vecWght=None, varTrm=0.1,
+               varConf=1.96, varVrtxVox=0.125):
+    """
+    Calculate statistics over vertices for all conditions & depth levels.
+
+    Parameters
+    ----------
+    aryData : np.array
+        Vertex data, shape aryData[condition, vertex, depth] (e.g. selected
+        vertices, as returned by `slct_vrtcs`).
+    strEst : str
+        Estimator of central tendency: 'mean', 'median', or 'trimmed'
+        (trimmed mean).
+    vecWght : np.array or None
+        Weights of vertices (only for `strEst='mean'`), shape vecWght[vertex].
+    varTrm : float
+        Proportion of vertices to cut from each end of the distribution for
+        trimmed mean.
+    varConf : float
+        Factor by which the standard error is multiplied for the confidence
+        interval (1.96 for 95% confidence interval).
+    varVrtxVox : float
+        Number of voxels per vertex. The sample size for the standard error is
+        the number of vertices times this factor (corresponding to the number
+        of voxels in native resolution).
+
+    Returns
+    -------
+    dicStats : dict
+        'mean' - estimate of central tendency, shape [condition, depth];
+        'sd' - standard deviation (weighted, or winsorised for the trimmed
+        mean), shape [condition, depth]; 'ci' - confidence interval (i.e.
+        `varConf` times the standard error), shape [condition, depth]; 'n' -
+        number of vertices (int).
+
+    Notes
+    -----
+    All statistics are calculated at once for all conditions and depth
+    levels. If there are no vertices, all statistics are zero. For the
+    median, the standard error is approximated as `sqrt(pi / 2)` times the
+    standard error of the mean. For the trimmed mean, the standard error is
+    the winsorised standard deviation divided by `(1 - 2 * varTrm) *
+    sqrt(n)`. For weighted means, the effective sample size (Kish) is used.
+    """
+    if strEst not in ('mean', 'median', 'trimmed'):
+        strErrMsg = ('ERROR. Unknown estimator: ' + str(strEst)
+                     + ' (expected mean, median, or trimmed).')
+        raise ValueError(strErrMsg)
+
+    if (vecWght is not None) and (strEst != 'mean'):
+        strErrMsg = 'ERROR. Vertex weights are only supported for the mean.'
+        raise ValueError(strErrMsg)
+
+    varNumCon, varNumVrtx, varNumDpth = aryData.shape
+
+    dicStats = {'mean': np.zeros((varNumCon, varNumDpth)),
+                'sd': np.zeros((varNumCon, varNumDpth)),
+                'ci': np.zeros((varNumCon, varNumDpth)),
+                'n': varNumVrtx}
+
+    # Avoid warning in case of empty array (i.e. no vertices included in ROI
+    # for current ROI/subject/hemisphere):
+    if varNumVrtx == 0:
+        return dicStats
+
+    # Vertex data with vertices along the last (contiguous) axis, shape
+    # aryTmp[condition, depth, vertex]:
+    aryTmp = np.ascontiguousarray(np.moveaxis(aryData, 1, 2))
+
+    if strEst == 'mean' and vecWght is None:
+
+        # Mean and standard deviation over vertices:
+        aryCntr = np.mean(aryTmp, axis=2)
+        arySd = np.std(aryTmp, axis=2)
+        varNumEff = float(varNumVrtx)
+
+    elif strEst == 'mean':
+
+        # Weighted mean and standard deviation over vertices:
+        vecWght = np.asarray(vecWght, dtype=np.float64)
+        varSumWght = np.sum(vecWght)
+        aryCntr = np.divide(np.dot(aryTmp, vecWght), varSumWght)
+        arySd = np.sqrt(np.divide(
+            np.dot(np.square(aryTmp - aryCntr[:, :, None]), vecWght),
+            varSumWght))
+
+        # Effective sample size:
+        varNumEff = np.divide(np.square(varSumWght),
+                              np.sum(np.square(vecWght)))
+
+    elif strEst == 'median':
+
+        aryCntr = np.median(aryTmp, axis=2)
+        arySd = np.std(aryTmp, axis=2)
+        varNumEff = float(varNumVrtx) / np.square(VAR_MDN_EFF)
+
+    else:
+
+        # Number of vertices to cut from each end:
+        varNumTrm = int(np.floor(varTrm * varNumVrtx))
+
+        # Sort vertices (in place, `aryTmp` is a copy):
+        aryTmp.sort(axis=2)
+
+        aryCntr = np.mean(aryTmp[:, :, varNumTrm:(varNumVrtx - varNumTrm)],
+                          axis=2)
+
+        # Winsorised standard deviation:
+        aryTmp = np.clip(aryTmp,
+                         aryTmp[:, :, varNumTrm][:, :, None],
+                         aryTmp[:, :, (varNumVrtx - varNumTrm - 1)][:, :,
+                                                                    None])
+        arySd = np.std(aryTmp, axis=2)
+        varNumEff = float(varNumVrtx) * np.square(1.0 - 2.0 * varTrm)
+
+    dicStats['mean'] = aryCntr
+    dicStats['sd'] = arySd
+
+    # Confidence interval for the estimate, obtained by multiplying the
+    # standard error by `varConf`. We obtain the standard error by dividing
+    # the standard deviation by the squareroot of the sample size n. We get n
+    # by taking 1/8 of the number of vertices, which corresponds to the
+    # number of voxels in native resolution.
+    dicStats['ci'] = np.multiply(
+        np.divide(arySd, np.sqrt(varNumEff * varVrtxVox)), varConf)
+
+    return dicStats
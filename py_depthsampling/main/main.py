@@ -18,10 +18,20 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import multiprocessing as mp
 from py_depthsampling.get_data.acr_subs_get_data import acr_subs_get_data
 from py_depthsampling.plot.plt_dpth_prfl_acr_subs import plt_dpth_prfl_acr_subs
+from py_depthsampling.main.stages import get_stage_key
+from py_depthsampling.main.stages import load_stage
+from py_depthsampling.main.stages import save_stage
+from py_depthsampling.main.shm_arrays import shm_attach
+from py_depthsampling.main.shm_arrays import shm_create
+from py_depthsampling.main.shm_arrays import shm_detach
+from py_depthsampling.main.shm_arrays import shm_free
+from py_depthsampling.main.checkpoint import ckpt_load
+from py_depthsampling.main.checkpoint import ckpt_save
 
 
 def ds_main(strRoi, lstHmsph, lstSubIds, lstCon, lstConLbl, strVtkDpth01,
@@ -31,11 +41,40 @@ def ds_main(strRoi, lstHmsph, lstSubIds, lstCon, lstConLbl, strVtkDpth01,
             strTitle, lstLimY, varAcrSubsYmin, varAcrSubsYmax, strXlabel,
             strYlabel, strPltOtPre, strPltOtSuf, varDpi, varNormIdx,
             lgcNormDiv, strDpthMeans, strMetaCon='', varNumLblY=5,
-            tplPadY=(0.0, 0.0)):
+            tplPadY=(0.0, 0.0), varPar=None, varMemMax=None,
+            strEst='mean', dicDsgn=None, lgcResume=False):
     """
     Delineate ROIs and create cortical depth profiles from VTK meshes.
 
     Main routine for analysis & visualisation of depth sampling results.
+
+    Subjects and hemispheres are processed as one set of tasks by a pool of
+    at most `varPar` worker processes (default: number of CPUs). If
+    `varMemMax` (MB) is given, the number of workers is reduced so that the
+    estimated memory of concurrently running tasks (size of their input vtk
+    files) stays within this budget. Workers write their depth profiles
+    directly into a shared memory results array. If `lgcResume` is `True`,
+    completed subjects & hemispheres are recorded per ROI and condition (see
+    `checkpoint`), and subjects & hemispheres recorded in a previous run with
+    identical parameters and input files are skipped (e.g. to resume after a
+    crash). The checkpoint directory can be set with the environment variable
+    `PY_DEPTHSAMPLING_CKPT`.
+
+    If the stage cache is enabled (environment variable
+    `PY_DEPTHSAMPLING_STAGES`, see `py_depthsampling.main.stages`), results of
+    the pipeline stages (vertex selection, depth profiles, vertex masks, npz
+    files, and plot) are cached, so that after a parameter change only the
+    affected stages are repeated. By default, all stages are run.
+
+    The single-subject depth profiles are the mean over vertices, or the
+    median or trimmed mean over vertices (`strEst`, see `dpth_stats`).
+
+    Parameter estimates are converted to percent signal change with the
+    peak-peak height of the regressor of the design of each condition
+    (`dicDsgn`, condition: design, e.g. {'kanizsa_flicker_sst_pe': 'sst'};
+    see `psc`). The design needs to be specified for each condition of
+    `lstCon` if the data are parameter estimates, otherwise a `ValueError` is
+    raised.
     """
     # *************************************************************************
     # *** Plot and retrieve single subject data
@@ -56,27 +95,19 @@ def ds_main(strRoi, lstHmsph, lstSubIds, lstCon, lstConLbl, strVtkDpth01,
     # Number of conditions (i.e. number of data vtk files per subject):
     varNumCon = len(lstCon)
 
-    # Array for single-subject depth sampling results:
-    arySubDpthMns = np.zeros((varNumSubs, varNumHmsph, varNumCon, varNumDpth))
+    # Design of each condition (for conversion to percent signal change):
+    if dicDsgn is None:
+        dicDsgn = {}
+    lstDsgn = [dicDsgn.get(strCon) for strCon in lstCon]
 
-    # Vector for number of vertices contained in the ROI:
-    vecNumInc = np.zeros((varNumSubs, varNumHmsph))
+    # List of tasks (one per subject and hemisphere). Each task consists of
+    # the subject index, hemisphere index, and the arguments for
+    # `acr_subs_get_data`.
+    lstTsk = []
 
     # Loop through hemispheres:
     for idxHmsph in range(varNumHmsph):
 
-        # List for single subject data (mean PE over depth levels):
-        lstSubData01 = [None] * varNumSubs
-
-        # Empty list to collect results from parallelised function:
-        lstParResult = [None] * varNumSubs
-
-        # Empty list for processes:
-        lstPrcs = [None] * varNumSubs
-
-        # Create a queue to put the results in:
-        queOut = mp.Queue()
-
         # Loop through subjects:
         for idxSub in range(varNumSubs):
 
@@ -98,74 +129,116 @@ def ds_main(strRoi, lstHmsph, lstSubIds, lstCon, lstConLbl, strVtkDpth01,
                                                   strMetaCon)
             strPltOtSufTmp = strPltOtSuf.format(('_' + strHmsph))
 
-            # Prepare processes that plot & return single subject data:
-            lstPrcs[idxSub] = \
-                mp.Process(
-                    target=acr_subs_get_data,
-                    args=(idxSub,              # Process ID
-                          lstSubIds[idxSub],   # Data struc - Subject ID
-                          lstVtkDpth01,        # Data struc - Pth vtk I
-                          varNumDpth,          # Data struc - Num depth lvls
-                          strPrcdData,         # Data struc - Str prcd VTK
-                          varNumLne,           # Data struc - Lns prcd VTK
-                          lgcSlct01,           # Criterion 1 - Yes or no?
-                          strCsvRoiTmp,        # Criterion 1 - CSV path
-                          varNumHdrRoi,        # Criterion 1 - Header lines
-                          lgcSlct02,           # Criterion 2 - Yes or no?
-                          strVtkSlct02Tmp,     # Criterion 2 - VTK path
-                          varThrSlct02,        # Criterion 2 - Threshold
-                          lgcSlct03,           # Criterion 3 - Yes or no?
-                          strVtkSlct03Tmp,     # Criterion 3 - VTK path
-                          varThrSlct03,        # Criterion 3 - Threshold
-                          lgcSlct04,           # Criterion 4 - Yes or no?
-                          strVtkSlct04Tmp,     # Criterion 4 - VTK path
-                          tplThrSlct04,        # Criterion 4 - Threshold
-                          lgcNormDiv,          # Normalisation - Yes or no?
-                          varNormIdx,          # Normalisation - Reference
-                          varDpi,              # Plot - dots per inch
-                          lstLimY[idxSub][0],  # Plot - Minimum of Y axis
-                          lstLimY[idxSub][1],  # Plot - Maximum of Y axis
-                          lstConLbl,           # Plot - Condition labels
-                          strXlabel,           # Plot - X axis label
-                          strYlabel,           # Plot - Y axis label
-                          strTitle,            # Plot - Title
-                          strPltOtPre,      # Plot - Output file path prefix
-                          strPltOtSufTmp,   # Plot - Output file path suffix
-                          strMetaCon,       # Metacondition (stim/periphery)
-                          queOut))          # Queue for output list
-
-        # Daemon (kills processes when exiting):
-        lstPrcs[idxSub].Daemon = True
-
-        # Start processes:
-        for idxSub in range(0, varNumSubs):
-            lstPrcs[idxSub].start()
-
-        # Collect results from queue:
-        for idxSub in range(0, varNumSubs):
-            lstParResult[idxSub] = queOut.get(True)
-
-        # Join processes:
-        for idxSub in range(0, varNumSubs):
-            lstPrcs[idxSub].join()
-
-        # List for arrays with depth profiles.
-        lstSubData01 = [None] * varNumSubs
-
-        # Put output into correct order:
-        for idxRes in range(varNumSubs):
-
-            # Index of results (first item in output list):
-            varTmpIdx = lstParResult[idxRes][0]
-
-            # Put fitting results into list, in correct order:
-            lstSubData01[varTmpIdx] = lstParResult[idxRes][1]
-            vecNumInc[varTmpIdx, idxHmsph] = lstParResult[idxRes][2]
-
-        # Retrieve single-subject data from list:
-        for idxSub in range(varNumSubs):
-            arySubDpthMns[idxSub, idxHmsph, :, :] = np.copy(
-                lstSubData01[idxSub])
+            # Arguments for function that plots & returns single subject
+            # data:
+            lstArgs = [idxSub,              # Process ID
+                       lstSubIds[idxSub],   # Data struc - Subject ID
+                       lstVtkDpth01,        # Data struc - Pth vtk I
+                       varNumDpth,          # Data struc - Num depth lvls
+                       strPrcdData,         # Data struc - Str prcd VTK
+                       varNumLne,           # Data struc - Lns prcd VTK
+                       lgcSlct01,           # Criterion 1 - Yes or no?
+                       strCsvRoiTmp,        # Criterion 1 - CSV path
+                       varNumHdrRoi,        # Criterion 1 - Header lines
+                       lgcSlct02,           # Criterion 2 - Yes or no?
+                       strVtkSlct02Tmp,     # Criterion 2 - VTK path
+                       varThrSlct02,        # Criterion 2 - Threshold
+                       lgcSlct03,           # Criterion 3 - Yes or no?
+                       strVtkSlct03Tmp,     # Criterion 3 - VTK path
+                       varThrSlct03,        # Criterion 3 - Threshold
+                       lgcSlct04,           # Criterion 4 - Yes or no?
+                       strVtkSlct04Tmp,     # Criterion 4 - VTK path
+                       tplThrSlct04,        # Criterion 4 - Threshold
+                       lgcNormDiv,          # Normalisation - Yes or no?
+                       varNormIdx,          # Normalisation - Reference
+                       varDpi,              # Plot - dots per inch
+                       lstLimY[idxSub][0],  # Plot - Minimum of Y axis
+                       lstLimY[idxSub][1],  # Plot - Maximum of Y axis
+                       lstConLbl,           # Plot - Condition labels
+                       strXlabel,           # Plot - X axis label
+                       strYlabel,           # Plot - Y axis label
+                       strTitle,            # Plot - Title
+                       strPltOtPre,         # Plot - Output file path prefix
+                       strPltOtSufTmp,      # Plot - Output file path suffix
+                       strMetaCon,          # Metacondition (stim/periphery)
+                       None,                # No queue, output is returned
+                       1,                   # Threads for loading vtk files
+                       strEst,              # Estimator ('mean', 'median'...)
+                       lstDsgn]             # Designs (for PSC conversion)
+
+            lstTsk.append((idxSub, idxHmsph, lstArgs))
+
+    # When resuming, subjects & hemispheres that have been completed in a
+    # previous run (for all conditions) are not processed again (see
+    # `checkpoint`). Results from checkpoints, shape
+    # aryDpthMean[condition, depth]:
+    dicDone = {}
+    lstRun = []
+    for idxSub, idxHmsph, lstArgs in lstTsk:
+        if not lgcResume:
+            lstRun.append((idxSub, idxHmsph, lstArgs, None))
+            continue
+        lstCkpt = _ds_ckpt(lstArgs, strRoi, lstHmsph[idxHmsph], lstCon, strEst)
+        lstRes = [ckpt_load(dicUnit, dicPrm, lgcResume=True)
+                  for dicUnit, dicPrm in lstCkpt]
+        if all([dicRes is not None for dicRes in lstRes]):
+            dicDone[(idxSub, idxHmsph)] = (
+                np.array([dicRes['aryDpthMean'] for dicRes in lstRes]),
+                lstRes[0]['varNumInc'][()])
+        else:
+            lstRun.append((idxSub, idxHmsph, lstArgs, lstCkpt))
+
+    if 0 < len(dicDone):
+        print('---Using checkpoints for ' + str(len(dicDone)) + ' of '
+              + str(len(lstTsk)) + ' subjects & hemispheres.')
+
+    lstTsk = [tplTsk[:3] for tplTsk in lstRun]
+
+    # Number of worker processes:
+    varNumWrk = get_num_wrk(lstTsk, varPar=varPar, varMemMax=varMemMax)
+
+    # Shape of results array (single-subject depth sampling results, followed
+    # by the number of vertices contained in the ROI):
+    tplShp = (varNumSubs, varNumHmsph, (varNumCon * varNumDpth + 1))
+
+    # Shared memory array for results (see `shm_arrays`):
+    dicShm = shm_create(tplShp)
+
+    try:
+
+        aryRes = shm_attach(dicShm)
+        for (idxSub, idxHmsph), (aryDpthMean, varNumInc) in dicDone.items():
+            aryRes[idxSub, idxHmsph, :-1] = aryDpthMean.reshape(-1)
+            aryRes[idxSub, idxHmsph, -1] = varNumInc
+        del(aryRes)
+        shm_detach(dicShm)
+
+        if varNumWrk == 1:
+            for idxSub, idxHmsph, lstArgs, lstCkpt in lstRun:
+                _ds_task(dicShm, idxSub, idxHmsph, lstArgs, lstCkpt)
+        elif lstRun:
+            with ProcessPoolExecutor(max_workers=varNumWrk) as objPool:
+                lstFtr = [objPool.submit(_ds_task, dicShm, idxSub, idxHmsph,
+                                         lstArgs, lstCkpt)
+                          for idxSub, idxHmsph, lstArgs, lstCkpt in lstRun]
+                # Raise exceptions from worker processes:
+                for objFtr in lstFtr:
+                    objFtr.result()
+
+        aryRes = shm_attach(dicShm)
+
+        # Array for single-subject depth sampling results:
+        arySubDpthMns = np.copy(aryRes[:, :, :-1]).reshape(
+            varNumSubs, varNumHmsph, varNumCon, varNumDpth)
+
+        # Vector for number of vertices contained in the ROI:
+        vecNumInc = np.copy(aryRes[:, :, -1])
+
+        del(aryRes)
+        shm_detach(dicShm)
+
+    finally:
+        shm_free(dicShm)
 
     # Array for single-subject depth sampling results, averaged over
     # hemispheres:
@@ -193,44 +266,199 @@ def ds_main(strRoi, lstHmsph, lstSubIds, lstCon, lstConLbl, strVtkDpth01,
 
     # We save the mean parameter estimates of all subjects to disk. This file
     # can be used to plot results from different ROIs in one plot. The depth
-    # profile for each condition is saved to a separate file (for consistency):
+    # profile for each condition is saved to a separate file (for consistency).
+    # Files are not written again if they have been written with identical
+    # content in a previous run (see `py_depthsampling.main.stages`).
 
-    for idxCon in range(varNumCon):
+    # Paths of npz files (`np.savez` appends the file extension if needed):
+    lstNpz = [strDpthMeans.format(strCon) for strCon in lstCon]
+    lstNpz = [(strNpz if strNpz.endswith('.npz') else (strNpz + '.npz'))
+              for strNpz in lstNpz]
 
-        # Form of the array that is saved to disk:
-        # arySubDpthMns[subject, depth]
+    strKeyNpz = get_stage_key('npz', {'arySubDpthMns': arySubDpthMns,
+                                      'vecNumInc': vecNumInc},
+                              lstOt=lstNpz)
 
-        # In addition, a vector with the number of vertices (for that ROI in
-        # tha subject) is saved, in order to be able to normalise when
-        # averaging over subjects. Shape: vecNumInc[subject]
+    if load_stage(strKeyNpz) is None:
 
-        # Save subject-level depth profiles, and number of vertices per
-        # subject:
-        np.savez(strDpthMeans.format(lstCon[idxCon]),
-                 arySubDpthMns=arySubDpthMns[:, idxCon, :],
-                 vecNumInc=vecNumInc)
+        for idxCon in range(varNumCon):
+
+            # Form of the array that is saved to disk:
+            # arySubDpthMns[subject, depth]
+
+            # In addition, a vector with the number of vertices (for that ROI
+            # in tha subject) is saved, in order to be able to normalise when
+            # averaging over subjects. Shape: vecNumInc[subject]
+
+            # Save subject-level depth profiles, and number of vertices per
+            # subject:
+            np.savez(lstNpz[idxCon],
+                     arySubDpthMns=arySubDpthMns[:, idxCon, :],
+                     vecNumInc=vecNumInc)
+
+        save_stage(strKeyNpz, 'npz', lstOt=lstNpz)
     # *************************************************************************
 
     # *************************************************************************
     # *** Plot mean over subjects
 
-    print('---Plot results - mean over subjects.')
-
-    plt_dpth_prfl_acr_subs(arySubDpthMns,
-                           varNumSubs,
-                           varNumDpth,
-                           varNumCon,
-                           varDpi,
-                           varAcrSubsYmin,
-                           varAcrSubsYmax,
-                           lstConLbl,
-                           strXlabel,
-                           strYlabel,
-                           strTitle,
-                           strPltOtPre,
-                           strPltOtSuf.format(''),
-                           strErr='sem',
-                           vecWghts=vecNumInc,
-                           varNumLblY=varNumLblY,
-                           tplPadY=tplPadY)
+    # The plot is only created if the data or any plot parameter has changed
+    # since the previous run (file name as in `plt_dpth_prfl_acr_subs`):
+    strPltOt = strPltOtPre + 'acrsSubsMean' + strPltOtSuf.format('')
+
+    strKeyPlt = get_stage_key('plot', {'arySubDpthMns': arySubDpthMns,
+                                       'vecNumInc': vecNumInc,
+                                       'varDpi': varDpi,
+                                       'varAcrSubsYmin': varAcrSubsYmin,
+                                       'varAcrSubsYmax': varAcrSubsYmax,
+                                       'lstConLbl': lstConLbl,
+                                       'strXlabel': strXlabel,
+                                       'strYlabel': strYlabel,
+                                       'strTitle': strTitle,
+                                       'varNumLblY': varNumLblY,
+                                       'tplPadY': tplPadY},
+                              lstOt=[strPltOt])
+
+    if load_stage(strKeyPlt) is None:
+
+        print('---Plot results - mean over subjects.')
+
+        plt_dpth_prfl_acr_subs(arySubDpthMns,
+                               varNumSubs,
+                               varNumDpth,
+                               varNumCon,
+                               varDpi,
+                               varAcrSubsYmin,
+                               varAcrSubsYmax,
+                               lstConLbl,
+                               strXlabel,
+                               strYlabel,
+                               strTitle,
+                               strPltOtPre,
+                               strPltOtSuf.format(''),
+                               strErr='sem',
+                               vecWghts=vecNumInc,
+                               varNumLblY=varNumLblY,
+                               tplPadY=tplPadY)
+
+        save_stage(strKeyPlt, 'plot', lstOt=[strPltOt])
+
+    else:
+
+        print('---Plot up to date: ' + strPltOt)
     # *************************************************************************
+
+
+def get_num_wrk(lstTsk, varPar=None, varMemMax=None):
+    """
+    Get number of worker processes for depth sampling tasks.
+
+    Parameters
+    ----------
+    lstTsk : list
+        Tasks, as created by `ds_main` (subject index, hemisphere index, and
+        arguments for `acr_subs_get_data`).
+    varPar : int or None
+        Maximum number of worker processes. If `None`, the number of CPUs is
+        used.
+    varMemMax : float or None
+        Memory budget (MB). The memory needed per task is estimated as the
+        total size of its input vtk files. If `None`, the number of workers is
+        not limited by memory.
+
+    Returns
+    -------
+    varNumWrk : int
+        Number of worker processes (at least one).
+    """
+    if varPar is None:
+        varPar = os.cpu_count() or 1
+
+    varNumWrk = max(1, min(varPar, len(lstTsk)))
+
+    if varMemMax is not None:
+
+        # Largest estimated memory per task (bytes):
+        varMemTsk = 0
+        for _, _, lstArgs in lstTsk:
+            lstPth = list(lstArgs[2]) + [lstArgs[10], lstArgs[13],
+                                         lstArgs[16]]
+            varMemTsk = max(varMemTsk,
+                            sum([os.path.getsize(strPth) for strPth in lstPth
+                                 if os.path.isfile(strPth)]))
+
+        if 0 < varMemTsk:
+            varNumWrk = max(1, min(varNumWrk,
+                                   int((varMemMax * 1048576.0) // varMemTsk)))
+
+    return varNumWrk
+
+
+def _ds_ckpt(lstArgs, strRoi, strHmsph, lstCon, strEst):
+    """
+    Get checkpoints of one subject & hemisphere (one per condition).
+
+    Parameters
+    ----------
+    lstArgs : list
+        Arguments for `acr_subs_get_data` (see `ds_main`).
+    strRoi : str
+        Region of interest.
+    strHmsph : str
+        Hemisphere.
+    lstCon : list
+        Condition levels.
+    strEst : str
+        Estimator of depth profiles (see `dpth_stats`).
+
+    Returns
+    -------
+    lstCkpt : list
+        Unit of work and parameters (see `checkpoint`) per condition.
+
+    Notes
+    -----
+    The depth profile of a condition depends on its vtk file, on the first
+    vtk file of the list of conditions (which determines the conversion to
+    percent signal change), on all vtk files if profiles are normalised, and
+    on the loading & vertex selection parameters.
+    """
+    lstVtkDpth01 = lstArgs[2]
+    lgcNormDiv = lstArgs[18]
+    lstCkpt = []
+    for idxCon, strCon in enumerate(lstCon):
+        dicUnit = {'subject': lstArgs[1],
+                   'hemisphere': strHmsph,
+                   'roi': strRoi,
+                   'condition': strCon,
+                   'metacondition': lstArgs[29]}
+        dicPrm = {'strVtk': lstVtkDpth01[idxCon],
+                  'strVtkRef': lstVtkDpth01[0],
+                  'lstVtkNorm': (lstVtkDpth01 if lgcNormDiv else None),
+                  'lstLoad': lstArgs[3:6],
+                  'lstSlct': lstArgs[6:18],
+                  'lgcNormDiv': lgcNormDiv,
+                  'strEst': strEst,
+                  'strDsgn': lstArgs[33][idxCon]}
+        lstCkpt.append((dicUnit, dicPrm))
+    return lstCkpt
+
+
+def _ds_task(dicShm, idxSub, idxHmsph, lstArgs, lstCkpt=None):
+    """Process one subject & hemisphere, write results to shared memory."""
+    lstOut = acr_subs_get_data(*lstArgs)
+
+    aryRes = shm_attach(dicShm)
+    try:
+        aryRes[idxSub, idxHmsph, :-1] = np.asarray(lstOut[1]).reshape(-1)
+        aryRes[idxSub, idxHmsph, -1] = lstOut[2]
+    finally:
+        del(aryRes)
+        shm_detach(dicShm)
+
+    # Record completed conditions (only when resuming, see `checkpoint`):
+    for idxCon, (dicUnit, dicPrm) in enumerate(lstCkpt or []):
+        ckpt_save(dicUnit, dicPrm,
+                  dicRes={'aryDpthMean': np.asarray(lstOut[1])[idxCon, :],
+                          'varNumInc': np.array(lstOut[2])},
+                  lgcResume=True)
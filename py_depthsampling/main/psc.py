@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion of FSL parameter estimates to percent signal change.
+
+According to the FSL documentation
+(https://fsl.fmrib.ox.ac.uk/fsl/fslwiki/FEAT/UserGuide), the PEs can be scaled
+to signal change with respect to the mean (over time within voxel): "This is
+achieved by scaling the PE or COPE values by (100*) the peak-peak height of
+the regressor (or effective regressor in the case of COPEs) and then by
+dividing by mean_func (the mean over time of filtered_func_data)."
+
+The peak-peak height of the regressor depends on the design (i.e. on the
+predictor), and is obtained from the FSL design matrix (`design.mat` in the
+FEAT directory). Peak-peak heights are kept in a registry, keyed by design.
+The design of each condition needs to be specified by the analysis; it is not
+determined from file names.
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+
+# Peak-peak height of the regressor, per design (sustained and transient
+# predictors, and target events):
+DIC_PPHEIGHT = {'sst': 1.268049,
+                'trn': 0.2269044,
+                'target': 0.2261552}
+
+
+def register_ppheight(strDsgn, varPpheight):
+    """
+    Add design to registry of peak-peak heights.
+
+    Parameters
+    ----------
+    strDsgn : str
+        Name of design (e.g. 'sst').
+    varPpheight : float
+        Peak-peak height of the regressor (from `design.mat`).
+    """
+    if not (0.0 < float(varPpheight)):
+        strErrMsg = ('ERROR. Peak-peak height of design ' + str(strDsgn)
+                     + ' needs to be positive.')
+        raise ValueError(strErrMsg)
+    DIC_PPHEIGHT[strDsgn] = float(varPpheight)
+
+
+def get_ppheight(strDsgn, strCon=None):
+    """
+    Get peak-peak height of the regressor of a design.
+
+    Parameters
+    ----------
+    strDsgn : str
+        Name of design (see `DIC_PPHEIGHT`).
+    strCon : str or None
+        Condition (or data file) the design is needed for, only used in error
+        messages.
+
+    Returns
+    -------
+    varPpheight : float
+        Peak-peak height of the regressor.
+
+    Notes
+    -----
+    The design of each condition needs to be specified explicitly. A
+    `ValueError` is raised if the design is missing (`None`) or not
+    registered, so that data are never scaled with a wrong (or default)
+    peak-peak height.
+    """
+    if strCon is None:
+        strFor = ''
+    else:
+        strFor = ' for ' + str(strCon)
+    if strDsgn is None:
+        strErrMsg = ('ERROR. No design specified' + strFor + '; the design '
+                     + 'of each condition is needed for the conversion to '
+                     + 'percent signal change (registered designs: '
+                     + ', '.join(sorted(DIC_PPHEIGHT.keys())) + ').')
+        raise ValueError(strErrMsg)
+    if strDsgn not in DIC_PPHEIGHT:
+        strErrMsg = ('ERROR. Unknown design' + strFor + ': ' + str(strDsgn)
+                     + ' (registered designs: '
+                     + ', '.join(sorted(DIC_PPHEIGHT.keys()))
+                     + '; see `register_ppheight`).')
+        raise ValueError(strErrMsg)
+    return DIC_PPHEIGHT[strDsgn]
+
+
+def psc_cnv(aryData, aryMneEpi, varPpheight):
+    """
+    Convert parameter estimates to percent signal change, in place.
+
+    Parameters
+    ----------
+    aryData : np.array
+        Parameter estimates, e.g. shape aryData[condition, vertex, depth] or
+        aryData[vertex]. Converted in place (the dtype is preserved).
+    aryMneEpi : np.array
+        Mean EPI, with the shape of the trailing dimensions of `aryData`
+        (e.g. aryMneEpi[vertex, depth]; broadcast over conditions).
+    varPpheight : float or np.array
+        Peak-peak height of the regressor (see `get_ppheight`), or one
+        peak-peak height per condition (i.e. along the first dimension of
+        `aryData`).
+
+    Returns
+    -------
+    aryData : np.array
+        The input array (converted to percent signal change).
+
+    Notes
+    -----
+    Elements that are zero, or for which the mean EPI is zero, are not
+    changed (to avoid division by zero). All conditions are converted in one
+    call, without temporary copies of the data.
+    """
+    varPpheight = np.asarray(varPpheight, dtype=np.float64)
+    if varPpheight.ndim == 1:
+        varPpheight = varPpheight.reshape(
+            ((-1,) + ((1,) * (aryData.ndim - 1))))
+    lgcMsk = np.logical_and(np.not_equal(aryData, 0.0),
+                            np.not_equal(aryMneEpi, 0.0))
+    np.multiply(aryData, (100.0 * varPpheight), out=aryData, where=lgcMsk)
+    np.divide(aryData, aryMneEpi, out=aryData, where=lgcMsk)
+    return aryData
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Shared memory arrays for exchanging data between parallel processes.
+
+Arrays are placed in named shared memory blocks (see
+`multiprocessing.shared_memory`). Processes only exchange the description of
+a block (name, shape, and dtype, as returned by `shm_create` or `shm_put`),
+attach to the block, and read or write the array in place. Hence, large
+arrays are neither pickled nor copied when they are passed to worker
+processes or placed on a queue.
+
+Shared memory blocks created or attached by the current process are kept in
+a registry, so that a block is only mapped once per process. The process
+that creates a block is responsible for removing it (`shm_free`); this can
+also be done by another process (e.g. a worker creates a block for its
+results, and the parent removes the block after having read the results).
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# Shared memory blocks mapped in the current process (name: [shared memory
+# object, number of attachments, whether the block was created by the current
+# process]):
+DIC_SHM = {}
+
+
+def shm_init():
+    """
+    Start resource tracker for shared memory blocks.
+
+    Notes
+    -----
+    The resource tracker (which removes shared memory blocks that are left
+    over when processes exit) needs to be started by the parent process before
+    any worker processes, so that workers share the tracker of the parent
+    process. Otherwise, blocks created by a worker for its results would be
+    removed when the worker exits. Called by `shm_create`; callers that start
+    workers which create blocks (e.g. `load_par`) without having created a
+    block themselves need to call it before starting the workers.
+    """
+    resource_tracker.ensure_running()
+
+
+def shm_create(tplShp, strDtype='float64', lgcZero=True):
+    """
+    Create shared memory array.
+
+    Parameters
+    ----------
+    tplShp : tuple
+        Shape of array.
+    strDtype : str
+        Data type of array.
+    lgcZero : bool
+        Whether to initialise the array with zeros.
+
+    Returns
+    -------
+    dicShm : dict
+        Description of shared memory array ('name', 'shape', 'dtype'), to be
+        passed to other processes.
+    """
+    tplShp = tuple(int(varTmp) for varTmp in tplShp)
+    objDtype = np.dtype(strDtype)
+    varSze = int(np.prod(tplShp)) * objDtype.itemsize
+
+    # Start resource tracker (if not running yet, see `shm_init`):
+    shm_init()
+
+    # Shared memory blocks cannot be empty:
+    objShm = shared_memory.SharedMemory(create=True, size=max(1, varSze))
+    DIC_SHM[objShm.name] = [objShm, 0, True]
+
+    dicShm = {'name': objShm.name,
+              'shape': tplShp,
+              'dtype': objDtype.str}
+
+    if lgcZero:
+        aryShm = shm_attach(dicShm)
+        aryShm[...] = 0
+        del(aryShm)
+        shm_detach(dicShm)
+
+    return dicShm
+
+
+def shm_put(aryIn):
+    """
+    Copy array into shared memory.
+
+    Parameters
+    ----------
+    aryIn : np.array
+        Array to copy.
+
+    Returns
+    -------
+    dicShm : dict
+        Description of shared memory array (see `shm_create`).
+    """
+    aryIn = np.asarray(aryIn)
+    dicShm = shm_create(aryIn.shape, strDtype=aryIn.dtype.str,
+                        lgcZero=False)
+    aryShm = shm_attach(dicShm)
+    aryShm[...] = aryIn
+    del(aryShm)
+    shm_detach(dicShm)
+    return dicShm
+
+
+def shm_attach(dicShm):
+    """
+    Attach to shared memory array.
+
+    Parameters
+    ----------
+    dicShm : dict
+        Description of shared memory array (see `shm_create`).
+
+    Returns
+    -------
+    aryShm : np.array
+        Array in shared memory (no copy; changes are visible to all processes
+        attached to the block).
+
+    Notes
+    -----
+    Each call to `shm_attach` needs to be followed by a call to `shm_detach`,
+    after all references to the array (including views) have been deleted.
+    """
+    strName = dicShm['name']
+    if strName not in DIC_SHM:
+        DIC_SHM[strName] = [shared_memory.SharedMemory(name=strName), 0,
+                            False]
+    DIC_SHM[strName][1] += 1
+    return np.ndarray(dicShm['shape'], dtype=np.dtype(dicShm['dtype']),
+                      buffer=DIC_SHM[strName][0].buf)
+
+
+def shm_detach(dicShm):
+    """
+    Detach from shared memory array.
+
+    Parameters
+    ----------
+    dicShm : dict
+        Description of shared memory array (see `shm_create`).
+
+    Notes
+    -----
+    The block is unmapped once it is not attached anymore (unless it was
+    created by the current process, in which case it stays mapped until
+    `shm_free` is called).
+    """
+    lstShm = DIC_SHM.get(dicShm['name'])
+    if lstShm is None:
+        return
+    lstShm[1] = max(0, lstShm[1] - 1)
+    if (lstShm[1] == 0) and (not lstShm[2]):
+        del(DIC_SHM[dicShm['name']])
+        _close(lstShm[0])
+
+
+def shm_get(dicShm):
+    """
+    Copy shared memory array into private memory.
+
+    Parameters
+    ----------
+    dicShm : dict
+        Description of shared memory array (see `shm_create`).
+
+    Returns
+    -------
+    aryOt : np.array
+        Copy of array.
+    """
+    aryShm = shm_attach(dicShm)
+    aryOt = np.copy(aryShm)
+    del(aryShm)
+    shm_detach(dicShm)
+    return aryOt
+
+
+def shm_free(dicShm):
+    """
+    Remove shared memory array.
+
+    Parameters
+    ----------
+    dicShm : dict
+        Description of shared memory array (see `shm_create`).
+
+    Notes
+    -----
+    The block is unmapped in the current process and removed from the
+    system. Other processes that are still attached to the block keep their
+    mapping until they detach.
+    """
+    lstShm = DIC_SHM.pop(dicShm['name'], None)
+    if lstShm is None:
+        objShm = shared_memory.SharedMemory(name=dicShm['name'])
+    else:
+        objShm = lstShm[0]
+    _close(objShm)
+    objShm.unlink()
+
+
+def _close(objShm):
+    """Unmap shared memory block (unless arrays still refer to it)."""
+    try:
+        objShm.close()
+    except BufferError:
+        # Arrays referring to the block are still alive; the block is
+        # unmapped when they are garbage collected.
+        pass
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Function of the depth sampling pipeline."""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import numpy as np
+from py_depthsampling.main.slct_vrtcs import slct_idx
+
+
+# Names of dimensions of threshold sweep results:
+TPL_SWP_DIMS = ('thr02', 'thr03', 'thr04', 'condition', 'depth')
+
+
+def _swp_rng(vecSrt, varNumNan, objThr):
+    """
+    Get range of sorted vertices that pass a selection criterion.
+
+    Parameters
+    ----------
+    vecSrt : np.array
+        Criterion values of vertices, sorted in ascending order (NaN values
+        at the end).
+    varNumNan : int
+        Number of NaN values.
+    objThr : float or tuple
+        Threshold (vertices ABOVE threshold are included) or interval
+        (vertices WITHIN interval are included).
+
+    Returns
+    -------
+    varStrt, varEnd : int
+        First and last (exclusive) index of included vertices.
+    """
+    if isinstance(objThr, (list, tuple)):
+        varStrt = int(np.searchsorted(vecSrt, objThr[0], side='right'))
+        varEnd = int(np.searchsorted(vecSrt, objThr[1], side='left'))
+    else:
+        varStrt = int(np.searchsorted(vecSrt, objThr, side='right'))
+        varEnd = vecSrt.shape[0] - varNumNan
+    return varStrt, max(varStrt, varEnd)
+
+
+def slct_sweep(aryDpthData01, dicSlct, vecRoiIdx=None, vecThrSlct02=None,
+               vecThrSlct03=None, lstThrSlct04=None, varConf=1.96,
+               varVrtxVox=0.125, idxPrc=1):
+    """
+    Depth profiles for all combinations of vertex selection thresholds.
+
+    Parameters
+    ----------
+    aryDpthData01 : np.array
+        Vertex data of all vertices (before selection, after conversion to
+        percent signal change), shape aryDpthData01[condition, vertex, depth].
+    dicSlct : dict
+        Vertex selection object of the same subject & hemisphere (see
+        `get_slct_obj` or `slct_obj` in `py_depthsampling.main.slct_vrtcs`).
+    vecRoiIdx : np.array or None
+        Indices of vertices contained within the ROI. If `None`, the ROI
+        criterion is not applied.
+    vecThrSlct02 : list, np.array or None
+        Thresholds for criterion 2 (median across depth levels). If `None`,
+        criterion 2 is not applied.
+    vecThrSlct03 : list, np.array or None
+        Thresholds for criterion 3 (minimum across depth levels). If `None`,
+        criterion 3 is not applied.
+    lstThrSlct04 : list or None
+        Intervals for criterion 4 (list of tuples, lower & upper bound). If
+        `None`, criterion 4 is not applied.
+    varConf : float
+        Factor by which the standard error is multiplied for the confidence
+        interval (see `dpth_stats`).
+    varVrtxVox : float
+        Number of voxels per vertex (see `dpth_stats`).
+    idxPrc : int
+        Process ID (status messages are only printed for process 0).
+
+    Returns
+    -------
+    dicSwp : dict
+        Labelled results. 'mean', 'sd', and 'ci' - mean over vertices,
+        standard deviation, and confidence interval, shape
+        [thr02, thr03, thr04, condition, depth]; 'n' - number of vertices,
+        shape [thr02, thr03, thr04]; 'dims' - names of dimensions; 'coords' -
+        thresholds along the first three dimensions (`[None]` for criteria
+        that are not applied).
+
+    Notes
+    -----
+    For the criterion with the most thresholds, vertices are sorted by
+    criterion value, and cumulative sums over sorted vertices are calculated
+    once (per combination of thresholds of the other criteria). The vertices
+    passing a threshold (or interval) of this criterion are a contiguous
+    range of sorted vertices, so that each of its thresholds only costs
+    O(condition * depth). Sums are taken relative to the mean over all
+    sorted vertices in order to limit rounding errors; results agree with
+    `slct_vrtcs` & `dpth_stats` (mean estimator) up to floating point
+    precision.
+    """
+    varNumCon, varNumVrtx, varNumDpth = aryDpthData01.shape
+
+    if dicSlct['num_vertices'] != varNumVrtx:
+        strErrMsg = ('ERROR. Number of vertices of selection object ('
+                     + str(dicSlct['num_vertices'])
+                     + ') differs from number of vertices of data ('
+                     + str(varNumVrtx) + ').')
+        raise ValueError(strErrMsg)
+
+    # Thresholds of criteria (`None` if criterion is not applied):
+    dicThr = {}
+    for idxCrt, objThr in ((2, vecThrSlct02),
+                           (3, vecThrSlct03),
+                           (4, lstThrSlct04)):
+        if objThr is None:
+            dicThr[idxCrt] = [None]
+            continue
+        if idxCrt == 4:
+            dicThr[idxCrt] = [tuple(float(varTmp) for varTmp in tplTmp)
+                              for tplTmp in objThr]
+        else:
+            dicThr[idxCrt] = [float(varTmp) for varTmp in objThr]
+        if idxCrt not in dicSlct['summary']:
+            strErrMsg = ('ERROR. Selection object does not contain criterion '
+                         + str(idxCrt) + '.')
+            raise ValueError(strErrMsg)
+
+    # Criterion to sweep with cumulative sums (the one with the most
+    # thresholds):
+    lstSwp = [idxCrt for idxCrt in (2, 3, 4) if dicThr[idxCrt][0] is not None]
+    if lstSwp:
+        idxSwp = max(lstSwp, key=lambda idxCrt: len(dicThr[idxCrt]))
+    else:
+        idxSwp = None
+
+    tplShp = tuple(len(dicThr[idxCrt]) for idxCrt in (2, 3, 4))
+    aryMean = np.zeros((tplShp + (varNumCon, varNumDpth)))
+    arySd = np.zeros((tplShp + (varNumCon, varNumDpth)))
+    aryNum = np.zeros(tplShp, dtype=np.int64)
+
+    # Combinations of thresholds of the other criteria:
+    lstOthr = [(2, 3, 4).index(idxCrt) for idxCrt in (2, 3, 4)
+               if idxCrt != idxSwp]
+    lstIdxThr = [range(len(dicThr[(2, 3, 4)[idxDim]])) for idxDim in lstOthr]
+
+    for tplIdxOthr in itertools.product(*lstIdxThr):
+
+        # Thresholds of the other criteria for current combination:
+        dicCmb = {idxCrt: None for idxCrt in (2, 3, 4)}
+        for idxDim, idxThr in zip(lstOthr, tplIdxOthr):
+            dicCmb[(2, 3, 4)[idxDim]] = dicThr[(2, 3, 4)[idxDim]][idxThr]
+
+        if idxPrc == 0:
+            print('---------Threshold sweep: ' + str(dicCmb))
+
+        # Vertices passing the ROI and the other criteria:
+        _, vecIdxInc, _ = slct_idx(dicSlct,
+                                   vecRoiIdx=vecRoiIdx,
+                                   varThrSlct02=dicCmb[2],
+                                   varThrSlct03=dicCmb[3],
+                                   tplThrSlct04=dicCmb[4],
+                                   idxPrc=1)
+
+        # Sort these vertices by value of sweep criterion:
+        if idxSwp is None:
+            vecSrt = np.zeros(vecIdxInc.shape[0])
+        else:
+            vecSrt = dicSlct['summary'][idxSwp][vecIdxInc]
+            vecOrd = np.argsort(vecSrt, kind='stable')
+            vecSrt = vecSrt[vecOrd]
+            vecIdxInc = vecIdxInc[vecOrd]
+        varNumNan = int(np.sum(np.isnan(vecSrt)))
+
+        # Data of sorted vertices, shape aryTmp[condition, vertex, depth],
+        # relative to the mean over vertices:
+        aryTmp = aryDpthData01[:, vecIdxInc, :]
+        if 0 < vecIdxInc.shape[0]:
+            aryRef = np.mean(aryTmp, axis=1)
+        else:
+            aryRef = np.zeros((varNumCon, varNumDpth))
+        aryTmp = np.subtract(aryTmp, aryRef[:, None, :])
+
+        # Cumulative sums (with leading zero) over sorted vertices, of data
+        # and of squared data:
+        aryCum01 = np.zeros((varNumCon, (aryTmp.shape[1] + 1), varNumDpth))
+        aryCum02 = np.zeros((varNumCon, (aryTmp.shape[1] + 1), varNumDpth))
+        np.cumsum(aryTmp, axis=1, out=aryCum01[:, 1:, :])
+        np.cumsum(np.square(aryTmp), axis=1, out=aryCum02[:, 1:, :])
+        del(aryTmp)
+
+        if idxSwp is None:
+            lstThrSwp = [None]
+        else:
+            lstThrSwp = dicThr[idxSwp]
+
+        for idxThr, objThr in enumerate(lstThrSwp):
+
+            if objThr is None:
+                varStrt, varEnd = 0, vecSrt.shape[0]
+            else:
+                varStrt, varEnd = _swp_rng(vecSrt, varNumNan, objThr)
+            varNumInc = varEnd - varStrt
+
+            # Index of result (thresholds of criteria 2, 3, and 4):
+            lstIdx = [0, 0, 0]
+            for idxDim, idxTmp in zip(lstOthr, tplIdxOthr):
+                lstIdx[idxDim] = idxTmp
+            if idxSwp is not None:
+                lstIdx[(2, 3, 4).index(idxSwp)] = idxThr
+            tplIdx = tuple(lstIdx)
+
+            aryNum[tplIdx] = varNumInc
+
+            # Avoid warning in case of empty selection (statistics are zero,
+            # as in `dpth_stats`):
+            if varNumInc == 0:
+                continue
+
+            aryMeanTmp = np.divide(
+                (aryCum01[:, varEnd, :] - aryCum01[:, varStrt, :]), varNumInc)
+            aryVar = (np.divide((aryCum02[:, varEnd, :]
+                                 - aryCum02[:, varStrt, :]), varNumInc)
+                      - np.square(aryMeanTmp))
+
+            aryMean[tplIdx] = aryRef + aryMeanTmp
+            arySd[tplIdx] = np.sqrt(np.maximum(aryVar, 0.0))
+
+    # Confidence interval (see `dpth_stats`):
+    aryCi = np.zeros(arySd.shape)
+    lgcNum = np.greater(aryNum, 0)
+    aryCi[lgcNum] = np.multiply(
+        np.divide(arySd[lgcNum],
+                  np.sqrt(aryNum[lgcNum] * varVrtxVox)[:, None, None]),
+        varConf)
+
+    dicSwp = {'mean': aryMean,
+              'sd': arySd,
+              'ci': aryCi,
+              'n': aryNum,
+              'dims': TPL_SWP_DIMS,
+              'coords': {'thr02': dicThr[2],
+                         'thr03': dicThr[3],
+                         'thr04': dicThr[4]}}
+
+    return dicSwp
@@ -22,10 +22,275 @@ Function of the depth sampling pipeline.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
+from py_depthsampling.get_data.load_vtk_multi import load_vtk_multi
+from py_depthsampling.main.stages import get_stage_key
+from py_depthsampling.main.stages import load_stage
+from py_depthsampling.main.stages import save_stage
+
+
+# Statistic across depth levels for selection criteria 2 to 4:
+DIC_CRT_STAT = {2: 'median', 3: 'min', 4: 'median'}
+
+# Number of set bits in each byte value (for counting vertices in packed
+# masks):
+VEC_NUM_BIT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None],
+                            axis=1).sum(axis=1)
+
+# Vertex selection objects of the current process (see `get_slct_obj`):
+DIC_SLCT_OBJ = {}
+
+# Maximum number of vertex selection objects kept in memory:
+VAR_NUM_SLCT_OBJ = 64
+
+
+def get_slct_sum(aryCrt, idxCrt):
+    """
+    Summary statistic across depth levels for a vertex selection criterion.
+
+    Parameters
+    ----------
+    aryCrt : np.array
+        Criterion data, shape aryCrt[vertex, depth].
+    idxCrt : int
+        Selection criterion (2, 3, or 4). Median across depth levels for
+        criteria 2 and 4, minimum for criterion 3.
+
+    Returns
+    -------
+    vecSum : np.array
+        Summary statistic, shape vecSum[vertex].
+    """
+    if DIC_CRT_STAT[idxCrt] == 'median':
+        return np.median(aryCrt, axis=1)
+    return np.min(aryCrt, axis=1)
+
+
+def slct_obj(varNumVrtx, dicSum):
+    """
+    Create vertex selection object.
+
+    Parameters
+    ----------
+    varNumVrtx : int
+        Number of vertices in mesh.
+    dicSum : dict
+        Summary statistics of selection criteria across depth levels
+        (criterion index: vector, see `get_slct_sum`).
+
+    Returns
+    -------
+    dicSlct : dict
+        Vertex selection object. Masks of criteria are created (and stored as
+        packed bits) when they are first used (see `slct_idx`).
+    """
+    for idxCrt, vecSum in dicSum.items():
+        if vecSum.shape[0] != varNumVrtx:
+            strErrMsg = ('ERROR. Number of vertices of selection criterion '
+                         + str(idxCrt) + ' (' + str(vecSum.shape[0])
+                         + ') differs from number of vertices of data ('
+                         + str(varNumVrtx) + ').')
+            raise ValueError(strErrMsg)
+    return {'num_vertices': varNumVrtx,
+            'summary': dicSum,
+            'masks': {}}
+
+
+def get_slct_obj(dicVtk, strPrcdData, varNumLne, varNumDpth, varNumVrtx,
+                 idxPrc=1):
+    """
+    Get vertex selection object for vtk files with selection criteria.
+
+    Parameters
+    ----------
+    dicVtk : dict
+        Paths of vtk files with selection criteria (criterion index: path),
+        e.g. {2: 'r2.vtk', 3: 'mean_epi.vtk', 4: 'prf_overlap.vtk'}.
+    strPrcdData : str
+        Beginning of string which precedes vertex data in vtk files.
+    varNumLne : int
+        Number of lines between vertex-identification-string and first data
+        point.
+    varNumDpth : int
+        Number of depth levels.
+    varNumVrtx : int
+        Number of vertices in mesh.
+    idxPrc : int
+        Process ID (status messages are only printed for process 0).
+
+    Returns
+    -------
+    dicSlct : dict
+        Vertex selection object (see `slct_obj`).
+
+    Notes
+    -----
+    Selection objects are kept in memory, so that the same subject and
+    hemisphere can be selected for several ROIs, conditions, and thresholds
+    without repeating any work. Summary statistics across depth levels are
+    also stored in the stage cache, if enabled (see
+    `py_depthsampling.main.stages`), so that vtk files with selection criteria
+    do not need to be loaded again in later runs.
+    """
+    strKeyObj = get_stage_key('slct_obj',
+                              {'dicVtk': dicVtk,
+                               'strPrcdData': strPrcdData,
+                               'varNumLne': varNumLne,
+                               'varNumDpth': varNumDpth,
+                               'varNumVrtx': varNumVrtx})
+
+    if strKeyObj in DIC_SLCT_OBJ:
+        return DIC_SLCT_OBJ[strKeyObj]
+
+    dicSum = {}
+    for idxCrt, strVtk in dicVtk.items():
+
+        strKey = get_stage_key('slct_summary',
+                               {'strVtk': strVtk,
+                                'strStat': DIC_CRT_STAT[idxCrt],
+                                'strPrcdData': strPrcdData,
+                                'varNumLne': varNumLne,
+                                'varNumDpth': varNumDpth})
+        dicRes = load_stage(strKey)
+
+        if dicRes is None:
+            if idxPrc == 0:
+                print('---------Importing vtk file for selection criterion '
+                      + str(idxCrt) + '.')
+            aryCrt = load_vtk_multi(strVtk, strPrcdData, varNumLne,
+                                    varNumDpth)
+            dicSum[idxCrt] = get_slct_sum(aryCrt, idxCrt)
+            del(aryCrt)
+            save_stage(strKey, 'slct_summary',
+                       dicRes={'vecSum': dicSum[idxCrt]})
+        else:
+            dicSum[idxCrt] = dicRes['vecSum']
+
+    dicSlct = slct_obj(varNumVrtx, dicSum)
+
+    if VAR_NUM_SLCT_OBJ <= len(DIC_SLCT_OBJ):
+        DIC_SLCT_OBJ.clear()
+    DIC_SLCT_OBJ[strKeyObj] = dicSlct
+
+    return dicSlct
+
+
+def slct_msk(dicSlct, idxCrt, objThr):
+    """
+    Get mask of vertices that pass a selection criterion (packed bits).
+
+    Parameters
+    ----------
+    dicSlct : dict
+        Vertex selection object (see `slct_obj`).
+    idxCrt : int
+        Selection criterion (2, 3, or 4).
+    objThr : float or tuple
+        Threshold (criteria 2 and 3, vertices ABOVE threshold are included) or
+        interval (criterion 4, vertices WITHIN interval are included).
+
+    Returns
+    -------
+    vecPck : np.array
+        Mask of included vertices, packed bits (see `np.packbits`). Masks are
+        stored in the selection object.
+    """
+    if isinstance(objThr, (list, tuple)):
+        tplKey = (idxCrt, tuple(objThr))
+    else:
+        tplKey = (idxCrt, objThr)
+
+    if tplKey not in dicSlct['masks']:
+
+        vecSum = dicSlct['summary'][idxCrt]
+
+        if idxCrt == 4:
+            # Check whether vertex values are within the interval (lower and
+            # upper bound):
+            vecLgc = np.logical_and(np.greater(vecSum, objThr[0]),
+                                    np.less(vecSum, objThr[1]))
+        else:
+            # Check whether vertex values are above the exclusion threshold:
+            vecLgc = np.greater(vecSum, objThr)
+
+        dicSlct['masks'][tplKey] = np.packbits(vecLgc)
+
+    return dicSlct['masks'][tplKey]
+
+
+def slct_idx(dicSlct, vecRoiIdx=None, varThrSlct02=None, varThrSlct03=None,
+             tplThrSlct04=None, idxPrc=1):
+    """
+    Select vertices.
+
+    Parameters
+    ----------
+    dicSlct : dict
+        Vertex selection object (see `slct_obj`).
+    vecRoiIdx : np.array or None
+        Indices of vertices contained within the ROI (criterion 1). If `None`,
+        the ROI criterion is not applied.
+    varThrSlct02 : float or None
+        Threshold for criterion 2 (not applied if `None`).
+    varThrSlct03 : float or None
+        Threshold for criterion 3 (not applied if `None`).
+    tplThrSlct04 : tuple or None
+        Interval for criterion 4 (not applied if `None`).
+    idxPrc : int
+        Process ID (status messages are only printed for process 0).
+
+    Returns
+    -------
+    vecInc : np.array
+        Vertex inclusion vector (boolean), shape vecInc[vertex].
+    vecIdxInc : np.array
+        Indices of included vertices (for selecting the data of all
+        conditions at once, e.g. `aryData[:, vecIdxInc, :]`).
+    varNumInc : int
+        Number of included vertices.
+    """
+    varNumVrtx = dicSlct['num_vertices']
+
+    if idxPrc == 0:
+        print('---------Total number of vertices in vtk mesh: '
+              + str(varNumVrtx))
+
+    # Vertex inclusion mask (packed bits):
+    if vecRoiIdx is None:
+        vecPck = np.packbits(np.ones(varNumVrtx, dtype=bool))
+    else:
+        if idxPrc == 0:
+            print('---------Select vertices contained within the ROI')
+        vecTmp = np.zeros(varNumVrtx, dtype=bool)
+        vecTmp[vecRoiIdx] = True
+        vecPck = np.packbits(vecTmp)
+        if idxPrc == 0:
+            print('------------Remaining vertices: '
+                  + str(np.sum(VEC_NUM_BIT[vecPck])))
+
+    # Apply selection criteria 2 to 4 (combined with the inclusion mask in
+    # packed form):
+    for idxCrt, objThr in ((2, varThrSlct02),
+                           (3, varThrSlct03),
+                           (4, tplThrSlct04)):
+        if objThr is None:
+            continue
+        if idxPrc == 0:
+            print('---------Select vertices based on criterion '
+                  + str(idxCrt))
+        vecPck = np.bitwise_and(vecPck, slct_msk(dicSlct, idxCrt, objThr))
+        if idxPrc == 0:
+            print('------------Remaining vertices: '
+                  + str(np.sum(VEC_NUM_BIT[vecPck])))
+
+    vecInc = np.unpackbits(vecPck, count=varNumVrtx).astype(bool)
+    vecIdxInc = np.flatnonzero(vecInc)
+    varNumInc = np.sum(vecInc)
+
+    return vecInc, vecIdxInc, varNumInc
 
 
 def slct_vrtcs(varNumCon,           # Number of conditions  #noqa
-               lstDpthData01,       # List with depth-sampled data I
+               aryDpthData01,       # Array with depth-sampled data I
                lgcSlct01,           # Criterion 1 - Yes or no?
                aryRoiVrtx,          # Criterion 1 - Data (ROI)
                lgcSlct02,           # Criterion 2 - Yes or no?
@@ -38,169 +303,62 @@ def slct_vrtcs(varNumCon,           # Number of conditions  #noqa
                arySlct04,           # Criterion 4 - Data
                tplThrSlct04,        # Criterion 4 - Threshold
                idxPrc):             # Process ID
-    """Select vertices. See ds_main.py for more information."""
-    # *************************************************************************
-    # Preparations
-
-    # Original number of vertices in mesh:
-    varOrigNumVtkVrtc = lstDpthData01[0].shape[0]
-
-    # Only print status message if this is the first of several parallel
-    # processes:
-    if idxPrc == 0:
-        print('---------Total number of vertices in vtk mesh: '
-              + str(varOrigNumVtkVrtc))
-
-    # Vertex inclusion vector. Contains '1' for each vertex that is included,
-    # otherwise '0'.
-    vecInc = np.ones(varOrigNumVtkVrtc, dtype=bool)
-
-    # Initialise number of included vertices:
-    varNumInc = np.sum(vecInc)
-    # *************************************************************************
-
-    # *************************************************************************
-    # *** (1) Select vertices contained within the ROI
-
-    # Apply first selection criterion (ROI)?
-    if lgcSlct01:
-
-        # Only print status messages if this is the first of several parallel
-        # processes:
-        if idxPrc == 0:
-            print('---------Select vertices contained within the ROI')
-
-        # The second column of the array "aryRoiVrtx" contains the indicies of
-        # the vertices contained in the ROI. We extract that information:
+    """
+    Select vertices. See ds_main.py for more information.
+
+    The depth-sampled data of all conditions are passed as one array, shape
+    aryDpthData01[condition, vertex, depth] (see `load_vtk_batch`), and the
+    selection is applied to all conditions at once.
+
+    Vertices are selected according to the following criteria:
+
+        (1) Vertices contained within the ROI.
+        (2) Vertices that are BELOW a certain threshold are excluded - median
+            across depth levels.
+        (3) Vertices that are BELOW a certain threshold are excluded - minimum
+            across depth levels.
+        (4) Vertices that are WITHIN INTERVAL are included - median across
+            depth levels.
+
+    To select vertices of the same subject & hemisphere repeatedly (e.g. for
+    several ROIs or thresholds), use `get_slct_obj` & `slct_idx` directly.
+    """
+    # Summary statistics of selection criteria across depth levels:
+    dicSum = {}
+    for idxCrt, lgcSlct, aryCrt in ((2, lgcSlct02, arySlct02),
+                                    (3, lgcSlct03, arySlct03),
+                                    (4, lgcSlct04, arySlct04)):
+        if lgcSlct:
+            dicSum[idxCrt] = get_slct_sum(aryCrt, idxCrt)
+
+    dicSlct = slct_obj(aryDpthData01.shape[1], dicSum)
+
+    # The second column of the array "aryRoiVrtx" contains the indicies of the
+    # vertices contained in the ROI. We extract that information (if only the
+    # index column was loaded, the array is one-dimensional):
+    if not lgcSlct01:
+        vecRoiIdx = None
+    elif aryRoiVrtx.ndim == 1:
+        vecRoiIdx = aryRoiVrtx.astype(np.int64)
+    else:
         vecRoiIdx = aryRoiVrtx[:, 1].astype(np.int64)
 
-        # If using the first criterion, re-initialise the inclusion vector and
-        # set it to 'True' only for vertices contained within the ROI:
-        vecInc = np.zeros(varOrigNumVtkVrtc, dtype=bool)
-        vecInc[vecRoiIdx] = True
-
-        # Update number of included vertices:
-        varNumInc = np.sum(vecInc)
-
-        # Only print status messages if this is the first of several parallel
-        # processes:
-        if idxPrc == 0:
-            print('------------Remaining vertices: ' + str(varNumInc))
-    # *************************************************************************
-
-    # *************************************************************************
-    # *** (2) Selection criterion 2
-    #         Vertices that are BELOW a certain threshold are excluded - median
-    #         across depth levels.
-
-    if lgcSlct02:
-
-        if idxPrc == 0:
-            print('---------Select vertices based on criterion 2')
-
-        # Get median value across cortical depths:
-        vecMneSlct02 = np.median(arySlct02, axis=1)
-
-        # Check whether vertex values are above the exclusion threshold:
-        vecSlct02 = np.greater(vecMneSlct02, varThrSlct02)
-
-        # Apply second vertex selection criterion to inclusion-vector:
-        vecInc = np.logical_and(vecInc,
-                                vecSlct02)
-
-        # Update number of included vertices:
-        varNumInc = np.sum(vecInc)
-
-        # Only print status messages if this is the first of several parallel
-        # processes:
-        if idxPrc == 0:
-            print('------------Remaining vertices: ' + str(varNumInc))
-    # *************************************************************************
-
-    # *************************************************************************
-    # *** (3) Selection criterion 3
-    #         Vertices that are BELOW a certain threshold are excluded -
-    #         minimum across depth levels.
-
-    if lgcSlct03:
-
-        if idxPrc == 0:
-            print('---------Select vertices based on criterion 3')
-
-        # Get minimum value across cortical depths:
-        vecMneSlct03 = np.min(arySlct03, axis=1)
-
-        # Check whether vertex values are above the exclusion threshold:
-        vecSlct03 = np.greater(vecMneSlct03, varThrSlct03)
-
-        # Apply second vertex selection criterion to inclusion-vector:
-        vecInc = np.logical_and(vecInc,
-                                vecSlct03)
-
-        # Update number of included vertices:
-        varNumInc = np.sum(vecInc)
-
-        # Only print status messages if this is the first of several parallel
-        # processes:
-        if idxPrc == 0:
-            print('------------Remaining vertices: ' + str(varNumInc))
-    # *************************************************************************
-
-    # *************************************************************************
-    # *** (2) Selection criterion 4
-    #         Vertices that are WITHIN INTERVAL are included - median across
-    #         depth levels).
-
-    if lgcSlct04:
-
-        if idxPrc == 0:
-            print('---------Select vertices based on criterion 4')
-
-        # Get median value across cortical depths:
-        vecMneSlct04 = np.median(arySlct04, axis=1)
-
-        # Check whether vertex values are within the interval (lower and upper
-        # bound):
-        vecSlct04lowbound = np.greater(vecMneSlct04, tplThrSlct04[0])
-        vecSlct04upbound = np.less(vecMneSlct04, tplThrSlct04[1])
-        vecSlct04 = np.logical_and(vecSlct04lowbound, vecSlct04upbound)
-
-        # Apply second vertex selection criterion to inclusion-vector:
-        vecInc = np.logical_and(vecInc,
-                                vecSlct04)
-
-        # Update number of included vertices:
-        varNumInc = np.sum(vecInc)
-
-        # Only print status messages if this is the first of several parallel
-        # processes:
-        if idxPrc == 0:
-            print('------------Remaining vertices: ' + str(varNumInc))
-    # *************************************************************************
-
-    # *************************************************************************
-    # *** Apply inclusion-vector to data
+    vecInc, vecIdxInc, varNumInc = slct_idx(
+        dicSlct,
+        vecRoiIdx=vecRoiIdx,
+        varThrSlct02=(varThrSlct02 if lgcSlct02 else None),
+        varThrSlct03=(varThrSlct03 if lgcSlct03 else None),
+        tplThrSlct04=(tplThrSlct04 if lgcSlct04 else None),
+        idxPrc=idxPrc)
 
     if idxPrc == 0:
         print('---------Applying inclusion criteria to data.')
 
-    # Loop through conditions (corresponding to input files):
-    for idxIn in range(0, varNumCon):
-
-        # Get array for current condition:
-        aryTmp = lstDpthData01[idxIn]
-
-        # Selcet vertices that survived all previous inclusion criteria:
-        aryTmp = aryTmp[vecInc, :]
-
-        # Put array back into list:
-        lstDpthData01[idxIn] = aryTmp
+    # Select vertices that survived all inclusion criteria (all conditions,
+    # corresponding to input files, at once):
+    aryDpthData01 = aryDpthData01[:, vecIdxInc, :]
 
     if idxPrc == 0:
         print('---------Final number of vertices: ' + str(varNumInc))
-    # *************************************************************************
 
-    # *************************************************************************
-    # *** Return
-    return lstDpthData01, varNumInc, vecInc
-    # *************************************************************************
+    return aryDpthData01, varNumInc, vecInc
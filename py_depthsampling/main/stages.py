@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Result cache for the stages of the depth sampling pipeline.
+
+The depth sampling pipeline consists of the following stages (per subject
+and hemisphere, unless stated otherwise):
+
+    load -> PSC conversion -> vertex selection (`slct_vrtcs`) -> depth means
+    -> vertex mask (`vtk_msk`) -> npz save & plot (across subjects)
+
+Each stage has a key, which is a hash of the stage name, of its parameters,
+and of the keys of the stages it depends on. Input files are represented by
+their path, modification time, and size. Hence, if a parameter is changed,
+the keys of the respective stage and of all downstream stages change, while
+the keys of upstream stages stay the same. Stages that write files (vertex
+mask, npz files, plots) only store the modification time and size of their
+output files, and are repeated if an output file has been modified or
+removed.
+
+Loaded data are not stored here (parsing of vtk files is cached by
+`vtk_cache`), and neither is the result of the PSC conversion (which is
+recomputed from the loaded data when needed); only their keys are part of
+the dependency chain.
+
+The stage cache is opt-in. It is enabled by setting the environment variable
+`PY_DEPTHSAMPLING_STAGES` to `on` (results are stored in
+`~/.cache/py_depthsampling/stages`) or to a directory. Otherwise, all stages
+are run, and all files are written, on every run. The total size of the stage
+cache is bounded (default 1024 MB, environment variable
+`PY_DEPTHSAMPLING_STAGES_MB`); least recently used results are removed first.
+Stage results can be inspected and purged with the command line interface of
+the vtk cache:
+
+    python -m py_depthsampling.get_data.vtk_cache inspect --stages
+    python -m py_depthsampling.get_data.vtk_cache purge --stages
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from py_depthsampling.get_data.vtk_cache import get_cache_root
+from py_depthsampling.get_data.vtk_pack import find_vtk_pack
+
+
+# Environment variables for enabling the stage cache, and for maximum size of
+# the stage cache (MB):
+STR_ENV_STG = 'PY_DEPTHSAMPLING_STAGES'
+STR_ENV_STG_SZE = 'PY_DEPTHSAMPLING_STAGES_MB'
+
+# Default maximum size of stage cache (MB):
+VAR_STG_SZE_DEF = 1024
+
+
+def get_stage_path():
+    """
+    Get path of stage cache directory (whether or not the cache is enabled).
+
+    Returns
+    -------
+    strDir : str
+        Directory set with the environment variable `PY_DEPTHSAMPLING_STAGES`,
+        or `~/.cache/py_depthsampling/stages`.
+    """
+    strDir = os.environ.get(STR_ENV_STG, '')
+    if strDir.lower() in ('', '0', '1', 'on', 'off', 'none'):
+        strDir = os.path.join(get_cache_root(), 'stages')
+    return strDir
+
+
+def get_stage_dir():
+    """
+    Get path of stage cache directory.
+
+    Returns
+    -------
+    strDir : str or None
+        Path of stage cache directory, or `None` if the stage cache is not
+        enabled (see module docstring).
+    """
+    if os.environ.get(STR_ENV_STG, '').lower() in ('', '0', 'off', 'none'):
+        return None
+    return get_stage_path()
+
+
+def get_stage_size():
+    """Get maximum size of stage cache (in bytes)."""
+    varSze = float(os.environ.get(STR_ENV_STG_SZE, VAR_STG_SZE_DEF))
+    return int(varSze * 1024 * 1024)
+
+
+def _fingerprint(objVal):
+    """Convert stage parameter to json-compatible representation."""
+    if isinstance(objVal, str):
+        # Input files are represented by path, modification time, and size.
+        # Files held by a packed container (see `vtk_pack`) are represented
+        # by the container.
+        strPth = objVal
+        if not os.path.isfile(strPth):
+            tplPck = find_vtk_pack(strPth)
+            if tplPck is not None:
+                strPth = tplPck[0]
+        if os.path.isfile(strPth):
+            objStat = os.stat(strPth)
+            return [objVal, objStat.st_mtime_ns, objStat.st_size]
+        return objVal
+    elif isinstance(objVal, np.ndarray):
+        objHsh = hashlib.sha1(np.ascontiguousarray(objVal).tobytes())
+        return [str(objVal.dtype), list(objVal.shape), objHsh.hexdigest()]
+    elif isinstance(objVal, np.generic):
+        return objVal.item()
+    elif isinstance(objVal, (list, tuple)):
+        return [_fingerprint(objTmp) for objTmp in objVal]
+    elif isinstance(objVal, dict):
+        return {str(strKey): _fingerprint(objTmp)
+                for strKey, objTmp in objVal.items()}
+    return objVal
+
+
+def get_stage_key(strStg, dicPrm, lstDep=None, lstOt=None):
+    """
+    Get key of pipeline stage.
+
+    Parameters
+    ----------
+    strStg : str
+        Name of stage (e.g. 'slct_vrtcs').
+    dicPrm : dict
+        Parameters of stage (paths of input files, thresholds, etc.).
+    lstDep : list or None
+        Keys of stages that this stage depends on.
+    lstOt : list or None
+        Paths of output files of stage (only the paths are part of the key,
+        not the modification time & size of existing files, as for the
+        parameters).
+
+    Returns
+    -------
+    strKey : str
+        Key of stage (sha1 hex digest).
+    """
+    if lstDep is None:
+        lstDep = []
+    if lstOt is None:
+        lstOt = []
+    strJsn = json.dumps({'stage': strStg,
+                         'params': _fingerprint(dicPrm),
+                         'deps': list(lstDep),
+                         'outputs': [os.path.abspath(strPth)
+                                     for strPth in lstOt]},
+                        sort_keys=True, default=str)
+    return hashlib.sha1(strJsn.encode('utf-8')).hexdigest()
+
+
+def load_stage(strKey):
+    """
+    Load result of pipeline stage.
+
+    Parameters
+    ----------
+    strKey : str
+        Key of stage (see `get_stage_key`).
+
+    Returns
+    -------
+    dicRes : dict or None
+        Arrays saved for stage (empty dict for stages that only write
+        output files). `None` if there is no result for this key, if an
+        output file of the stage has been modified or removed, or if the stage
+        cache is not enabled.
+    """
+    strDir = get_stage_dir()
+    if strDir is None:
+        return None
+
+    strJsn = os.path.join(strDir, strKey + '.json')
+    try:
+        with open(strJsn, 'r') as fleJsn:
+            dicMeta = json.load(fleJsn)
+    except (IOError, OSError, ValueError):
+        return None
+
+    # Check output files:
+    for strPth, varMtime, varSze in dicMeta.get('outputs', []):
+        try:
+            objStat = os.stat(strPth)
+        except OSError:
+            return None
+        if (objStat.st_mtime_ns != varMtime) or (objStat.st_size != varSze):
+            return None
+
+    dicRes = {}
+    if dicMeta.get('arrays', False):
+        try:
+            with np.load(os.path.join(strDir, strKey + '.npz')) as objNpz:
+                for strName in objNpz.files:
+                    dicRes[strName] = objNpz[strName]
+        except (IOError, OSError, ValueError):
+            return None
+
+    try:
+        # Mark result as recently used (see `evict_stages`):
+        os.utime(strJsn, None)
+    except OSError:
+        pass
+
+    return dicRes
+
+
+def save_stage(strKey, strStg, dicRes=None, lstOt=None):
+    """
+    Save result of pipeline stage.
+
+    Parameters
+    ----------
+    strKey : str
+        Key of stage (see `get_stage_key`).
+    strStg : str
+        Name of stage (for inspection only).
+    dicRes : dict or None
+        Arrays to save (name: array).
+    lstOt : list or None
+        Paths of output files written by the stage.
+
+    Notes
+    -----
+    Files are written to a temporary file and renamed, so that parallel
+    processes never see incomplete results. Nothing is saved if the stage
+    cache is not enabled. Least recently used results are removed if the
+    stage cache exceeds its maximum size (see `evict_stages`).
+    """
+    strDir = get_stage_dir()
+    if strDir is None:
+        return
+
+    if not os.path.isdir(strDir):
+        os.makedirs(strDir, exist_ok=True)
+
+    if dicRes:
+        varFd, strTmp = tempfile.mkstemp(dir=strDir, suffix='.tmp')
+        try:
+            with os.fdopen(varFd, 'wb') as fleOt:
+                np.savez(fleOt, **dicRes)
+            os.replace(strTmp, os.path.join(strDir, strKey + '.npz'))
+        except BaseException:
+            if os.path.isfile(strTmp):
+                os.remove(strTmp)
+            raise
+
+    lstOtStat = []
+    for strPth in (lstOt or []):
+        objStat = os.stat(strPth)
+        lstOtStat.append([os.path.abspath(strPth), objStat.st_mtime_ns,
+                          objStat.st_size])
+
+    dicMeta = {'stage': strStg,
+               'arrays': bool(dicRes),
+               'outputs': lstOtStat}
+
+    varFd, strTmp = tempfile.mkstemp(dir=strDir, suffix='.tmp')
+    try:
+        with os.fdopen(varFd, 'wb') as fleOt:
+            fleOt.write(json.dumps(dicMeta, indent=1).encode('utf-8'))
+        os.replace(strTmp, os.path.join(strDir, strKey + '.json'))
+    except BaseException:
+        if os.path.isfile(strTmp):
+            os.remove(strTmp)
+        raise
+
+    evict_stages(strDir)
+
+
+def lst_stages(strDir=None):
+    """
+    List stage results.
+
+    Parameters
+    ----------
+    strDir : str or None
+        Stage cache directory (default: `get_stage_path()`).
+
+    Returns
+    -------
+    lstEnt : list
+        One dict per stage result (keys: 'key', 'stage', 'bytes' (size of
+        json and npz file), 'last_used'), sorted from least to most recently
+        used.
+    """
+    if strDir is None:
+        strDir = get_stage_path()
+    if not os.path.isdir(strDir):
+        return []
+
+    lstEnt = []
+    for strFle in os.listdir(strDir):
+        if not strFle.endswith('.json'):
+            continue
+        strKey = strFle[:-5]
+        strJsn = os.path.join(strDir, strFle)
+        try:
+            objStat = os.stat(strJsn)
+            with open(strJsn, 'r') as fleJsn:
+                strStg = json.load(fleJsn).get('stage', None)
+        except (IOError, OSError, ValueError):
+            # Removed by another process in the meantime, or incomplete.
+            continue
+        varSze = objStat.st_size
+        strNpz = os.path.join(strDir, strKey + '.npz')
+        if os.path.isfile(strNpz):
+            varSze += os.path.getsize(strNpz)
+        lstEnt.append({'key': strKey,
+                       'stage': strStg,
+                       'bytes': varSze,
+                       'last_used': objStat.st_mtime})
+
+    lstEnt.sort(key=lambda dicEnt: dicEnt['last_used'])
+
+    return lstEnt
+
+
+def _rm_stage(strDir, strKey):
+    """Remove stage result (*.json & *.npz file)."""
+    for strExt in ('.json', '.npz'):
+        try:
+            os.remove(os.path.join(strDir, strKey + strExt))
+        except OSError:
+            pass
+
+
+def evict_stages(strDir=None, varSzeMax=None):
+    """
+    Remove least recently used stage results until size is below limit.
+
+    Parameters
+    ----------
+    strDir : str or None
+        Stage cache directory (default: `get_stage_path()`).
+    varSzeMax : int or None
+        Maximum size in bytes (default: `get_stage_size()`).
+
+    Returns
+    -------
+    varNumRm : int
+        Number of removed stage results.
+    """
+    if strDir is None:
+        strDir = get_stage_path()
+    if varSzeMax is None:
+        varSzeMax = get_stage_size()
+    lstEnt = lst_stages(strDir)
+    varSze = sum([dicEnt['bytes'] for dicEnt in lstEnt])
+    varNumRm = 0
+    for dicEnt in lstEnt:
+        if varSze <= varSzeMax:
+            break
+        _rm_stage(strDir, dicEnt['key'])
+        varSze -= dicEnt['bytes']
+        varNumRm += 1
+    return varNumRm
+
+
+def purge_stages(strDir=None):
+    """
+    Remove all stage results.
+
+    Parameters
+    ----------
+    strDir : str or None
+        Stage cache directory (default: `get_stage_path()`, i.e. results are
+        removed even if the stage cache is not enabled).
+
+    Returns
+    -------
+    varNumRm : int
+        Number of removed stage results.
+    """
+    if strDir is None:
+        strDir = get_stage_path()
+    if not os.path.isdir(strDir):
+        return 0
+    varNumRm = 0
+    for strFle in os.listdir(strDir):
+        if not strFle.endswith(('.json', '.npz', '.tmp')):
+            continue
+        try:
+            os.remove(os.path.join(strDir, strFle))
+        except OSError:
+            continue
+        if strFle.endswith('.json'):
+            varNumRm += 1
+    return varNumRm
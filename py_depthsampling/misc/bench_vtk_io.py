@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for loading vertex data from vtk meshes.
+
+Compares the line-by-line (csv reader) vtk parser that was previously used in
+`load_vtk_multi` with the bulk parser in `py_depthsampling.get_data.vtk_io`,
+and with reloading the parsed data from the on-disk cache
+(`py_depthsampling.get_data.vtk_cache`). A synthetic mesh is created in a
+temporary directory, so no data are needed to run the benchmark:
+
+    python -m py_depthsampling.misc.bench_vtk_io
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from py_depthsampling.get_data.load_vtk_multi import load_vtk_multi
+from py_depthsampling.get_data.vtk_cache import STR_ENV_DIR
+
+
+def crt_vtk(strVtkOt, varNumVrtx, varNumDpth, varSeed=0):
+    """
+    Create synthetic ASCII vtk mesh with multiple data points per vertex.
+
+    Parameters
+    ----------
+    strVtkOt : str
+        Output path.
+    varNumVrtx : int
+        Number of vertices.
+    varNumDpth : int
+        Number of data points per vertex (e.g. cortical depth levels).
+    varSeed : int
+        Seed for random number generator.
+
+    Returns
+    -------
+    aryData : np.array
+        Vertex data written to the mesh, shape aryData[vertex, depth].
+    """
+    objRng = np.random.RandomState(varSeed)
+
+    # Vertex coordinates & triangles (topology is not meaningful, but the size
+    # of the sections preceding the data is realistic):
+    aryPnts = objRng.uniform(-100.0, 100.0, size=(varNumVrtx, 3))
+    varNumPly = 2 * varNumVrtx
+    aryPly = np.zeros((varNumPly, 4), dtype=np.int64)
+    aryPly[:, 0] = 3
+    aryPly[:, 1:] = objRng.randint(0, varNumVrtx, size=(varNumPly, 3))
+
+    # Vertex data, rounded to the precision with which they are written to
+    # the mesh:
+    aryData = objRng.normal(0.0, 1.0, size=(varNumVrtx, varNumDpth))
+    aryData = np.char.mod('%.8g', aryData).astype(np.float64)
+
+    with open(strVtkOt, 'w') as fleOt:
+        fleOt.write('# vtk DataFile Version 3.0\n')
+        fleOt.write('synthetic_mesh\n')
+        fleOt.write('ASCII\n')
+        fleOt.write('DATASET POLYDATA\n')
+        fleOt.write('POINTS ' + str(varNumVrtx) + ' float\n')
+        np.savetxt(fleOt, aryPnts, fmt='%.6f', delimiter=' ')
+        fleOt.write('POLYGONS ' + str(varNumPly) + ' '
+                    + str(aryPly.size) + '\n')
+        np.savetxt(fleOt, aryPly, fmt='%d', delimiter=' ')
+        fleOt.write('POINT_DATA ' + str(varNumVrtx) + '\n')
+        fleOt.write('SCALARS EmbedVertex float ' + str(varNumDpth) + '\n')
+        fleOt.write('LOOKUP_TABLE default\n')
+        np.savetxt(fleOt, aryData, fmt='%.8g', delimiter=' ')
+
+    return aryData
+
+
+def load_vtk_multi_csv(strVtkIn, strPrcdData, varNumLne, varNumDpth):
+    """
+    Load vtk file with multiple data points per vertex (csv reader).
+
+    Previous implementation of `load_vtk_multi`, used as reference.
+    """
+    fleVtkIn = open(strVtkIn, 'r')
+    csvIn = csv.reader(fleVtkIn,
+                       delimiter='\n',
+                       skipinitialspace=True)
+    lstVtkData = []
+    for lstTmp in csvIn:
+        for strTmp in lstTmp:
+            lstVtkData.append(strTmp[:])
+    fleVtkIn.close()
+    for idxSrch in range(0, len(lstVtkData)):
+        if lstVtkData[idxSrch].startswith((strPrcdData)):
+            varIdxTmp = idxSrch
+    strNumDataVrtx = lstVtkData[(varIdxTmp - 1)]
+    varNumDataVrtx = int(strNumDataVrtx[11:])
+    varIdxFrst = varIdxTmp + varNumLne
+    aryVtkData = np.zeros((varNumDataVrtx, varNumDpth))
+    for idxData in range(0, varNumDataVrtx):
+        varTmpStrt = varIdxFrst + idxData
+        aryVtkData[idxData, :] = \
+            lstVtkData[varTmpStrt].split(' ')[0:varNumDpth]
+    return aryVtkData
+
+
+def bench_vtk_io(varNumVrtx=300000, varNumDpth=11, varNumRep=3):
+    """
+    Compare run time of csv-based and bulk vtk parser, and of cache reload.
+
+    Parameters
+    ----------
+    varNumVrtx : int
+        Number of vertices of the synthetic mesh.
+    varNumDpth : int
+        Number of data points per vertex.
+    varNumRep : int
+        Number of repetitions (the minimum run time is reported).
+
+    Returns
+    -------
+    dicTme : dict
+        Minimum run time (in seconds) of the three implementations.
+    """
+    strTmp = tempfile.mkdtemp()
+    # Use temporary cache directory:
+    strCchOld = os.environ.get(STR_ENV_DIR, None)
+    os.environ[STR_ENV_DIR] = os.path.join(strTmp, 'cache')
+    try:
+        strVtk = os.path.join(strTmp, 'mesh.vtk')
+        aryRef = crt_vtk(strVtk, varNumVrtx, varNumDpth)
+        print(('---Synthetic mesh: ' + str(varNumVrtx) + ' vertices, '
+               + str(varNumDpth) + ' depth levels, '
+               + str(np.around(os.path.getsize(strVtk) / 1e6, decimals=1))
+               + ' MB'))
+
+        # Populate cache:
+        load_vtk_multi(strVtk, 'SCALARS', 2, varNumDpth)
+
+        dicFnc = {'csv': (load_vtk_multi_csv, {}),
+                  'bulk': (load_vtk_multi, {'lgcCache': False}),
+                  'cache': (load_vtk_multi, {'lgcCache': True})}
+        dicTme = {}
+        for strKey in ['csv', 'bulk', 'cache']:
+            objFnc, dicKw = dicFnc[strKey]
+            lstTme = []
+            for idxRep in range(varNumRep):
+                varTme = time.time()
+                aryTmp = objFnc(strVtk, 'SCALARS', 2, varNumDpth, **dicKw)
+                # Access all data (the cached array is memory-mapped):
+                np.sum(aryTmp)
+                lstTme.append(time.time() - varTme)
+            # The two parsers have to return identical arrays:
+            if not np.array_equal(aryTmp, aryRef):
+                strErrMsg = ('ERROR. Parser "' + strKey + '" returned '
+                             + 'unexpected data.')
+                raise ValueError(strErrMsg)
+            dicTme[strKey] = min(lstTme)
+            print(('---' + strKey + ': ' + str(np.around(dicTme[strKey],
+                                                         decimals=3))
+                   + ' s'))
+        print(('---Speedup (bulk): '
+               + str(np.around((dicTme['csv'] / dicTme['bulk']),
+                               decimals=1))))
+        print(('---Speedup (cache): '
+               + str(np.around((dicTme['csv'] / dicTme['cache']),
+                               decimals=1))))
+    finally:
+        if strCchOld is None:
+            del os.environ[STR_ENV_DIR]
+        else:
+            os.environ[STR_ENV_DIR] = strCchOld
+        shutil.rmtree(strTmp)
+
+    return dicTme
+
+
+if __name__ == "__main__":
+
+    bench_vtk_io()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Check symmetry-halved exact permutation tests against brute force.
+
+Exact permutation tests (`perm_main.permute` and `perm_max.permute_max` with
+`varNumIt=None`, and `perm_engine.exact_null`) only evaluate half of the 2^N
+assignments of condition labels, and mirror the null distribution. Here, the
+results are compared with a brute force enumeration of all assignments
+(`itertools.product`, with the previous implementation of the null
+distribution, `perm_engine.loop_null`) on random data with small numbers of
+subjects. No data are needed:
+
+    python -m py_depthsampling.misc.check_perm_sym
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import numpy as np
+from py_depthsampling.permutation.perm_engine import VAR_NUM_BIN
+from py_depthsampling.permutation.perm_engine import exact_null
+from py_depthsampling.permutation.perm_engine import loop_null
+from py_depthsampling.permutation.perm_main import permute
+from py_depthsampling.permutation.perm_max import permute_max
+
+
+def perm_brute(aryDpth01, aryDpth02, vecNumInc, varLow=2.5, varUp=97.5):
+    """
+    Exact permutation test, brute force enumeration of all assignments.
+
+    Parameters
+    ----------
+    aryDpth01 : np.array
+        Depth profiles from first condition, shape aryDpth01[subject, depth].
+    aryDpth02 : np.array
+        Depth profiles from second condition, shape aryDpth02[subject, depth].
+    vecNumInc : np.array
+        Weights of subjects, shape vecNumInc[subject].
+    varLow : float
+        Lower percentile of null distribution.
+    varUp : float
+        Upper percentile of null distribution.
+
+    Returns
+    -------
+    aryNull : np.array
+        Lower percentile, mean, and upper percentile of the null
+        distribution, shape aryNull[3, depth].
+    vecP : np.array
+        Permutation p-value for each depth level.
+    varPMax : float
+        Permutation p-value for maximum absolute difference across depth.
+    """
+    varNumSubs = aryDpth01.shape[0]
+
+    aryRnd = np.array(list(itertools.product([0, 1], repeat=varNumSubs)))
+    aryPermDiff = loop_null(aryDpth01, aryDpth02, vecNumInc, aryRnd)
+
+    vecEmp = np.average(np.subtract(aryDpth01, aryDpth02), weights=vecNumInc,
+                        axis=0)
+
+    aryPrcnt = np.percentile(aryPermDiff, (varLow, varUp), axis=0)
+    aryNull = np.array([aryPrcnt[0, :],
+                        np.mean(aryPermDiff, axis=0),
+                        aryPrcnt[1, :]])
+
+    vecP = np.divide(np.sum(np.greater_equal(aryPermDiff, vecEmp[None, :]),
+                            axis=0).astype(np.float64),
+                     float(aryRnd.shape[0]))
+
+    varPMax = np.divide(float(np.sum(np.greater_equal(
+        np.max(np.absolute(aryPermDiff), axis=1),
+        np.max(np.absolute(vecEmp))))), float(aryRnd.shape[0]))
+
+    return aryNull, vecP, varPMax
+
+
+def check_perm_sym(lstNumSubs=(1, 2, 3, 5, 8, 11), varNumDpt=11, varNumRep=3,
+                   varSeed=0):
+    """
+    Compare symmetry-halved exact permutation tests with brute force.
+
+    Parameters
+    ----------
+    lstNumSubs : tuple
+        Numbers of subjects to check.
+    varNumDpt : int
+        Number of depth levels.
+    varNumRep : int
+        Number of random data sets per number of subjects.
+    varSeed : int
+        Seed for random number generator.
+
+    Notes
+    -----
+    A `ValueError` is raised if a result differs. P-values need to be
+    identical; percentiles of the in-memory test need to be identical, and
+    percentiles of `exact_null` (from histogram) need to be within one
+    histogram bin. The mean of the null distribution is zero for the
+    symmetry-halved tests, and needs to be within rounding error for brute
+    force.
+    """
+    objRng = np.random.RandomState(varSeed)
+
+    for varNumSubs in lstNumSubs:
+        for idxRep in range(varNumRep):
+
+            # Random depth profiles, with a condition difference:
+            aryDpth01 = (objRng.randn(varNumSubs, varNumDpt)
+                         + np.linspace(0.0, 1.0, num=varNumDpt)[None, :])
+            aryDpth02 = objRng.randn(varNumSubs, varNumDpt)
+            vecNumInc = objRng.randint(100, 2000,
+                                       size=varNumSubs).astype(np.float64)
+            if idxRep == 0:
+                # Ties between subjects (equal profiles):
+                aryDpth02[0, :] = aryDpth01[0, :]
+                vecNumInc = None
+
+            vecWght = (np.ones(varNumSubs) if vecNumInc is None
+                       else vecNumInc)
+
+            aryNull01, vecP01, varPMax01 = perm_brute(aryDpth01, aryDpth02,
+                                                      vecWght)
+
+            aryNull02, vecP02, _ = permute(aryDpth01, aryDpth02,
+                                           vecNumInc=vecNumInc, varNumIt=None)
+            varPMax02 = permute_max(aryDpth01, aryDpth02, vecNumInc=vecNumInc,
+                                    varNumIt=None)
+
+            # Streaming test (small blocks, so that Gray code order is used):
+            aryDiff = np.subtract(aryDpth01, aryDpth02)
+            vecEmp = np.average(aryDiff, weights=vecWght, axis=0)
+            aryNull03, vecCnt03, varCntMax03, varNumIt03 = exact_null(
+                aryDiff, vecWght, vecEmp, varNumLow=2)
+            vecBnd = np.divide(np.sum(np.absolute(np.multiply(
+                aryDiff, vecWght[:, None])), axis=0), np.sum(vecWght))
+
+            lstErr = []
+            if not np.array_equal(vecP01, vecP02):
+                lstErr.append('p-values (permute)')
+            if not (varPMax01 == varPMax02):
+                lstErr.append('p-value (permute_max)')
+            if not np.array_equal(aryNull01[[0, 2], :], aryNull02[[0, 2], :]):
+                lstErr.append('percentiles (permute)')
+            if not np.allclose(aryNull01[1, :], aryNull02[1, :], rtol=0.0,
+                               atol=1e-12):
+                lstErr.append('mean (permute)')
+            if not np.array_equal(
+                    vecP01, np.divide(vecCnt03, float(varNumIt03))):
+                lstErr.append('p-values (exact_null)')
+            if not (varPMax01 == (float(varCntMax03) / float(varNumIt03))):
+                lstErr.append('p-value of maximum (exact_null)')
+            if not np.all(np.less_equal(
+                    np.absolute(aryNull01[[0, 2], :] - aryNull03[[0, 2], :]),
+                    (2.0 * vecBnd / float(VAR_NUM_BIN))[None, :] + 1e-12)):
+                lstErr.append('percentiles (exact_null)')
+
+            if lstErr:
+                strErrMsg = ('ERROR. Symmetry-halved exact test differs from '
+                             + 'brute force (' + str(varNumSubs)
+                             + ' subjects, data set ' + str(idxRep) + '): '
+                             + ', '.join(lstErr))
+                raise ValueError(strErrMsg)
+
+        print(('---' + str(varNumSubs) + ' subjects: identical to brute '
+               + 'force'))
+
+
+if __name__ == "__main__":
+    check_perm_sym()
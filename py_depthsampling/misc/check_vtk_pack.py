@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Check that vtk files are loaded identically from a packed container.
+
+Random meshes with several point data arrays (of different numbers of values
+per vertex) are written as ASCII and binary legacy vtk files and as XML
+PolyData files, and packed into a container (see
+`py_depthsampling.get_data.vtk_pack`). The data returned by `load_vtk_multi`
+and `load_vtk_single` from the container are compared with the data loaded
+from the vtk files (with containers disabled, and with a temporary vtk cache,
+so that the vtk index is used, which is needed for ASCII files with several
+arrays), for different strings preceding the data, numbers of values per
+vertex, and subsets of vertices.
+Requires h5py; no data are needed:
+
+    python -m py_depthsampling.misc.check_vtk_pack
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from py_depthsampling.get_data.load_vtk_multi import load_vtk_multi
+from py_depthsampling.get_data.load_vtk_single import load_vtk_single
+from py_depthsampling.get_data.vtk_cache import STR_ENV_DIR
+from py_depthsampling.get_data.vtk_io import write_vtk_mesh
+from py_depthsampling.get_data.vtk_pack import STR_ENV_PCK
+from py_depthsampling.get_data.vtk_pack import find_vtk_pack
+from py_depthsampling.get_data.vtk_pack import pack_vtk
+
+
+def load_both(strVtk, strPrcdData, varNumLne, varNumDpth, vecIdx, strCache):
+    """
+    Load vtk data from container and from vtk file.
+
+    Parameters
+    ----------
+    strVtk : str
+        Path of vtk file.
+    strPrcdData : str
+        Beginning of string which precedes vertex data in the vtk file.
+    varNumLne : int
+        Number of lines between `strPrcdData` and first data point.
+    varNumDpth : int or None
+        Number of values per vertex (`None` for `load_vtk_single`).
+    vecIdx : np.array or None
+        Indices of vertices to load.
+    strCache : str
+        Directory of temporary vtk cache.
+
+    Returns
+    -------
+    lstRes : list
+        Data (or error message) from container and from vtk file.
+    """
+    os.environ[STR_ENV_DIR] = strCache
+    lstRes = []
+    for strPck in ('', 'off'):
+        os.environ[STR_ENV_PCK] = strPck
+        try:
+            if varNumDpth is None:
+                lstRes.append(load_vtk_single(strVtk, strPrcdData, varNumLne,
+                                              vecIdx=vecIdx))
+            else:
+                lstRes.append(load_vtk_multi(strVtk, strPrcdData, varNumLne,
+                                             varNumDpth, vecIdx=vecIdx))
+        except ValueError as objErr:
+            lstRes.append('ValueError: ' + str(objErr))
+    os.environ.pop(STR_ENV_PCK)
+    os.environ.pop(STR_ENV_DIR)
+    return lstRes
+
+
+def check_vtk_pack(varNumVrtx=5000, varSeed=0):
+    """
+    Compare data loaded from container and from vtk files.
+
+    Parameters
+    ----------
+    varNumVrtx : int
+        Number of vertices of random meshes.
+    varSeed : int
+        Seed for random number generator.
+
+    Notes
+    -----
+    A `ValueError` is raised if the data differ, or if only one of the two
+    loads fails (e.g. because more values per vertex are requested than are
+    stored).
+    """
+    objRng = np.random.RandomState(varSeed)
+
+    strDir = tempfile.mkdtemp()
+
+    try:
+
+        # Random mesh with three point data arrays (the last one with fewer
+        # values per vertex than the others):
+        aryPnts = objRng.randn(varNumVrtx, 3)
+        aryPly = np.concatenate(
+            [np.full((varNumVrtx - 2, 1), 3),
+             np.arange(varNumVrtx - 2)[:, None] + np.arange(3)[None, :]],
+            axis=1).reshape(-1)
+        dicData = {'depth_data': objRng.randn(varNumVrtx, 11),
+                   'combined_mean': objRng.randn(varNumVrtx, 11),
+                   'single_depth': objRng.randn(varNumVrtx, 1)}
+
+        lstVtk = []
+        for strFrmt in ('ascii', 'binary', 'xml'):
+            strVtk = os.path.join(strDir, 'mesh_' + strFrmt
+                                  + ('.vtp' if strFrmt == 'xml' else '.vtk'))
+            write_vtk_mesh(strVtk, aryPnts, aryPly, dicData, strFrmt=strFrmt)
+            lstVtk.append(strVtk)
+
+        pack_vtk(strDir, strPattern='mesh_*')
+
+        # Random subset of vertices, in random order:
+        vecIdx = objRng.permutation(varNumVrtx)[:(varNumVrtx // 10)]
+
+        varNumCmp = 0
+        for strVtk in lstVtk:
+
+            if find_vtk_pack(strVtk) is None:
+                strErrMsg = ('ERROR. Vtk file not found in container: '
+                             + strVtk)
+                raise ValueError(strErrMsg)
+
+            for strPrcdData, varNumLne in (('SCALARS', 2),
+                                           ('SCALARS depth_data', 2),
+                                           ('SCALARS combined_mean', 2),
+                                           ('combined_mean', 2),
+                                           ('LOOKUP_TABLE', 1),
+                                           ('VECTORS', 2)):
+                for varNumDpth in (None, 1, 5, 11, 12):
+                    for vecTmp in (None, vecIdx):
+
+                        objPck, objVtk = load_both(
+                            strVtk, strPrcdData, varNumLne, varNumDpth, vecTmp,
+                            os.path.join(strDir, 'cache'))
+
+                        if isinstance(objPck, str) or isinstance(objVtk, str):
+                            lgcSame = (isinstance(objPck, str)
+                                       and isinstance(objVtk, str))
+                        else:
+                            lgcSame = ((objPck.shape == objVtk.shape)
+                                       and np.array_equal(objPck, objVtk))
+
+                        if not lgcSame:
+                            strErrMsg = ('ERROR. Data from container differ '
+                                         + 'from vtk file: '
+                                         + os.path.basename(strVtk) + ', "'
+                                         + strPrcdData + '", '
+                                         + str(varNumDpth) + ' values, '
+                                         + ('all' if vecTmp is None
+                                            else 'subset of')
+                                         + ' vertices (container: '
+                                         + str(objPck)[:80] + '; vtk file: '
+                                         + str(objVtk)[:80] + ').')
+                            raise ValueError(strErrMsg)
+
+                        varNumCmp += 1
+
+            print('---' + os.path.basename(strVtk)
+                  + ': identical to vtk file')
+
+        print('---' + str(varNumCmp) + ' comparisons.')
+
+    finally:
+        shutil.rmtree(strDir)
+
+
+if __name__ == "__main__":
+    check_vtk_pack()
@@ -24,20 +24,26 @@ Function of the depth sampling pipeline.
 
 import csv
 import numpy as np
+from scipy.spatial import cKDTree
+from py_depthsampling.get_data.vtk_cache import load_vtk_index
+from py_depthsampling.get_data.vtk_io import read_vtk_points
 
 
 def fix_roi_csv(strCsvRoi, strCsvRoiOut, strVtkIn, varNumHdrRoi=1,  #noqa
-                strPrcdCoor='POINTS', varNumLne=1, varRnd=1):
+                strPrcdCoor='POINTS', varNumLne=1, varRnd=1, varTol=None):
     """
     Fix indices in ROI definitions.
 
     Parameters
     ----------
-    strCsvRoi : string
+    strCsvRoi : string or list
         Base path of csv files with ROI definition (i.e. patch of cortex
-        selected on the surface, e.g. V1 or V2).
-    strCsvRoiOut : string
-        Output path of modified csv file.
+        selected on the surface, e.g. V1 or V2). Can be a list of paths, in
+        which case all ROIs are fixed with respect to the same reference vtk
+        mesh (which is only loaded once).
+    strCsvRoiOut : string or list
+        Output path of modified csv file (list of paths if `strCsvRoi` is a
+        list).
     strVtkIn : string
         Path of reference vtk file. The coordinates of vertices in the ROI csv
         file are compared with the coordinate of vertices in this vtk mesh, and
@@ -54,11 +60,19 @@ def fix_roi_csv(strCsvRoi, strCsvRoiOut, strVtkIn, varNumHdrRoi=1,  #noqa
     varRnd : int
         Number of decimal places after rounding for comparison of vertex
         coordinates between csv ROI and vtk mesh.
+    varTol : float or None
+        Maximum Euclidean distance between an ROI vertex and the closest vertex
+        in the vtk mesh. ROI vertices without a vtk vertex within this distance
+        are reported, and their index is left unchanged. If `None`, every ROI
+        vertex is assigned the index of the closest vtk vertex.
 
     Returns
     -------
-    This function has no return value. The indices in the csv file are updated,
-    and changes are written to disk.
+    vecUnmtch : np.array or list
+        Indices (zero-based, excluding header) of ROI vertices without a match
+        within the tolerance (empty if `varTol` is `None`). A list of such
+        arrays (one per csv file) if `strCsvRoi` is a list. The indices in the
+        csv file are updated, and changes are written to disk.
 
     Notes
     -----
@@ -68,69 +82,40 @@ def fix_roi_csv(strCsvRoi, strCsvRoiOut, strVtkIn, varNumHdrRoi=1,  #noqa
     file) and then edited. Here, such edited ROIs are loaded, and their
     indicies are replaced with those from a reference VTK mesh file, based on
     the correspondence of vertex coordinates between the VTK mesh and the CSV
-    ROI.
+    ROI. The closest vtk vertex is found with a KD-tree of the vtk vertex
+    coordinates.
     """
-    print('-Fixing vertex indices in ROI CSV file.')
-    print(('---CSV ROI: ' + strCsvRoi))
-
     # -------------------------------------------------------------------------
     # *** Load vtk file
 
     # Load single-depth-level vtk file (e.g. 'polar_angle_thr.vtk' that was
     # used to delineate ROI). Different to the standard ROI loading module
     # (i.e. 'load_vtk_single'), we do not only load the data, but the indices
-    # and coordinates of vertices.
-
-    # Open vtk file:
-    fleVtkIn = open(strVtkIn, 'r')
-
-    # Read file  vtk file:
-    csvIn = csv.reader(fleVtkIn,
-                       delimiter='\n',
-                       skipinitialspace=True)
-
-    # Create empty list for vertex data:
-    lstVtkData = []
-
-    # Loop through csv object to fill list with vertex data:
-    for lstTmp in csvIn:
-        for strTmp in lstTmp:
-            lstVtkData.append(strTmp[:])
-
-    # Close file:
-    fleVtkIn.close()
-
-    # Get index of string that precedes the vertex coordinates:
-    for idxSrch in range(0, len(lstVtkData)):
-        if lstVtkData[idxSrch].startswith((strPrcdCoor)):
-            varIdxTmp = idxSrch
-
-    # Get number of vertices from the line preceding the specified string. The
-    # string is supposed to be of the form 'POINTS 252382 float'. We split the
-    # string and assume that the second element is the number of vertices.
-    varNumDataVrtx = int(lstVtkData[varIdxTmp].split()[1])
+    # and coordinates of vertices. The vtk file may be in ASCII or binary
+    # legacy format, or in XML format.
+    aryPnts = read_vtk_points(strVtkIn, strPrcdCoor=strPrcdCoor,
+                              varNumLne=varNumLne,
+                              dicIdx=load_vtk_index(strVtkIn))
 
-    # Index of first vertex data point:
-    varIdxFrst = varIdxTmp + varNumLne
+    # Spatial index of vertex coordinates (the position of a vertex in this
+    # tree corresponds to its vertex ID in the vtk mesh):
+    objTree = cKDTree(aryPnts)
 
-    # Array for vertex coordinates (columns correspond to vertex ID, x-, y-,
-    # and z-position, respectively):
-    aryVtk = np.zeros((varNumDataVrtx, 4))
-
-    # Get vertex coordinates:
-    for idxData in range(0, varNumDataVrtx):
+    # -------------------------------------------------------------------------
+    # *** Fix CSV ROI indices
 
-        # Line of current vertex in csv list:
-        varTmpStrt = varIdxFrst + idxData
+    if isinstance(strCsvRoi, (list, tuple)):
+        return [_fix_one(strCsvTmp, strCsvOtTmp, objTree, varNumHdrRoi,
+                         varTol)
+                for strCsvTmp, strCsvOtTmp in zip(strCsvRoi, strCsvRoiOut)]
+    else:
+        return _fix_one(strCsvRoi, strCsvRoiOut, objTree, varNumHdrRoi, varTol)
 
-        # Put vertex data into array:
-        aryVtk[idxData, 0] = float(idxData)
-        aryVtk[idxData, 1] = float(lstVtkData[varTmpStrt].split()[0])
-        aryVtk[idxData, 2] = float(lstVtkData[varTmpStrt].split()[1])
-        aryVtk[idxData, 3] = float(lstVtkData[varTmpStrt].split()[2])
 
-    # 'aryVtk' now contains all vertex indices and coordinates:
-    # aryVtk[idxVertex, x, y, z]
+def _fix_one(strCsvRoi, strCsvRoiOut, objTree, varNumHdrRoi, varTol):
+    """Fix indices of one ROI csv file with respect to a vtk KD-tree."""
+    print('-Fixing vertex indices in ROI CSV file.')
+    print(('---CSV ROI: ' + strCsvRoi))
 
     # -------------------------------------------------------------------------
     # *** Load CSV ROI
@@ -154,56 +139,51 @@ def fix_roi_csv(strCsvRoi, strCsvRoiOut, strVtkIn, varNumHdrRoi=1,  #noqa
     # Close file:
     fleCsvRoi.close()
 
+    # Get lines of csv file (split into list of strings, corresponding to
+    # parameter value (e.g. polar angle), vertex ID, x-coordinate,
+    # y-coordinate, z-coordinate.
+    lstLnes = [strTmp.split(',') for strTmp in lstCsvRoi[varNumHdrRoi:]]
+
+    # Coordinates of ROI vertices (x, y, z):
+    aryRoiCoor = np.array([lstTmp[2:5] for lstTmp in lstLnes],
+                          dtype=np.float64).reshape(-1, 3)
+
     # -------------------------------------------------------------------------
     # *** Fix CSV ROI indices
 
-    # Loop through CSV file:
-    for idxCsv in range(varNumHdrRoi, len(lstCsvRoi)):
-
-        # Get current line of csv file (split into list of strings,
-        # corresponding to parameter value (e.g. polar angle), vertex ID,
-        # x-coordinate, y-coordinate, z-coordinate.
-        lstTmp = lstCsvRoi[idxCsv].split(',')
-
-        # Coordinates of current vertex (from CSV ROI; x, y, z):
-        vecTmpRoiCoor = np.array(lstTmp[2:5], dtype=np.float64)
-
-        # Eucledian distance between current ROI vertex and all vertices in
-        # vtk mesh:
-        aryTmpDst = np.sqrt(
-                            np.sum(
-                                   np.power(
-                                            np.subtract(aryVtk[:, 1:4],
-                                                        vecTmpRoiCoor[None,
-                                                                      :]
-                                                        ),
-                                            2.0),
-                                   axis=1)
-                            )
-
-        # Find vertex from vtk mesh with minimum distance to current ROI
-        # vertex:
-        varTmpIdxMin = np.argmin(aryTmpDst)
-
-        # 'varTmpIdxMin' is the index of the vertex closest to the current ROI
-        # vertex within the array ('aryVtk'). This index is probably (but not
-        # necessarily) identical to the vertex ID in the vtk mesh. To be safe,
-        # we obtain the actual vtk vertex ID.
-        strTmpIdxMin = str(int(np.around(aryVtk[varTmpIdxMin, 0])))
-
-        # We now have the index of the vertex from the vtk mesh which is
-        # closest tot he current CSV ROI vertex. We replace the (possibly
-        # wrong) vertex index in the CSV ROI with the vtk mesh index.
-
-        # Replace old (wrong) index with new index:
-        lstTmp[1] = strTmpIdxMin
-
-        # Converte list of strings to string (same as original line from
-        # csv file, just with new index):
-        strTmp = ','.join(lstTmp)
-
-        # Put modified line into csv list:
-        lstCsvRoi[idxCsv] = strTmp
+    # Find vertices from vtk mesh with minimum distance to ROI vertices (all
+    # ROI vertices at once):
+    if 0 < aryRoiCoor.shape[0]:
+        vecDst, vecIdxMin = objTree.query(aryRoiCoor, k=1)
+    else:
+        vecDst = np.zeros(0)
+        vecIdxMin = np.zeros(0, dtype=np.int64)
+
+    # ROI vertices without vtk vertex within tolerance:
+    if varTol is None:
+        vecLgcMtch = np.ones(vecDst.shape, dtype=bool)
+    else:
+        vecLgcMtch = np.less_equal(vecDst, varTol)
+    vecUnmtch = np.where(np.logical_not(vecLgcMtch))[0]
+
+    if 0 < vecUnmtch.size:
+        print(('---Number of ROI vertices without match within tolerance: '
+               + str(vecUnmtch.size) + ' (maximum distance: '
+               + str(np.max(vecDst)) + ')'))
+
+    for idxVrtx in range(len(lstLnes)):
+        if vecLgcMtch[idxVrtx]:
+
+            # We now have the index of the vertex from the vtk mesh which is
+            # closest to the current CSV ROI vertex. We replace the (possibly
+            # wrong) vertex index in the CSV ROI with the vtk mesh index.
+            lstTmp = lstLnes[idxVrtx]
+            lstTmp[1] = str(int(vecIdxMin[idxVrtx]))
+
+            # Converte list of strings to string (same as original line from
+            # csv file, just with new index), and put modified line into csv
+            # list:
+            lstCsvRoi[varNumHdrRoi + idxVrtx] = ','.join(lstTmp)
 
     # Replace header (to avoid problems with multiple delimiters, i.e. ' ' and
     # ',').
@@ -226,39 +206,46 @@ def fix_roi_csv(strCsvRoi, strCsvRoiOut, strVtkIn, varNumHdrRoi=1,  #noqa
     objCsvOt.close()
     # -------------------------------------------------------------------------
 
+    return vecUnmtch
 
-# -----------------------------------------------------------------------------
-# *** Run function
-
-# Region of interest ('v1' or 'v2'):
-lstRoi = ['v1', 'v2', 'v3']
 
-# Hemispheres ('lh' or 'rh'):
-lstHmsph = ['lh', 'rh']
+if __name__ == '__main__':
 
-# List of subject identifiers:
-lstSubIds = ['20171023',  # '20171109',
-             '20171204_01',
-             '20171204_02',
-             '20171211',
-             '20171213',
-             '20180111',
-             '20180118']
-
-# Path of input csv files (subject ID, hemisphere, and ROI left open):
-strCsvRoi = '/media/sf_D_DRIVE/MRI_Data_PhD/05_PacMan/{}/cbs/{}/{}.csv'
-
-# Path of output csv files (subject ID, hemisphere, and ROI left open):
-strCsvRoiOut = '/media/sf_D_DRIVE/MRI_Data_PhD/05_PacMan/{}/cbs/{}/{}_mod.csv'
-
-# Path of reference vtk file (subject ID and hemisphere left open):
-strVtkIn = '/media/sf_D_DRIVE/MRI_Data_PhD/05_PacMan/{}/cbs/{}/pRF_results_polar_angle_mid_GM_thr.vtk'  #noqa
-
-for idxSub in lstSubIds:
-    for idxHmpsh in lstHmsph:
-        for idxRoi in lstRoi:
-
-            fix_roi_csv(strCsvRoi.format(idxSub, idxHmpsh, idxRoi),
-                        strCsvRoiOut.format(idxSub, idxHmpsh, idxRoi),
+    # -------------------------------------------------------------------------
+    # *** Run function
+
+    # Region of interest ('v1' or 'v2'):
+    lstRoi = ['v1', 'v2', 'v3']
+
+    # Hemispheres ('lh' or 'rh'):
+    lstHmsph = ['lh', 'rh']
+
+    # List of subject identifiers:
+    lstSubIds = ['20171023',  # '20171109',
+                 '20171204_01',
+                 '20171204_02',
+                 '20171211',
+                 '20171213',
+                 '20180111',
+                 '20180118']
+
+    # Path of input csv files (subject ID, hemisphere, and ROI left open):
+    strCsvRoi = '/media/sf_D_DRIVE/MRI_Data_PhD/05_PacMan/{}/cbs/{}/{}.csv'
+
+    # Path of output csv files (subject ID, hemisphere, and ROI left open):
+    strCsvRoiOut = \
+        '/media/sf_D_DRIVE/MRI_Data_PhD/05_PacMan/{}/cbs/{}/{}_mod.csv'
+
+    # Path of reference vtk file (subject ID and hemisphere left open):
+    strVtkIn = '/media/sf_D_DRIVE/MRI_Data_PhD/05_PacMan/{}/cbs/{}/pRF_results_polar_angle_mid_GM_thr.vtk'  #noqa
+
+    # All ROIs of one hemisphere are fixed with respect to the same reference
+    # mesh:
+    for idxSub in lstSubIds:
+        for idxHmpsh in lstHmsph:
+            fix_roi_csv([strCsvRoi.format(idxSub, idxHmpsh, idxRoi)
+                         for idxRoi in lstRoi],
+                        [strCsvRoiOut.format(idxSub, idxHmpsh, idxRoi)
+                         for idxRoi in lstRoi],
                         strVtkIn.format(idxSub, idxHmpsh))
-# -----------------------------------------------------------------------------
+    # -------------------------------------------------------------------------
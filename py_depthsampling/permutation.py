@@ -29,9 +29,9 @@ Inputs are *.npz files containing depth profiles for each subject.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import numpy as np
-from py_depthsampling.permutation.perm_main import permute
-from py_depthsampling.plot.plt_dpth_prfl import plt_dpth_prfl
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # -----------------------------------------------------------------------------
@@ -87,170 +87,85 @@ varYmax = 0.5
 
 # Figure scaling factor:
 varDpi = 100.0
-# -----------------------------------------------------------------------------
-
 
-# -----------------------------------------------------------------------------
-# *** Preparations
+# Number of CPUs & memory (MB) for all comparisons together (`None` for all
+# CPUs & no memory limit):
+varCpuMax = None
+varMemMax = None
 
-# Number of comparisons:
-varNumDiff = len(lstDiff)
+# State file for resuming the batch after a crash (records of finished
+# comparisons; `None` to always run all comparisons):
+strState = None
 # -----------------------------------------------------------------------------
 
 
 # -----------------------------------------------------------------------------
 # *** Permutation test
 
-# Loop through models, ROIs, hemispheres, and conditions to create plots:
-for idxMtaCn in range(len(lstMetaCon)):  #noqa
-    for idxMdl in range(len(lstMdl)):  #noqa
-        for idxRoi in range(len(lstRoi)):
-            for idxHmsph in range(len(lstHmsph)):
-                for idxDiff in range(len(lstDiff)):
-
-                    # Condition names:
-                    strTmpCon01 = lstCon[lstDiff[idxDiff][0]]
-                    strTmpCon02 = lstCon[lstDiff[idxDiff][1]]
-
-                    # Only create plots for stimulus-sustained and
-                    # perihpery-transient:
-                    lgcPass = (
-                               (
-                                ('stimulus' in lstMetaCon[idxMtaCn])
-                                and
-                                ('sst' in strTmpCon01)
-                               )
-                               or
-                               (
-                                ('periphery' in lstMetaCon[idxMtaCn])
-                                and
-                                ('trn' in strTmpCon01)
-                                )
-                               )
-                    if lgcPass:
-
-                        # Plot title:
-                        strTtle = ((strTmpCon01 + ' minus ' + strTmpCon02))
-
-                        # Condition name for output file path:
-                        strPthCon = ((strTmpCon01 + '_min_' + strTmpCon02))
-
-                        # Path of first depth profile:
-                        strTmpPth01 = strPthPrf.format(
-                            lstMetaCon[idxMtaCn], lstRoi[idxRoi],
-                            lstHmsph[idxHmsph], strTmpCon01, lstMdl[idxMdl])
-
-                        # Path of second depth profile:
-                        strTmpPth02 = strPthPrf.format(
-                            lstMetaCon[idxMtaCn], lstRoi[idxRoi],
-                            lstHmsph[idxHmsph], strTmpCon02, lstMdl[idxMdl])
-
-                        # Load single subject depth profiles (shape
-                        # aryDpth[subject, depth]):
-                        objNpz01 = np.load(strTmpPth01)
-                        aryDpth01 = objNpz01['arySubDpthMns']
-                        objNpz02 = np.load(strTmpPth02)
-                        aryDpth02 = objNpz02['arySubDpthMns']
-
-                        # Array with number of vertices (for weighted averaging
-                        # across subjects), shape: vecNumInc[subjects].
-                        vecNumInc01 = objNpz01['vecNumInc']
-                        vecNumInc02 = objNpz02['vecNumInc']
-
-                        # Number of vertices are assumed to be the same for the
-                        # two conditions (since the data is sampled from the
-                        # same ROI). If not, raise an error.
-                        if np.all(np.equal(vecNumInc01, vecNumInc02)):
-                            vecNumInc = vecNumInc01
-                        else:
-                            strErrMsg = ('ERROR. Number of vertices within ROI'
-                                         + ' is not consistent across'
-                                         + ' conditions.')
-                            raise ValueError(strErrMsg)
-
-                        # Number of depth levels:
-                        varNumDpt = aryDpth01.shape[1]
-
-                        # Run permutation test:
-                        aryNull, vecP, aryEmpDiffMdn = permute(
-                            aryDpth01, aryDpth02, vecNumInc=vecNumInc,
-                            varNumIt=varNumIt, varLow=varLow, varUp=varUp)
-
-                        # Data array to be passed into plotting function,
-                        # containing the empirical condition difference and the
-                        # permutation difference:
-                        aryPlot01 = np.zeros((2, varNumDpt))
-                        aryPlot01[0, :] = aryEmpDiffMdn.flatten()
-                        aryPlot01[1, :] = aryNull[1, :].flatten()
-
-                        # Data array to be passed into plotting function,
-                        # containing the error shading (dummy array for
-                        # empirical data, because we do not plot the empirical
-                        # variance for better visibility, and the lower and
-                        # upper bounds of the permutation distribution:
-                        aryPlotErrLw = np.zeros((2, varNumDpt))
-                        aryPlotErrLw[1, :] = aryNull[0, :].flatten()
-                        aryPlotErrUp = np.zeros((2, varNumDpt))
-                        aryPlotErrUp[1, :] = aryNull[2, :].flatten()
-
-                        # Plot empirical condition difference and permutation
-                        # null distribution:
-                        plt_dpth_prfl(aryPlot01,
-                                      None,
-                                      varNumDpt,
-                                      2,
-                                      varDpi,
-                                      varYmin,
-                                      varYmax,
-                                      False,
-                                      ['Empirical condition difference',
-                                       'Permutation null distribution'],
-                                      'Cortical depth level',
-                                      'fMRI signal change [%]',
-                                      (lstRoi[idxRoi].upper()
-                                       + ' '
-                                       + lstHmsph[idxHmsph].upper()
-                                       + ' '
-                                       + strTtle),
-                                      True,
-                                      (strPthPltOt.format(lstMetaCon[idxMtaCn],
-                                                          lstRoi[idxRoi],
-                                                          lstHmsph[idxHmsph],
-                                                          strPthCon,
-                                                          lstMdl[idxMdl])
-                                       + strFlTp),
-                                      aryCnfLw=aryPlotErrLw,
-                                      aryCnfUp=aryPlotErrUp)
-
-                        # Reshape p-values for plot:
-                        vecP = vecP.reshape((1, varNumDpt))
-
-                        if False:
-
-                            # Plot p-value:
-                            plt_dpth_prfl(vecP,
-                                          np.zeros(vecP.shape),
-                                          varNumDpt,
-                                          1,
-                                          varDpi,
-                                          0.0,
-                                          0.5,
-                                          False,
-                                          ['p-value'],
-                                          'Cortical depth level (equivolume)',
-                                          'p-value',
-                                          (lstRoi[idxRoi].upper()
-                                           + ' '
-                                           + lstHmsph[idxHmsph].upper()
-                                           + ' '
-                                           + strTtle),
-                                          False,
-                                          (strPthPltOt.format(
-                                               lstMetaCon[idxMtaCn],
-                                               lstRoi[idxRoi],
-                                               lstHmsph[idxHmsph],
-                                               strPthCon, lstMdl[idxMdl])
-                                           + 'pval'
-                                           + strFlTp),
-                                          varNumLblY=6)
+# Comparisons for each meta-condition. Only create plots for
+# stimulus-sustained and perihpery-transient:
+dicDiff = {}
+for strMtaCn in lstMetaCon:
+    dicDiff[strMtaCn] = []
+    for tplDiff in lstDiff:
+
+        # Condition names:
+        strTmpCon01 = lstCon[tplDiff[0]]
+        strTmpCon02 = lstCon[tplDiff[1]]
+
+        lgcPass = ((('stimulus' in strMtaCn) and ('sst' in strTmpCon01))
+                   or (('periphery' in strMtaCn) and ('trn' in strTmpCon01)))
+
+        if lgcPass:
+            dicDiff[strMtaCn].append(
+                {'_strCon01': strTmpCon01,
+                 '_strCon02': strTmpCon02,
+                 # Plot title:
+                 '_strTtl': (strTmpCon01 + ' minus ' + strTmpCon02),
+                 # Condition name for output file path:
+                 '_strPthCon': (strTmpCon01 + '_min_' + strTmpCon02),
+                 '_name': (strTmpCon01 + '_min_' + strTmpCon02)})
+
+# One job per meta-condition, model, ROI, hemisphere, and comparison (see
+# `py_depthsampling.main.batch`):
+dicSpec = {'jobs': [{
+    'function': 'perm_plot',
+    'params': {'strPthPrf01': strPthPrf.format('${_strMetaCon}', '${_strRoi}',
+                                               '${_strHmsph}', '${_strCon01}',
+                                               '${_strMdl}'),
+               'strPthPrf02': strPthPrf.format('${_strMetaCon}', '${_strRoi}',
+                                               '${_strHmsph}', '${_strCon02}',
+                                               '${_strMdl}'),
+               'strPthPltOt': strPthPltOt.format('${_strMetaCon}',
+                                                 '${_strRoi}', '${_strHmsph}',
+                                                 '${_strPthCon}',
+                                                 '${_strMdl}'),
+               'strTtl': '${_strRoiLbl} ${_strHmsphLbl} ${_strTtl}',
+               'strFlTp': strFlTp,
+               'varNumIt': varNumIt,
+               'varLow': varLow,
+               'varUp': varUp,
+               'varYmin': varYmin,
+               'varYmax': varYmax,
+               'varDpi': varDpi},
+    'loops': {'_strMetaCon': [strMtaCn],
+              'mdl': [{'_strMdl': strMdl, '_name': (strMdl or 'none')}
+                      for strMdl in lstMdl],
+              '_strRoi': lstRoi,
+              '_strHmsph': lstHmsph,
+              'diff': dicDiff[strMtaCn]},
+    'match': {'_strRoi': {strRoi: {'_strRoiLbl': strRoi.upper()}
+                          for strRoi in lstRoi},
+              '_strHmsph': {strHmsph: {'_strHmsphLbl': strHmsph.upper()}
+                            for strHmsph in lstHmsph}}}
+    for strMtaCn in lstMetaCon]}
+
+if __name__ == "__main__":
+
+    # Run comparisons (in parallel, within CPU & memory budget):
+    lstRec = run_jobs(expand_jobs(dicSpec), varCpuMax=varCpuMax,
+                      varMemMax=varMemMax, strState=strState)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
 # -----------------------------------------------------------------------------
@@ -44,9 +44,10 @@ Function of the depth sampling pipeline.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import itertools
 import numpy as np
 from py_depthsampling.main.find_peak import find_peak
+from py_depthsampling.permutation.perm_engine import get_num_perm
+from py_depthsampling.permutation.perm_exec import peak_run
 
 
 # ----------------------------------------------------------------------------
@@ -63,6 +64,14 @@ objDpth02 = '/home/john/Dropbox/PacMan_Depth_Data/Higher_Level_Analysis/peripher
 # size for exact test, otherwise Monte Carlo resampling is performed):
 varNumIt = None
 
+# Seed for Monte Carlo resampling (if `None`, permutations are drawn from the
+# global random state, see `perm_exec.perm_run`):
+varSeed = None
+
+# Number of processes for resampling (parallel processing relies on the 'fork'
+# start method, because this script is executed at module level):
+varPar = 1
+
 
 # ----------------------------------------------------------------------------
 # *** Load depth profiles
@@ -154,105 +163,37 @@ print(('------Absolute difference in peak positions (empirical): '
 
 print('---Create permutation samples')
 
-# Random array that is used to permute V1 and V2 labels within subjects, of the
-# form aryRnd[idxIteration, idxSub]. For each iteration and subject, there is
-# either a zero or a one. 'Zero' means that the actual V1 value gets assigned
-# to the permuted 'V1' group and the actual V2 value gets assigned to the
-# permuted 'V2' group. 'One' means that the labels are switched, i.e. the
-# actual V1 label get assignet to the 'V2' group and vice versa.
-if not(varNumIt is None):
-    # Monte Carlo resampling:
-    aryRnd = np.random.randint(0, high=2, size=(varNumIt, varNumSubs))
-else:
-    # In case of tractable number of permutations, create a list of all
-    # possible permutations (Bernoulli sequence).
-    lstBnl = list(itertools.product([0, 1], repeat=varNumSubs))
-    aryRnd = np.array(lstBnl)
-    # Number of resampling cases:
-    varNumIt = len(lstBnl)
-
-# We need two versions of the randomisation array, one for sampling from the
-# first input array (e.g. V1), and a second version to sample from the second
-# input array (e.g. V2). (I.e. the second version is the opposite of the first
-# version.)
-aryRnd01 = np.equal(aryRnd, 1)
-aryRnd02 = np.equal(aryRnd, 0)
-del(aryRnd)
-
-# Arrays for permuted depth profiles for the two randomised groups:
-aryDpthRnd01 = np.zeros((varNumIt, varNumSubs, varNumCon, varNumDpt))
-aryDpthRnd02 = np.zeros((varNumIt, varNumSubs, varNumCon, varNumDpt))
-
-# Arrays for number of vertices for randomised groups:
-aryNumIncRnd01 = np.zeros((varNumIt, varNumSubs, varNumCon, varNumDpt))
-aryNumIncRnd02 = np.zeros((varNumIt, varNumSubs, varNumCon, varNumDpt))
-
-# Loop through iterations:
-for idxIt in range(0, varNumIt):
-
-    # Assign values from original group 1 to permutation group 1:
-    aryDpthRnd01[idxIt, aryRnd01[idxIt, :], :, :] = \
-        aryDpth01[aryRnd01[idxIt, :], :, :]
-
-    # Assign values from original group 2 to permutation group 1:
-    aryDpthRnd01[idxIt, aryRnd02[idxIt, :], :, :] = \
-        aryDpth02[aryRnd02[idxIt, :], :, :]
-
-    # Assign values from original group 1 to permutation group 2:
-    aryDpthRnd02[idxIt, aryRnd02[idxIt, :], :, :] = \
-        aryDpth01[aryRnd02[idxIt, :], :, :]
-
-    # Assign values from original group 2 to permutation group 2:
-    aryDpthRnd02[idxIt, aryRnd01[idxIt, :], :, :] = \
-        aryDpth02[aryRnd01[idxIt, :], :, :]
-
-    if '.npz' in objDpth01:
-
-        # Number of vertices from original group 1 to permutation group 1:
-        aryNumIncRnd01[idxIt, aryRnd01[idxIt, :], :, :] = \
-            vecNumIncRoi01[aryRnd01[idxIt, :], None, None]
-
-        # Number of vertices from original group 2 to permutation group 1:
-        aryNumIncRnd01[idxIt, aryRnd02[idxIt, :], :, :] = \
-            vecNumIncRoi02[aryRnd02[idxIt, :], None, None]
-
-        # Number of vertices from original group 1 to permutation group 2:
-        aryNumIncRnd02[idxIt, aryRnd02[idxIt, :], :, :] = \
-            vecNumIncRoi01[aryRnd02[idxIt, :], None, None]
-
-        # Number of vertices from original group 2 to permutation group 2:
-        aryNumIncRnd02[idxIt, aryRnd01[idxIt, :], :, :] = \
-            vecNumIncRoi02[aryRnd01[idxIt, :], None, None]
-
+# Weights for averaging across subjects in permutation samples (mean across
+# subjects for npy files, weighted mean for npz files):
 if '.npy' in objDpth01:
-
-    # Take mean across subjects in permutation samples:
-    aryDpthRnd01 = np.mean(aryDpthRnd01, axis=1)
-    aryDpthRnd02 = np.mean(aryDpthRnd02, axis=1)
-
+    vecWght01 = np.ones((varNumSubs))
+    vecWght02 = np.ones((varNumSubs))
 elif '.npz' in objDpth01:
+    vecWght01 = vecNumIncRoi01
+    vecWght02 = vecNumIncRoi02
 
-    # Weighted mean across subjects:
-    aryDpthRnd01 = np.average(aryDpthRnd01, axis=1, weights=vecNumIncRoi01)
-    aryDpthRnd02 = np.average(aryDpthRnd02, axis=1, weights=vecNumIncRoi02)
-
+# Exact test (all possible permutations)?
+lgcExct = varNumIt is None
 
-# ----------------------------------------------------------------------------
-# *** Find peaks in permutation samples
+# Number of resampling cases:
+varNumIt = get_num_perm(varNumSubs, varNumIt=varNumIt)
 
 print('---Find peaks in permutation samples')
 
-# Array for peak positions in permutation samples, of the form
-# aryPermPeaks01[idxCondition, idxIteration]
-aryPermPeaks01 = np.zeros((varNumCon, varNumIt))
-aryPermPeaks02 = np.zeros((varNumCon, varNumIt))
-
-# Loop through conditions and find peaks:
-for idxCon in range(0, varNumCon):
-    aryPermPeaks01[idxCon, :] = find_peak(aryDpthRnd01[:, idxCon, :],
-                                          lgcStat=False)
-    aryPermPeaks02[idxCon, :] = find_peak(aryDpthRnd02[:, idxCon, :],
-                                          lgcStat=False)
+# Permutation samples are created (and peaks are identified) in chunks of
+# iterations, so that memory usage does not depend on the number of iterations,
+# and chunks can be processed in parallel (see `perm_exec`). The permutation
+# matrix is of the form aryRnd[idxIteration, idxSub]. For each iteration and
+# subject, there is either a zero or a one. 'One' means that the actual V1
+# value gets assigned to the permuted 'V1' group and the actual V2 value gets
+# assigned to the permuted 'V2' group. 'Zero' means that the labels are
+# switched, i.e. the actual V1 label get assignet to the 'V2' group and vice
+# versa. In case of small enough sample size, all possible permutations
+# (Bernoulli sequences) are enumerated. Arrays for peak positions in
+# permutation samples, of the form aryPermPeaks01[idxCondition, idxIteration].
+aryPermPeaks01, _, aryPermPeaks02, _, _ = peak_run(
+    aryDpth01, aryDpth02, (vecWght01, vecWght01), (vecWght02, vecWght02),
+    varNumIt=(None if lgcExct else varNumIt), varSeed=varSeed, varPar=varPar)
 
 
 # ----------------------------------------------------------------------------
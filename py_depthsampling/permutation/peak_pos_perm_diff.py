@@ -19,12 +19,13 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import itertools
 import numpy as np
 from py_depthsampling.main.find_peak import find_peak
+from py_depthsampling.permutation.perm_exec import peak_run
 
 
-def peak_diff(strPthData, lstDiff, lstCon, varNumIt=1000, varThr=0.05):
+def peak_diff(strPthData, lstDiff, lstCon, varNumIt=1000, varThr=0.05,
+              varSeed=None, varPar=1):
     """
     Permutation test for condition differences on depth profiles.
 
@@ -50,6 +51,11 @@ def peak_diff(strPthData, lstDiff, lstCon, varNumIt=1000, varThr=0.05):
         of a peak below thershold, the difference in peak position (between the
         two conditions that are compared) is set to zero for the respective
         comparison.
+    varSeed : int or None
+        Seed for Monte Carlo resampling. If `None`, permutations are drawn from
+        the global random state (see `perm_exec.perm_run`).
+    varPar : int
+        Number of processes for resampling.
 
     Returns
     -------
@@ -119,9 +125,6 @@ def peak_diff(strPthData, lstDiff, lstCon, varNumIt=1000, varThr=0.05):
     vecNumIncB01 = objNpzB01['vecNumInc']
     # vecNumIncB02 = objNpzB02['vecNumInc']
 
-    # Number of subjects:
-    varNumSub = aryDpthA01.shape[0]
-
     # Number of depth levels:
     varNumDpth = aryDpthA01.shape[1]
 
@@ -184,71 +187,29 @@ def peak_diff(strPthData, lstDiff, lstCon, varNumIt=1000, varThr=0.05):
 
     print('---Create permutation samples')
 
-    # Random array that is used to permute condition labels within subjects, of
-    # the form aryRnd[idxIteration, idxSub]. For each iteration and subject,
-    # there is either a zero or a one. 'Zero' means that the actual label gets
-    # assigned to the permuted group. 'One' means that the labels are switched.
-    if not(varNumIt is None):
-        # Monte Carlo resampling:
-        aryRnd = np.random.randint(0, high=2, size=(varNumIt, varNumSub))
-    else:
-        # In case of tractable number of permutations, create a list of all
-        # possible permutations (Bernoulli sequence).
-        lstBnl = list(itertools.product([0, 1], repeat=varNumSub))
-        aryRnd = np.array(lstBnl)
-        # Number of resampling cases:
-        varNumIt = len(lstBnl)
-
-    # We need two versions of the randomisation array, one for sampling from
-    # the first input array, and a second version to sample from the second
-    # input array. (I.e. the second version is the inverse of the first
-    # version.)
-    aryRnd01 = np.equal(aryRnd, 1)
-    aryRnd02 = np.equal(aryRnd, 0)
-    del(aryRnd)
-
-    # Arrays for permuted depth profiles for the randomised groups:
-    aryDpthRndA = np.zeros((varNumIt, varNumSub, varNumDpth))
-    aryDpthRndB = np.zeros((varNumIt, varNumSub, varNumDpth))
-
-    # Loop through iterations:
-    for idxIt in range(0, varNumIt):
-
-        # Assign values from original group A to permutation group A:
-        aryDpthRndA[idxIt, aryRnd01[idxIt, :], :] = \
-            aryDpthDiffA[aryRnd01[idxIt, :], :]
-
-        # Assign values from original group B to permutation group A:
-        aryDpthRndA[idxIt, aryRnd02[idxIt, :], :] = \
-            aryDpthDiffB[aryRnd02[idxIt, :], :]
-
-        # Assign values from original group A to permutation group B:
-        aryDpthRndB[idxIt, aryRnd02[idxIt, :], :] = \
-            aryDpthDiffA[aryRnd02[idxIt, :], :]
-
-        # Assign values from original group B to permutation group B:
-        aryDpthRndB[idxIt, aryRnd01[idxIt, :], :] = \
-            aryDpthDiffB[aryRnd01[idxIt, :], :]
-
-    # -------------------------------------------------------------------------
-    # *** Average within permutation samples
-
-    # Weighted average (across subjects within permutation samples):
-    aryDpthRndA = np.average(aryDpthRndA, axis=1, weights=vecNumIncA01)
-    aryDpthRndB = np.average(aryDpthRndB, axis=1, weights=vecNumIncB01)
-
-    # -------------------------------------------------------------------------
-    # *** Find peaks in permutation samples
-
-    print('---Find peaks in permutation samples')
-
-    # Absolute difference (so as to also count negative peaks):
-    aryDpthRndA = np.absolute(aryDpthRndA)
-    aryDpthRndB = np.absolute(aryDpthRndB)
-
-    # Find peaks:
-    vecPermPeaksA, vecLgcA = find_peak(aryDpthRndA, varThr=varThr)
-    vecPermPeaksB, vecLgcB = find_peak(aryDpthRndB, varThr=varThr)
+    # Permutation samples are created (and peaks are identified) in chunks of
+    # iterations, so that memory usage does not depend on the number of
+    # iterations, and chunks can be processed in parallel (see `perm_exec`).
+    # The permutation matrix is of the form aryRnd[idxIteration, idxSub]. For
+    # each iteration and subject, there is either a zero or a one. 'One' means
+    # that the depth profile of the subject is assigned to the same
+    # permutation group (e.g. from original group A to permutation group A).
+    # 'Zero' means that the labels are switched. In case of small enough sample
+    # size (`varNumIt = None`), all possible permutations (Bernoulli sequences)
+    # are enumerated. The weighted average across subjects within permutation
+    # samples is calculated, and peaks are identified in the absolute
+    # difference (so as to also count negative peaks).
+    aryPermPeaksA, aryLgcA, aryPermPeaksB, aryLgcB, varNumIt = peak_run(
+        aryDpthDiffA, aryDpthDiffB, (vecNumIncA01, vecNumIncA01),
+        (vecNumIncB01, vecNumIncB01), varNumIt=varNumIt, lgcAbs=True,
+        dicPeak={'varThr': varThr}, varSeed=varSeed, varPar=varPar)
+
+    # Peak positions in permutation samples, and whether a peak was identified
+    # (single condition difference):
+    vecPermPeaksA = aryPermPeaksA[0, :]
+    vecPermPeaksB = aryPermPeaksB[0, :]
+    vecLgcA = aryLgcA[0, :]
+    vecLgcB = aryLgcB[0, :]
 
     # Ratio of iterations with peak:
     varRatioPeak = (float(np.sum(vecLgcA) + np.sum(vecLgcB))
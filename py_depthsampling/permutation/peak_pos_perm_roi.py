@@ -46,9 +46,10 @@ Function of the depth sampling pipeline.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import itertools
 import numpy as np
 from py_depthsampling.main.find_peak import find_peak
+from py_depthsampling.permutation.perm_engine import get_num_perm
+from py_depthsampling.permutation.perm_exec import peak_run
 
 
 # ----------------------------------------------------------------------------
@@ -76,6 +77,14 @@ strRoi02Con02 = '/home/john/Dropbox/PacMan_Depth_Data/Higher_Level_Analysis/stim
 # size for exact test, otherwise Monte Carlo resampling is performed):
 varNumIt = None
 
+# Seed for Monte Carlo resampling (if `None`, permutations are drawn from the
+# global random state, see `perm_exec.perm_run`):
+varSeed = None
+
+# Number of processes for resampling (parallel processing relies on the 'fork'
+# start method, because this script is executed at module level):
+varPar = 1
+
 # Standard deviation of the Gaussian kernel used for smoothing, relative to
 # cortical thickness (i.e. a value of 0.05 would result in a Gaussian with SD
 # of 5 percent of the cortical thickness).
@@ -194,97 +203,41 @@ print(('------Absolute difference in peak positions (empirical): '
 
 print('---Create permutation samples')
 
-# Random array that is used to permute V1 and V2 labels within subjects, of the
-# form aryRnd[idxIteration, idxSub]. For each iteration and subject, there is
-# either a zero or a one. 'Zero' means that the actual V1 value gets assigned
-# to the permuted 'V1' group and the actual V2 value gets assigned to the
-# permuted 'V2' group. 'One' means that the labels are switched, i.e. the
-# actual V1 label get assignet to the 'V2' group and vice versa.
-if not(varNumIt is None):
-    # Monte Carlo resampling:
-    aryRnd = np.random.randint(0, high=2, size=(varNumIt, varNumSubs))
-else:
-    # In case of tractable number of permutations, create a list of all
-    # possible permutations (Bernoulli sequence).
-    lstBnl = list(itertools.product([0, 1], repeat=varNumSubs))
-    aryRnd = np.array(lstBnl)
-    # Number of resampling cases:
-    varNumIt = len(lstBnl)
+# Exact test (all possible permutations)?
+lgcExct = varNumIt is None
+
+# Number of resampling cases:
+if lgcExct:
     print('------Testing complete set of possible resampling combinations.')
+varNumIt = get_num_perm(varNumSubs, varNumIt=varNumIt)
 print(('------Number of combinations: ' + str(varNumIt)))
 
-# We need two versions of the randomisation array, one for sampling from the
-# first input array (e.g. V1), and a second version to sample from the second
-# input array (e.g. V2). (I.e. the second version is the opposite of the first
-# version.)
-aryRnd01 = np.equal(aryRnd, 1)
-aryRnd02 = np.equal(aryRnd, 0)
-del(aryRnd)
-
-# Arrays with permuted depth profiles for the two randomised groups:
-aryDpthRnd01 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-aryDpthRnd02 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-
-# Arrays for number of vertices for randomised groups:
-aryNumIncRnd01 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-aryNumIncRnd02 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-
-# Loop through iterations:
-for idxIt in range(varNumIt):
-
-    # Assign values from original group 1 to permutation group 1:
-    aryDpthRnd01[idxIt, aryRnd01[idxIt, :], :] = \
-        aryCtrRoi01[aryRnd01[idxIt, :], :]
-
-    # Assign values from original group 2 to permutation group 1:
-    aryDpthRnd01[idxIt, aryRnd02[idxIt, :], :] = \
-        aryCtrRoi02[aryRnd02[idxIt, :], :]
-
-    # Assign values from original group 1 to permutation group 2:
-    aryDpthRnd02[idxIt, aryRnd02[idxIt, :], :] = \
-        aryCtrRoi01[aryRnd02[idxIt, :], :]
-
-    # Assign values from original group 2 to permutation group 2:
-    aryDpthRnd02[idxIt, aryRnd01[idxIt, :], :] = \
-        aryCtrRoi02[aryRnd01[idxIt, :], :]
-
-    # Assign number of vertices from original group 1 to permutation group 1:
-    aryNumIncRnd01[idxIt, aryRnd01[idxIt, :], :] = \
-        vecNumIncRoi01[aryRnd01[idxIt, :], None]
-
-    # Assign number of vertices from original group 2 to permutation group 1:
-    aryNumIncRnd01[idxIt, aryRnd02[idxIt, :], :] = \
-        vecNumIncRoi02[aryRnd02[idxIt, :], None]
-
-    # Assign number of vertices from original group 1 to permutation group 2:
-    aryNumIncRnd02[idxIt, aryRnd02[idxIt, :], :] = \
-        vecNumIncRoi01[aryRnd02[idxIt, :], None]
-
-    # Assign number of vertices from original group 2 to permutation group 2:
-    aryNumIncRnd02[idxIt, aryRnd01[idxIt, :], :] = \
-        vecNumIncRoi02[aryRnd01[idxIt, :], None]
-
-# Take mean across subjects in permutation samples:
-aryDpthRnd01 = np.average(aryDpthRnd01, axis=1, weights=aryNumIncRnd01)
-aryDpthRnd02 = np.average(aryDpthRnd02, axis=1, weights=aryNumIncRnd02)
-
-
-# ----------------------------------------------------------------------------
-# *** Find peaks in permutation samples
-
 print('---Find peaks in permutation samples')
 
-# Find peaks, permutation group 1:
-vecPermPeaks01, vecLgc01 = find_peak(aryDpthRnd01,
-                                     varSd=varSd,
-                                     varThr=varThr,
-                                     lgcStat=False)
-
-# Find peaks, permutation group 2:
-vecPermPeaks02, vecLgc02 = find_peak(aryDpthRnd02,
-                                     varSd=varSd,
-                                     varThr=varThr,
-                                     lgcStat=False)
+# Permutation samples are created (and peaks are identified) in chunks of
+# iterations, so that memory usage does not depend on the number of iterations,
+# and chunks can be processed in parallel (see `perm_exec`). The permutation
+# matrix is of the form aryRnd[idxIteration, idxSub]. For each iteration and
+# subject, there is either a zero or a one. 'One' means that the actual V1
+# value (and number of vertices) gets assigned to the permuted 'V1' group and
+# the actual V2 value gets assigned to the permuted 'V2' group. 'Zero' means
+# that the labels are switched, i.e. the actual V1 value get assignet to the
+# 'V2' group and vice versa. In case of small enough sample size, all possible
+# permutations (Bernoulli sequences) are enumerated. Mean depth profiles are
+# weighted with the number of vertices from the original group of each depth
+# profile.
+aryPermPeaks01, aryLgc01, aryPermPeaks02, aryLgc02, _ = peak_run(
+    aryCtrRoi01, aryCtrRoi02, (vecNumIncRoi01, vecNumIncRoi02),
+    (vecNumIncRoi01, vecNumIncRoi02),
+    varNumIt=(None if lgcExct else varNumIt),
+    dicPeak={'varSd': varSd, 'varThr': varThr}, varSeed=varSeed,
+    varPar=varPar)
+
+# Peak positions in permutation samples, and whether a peak was identified:
+vecPermPeaks01 = aryPermPeaks01[0, :]
+vecPermPeaks02 = aryPermPeaks02[0, :]
+vecLgc01 = aryLgc01[0, :]
+vecLgc02 = aryLgc02[0, :]
 
 # Ratio of iterations with peak:
 varRatioPeak = (float(np.sum(vecLgc01) + np.sum(vecLgc02))
@@ -0,0 +1,593 @@
+# -*- coding: utf-8 -*-
+"""
+Sign-flip engine for paired permutation tests.
+
+Function of the depth sampling pipeline.
+
+In a paired design with two conditions, swapping the condition labels of a
+subject negates the within-subject difference between conditions. Hence, the
+permutation null distribution of the (weighted) mean difference across
+subjects is a product of a sign-flip matrix (iterations x subjects) and the
+weighted difference profiles (subjects x depth levels), divided by the sum of
+weights. The null distribution is calculated in chunks of iterations, so that
+memory is bounded by the size of the null distribution itself (iterations x
+depth levels).
+
+For exact tests (all 2^N assignments of condition labels for N subjects), the
+assignments are enumerated in blocks (`iter_perm`), without creating a list of
+all assignments. For the weighted mean difference, `exact_null` walks the
+assignments without storing the null distribution (Gray code over the first
+subjects, block matrix over the remaining subjects), and accumulates counts
+and a histogram of the null distribution on the fly.
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+
+
+# Default number of iterations per chunk:
+VAR_CHNK = 8192
+
+# Maximum number of subjects for which the null distribution of an exact test
+# is held in memory (otherwise, see `exact_null`):
+VAR_NUM_SUB_EXCT = 16
+
+# Number of subjects in block matrix of `exact_null` (2^12 assignments per
+# block):
+VAR_NUM_LOW = 12
+
+# Number of histogram bins (per depth level) for quantiles of `exact_null`:
+VAR_NUM_BIN = 16384
+
+# Relative tolerance for ties between permuted and empirical differences in
+# `exact_null` (relative to the largest possible absolute difference):
+VAR_TOL = 1e-9
+
+
+def get_wght_sum(vecWght):
+    """
+    Sum of weights, as calculated by `np.average` (same rounding).
+
+    Parameters
+    ----------
+    vecWght : np.array
+        Weights of subjects, shape vecWght[subject].
+
+    Returns
+    -------
+    varScl : float
+        Sum of weights.
+    """
+    vecWght = np.asarray(vecWght, dtype=np.float64)
+    return np.sum(vecWght.reshape(1, -1, 1), axis=1)[0, 0]
+
+
+def sign_flip_null(aryDiff, vecWght, aryRnd, varChnk=VAR_CHNK):
+    """
+    Permutation null distribution of weighted mean difference.
+
+    Parameters
+    ----------
+    aryDiff : np.array
+        Within-subject difference between conditions (first minus second
+        condition), shape aryDiff[subject, depth].
+    vecWght : np.array
+        Weights of subjects (e.g. number of vertices), shape vecWght[subject].
+    aryRnd : np.array
+        Permutation matrix, shape aryRnd[iteration, subject]. A one means
+        that the condition labels of the subject are kept, a zero means that
+        they are swapped (as in `perm_main.permute`).
+    varChnk : int
+        Number of iterations per chunk.
+
+    Returns
+    -------
+    aryNull : np.array
+        Weighted mean difference across subjects for each iteration, shape
+        aryNull[iteration, depth].
+
+    Notes
+    -----
+    The weighted mean is accumulated subject by subject, in the same order
+    as `np.average`, and swapped labels negate the difference exactly.
+    Hence, the null distribution is identical (not only up to rounding) to
+    the one obtained by permuting the depth profiles and averaging with
+    `np.average`, so that ties between permuted and empirical differences
+    (e.g. for the identity permutation) are preserved.
+    """
+    varNumIt, varNumSubs = aryRnd.shape
+    varNumDpt = aryDiff.shape[1]
+
+    vecWght = np.asarray(vecWght, dtype=np.float64)
+    varScl = get_wght_sum(vecWght)
+
+    # Weighted differences (rows of the matrix product):
+    aryWghtDiff = np.multiply(aryDiff, vecWght[:, None])
+
+    aryNull = np.empty((varNumIt, varNumDpt))
+
+    for idxStrt in range(0, varNumIt, varChnk):
+
+        idxEnd = min(varNumIt, (idxStrt + varChnk))
+
+        # Signs for current chunk, shape arySgn[iteration, subject]:
+        arySgn = np.where(np.equal(aryRnd[idxStrt:idxEnd, :], 1), 1.0, -1.0)
+
+        # Sum over subjects (of sign-flipped, weighted differences):
+        aryAcc = np.multiply(arySgn[:, 0, None], aryWghtDiff[0, :][None, :])
+        for idxSub in range(1, varNumSubs):
+            aryAcc += np.multiply(arySgn[:, idxSub, None],
+                                  aryWghtDiff[idxSub, :][None, :])
+
+        aryNull[idxStrt:idxEnd, :] = np.divide(aryAcc, varScl)
+
+    return aryNull
+
+
+def loop_null(aryDpth01, aryDpth02, vecWght, aryRnd):
+    """
+    Permutation null distribution by permuting depth profiles.
+
+    Parameters
+    ----------
+    aryDpth01 : np.array
+        Depth profiles from first condition, shape aryDpth01[subject, depth].
+    aryDpth02 : np.array
+        Depth profiles from second condition, shape aryDpth02[subject, depth].
+    vecWght : np.array
+        Weights of subjects, shape vecWght[subject].
+    aryRnd : np.array
+        Permutation matrix, shape aryRnd[iteration, subject] (see
+        `sign_flip_null`).
+
+    Returns
+    -------
+    aryNull : np.array
+        Weighted mean difference across subjects for each iteration, shape
+        aryNull[iteration, depth].
+
+    Notes
+    -----
+    Reference implementation (previous version of `perm_main.permute`).
+    Memory usage is proportional to iterations x subjects x depth levels.
+    """
+    varNumIt, varNumSubs = aryRnd.shape
+    varNumDpt = aryDpth01.shape[1]
+
+    # We need two versions of the randomisation array, one for sampling from
+    # the first input array (e.g. 'PacMan Dynamic'), and a second version to
+    # sample from the second input array (e.g. 'PacMan Static'). (I.e. the
+    # second version is the opposite of the first version.)
+    aryRnd01 = np.equal(aryRnd, 1)
+    aryRnd02 = np.equal(aryRnd, 0)
+
+    # Arrays for permuted depth profiles for the two randomised groups:
+    aryDpthRnd01 = np.zeros((varNumIt, varNumSubs, varNumDpt))
+    aryDpthRnd02 = np.zeros((varNumIt, varNumSubs, varNumDpt))
+
+    # Loop through iterations:
+    for idxIt in range(0, varNumIt):
+
+        # Assign values from original group 1 to permutation group 1:
+        aryDpthRnd01[idxIt, aryRnd01[idxIt, :], :] = \
+            aryDpth01[aryRnd01[idxIt, :], :]
+
+        # Assign values from original group 2 to permutation group 1:
+        aryDpthRnd01[idxIt, aryRnd02[idxIt, :], :] = \
+            aryDpth02[aryRnd02[idxIt, :], :]
+
+        # Assign values from original group 1 to permutation group 2:
+        aryDpthRnd02[idxIt, aryRnd02[idxIt, :], :] = \
+            aryDpth01[aryRnd02[idxIt, :], :]
+
+        # Assign values from original group 2 to permutation group 2:
+        aryDpthRnd02[idxIt, aryRnd01[idxIt, :], :] = \
+            aryDpth02[aryRnd01[idxIt, :], :]
+
+    # Within-subject difference between conditions (separately for each
+    # iteration, subject, and depth level):
+    aryPermDiff = np.subtract(aryDpthRnd01, aryDpthRnd02)
+    del(aryDpthRnd01)
+    del(aryDpthRnd02)
+
+    # Mean condition difference across subjects (separately for each
+    # iteration and depth level):
+    return np.average(aryPermDiff, weights=vecWght, axis=1)
+
+
+def perm_null(aryDpth01, aryDpth02, vecWght, aryRnd, strEngine='sign'):
+    """
+    Permutation null distribution of weighted mean difference.
+
+    Parameters
+    ----------
+    aryDpth01 : np.array
+        Depth profiles from first condition, shape aryDpth01[subject, depth].
+    aryDpth02 : np.array
+        Depth profiles from second condition, shape aryDpth02[subject, depth].
+    vecWght : np.array
+        Weights of subjects, shape vecWght[subject].
+    aryRnd : np.array
+        Permutation matrix, shape aryRnd[iteration, subject] (see
+        `sign_flip_null`).
+    strEngine : str
+        'sign' (sign flip of within-subject differences, see
+        `sign_flip_null`) or 'loop' (permutation of depth profiles, see
+        `loop_null`). Both give identical results.
+
+    Returns
+    -------
+    aryNull : np.array
+        Weighted mean difference across subjects for each iteration, shape
+        aryNull[iteration, depth].
+    """
+    if strEngine == 'sign':
+        return sign_flip_null(np.subtract(aryDpth01, aryDpth02), vecWght,
+                              aryRnd)
+    elif strEngine == 'loop':
+        return loop_null(aryDpth01, aryDpth02, vecWght, aryRnd)
+    strErrMsg = ('ERROR. Unknown permutation engine: ' + str(strEngine)
+                 + " (options: 'sign', 'loop').")
+    raise ValueError(strErrMsg)
+
+
+def get_num_perm(varNumSubs, varNumIt=None):
+    """
+    Get number of permutations.
+
+    Parameters
+    ----------
+    varNumSubs : int
+        Number of subjects.
+    varNumIt : int or None
+        Number of Monte Carlo iterations, or `None` for an exact test.
+
+    Returns
+    -------
+    varNumIt : int
+        Number of permutations (2^N for exact test).
+    """
+    if varNumIt is None:
+        return 2 ** varNumSubs
+    return varNumIt
+
+
+def get_bnl(varNumSubs, varStrt=0, varEnd=None):
+    """
+    Get assignments of condition labels for exact test.
+
+    Parameters
+    ----------
+    varNumSubs : int
+        Number of subjects.
+    varStrt : int
+        Index of first assignment.
+    varEnd : int or None
+        Index after last assignment (`None` for 2^N).
+
+    Returns
+    -------
+    aryRnd : np.array
+        Assignments (Bernoulli sequences), shape aryRnd[assignment, subject].
+        Same order as `itertools.product([0, 1], repeat=varNumSubs)`, i.e. row
+        `i` contains the binary digits of `i` (first subject is the most
+        significant digit).
+    """
+    if varEnd is None:
+        varEnd = 2 ** varNumSubs
+    vecIt = np.arange(varStrt, varEnd, dtype=np.int64)
+    vecShft = np.arange((varNumSubs - 1), -1, -1, dtype=np.int64)
+    return np.bitwise_and(np.right_shift(vecIt[:, None], vecShft[None, :]),
+                          1)
+
+
+def iter_perm(varNumSubs, varNumIt=None, varChnk=VAR_CHNK):
+    """
+    Iterate over blocks of permutations.
+
+    Parameters
+    ----------
+    varNumSubs : int
+        Number of subjects.
+    varNumIt : int or None
+        Number of Monte Carlo iterations, or `None` for an exact test (all
+        possible assignments).
+    varChnk : int
+        Number of permutations per block.
+
+    Yields
+    ------
+    idxStrt : int
+        Index of first permutation in block.
+    aryRnd : np.array
+        Block of permutation matrix, shape aryRnd[iteration, subject] (see
+        `sign_flip_null`).
+
+    Notes
+    -----
+    Monte Carlo permutations are drawn from the global random state, block by
+    block; the permutations are the same as when drawing the whole
+    permutation matrix at once (`np.random.randint(0, high=2,
+    size=(varNumIt, varNumSubs))`).
+    """
+    varNumPerm = get_num_perm(varNumSubs, varNumIt=varNumIt)
+    for idxStrt in range(0, varNumPerm, varChnk):
+        idxEnd = min(varNumPerm, (idxStrt + varChnk))
+        if varNumIt is None:
+            aryRnd = get_bnl(varNumSubs, varStrt=idxStrt, varEnd=idxEnd)
+        else:
+            aryRnd = np.random.randint(0, high=2,
+                                       size=((idxEnd - idxStrt), varNumSubs))
+        yield idxStrt, aryRnd
+
+
+def perm_avg(aryDpth01, aryDpth02, aryRnd, vecWght01, vecWght02):
+    """
+    Weighted mean across subjects of permuted depth profiles.
+
+    Parameters
+    ----------
+    aryDpth01 : np.array
+        Depth profiles from first group, shape aryDpth01[subject, depth].
+    aryDpth02 : np.array
+        Depth profiles from second group, shape aryDpth02[subject, depth].
+    aryRnd : np.array
+        Permutation matrix, shape aryRnd[iteration, subject]. The depth
+        profile of a subject is taken from the first group where `aryRnd` is
+        one, and from the second group otherwise.
+    vecWght01 : np.array
+        Weights of subjects, for depth profiles taken from the first group,
+        shape vecWght01[subject].
+    vecWght02 : np.array
+        Weights of subjects, for depth profiles taken from the second group
+        (same as `vecWght01` if the weights are not permuted).
+
+    Returns
+    -------
+    aryMne : np.array
+        Weighted mean across subjects of permuted depth profiles, shape
+        aryMne[iteration, depth].
+
+    Notes
+    -----
+    Same as assigning the depth profiles and weights for each iteration, and
+    averaging with `np.average` (up to rounding), without arrays of shape
+    [iteration, subject, depth].
+    """
+    aryRnd01 = np.equal(aryRnd, 1).astype(np.float64)
+    aryRnd02 = np.subtract(1.0, aryRnd01)
+    vecWght01 = np.asarray(vecWght01, dtype=np.float64)
+    vecWght02 = np.asarray(vecWght02, dtype=np.float64)
+
+    # Weighted sum of depth profiles:
+    aryMne = np.add(np.dot(aryRnd01, np.multiply(aryDpth01,
+                                                 vecWght01[:, None])),
+                    np.dot(aryRnd02, np.multiply(aryDpth02,
+                                                 vecWght02[:, None])))
+
+    # Sum of weights:
+    vecScl = np.add(np.dot(aryRnd01, vecWght01), np.dot(aryRnd02, vecWght02))
+
+    return np.divide(aryMne, vecScl[:, None])
+
+
+def hist_prcnt(aryHst, vecBnd, varNumIt, varPrc):
+    """
+    Percentile of distribution from histogram.
+
+    Parameters
+    ----------
+    aryHst : np.array
+        Histogram counts, shape aryHst[depth, bin]. Bins are of equal width
+        between `-vecBnd` and `vecBnd`.
+    vecBnd : np.array
+        Bound of histogram, shape vecBnd[depth].
+    varNumIt : int
+        Number of samples.
+    varPrc : float
+        Percentile (between 0 and 100).
+
+    Returns
+    -------
+    vecPrc : np.array
+        Percentile, shape vecPrc[depth]. Samples within a bin are assumed to
+        be uniformly spaced, so the error is below the width of a bin.
+    """
+    varNumDpt, varNumBin = aryHst.shape
+
+    # Position of percentile in sorted samples (as `np.percentile`, linear
+    # interpolation between neighbouring samples):
+    varPos = float(varNumIt - 1) * varPrc / 100.0
+    idxRnk = min(int(np.floor(varPos)), (varNumIt - 1))
+    varFrc = varPos - float(idxRnk)
+
+    vecPrc = np.zeros(varNumDpt)
+    for idxDpt in range(varNumDpt):
+        vecCum = np.cumsum(aryHst[idxDpt, :])
+        varWdth = 2.0 * vecBnd[idxDpt] / float(varNumBin)
+        lstVal = []
+        for idxTmp in (idxRnk, min((idxRnk + 1), (varNumIt - 1))):
+            # Bin of sample (samples within a bin are assumed to be uniformly
+            # spaced):
+            idxBin = int(np.searchsorted(vecCum, idxTmp, side='right'))
+            varNumBfr = vecCum[idxBin] - aryHst[idxDpt, idxBin]
+            lstVal.append(-vecBnd[idxDpt]
+                          + (float(idxBin)
+                             + (float(idxTmp - varNumBfr) + 0.5)
+                             / float(aryHst[idxDpt, idxBin])) * varWdth)
+        vecPrc[idxDpt] = lstVal[0] + varFrc * (lstVal[1] - lstVal[0])
+
+    return vecPrc
+
+
+def exact_null(aryDiff, vecWght, vecEmp, varLow=2.5, varUp=97.5,
+               varNumBin=VAR_NUM_BIN, varTol=VAR_TOL, varNumLow=VAR_NUM_LOW):
+    """
+    Exact permutation test without storing the null distribution.
+
+    Parameters
+    ----------
+    aryDiff : np.array
+        Within-subject difference between conditions, shape aryDiff[subject,
+        depth].
+    vecWght : np.array
+        Weights of subjects, shape vecWght[subject].
+    vecEmp : np.array
+        Empirical (weighted mean) difference, shape vecEmp[depth].
+    varLow : float
+        Lower percentile of null distribution.
+    varUp : float
+        Upper percentile of null distribution.
+    varNumBin : int
+        Number of histogram bins per depth level (for percentiles).
+    varTol : float
+        Tolerance for ties between permuted and empirical differences,
+        relative to the largest possible absolute difference.
+    varNumLow : int
+        Number of subjects in block matrix (2^varNumLow assignments per
+        block).
+
+    Returns
+    -------
+    aryNull : np.array
+        Lower percentile, mean, and upper percentile of the null
+        distribution, shape aryNull[3, depth] (as `perm_main.permute`).
+    vecCnt : np.array
+        Number of assignments with a difference greater than or equal to the
+        empirical difference, shape vecCnt[depth].
+    varCntMax : int
+        Number of assignments with a maximum absolute difference (across
+        depth) greater than or equal to the empirical maximum absolute
+        difference (see `perm_max.permute_max`).
+    varNumIt : int
+        Number of assignments (2^N).
+
+    Notes
+    -----
+    Because switching the labels of all subjects negates the difference, the
+    null distribution is symmetric around zero. Hence, only the 2^(N-1)
+    assignments in which the labels of the first subject are switched are
+    evaluated; counts and histograms of the other half are obtained by
+    mirroring (and the mean is zero).
+
+    The assignments are walked in blocks. The assignments of the last
+    `varNumLow` subjects are the rows of a block matrix (precomputed sums of
+    sign-flipped, weighted differences). The assignments of the first
+    subjects are walked in Gray code order, so that each step flips the sign
+    of one subject and updates the sum of the first subjects in O(depth).
+    Memory usage is bounded by the size of a block (and of the histograms),
+    irrespective of the number of subjects.
+
+    The percentiles are obtained from histograms between -B and B, where B is
+    the largest possible absolute difference at each depth level (sum of
+    absolute weighted differences, divided by the sum of weights); their error
+    is below the bin width (2B / varNumBin). Because the sums are updated
+    incrementally, permuted differences may deviate from the directly
+    calculated differences by rounding errors; ties with the empirical
+    difference (e.g. for the identity permutation) are resolved with the
+    tolerance `varTol * B`.
+    """
+    varNumSubs, varNumDpt = aryDiff.shape
+
+    vecWght = np.asarray(vecWght, dtype=np.float64)
+    varScl = get_wght_sum(vecWght)
+
+    # Weighted differences:
+    aryWghtDiff = np.multiply(aryDiff, vecWght[:, None])
+
+    # Largest possible absolute difference (bound of null distribution):
+    vecBnd = np.divide(np.sum(np.absolute(aryWghtDiff), axis=0), varScl)
+
+    # Tolerance for ties:
+    vecThr = np.subtract(vecEmp, np.multiply(varTol, vecBnd))
+    varThrMax = (np.max(np.absolute(vecEmp)) - varTol * np.max(vecBnd))
+
+    # Scaling factor for histogram bins (avoid division by zero if all
+    # differences are zero):
+    vecBinScl = np.divide(float(varNumBin),
+                          np.multiply(2.0, np.maximum(vecBnd, 1e-300)))
+    vecBinOff = np.multiply(np.arange(varNumDpt), varNumBin)
+
+    # Only half of the assignments are evaluated: switching the labels of all
+    # subjects negates the difference, so the null distribution is symmetric
+    # around zero. The labels of the first subject are kept switched, and the
+    # other half of the assignments is mirrored. Number of subjects in block
+    # matrix (last subjects), and number of subjects walked in Gray code order
+    # (second to `varNumHgh + 1`-th subject):
+    varNumLow = min((varNumSubs - 1), varNumLow)
+    varNumHgh = varNumSubs - 1 - varNumLow
+
+    # Block matrix, sums of sign-flipped weighted differences of last
+    # subjects, for all assignments of their labels:
+    arySgnLow = np.subtract(np.multiply(2.0, get_bnl(varNumLow)), 1.0)
+    aryBlkLow = np.dot(arySgnLow, aryWghtDiff[(varNumHgh + 1):, :])
+    del(arySgnLow)
+
+    # Signs of first subjects, starting with all labels switched:
+    vecSgnHgh = np.ones(varNumHgh + 1) * -1.0
+    vecSumHgh = np.multiply(-1.0,
+                            np.sum(aryWghtDiff[:(varNumHgh + 1), :], axis=0))
+
+    vecCnt = np.zeros(varNumDpt, dtype=np.int64)
+    varCntMax = 0
+    vecHst = np.zeros((varNumDpt * varNumBin), dtype=np.int64)
+
+    for idxStp in range(2 ** varNumHgh):
+
+        if idxStp > 0:
+            # Gray code: flip the sign of one subject (lowest set bit of step
+            # index, counted from the last of the subjects walked in Gray code
+            # order):
+            idxSub = varNumHgh - ((idxStp & -idxStp).bit_length() - 1)
+            vecSgnHgh[idxSub] = -vecSgnHgh[idxSub]
+            vecSumHgh += np.multiply((2.0 * vecSgnHgh[idxSub]),
+                                     aryWghtDiff[idxSub, :])
+
+        # Mean differences for block of assignments:
+        aryBlk = np.divide(np.add(vecSumHgh[None, :], aryBlkLow), varScl)
+
+        # Count of block and of mirrored block (a negated difference is
+        # greater than or equal to the threshold if the difference is less
+        # than or equal to the negated threshold):
+        vecCnt += np.sum(np.greater_equal(aryBlk, vecThr[None, :]), axis=0)
+        vecCnt += np.sum(np.less_equal(aryBlk, -vecThr[None, :]), axis=0)
+
+        # The maximum absolute difference is the same for the mirrored block:
+        varCntMax += 2 * int(np.sum(np.greater_equal(
+            np.max(np.absolute(aryBlk), axis=1), varThrMax)))
+
+        # Histogram:
+        aryIdx = np.floor(np.multiply(np.add(aryBlk, vecBnd[None, :]),
+                                      vecBinScl[None, :])).astype(np.int64)
+        np.clip(aryIdx, 0, (varNumBin - 1), out=aryIdx)
+        vecHst += np.bincount(np.add(aryIdx, vecBinOff[None, :]).ravel(),
+                              minlength=(varNumDpt * varNumBin))
+
+    varNumIt = 2 ** varNumSubs
+
+    # Histogram of mirrored assignments (bins are symmetric around zero):
+    aryHst = vecHst.reshape(varNumDpt, varNumBin)
+    aryHst = np.add(aryHst, aryHst[:, ::-1])
+
+    # The mean of the (symmetric) null distribution is zero:
+    aryNull = np.array([hist_prcnt(aryHst, vecBnd, varNumIt, varLow),
+                        np.zeros(varNumDpt),
+                        hist_prcnt(aryHst, vecBnd, varNumIt, varUp)])
+
+    return aryNull, vecCnt, varCntMax, varNumIt
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel executor for Monte Carlo permutation tests.
+
+Function of the depth sampling pipeline.
+
+The permutation iterations are split into chunks of fixed size
+(`VAR_CHNK_MC`), and a function (e.g. calculating the null distribution, or
+peak positions, for a block of permutations) is applied to each chunk, on a
+pool of worker processes. The results are returned in chunk order, so that
+they can be merged (e.g. concatenation of null samples, or sum of exceedance
+counts) irrespective of which worker finished first.
+
+If a seed is provided, the permutations of each chunk are drawn from an
+independent random generator, which is created from a `SeedSequence` that
+only depends on the seed and the index of the chunk. Hence, results are
+identical for a given seed, irrespective of the number of worker processes.
+Without a seed, and with a single process, permutations are drawn from the
+global random state (`np.random`), as in previous versions (the results are
+identical to drawing the whole permutation matrix at once). Without a seed,
+and with several processes, a seed is drawn from the global random state (so
+that results can be reproduced with `np.random.seed`).
+
+For sequential Monte Carlo tests (see `perm_iter` and `seq_stop`), chunks are
+returned one at a time, and resampling can be stopped as soon as the
+confidence interval of the permutation p-value does not include the decision
+threshold (in the spirit of Besag & Clifford, 1991, Biometrika 78, 301-304).
+The stopping rule is evaluated after each chunk, in chunk order, so that the
+number of iterations does not depend on the number of processes either.
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import stats
+from py_depthsampling.main.find_peak import find_peak
+from py_depthsampling.permutation.perm_engine import get_bnl
+from py_depthsampling.permutation.perm_engine import get_num_perm
+from py_depthsampling.permutation.perm_engine import perm_avg
+
+
+# Number of permutations per chunk (fixed, so that the random permutations do
+# not depend on the number of processes):
+VAR_CHNK_MC = 1000
+
+# Number of permutations per chunk for sequential tests (the stopping rule is
+# evaluated after each chunk):
+VAR_CHNK_SEQ = 100
+
+
+def get_chnk_rnd(varNumSubs, varNumRow, varSeed, idxChnk):
+    """
+    Draw permutations for one chunk from a chunk-specific random generator.
+
+    Parameters
+    ----------
+    varNumSubs : int
+        Number of subjects.
+    varNumRow : int
+        Number of permutations in chunk.
+    varSeed : int
+        Seed of permutation test.
+    idxChnk : int
+        Index of chunk.
+
+    Returns
+    -------
+    aryRnd : np.array
+        Permutation matrix, shape aryRnd[iteration, subject], with zeros and
+        ones (see `perm_engine.sign_flip_null`).
+    """
+    objSeed = np.random.SeedSequence(varSeed, spawn_key=(idxChnk,))
+    objRng = np.random.default_rng(objSeed)
+    return objRng.integers(0, high=2, size=(varNumRow, varNumSubs))
+
+
+def _run_chnk(objFunc, lstArgs, dicKwargs, strKeyIdx, aryRnd, varNumSubs,
+              varSeed, idxChnk, idxStrt, idxEnd):
+    """Apply function to one chunk of permutations (in worker process)."""
+    if aryRnd is None:
+        if varSeed is None:
+            # Exact test:
+            aryRnd = get_bnl(varNumSubs, varStrt=idxStrt, varEnd=idxEnd)
+        else:
+            aryRnd = get_chnk_rnd(varNumSubs, (idxEnd - idxStrt), varSeed,
+                                  idxChnk)
+    dicKwargs = dict(dicKwargs)
+    if strKeyIdx is not None:
+        dicKwargs[strKeyIdx] = idxChnk
+    return objFunc(*lstArgs, aryRnd=aryRnd, **dicKwargs)
+
+
+def perm_iter(objFunc, varNumSubs, varNumIt=None, lstArgs=(), dicKwargs=None,
+              varSeed=None, varPar=1, varChnk=VAR_CHNK_MC, strKeyIdx=None):
+    """
+    Apply function to chunks of permutations, in parallel (generator).
+
+    Parameters
+    ----------
+    objFunc, varNumSubs, varNumIt, lstArgs, dicKwargs, varSeed, varPar,
+    varChnk, strKeyIdx
+        See `perm_run`.
+
+    Yields
+    ------
+    objOut : object
+        Return value of `objFunc`, for one chunk, in chunk order.
+
+    Notes
+    -----
+    Chunks are only evaluated when they are needed (with several processes,
+    at most two chunks per process are evaluated in advance). If the generator
+    is closed before all chunks have been returned (e.g. because a sequential
+    test has been stopped), pending chunks are cancelled.
+    """
+    dicKwargs = ({} if dicKwargs is None else dicKwargs)
+
+    varNumPerm = get_num_perm(varNumSubs, varNumIt=varNumIt)
+
+    # Chunks, list of tuples (index of chunk, first and last iteration):
+    lstChnk = [(idxChnk, idxStrt, min(varNumPerm, (idxStrt + varChnk)))
+               for idxChnk, idxStrt in enumerate(range(0, varNumPerm,
+                                                       varChnk))]
+
+    # Monte Carlo test without seed, with several processes: seed is drawn
+    # from global random state.
+    if (varNumIt is not None) and (varSeed is None) and (1 < varPar):
+        varSeed = int(np.random.randint(0, high=(2 ** 31 - 1)))
+
+    if (varPar == 1) or (len(lstChnk) == 1):
+
+        for idxChnk, idxStrt, idxEnd in lstChnk:
+            aryRnd = None
+            if (varNumIt is not None) and (varSeed is None):
+                # Legacy behaviour, draw permutations from global random
+                # state:
+                aryRnd = np.random.randint(0, high=2,
+                                           size=((idxEnd - idxStrt),
+                                                 varNumSubs))
+            yield _run_chnk(objFunc, lstArgs, dicKwargs, strKeyIdx, aryRnd,
+                            varNumSubs, varSeed, idxChnk, idxStrt, idxEnd)
+
+    else:
+
+        with ProcessPoolExecutor(max_workers=varPar) as objPool:
+            lstFtr = []
+            try:
+                for idxChnk, idxStrt, idxEnd in lstChnk:
+                    lstFtr.append(objPool.submit(_run_chnk, objFunc, lstArgs,
+                                                 dicKwargs, strKeyIdx, None,
+                                                 varNumSubs, varSeed, idxChnk,
+                                                 idxStrt, idxEnd))
+                    # Return results in chunk order (and raise exceptions
+                    # from worker processes), keeping at most two chunks per
+                    # process pending:
+                    if (2 * varPar) <= len(lstFtr):
+                        yield lstFtr.pop(0).result()
+                while lstFtr:
+                    yield lstFtr.pop(0).result()
+            finally:
+                for objFtr in lstFtr:
+                    objFtr.cancel()
+
+
+def perm_run(objFunc, varNumSubs, varNumIt=None, lstArgs=(), dicKwargs=None,
+             varSeed=None, varPar=1, varChnk=VAR_CHNK_MC, strKeyIdx=None):
+    """
+    Apply function to chunks of permutations, in parallel.
+
+    Parameters
+    ----------
+    objFunc : function
+        Function to apply to each chunk, called as `objFunc(*lstArgs,
+        aryRnd=aryRnd, **dicKwargs)`, where `aryRnd` is the permutation matrix
+        of the chunk (shape aryRnd[iteration, subject]). Needs to be defined
+        at module level (so that it can be sent to worker processes).
+    varNumSubs : int
+        Number of subjects.
+    varNumIt : int or None
+        Number of Monte Carlo iterations, or `None` for an exact test (all
+        possible assignments, enumerated in chunks).
+    lstArgs : tuple
+        Positional arguments for `objFunc`.
+    dicKwargs : dict or None
+        Keyword arguments for `objFunc`.
+    varSeed : int or None
+        Seed for random permutations. If `None`, permutations are drawn from
+        the global random state (see module docstring).
+    varPar : int
+        Number of worker processes.
+    varChnk : int
+        Number of permutations per chunk.
+    strKeyIdx : str or None
+        If not `None`, the index of the chunk is passed to `objFunc` as
+        keyword argument with this name (e.g. for progress output of the
+        first chunk only).
+
+    Returns
+    -------
+    lstOut : list
+        Return values of `objFunc`, in chunk order.
+    varNumIt : int
+        Number of permutations (2^N for exact test).
+    """
+    lstOut = list(perm_iter(objFunc, varNumSubs, varNumIt=varNumIt,
+                            lstArgs=lstArgs, dicKwargs=dicKwargs,
+                            varSeed=varSeed, varPar=varPar, varChnk=varChnk,
+                            strKeyIdx=strKeyIdx))
+
+    return lstOut, get_num_perm(varNumSubs, varNumIt=varNumIt)
+
+
+def get_p_ci(vecCnt, varNumIt, varConf=0.99):
+    """
+    Confidence interval of Monte Carlo permutation p-values.
+
+    Parameters
+    ----------
+    vecCnt : np.array or int
+        Number of resampling cases with a difference greater or equal to the
+        empirical difference.
+    varNumIt : int
+        Number of resampling cases.
+    varConf : float
+        Confidence level (exact, Clopper-Pearson interval).
+
+    Returns
+    -------
+    vecLow : np.array
+        Lower bound of confidence interval (same shape as `vecCnt`).
+    vecUp : np.array
+        Upper bound of confidence interval.
+    """
+    vecCnt = np.asarray(vecCnt, dtype=np.float64)
+    varTail = 0.5 * (1.0 - varConf)
+
+    # Bounds from beta distribution (the bounds are zero and one if no case,
+    # or all cases, exceeded the empirical difference):
+    with np.errstate(invalid='ignore'):
+        vecLow = np.where(np.greater(vecCnt, 0.0),
+                          stats.beta.ppf(varTail, vecCnt,
+                                         (varNumIt - vecCnt + 1.0)),
+                          0.0)
+        vecUp = np.where(np.less(vecCnt, varNumIt),
+                         stats.beta.ppf((1.0 - varTail), (vecCnt + 1.0),
+                                        (varNumIt - vecCnt)),
+                         1.0)
+
+    return vecLow, vecUp
+
+
+def seq_stop(vecCnt, varNumIt, varAlpha=0.05, varConf=0.99):
+    """
+    Stopping rule of sequential Monte Carlo permutation test.
+
+    Parameters
+    ----------
+    vecCnt : np.array or int
+        Number of resampling cases with a difference greater or equal to the
+        empirical difference (e.g. one count per depth level).
+    varNumIt : int
+        Number of resampling cases so far.
+    varAlpha : float
+        Decision threshold for p-values.
+    varConf : float
+        Confidence level of p-values (see `get_p_ci`).
+
+    Returns
+    -------
+    lgcStop : bool
+        Whether resampling can be stopped, i.e. whether for all p-values, the
+        confidence interval does not include the threshold (the decision
+        would not change with more iterations, with the given confidence).
+    """
+    vecLow, vecUp = get_p_ci(vecCnt, varNumIt, varConf=varConf)
+
+    return bool(np.all(np.logical_or(np.less(vecUp, varAlpha),
+                                     np.greater(vecLow, varAlpha))))
+
+
+def peak_chnk(aryDpth01, aryDpth02, tplWght01, tplWght02, lgcAbs=False,
+              dicPeak=None, aryRnd=None):
+    """
+    Peak positions in permuted depth profiles, for one chunk of permutations.
+
+    Parameters
+    ----------
+    aryDpth01 : np.array
+        Depth profiles from first group, shape aryDpth01[subject, depth] or
+        aryDpth01[subject, condition, depth].
+    aryDpth02 : np.array
+        Depth profiles from second group (same shape as `aryDpth01`).
+    tplWght01 : tuple
+        Weights of subjects for the first permutation group, for depth
+        profiles taken from the first and second group (see
+        `perm_engine.perm_avg`).
+    tplWght02 : tuple
+        Weights of subjects for the second permutation group, for depth
+        profiles taken from the first and second group.
+    lgcAbs : bool
+        Whether to find peaks in the absolute mean depth profiles.
+    dicPeak : dict or None
+        Keyword arguments for `find_peak` (`lgcStat` is set to `False`).
+    aryRnd : np.array
+        Permutation matrix of chunk, shape aryRnd[iteration, subject]. The
+        depth profile of a subject is taken from the first group for the
+        first permutation group where `aryRnd` is one, and for the second
+        permutation group otherwise.
+
+    Returns
+    -------
+    aryPeaks01 : np.array
+        Peak positions, first permutation group, shape aryPeaks01[condition,
+        iteration] (a single condition for two-dimensional input).
+    aryLgc01 : np.array or None
+        Whether a peak above threshold was found, first permutation group
+        (`None` if no threshold is provided in `dicPeak`).
+    aryPeaks02 : np.array
+        Peak positions, second permutation group.
+    aryLgc02 : np.array or None
+        Whether a peak above threshold was found, second permutation group.
+    """
+    dicPeak = dict({} if dicPeak is None else dicPeak)
+    dicPeak['lgcStat'] = False
+    lgcThr = dicPeak.get('varThr', None) is not None
+
+    if aryDpth01.ndim == 2:
+        aryDpth01 = aryDpth01[:, None, :]
+        aryDpth02 = aryDpth02[:, None, :]
+
+    varNumCon = aryDpth01.shape[1]
+    varNumRow = aryRnd.shape[0]
+
+    aryPeaks01 = np.zeros((varNumCon, varNumRow))
+    aryPeaks02 = np.zeros((varNumCon, varNumRow))
+    aryLgc01 = np.zeros((varNumCon, varNumRow), dtype=bool)
+    aryLgc02 = np.zeros((varNumCon, varNumRow), dtype=bool)
+
+    for idxCon in range(varNumCon):
+
+        # Weighted mean across subjects in permutation samples:
+        aryDpthRnd01 = perm_avg(aryDpth01[:, idxCon, :],
+                                aryDpth02[:, idxCon, :], aryRnd,
+                                tplWght01[0], tplWght01[1])
+        aryDpthRnd02 = perm_avg(aryDpth01[:, idxCon, :],
+                                aryDpth02[:, idxCon, :],
+                                np.subtract(1, aryRnd), tplWght02[0],
+                                tplWght02[1])
+
+        if lgcAbs:
+            aryDpthRnd01 = np.absolute(aryDpthRnd01)
+            aryDpthRnd02 = np.absolute(aryDpthRnd02)
+
+        if lgcThr:
+            aryPeaks01[idxCon, :], aryLgc01[idxCon, :] = \
+                find_peak(aryDpthRnd01, **dicPeak)
+            aryPeaks02[idxCon, :], aryLgc02[idxCon, :] = \
+                find_peak(aryDpthRnd02, **dicPeak)
+        else:
+            aryPeaks01[idxCon, :] = find_peak(aryDpthRnd01, **dicPeak)
+            aryPeaks02[idxCon, :] = find_peak(aryDpthRnd02, **dicPeak)
+
+    if not lgcThr:
+        aryLgc01 = None
+        aryLgc02 = None
+
+    return aryPeaks01, aryLgc01, aryPeaks02, aryLgc02
+
+
+def peak_run(aryDpth01, aryDpth02, tplWght01, tplWght02, varNumIt=None,
+             lgcAbs=False, dicPeak=None, varSeed=None, varPar=1):
+    """
+    Peak positions in permuted depth profiles (see `peak_chnk`).
+
+    Parameters
+    ----------
+    aryDpth01, aryDpth02, tplWght01, tplWght02, lgcAbs, dicPeak
+        See `peak_chnk`.
+    varNumIt : int or None
+        Number of Monte Carlo iterations, or `None` for exact test.
+    varSeed : int or None
+        Seed for random permutations (see `perm_run`).
+    varPar : int
+        Number of worker processes.
+
+    Returns
+    -------
+    aryPeaks01, aryLgc01, aryPeaks02, aryLgc02 : np.array
+        See `peak_chnk`, for all permutations (merged in chunk order).
+    varNumIt : int
+        Number of permutations.
+    """
+    lstOut, varNumIt = perm_run(peak_chnk, aryDpth01.shape[0],
+                                varNumIt=varNumIt,
+                                lstArgs=(aryDpth01, aryDpth02, tplWght01,
+                                         tplWght02),
+                                dicKwargs={'lgcAbs': lgcAbs,
+                                           'dicPeak': dicPeak},
+                                varSeed=varSeed, varPar=varPar)
+
+    lstMrg = []
+    for idxOut in range(4):
+        if lstOut[0][idxOut] is None:
+            lstMrg.append(None)
+        else:
+            lstMrg.append(np.concatenate([tplOut[idxOut] for tplOut in lstOut],
+                                         axis=1))
+
+    return lstMrg[0], lstMrg[1], lstMrg[2], lstMrg[3], varNumIt
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Permutation tests on data loaded from disk.
+
+The functions are run as jobs of the permutation scripts (one job per
+comparison, see `py_depthsampling.main.batch`), and return their results.
+
+Function of the depth sampling pipeline.
+"""
+
+# Part of py_depthsampling library
+# Copyright (C) 2018 Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pickle
+import numpy as np
+from py_depthsampling.permutation.perm_main import permute
+from py_depthsampling.permutation.perm_max import permute_max
+from py_depthsampling.plot.plt_dpth_prfl import plt_dpth_prfl
+
+
+def load_prf_pair(strPthPrf01, strPthPrf02, lgcMean=False):
+    """
+    Load single subject depth profiles of two conditions.
+
+    Parameters
+    ----------
+    strPthPrf01 : str
+        Path of depth profiles of first condition (npz file).
+    strPthPrf02 : str
+        Path of depth profiles of second condition (npz file).
+    lgcMean : bool
+        If `False`, the number of vertices per subject has to be the same for
+        the two conditions (since the data is sampled from the same ROI).
+        If `True`, the mean number of vertices of the two conditions is used
+        (e.g. because of asymetric ROIs in the surface experiment).
+
+    Returns
+    -------
+    aryDpth01 : np.array
+        Depth profiles of first condition, shape aryDpth01[subject, depth].
+    aryDpth02 : np.array
+        Depth profiles of second condition, shape aryDpth02[subject, depth].
+    vecNumInc : np.array
+        Number of vertices per subject (for weighted averaging across
+        subjects), shape vecNumInc[subject].
+    """
+    # Load single subject depth profiles (shape aryDpth[subject, depth]):
+    objNpz01 = np.load(strPthPrf01)
+    aryDpth01 = objNpz01['arySubDpthMns']
+    objNpz02 = np.load(strPthPrf02)
+    aryDpth02 = objNpz02['arySubDpthMns']
+
+    # Array with number of vertices (for weighted averaging across subjects),
+    # shape: vecNumInc[subjects].
+    vecNumInc01 = objNpz01['vecNumInc']
+    vecNumInc02 = objNpz02['vecNumInc']
+
+    if lgcMean:
+        vecNumInc = np.around(
+                              np.multiply(
+                                          np.add(vecNumInc01,
+                                                 vecNumInc02
+                                                 ).astype(np.float32),
+                                          0.5)
+                              ).astype(np.int32)
+
+    elif np.all(np.equal(vecNumInc01, vecNumInc02)):
+        vecNumInc = vecNumInc01
+
+    else:
+        strErrMsg = ('ERROR. Number of vertices within ROI is not consistent'
+                     + ' across conditions.')
+        raise ValueError(strErrMsg)
+
+    return aryDpth01, aryDpth02, vecNumInc
+
+
+def perm_plot(strPthPrf01, strPthPrf02, strPthPltOt, strTtl, strFlTp='.png',
+              varNumIt=None, varLow=2.5, varUp=97.5, varYmin=-0.5,
+              varYmax=0.5, varDpi=100.0, lgcPltP=False):
+    """
+    Permutation test for difference between two depth profiles, with plot.
+
+    Parameters
+    ----------
+    strPthPrf01 : str
+        Path of depth profiles of first condition (npz file).
+    strPthPrf02 : str
+        Path of depth profiles of second condition (npz file).
+    strPthPltOt : str
+        Output path & prefix for plots.
+    strTtl : str
+        Plot title.
+    strFlTp : str
+        File type suffix for plot.
+    varNumIt : int or None
+        Number of resampling iterations (set to `None` in case of small enough
+        sample size for exact test, otherwise Monte Carlo resampling is
+        performed).
+    varLow : float
+        Lower bound of confidence interval of permutation null distribution
+        (for plot).
+    varUp : float
+        Upper bound of confidence interval of permutation null distribution
+        (for plot).
+    varYmin : float
+        Lower limit of y-axis.
+    varYmax : float
+        Upper limit of y-axis.
+    varDpi : float
+        Figure scaling factor.
+    lgcPltP : bool
+        Whether to also plot the p-values.
+
+    Notes
+    -----
+    Plots the empirical condition difference and the permutation null
+    distribution over cortical depth.
+    """
+    aryDpth01, aryDpth02, vecNumInc = load_prf_pair(strPthPrf01, strPthPrf02)
+
+    # Number of depth levels:
+    varNumDpt = aryDpth01.shape[1]
+
+    # Run permutation test:
+    aryNull, vecP, aryEmpDiffMdn = permute(
+        aryDpth01, aryDpth02, vecNumInc=vecNumInc,
+        varNumIt=varNumIt, varLow=varLow, varUp=varUp)
+
+    # Data array to be passed into plotting function, containing the empirical
+    # condition difference and the permutation difference:
+    aryPlot01 = np.zeros((2, varNumDpt))
+    aryPlot01[0, :] = aryEmpDiffMdn.flatten()
+    aryPlot01[1, :] = aryNull[1, :].flatten()
+
+    # Data array to be passed into plotting function, containing the error
+    # shading (dummy array for empirical data, because we do not plot the
+    # empirical variance for better visibility, and the lower and upper bounds
+    # of the permutation distribution:
+    aryPlotErrLw = np.zeros((2, varNumDpt))
+    aryPlotErrLw[1, :] = aryNull[0, :].flatten()
+    aryPlotErrUp = np.zeros((2, varNumDpt))
+    aryPlotErrUp[1, :] = aryNull[2, :].flatten()
+
+    # Plot empirical condition difference and permutation null distribution:
+    plt_dpth_prfl(aryPlot01,
+                  None,
+                  varNumDpt,
+                  2,
+                  varDpi,
+                  varYmin,
+                  varYmax,
+                  False,
+                  ['Empirical condition difference',
+                   'Permutation null distribution'],
+                  'Cortical depth level',
+                  'fMRI signal change [%]',
+                  strTtl,
+                  True,
+                  (strPthPltOt + strFlTp),
+                  aryCnfLw=aryPlotErrLw,
+                  aryCnfUp=aryPlotErrUp)
+
+    if lgcPltP:
+
+        # Reshape p-values for plot:
+        vecP = vecP.reshape((1, varNumDpt))
+
+        # Plot p-value:
+        plt_dpth_prfl(vecP,
+                      np.zeros(vecP.shape),
+                      varNumDpt,
+                      1,
+                      varDpi,
+                      0.0,
+                      0.5,
+                      False,
+                      ['p-value'],
+                      'Cortical depth level (equivolume)',
+                      'p-value',
+                      strTtl,
+                      False,
+                      (strPthPltOt + 'pval' + strFlTp),
+                      varNumLblY=6)
+
+
+def perm_max_prf(strPthPrf01, strPthPrf02, varNumIt=None):
+    """
+    Permutation test for difference between two depth profiles (maximum).
+
+    Parameters
+    ----------
+    strPthPrf01 : str
+        Path of depth profiles of first condition (npz file).
+    strPthPrf02 : str
+        Path of depth profiles of second condition (npz file).
+    varNumIt : int or None
+        Number of resampling iterations (set to `None` in case of small enough
+        sample size for exact test, otherwise Monte Carlo resampling is
+        performed).
+
+    Returns
+    -------
+    varP : float
+        Permutation p-value (see `permute_max`).
+
+    Notes
+    -----
+    Because of asymetric ROIs in the surface experiment (between 'Kanizsa
+    square' and 'Kanizsa rotated' conditions), there may be a slight
+    discrepancy in number of vertices across ROIs. We take the mean.
+    """
+    aryDpth01, aryDpth02, vecNumInc = load_prf_pair(strPthPrf01, strPthPrf02,
+                                                    lgcMean=True)
+
+    # Run permutation test:
+    varP = permute_max(aryDpth01,
+                       aryDpth02,
+                       vecNumInc=vecNumInc,
+                       varNumIt=varNumIt)
+
+    return varP
+
+
+def perm_max_ert(strPthErt, lstDiff, tplCmp, varNumIt=None):
+    """
+    Permutation test for differences between event-related timecourses.
+
+    Parameters
+    ----------
+    strPthErt : str
+        Path of event-related timecourses of all subjects (pickle, see
+        `py_depthsampling.ert.ert_main_surface`).
+    lstDiff : list
+        Which conditions to compare (list of tuples with condition indices).
+    tplCmp : tuple
+        Time window (start & end volume) over which the timecourses are
+        averaged before comparison.
+    varNumIt : int or None
+        Number of resampling iterations (set to `None` in case of small enough
+        sample size for exact test, otherwise Monte Carlo resampling is
+        performed).
+
+    Returns
+    -------
+    lstP : list
+        Permutation p-value of each comparison (see `permute_max`).
+
+    Notes
+    -----
+    The timecourses are loaded once for all comparisons.
+    """
+    # Load previously prepared event-related timecourses from pickle:
+    with open(strPthErt, 'rb') as fleErt:
+        dicAllSubsRoiErt = pickle.load(fleErt)
+
+    # Get subject IDs:
+    lstSubIds = list(dicAllSubsRoiErt.keys())
+
+    # Get number of depth levels:
+    varNumDpth = dicAllSubsRoiErt[lstSubIds[0]][0].shape[1]
+
+    # Number of subjects:
+    varNumSub = len(lstSubIds)
+
+    # Vector for number of vertices per subject (for weighter averaging across
+    # subjects):
+    vecNumInc = np.zeros(varNumSub)
+    for idxSub in range(varNumSub):
+        vecNumInc[idxSub] = dicAllSubsRoiErt[lstSubIds[idxSub]][1]
+
+    lstP = [None] * len(lstDiff)
+
+    for idxDiff in range(len(lstDiff)):
+
+        # Arrays for single-subject timecourses for both conditions, averaged
+        # over the time window:
+        aryErt01 = np.zeros((varNumSub, varNumDpth))
+        aryErt02 = np.zeros((varNumSub, varNumDpth))
+
+        for idxSub in range(varNumSub):
+
+            # Get ERT array for current subject, shape:
+            # aryErtTmp[condition, depth, time].
+            aryErtTmp = dicAllSubsRoiErt[lstSubIds[idxSub]][0]
+
+            # Mean over time window, for the conditions to compare:
+            aryErt01[idxSub] = np.mean(
+                aryErtTmp[lstDiff[idxDiff][0], :, tplCmp[0]:tplCmp[1]],
+                axis=1)
+            aryErt02[idxSub] = np.mean(
+                aryErtTmp[lstDiff[idxDiff][1], :, tplCmp[0]:tplCmp[1]],
+                axis=1)
+
+        # Run permutation test:
+        lstP[idxDiff] = permute_max(aryErt01,
+                                    aryErt02,
+                                    vecNumInc=vecNumInc,
+                                    varNumIt=varNumIt)
+
+    return lstP
@@ -22,12 +22,20 @@ Function of the depth sampling pipeline.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import itertools
 import numpy as np
+from py_depthsampling.permutation.perm_engine import VAR_NUM_SUB_EXCT
+from py_depthsampling.permutation.perm_engine import get_bnl
+from py_depthsampling.permutation.perm_engine import exact_null
+from py_depthsampling.permutation.perm_engine import perm_null
+from py_depthsampling.permutation.perm_exec import VAR_CHNK_MC
+from py_depthsampling.permutation.perm_exec import VAR_CHNK_SEQ
+from py_depthsampling.permutation.perm_exec import perm_iter
+from py_depthsampling.permutation.perm_exec import seq_stop
 
 
 def permute(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000, varLow=2.5,
-            varUp=97.5):
+            varUp=97.5, strEngine='sign', varSeed=None, varPar=1,
+            lgcSeq=False, varAlpha=0.05, varConf=0.99):
     """
     Permutation test for difference between conditions in depth profiles.
 
@@ -46,11 +54,36 @@ def permute(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000, varLow=2.5,
     varNumIt : int or None
         Number of resampling iterations. Set to `None` in case of small enough
         sample size for exact test (i.e. all possible resamples), otherwise
-        Monte Carlo resampling is performed.
+        Monte Carlo resampling is performed. In case of an exact test with
+        more than `perm_engine.VAR_NUM_SUB_EXCT` subjects, the permutations
+        are not held in memory, and the bounds of the null distribution are
+        obtained from a histogram (see `perm_engine.exact_null`).
     varLow : float
         Lower bound of null distribution.
     varUp : float
         Upper bound of null distribution.
+    strEngine : str
+        Method for calculating the null distribution, 'sign' (matrix form;
+        sign flip of within-subject differences, memory bounded by the size
+        of the null distribution) or 'loop' (permutation of depth profiles,
+        previous implementation). Both give identical results.
+    varSeed : int or None
+        Seed for Monte Carlo resampling. If `None`, permutations are drawn from
+        the global random state (see `perm_exec.perm_run`). With a seed,
+        results do not depend on the number of processes.
+    varPar : int
+        Number of processes for Monte Carlo resampling.
+    lgcSeq : bool
+        Sequential Monte Carlo test. Permutations are drawn in chunks of
+        `perm_exec.VAR_CHNK_SEQ` iterations, and resampling is stopped as soon
+        as the confidence intervals of the p-values at all depth levels do not
+        include `varAlpha` (see `perm_exec.seq_stop`), or after `varNumIt`
+        iterations. The number of iterations is returned. Has no effect on
+        exact tests.
+    varAlpha : float
+        Decision threshold of sequential test.
+    varConf : float
+        Confidence level of p-values for sequential test.
 
     Returns
     -------
@@ -67,6 +100,10 @@ def permute(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000, varLow=2.5,
         condition difference.
     aryEmpDiffMdn : np.array
         Empirical difference between conditions (mean across subjects).
+    varNumIt : int
+        Number of resampling iterations (only returned if `lgcSeq` is
+        `True`). The bounds of the null distribution and the p-values are
+        based on this number of iterations.
 
     Notes
     -----
@@ -106,11 +143,41 @@ def permute(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000, varLow=2.5,
     if vecNumInc is None:
         vecNumInc = np.ones((varNumSubs))
 
+    # -------------------------------------------------------------------------
+    # *** Calculate empirical difference
+
+    print('---Calculate empirical difference')
+
+    # Empirical difference between conditions. First, calculate within-subject
+    # difference:
+    aryEmpDiff = np.subtract(aryDpth01, aryDpth02)
+
+    # Mean difference across subjects:
+    aryEmpDiffMdn = np.average(aryEmpDiff, weights=vecNumInc, axis=0)
+
     # -------------------------------------------------------------------------
     # *** Create null distribution
 
     print('---Create null distribution')
 
+    if (varNumIt is None) and (VAR_NUM_SUB_EXCT < varNumSubs):
+
+        # Exact test with too many possible permutations to be held in memory.
+        # The permutations are enumerated in blocks, and the p-values and
+        # bounds of the null distribution are accumulated on the fly (bounds
+        # from histogram, see `perm_engine.exact_null`).
+        print('---Calculate p-value')
+        aryNull, vecP, _, varNumIt = exact_null(aryEmpDiff, vecNumInc,
+                                                aryEmpDiffMdn, varLow=varLow,
+                                                varUp=varUp)
+
+        # Convert count of cases into p-value:
+        vecP = np.divide(vecP.astype(np.float64), float(varNumIt))
+
+        if lgcSeq:
+            return aryNull, vecP, aryEmpDiffMdn, varNumIt
+        return aryNull, vecP, aryEmpDiffMdn
+
     # Random array that is used to permute condition labels within subjects, of
     # the form aryRnd[idxIteration, idxSub]. For each iteration and subject,
     # there is either a zero or a one. For instance, assume that conditions are
@@ -121,59 +188,71 @@ def permute(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000, varLow=2.5,
     # i.e. the actual 'PacMan Dynamic' value get assignet to the 'PacMan
     # Static' group, and vice versa.
     if not(varNumIt is None):
-        # Monte Carlo resampling:
-        aryRnd = np.random.randint(0, high=2, size=(varNumIt, varNumSubs))
+        # Monte Carlo resampling, in chunks of iterations (in parallel, see
+        # `perm_exec`). In case of a sequential test, the number of resampling
+        # cases with a difference greater or equal to the empirical difference
+        # is updated after each chunk, and resampling is stopped as soon as
+        # all p-values are decided.
+        lstPermDiff = []
+        vecCnt = np.zeros((varNumDpt))
+        varNumDrw = 0
+        objIter = perm_iter(perm_null, varNumSubs, varNumIt=varNumIt,
+                            lstArgs=(aryDpth01, aryDpth02, vecNumInc),
+                            dicKwargs={'strEngine': strEngine},
+                            varSeed=varSeed, varPar=varPar,
+                            varChnk=(VAR_CHNK_SEQ if lgcSeq else VAR_CHNK_MC))
+        for aryTmp in objIter:
+            lstPermDiff.append(aryTmp)
+            if lgcSeq:
+                varNumDrw += aryTmp.shape[0]
+                vecCnt += np.sum(np.greater_equal(aryTmp,
+                                                  aryEmpDiffMdn[None, :]),
+                                 axis=0)
+                if seq_stop(vecCnt, varNumDrw, varAlpha=varAlpha,
+                            varConf=varConf):
+                    break
+        objIter.close()
+        del(objIter)
     else:
-        # In case of tractable number of permutations, create a list of all
-        # possible permutations (Bernoulli sequence).
-        lstBnl = list(itertools.product([0, 1], repeat=varNumSubs))
-        aryRnd = np.array(lstBnl)
-        # Number of resampling cases:
-        varNumIt = len(lstBnl)
-
-    # We need two versions of the randomisation array, one for sampling from
-    # the first input array (e.g. 'PacMan Dynamic'), and a second version to
-    # sample from the second input array (e.g. 'PacMan Static'). (I.e. the
-    # second version is the opposite of the first version.)
-    aryRnd01 = np.equal(aryRnd, 1)
-    aryRnd02 = np.equal(aryRnd, 0)
-    del(aryRnd)
-
-    # Arrays for permuted depth profiles for the two randomised groups:
-    aryDpthRnd01 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-    aryDpthRnd02 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-
-    # Loop through iterations:
-    for idxIt in range(0, varNumIt):
-
-        # Assign values from original group 1 to permutation group 1:
-        aryDpthRnd01[idxIt, aryRnd01[idxIt, :], :] = \
-            aryDpth01[aryRnd01[idxIt, :], :]
-
-        # Assign values from original group 2 to permutation group 1:
-        aryDpthRnd01[idxIt, aryRnd02[idxIt, :], :] = \
-            aryDpth02[aryRnd02[idxIt, :], :]
-
-        # Assign values from original group 1 to permutation group 2:
-        aryDpthRnd02[idxIt, aryRnd02[idxIt, :], :] = \
-            aryDpth01[aryRnd02[idxIt, :], :]
-
-        # Assign values from original group 2 to permutation group 2:
-        aryDpthRnd02[idxIt, aryRnd01[idxIt, :], :] = \
-            aryDpth02[aryRnd01[idxIt, :], :]
-
-    # Within-subject difference between conditions (separately for each
-    # iteration, subject, and depth level):
-    aryPermDiff = np.subtract(aryDpthRnd01, aryDpthRnd02)
+        # In case of tractable number of permutations, create an array of all
+        # possible permutations (Bernoulli sequence). Only the first half is
+        # needed (labels of first subject switched); the permutations of the
+        # second half switch all labels of the first half, and negate the
+        # difference (see below).
+        aryRnd = get_bnl(varNumSubs, varEnd=(2 ** (varNumSubs - 1)))
 
     # Mean condition difference across subjects (separately for each
-    # iteration and depth level):
-    # aryPermDiff = np.mean(aryPermDiff, axis=1)
-    aryPermDiff = np.average(aryPermDiff, weights=vecNumInc, axis=1)
-
-    # Mean of permutation distribution - i.e. the mean difference between
-    # randomly permuted conditions - the mean difference expected by chance.
-    aryPermDiffMne = np.mean(aryPermDiff, axis=0)
+    # iteration and depth level). The within-subject difference of permuted
+    # conditions is the empirical difference, with the sign flipped for
+    # subjects with switched labels (see `perm_engine`).
+    if varNumIt is None:
+        aryPermDiff = perm_null(aryDpth01, aryDpth02, vecNumInc, aryRnd,
+                                strEngine=strEngine)
+        del(aryRnd)
+    else:
+        aryPermDiff = np.concatenate(lstPermDiff, axis=0)
+        del(lstPermDiff)
+        if lgcSeq:
+            print(('------Sequential test, number of iterations: '
+                   + str(aryPermDiff.shape[0])))
+
+    if varNumIt is None:
+        # Exact test, mirror the null distribution (the second half of the
+        # permutations gives the negated differences of the first half):
+        aryPermDiff = np.concatenate((aryPermDiff, np.negative(aryPermDiff)),
+                                     axis=0)
+        # Number of resampling cases:
+        varNumIt = aryPermDiff.shape[0]
+        # Mean of permutation distribution (symmetric around zero):
+        aryPermDiffMne = np.zeros((varNumDpt))
+    else:
+        # Number of resampling cases (less than `varNumIt` if a sequential
+        # test was stopped):
+        varNumIt = aryPermDiff.shape[0]
+        # Mean of permutation distribution - i.e. the mean difference between
+        # randomly permuted conditions - the mean difference expected by
+        # chance.
+        aryPermDiffMne = np.mean(aryPermDiff, axis=0)
 
     # Lower and upper bound of the permutation null distribution. For instance,
     # if `varLow = 2.5` and `varUp = 97.5`, this corresponds to the bounds of
@@ -187,18 +266,6 @@ def permute(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000, varLow=2.5,
                         aryPermDiffMne,
                         aryPermDiffPrcnt[:, 1]])
 
-    # -------------------------------------------------------------------------
-    # *** Calculate empirical difference
-
-    print('---Calculate empirical difference')
-
-    # Empirical difference between conditions. First, calculate within-subject
-    # difference:
-    aryEmpDiff = np.subtract(aryDpth01, aryDpth02)
-
-    # Mean difference across subjects:
-    aryEmpDiffMdn = np.average(aryEmpDiff, weights=vecNumInc, axis=0)
-
     # -------------------------------------------------------------------------
     # *** Calculate p-value
 
@@ -225,5 +292,7 @@ def permute(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000, varLow=2.5,
     # Convert count of cases into p-value:
     vecP = np.divide(vecP, float(varNumIt))
 
+    if lgcSeq:
+        return aryNull, vecP, aryEmpDiffMdn, varNumIt
     return aryNull, vecP, aryEmpDiffMdn
     # -------------------------------------------------------------------------
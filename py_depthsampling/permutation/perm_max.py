@@ -22,11 +22,20 @@ Function of the depth sampling pipeline.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import itertools
 import numpy as np
-
-
-def permute_max(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000):
+from py_depthsampling.permutation.perm_engine import VAR_NUM_SUB_EXCT
+from py_depthsampling.permutation.perm_engine import get_bnl
+from py_depthsampling.permutation.perm_engine import exact_null
+from py_depthsampling.permutation.perm_engine import perm_null
+from py_depthsampling.permutation.perm_exec import VAR_CHNK_MC
+from py_depthsampling.permutation.perm_exec import VAR_CHNK_SEQ
+from py_depthsampling.permutation.perm_exec import perm_iter
+from py_depthsampling.permutation.perm_exec import seq_stop
+
+
+def permute_max(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000,
+                strEngine='sign', varSeed=None, varPar=1, lgcSeq=False,
+                varAlpha=0.05, varConf=0.99):
     """
     Permutation test for difference between conditions in depth profiles.
 
@@ -45,12 +54,38 @@ def permute_max(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000):
     varNumIt : int or None
         Number of resampling iterations. Set to `None` in case of small enough
         sample size for exact test (i.e. all possible resamples), otherwise
-        Monte Carlo resampling is performed.
+        Monte Carlo resampling is performed. In case of an exact test with
+        more than `perm_engine.VAR_NUM_SUB_EXCT` subjects, the permutations
+        are not held in memory (see `perm_engine.exact_null`).
+    strEngine : str
+        Method for calculating the null distribution, 'sign' (matrix form;
+        sign flip of within-subject differences, memory bounded by the size
+        of the null distribution) or 'loop' (permutation of depth profiles,
+        previous implementation). Both give identical results.
+    varSeed : int or None
+        Seed for Monte Carlo resampling. If `None`, permutations are drawn from
+        the global random state (see `perm_exec.perm_run`). With a seed,
+        results do not depend on the number of processes.
+    varPar : int
+        Number of processes for Monte Carlo resampling.
+    lgcSeq : bool
+        Sequential Monte Carlo test. Permutations are drawn in chunks of
+        `perm_exec.VAR_CHNK_SEQ` iterations, and resampling is stopped as soon
+        as the confidence interval of the p-value does not include `varAlpha`
+        (see `perm_exec.seq_stop`), or after `varNumIt` iterations. The number
+        of iterations is returned. Has no effect on exact tests.
+    varAlpha : float
+        Decision threshold of sequential test.
+    varConf : float
+        Confidence level of p-value for sequential test.
 
     Returns
     -------
     varP : float
         Permutation p-value.
+    varNumIt : int
+        Number of resampling iterations (only returned if `lgcSeq` is
+        `True`).
 
     Notes
     -----
@@ -86,19 +121,50 @@ def permute_max(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000):
     # Number of subject:
     varNumSubs = aryDpth01.shape[0]
 
-    # Number of depth levels:
-    varNumDpt = aryDpth01.shape[1]
-
     # If number of vertices per subject is not provided, assume it to be the
     # same across subjects (for weighted averaging):
     if vecNumInc is None:
         vecNumInc = np.ones((varNumSubs))
 
+    # -------------------------------------------------------------------------
+    # *** Calculate empirical difference
+
+    print('---Calculate empirical parameter value')
+
+    # Empirical difference between conditions. First, calculate within-subject
+    # difference:
+    aryEmpDiff = np.subtract(aryDpth01, aryDpth02)
+
+    # Mean difference across subjects:
+    aryEmpDiffMne = np.average(aryEmpDiff, weights=vecNumInc, axis=0)
+
+    # Maximum difference across cortical depth:
+    # varEmpDiffMneMax = np.max(aryEmpDiffMne)
+    varEmpDiffMneMax = np.max(np.absolute(aryEmpDiffMne))
+
     # -------------------------------------------------------------------------
     # *** Create null distribution
 
     print('---Create null distribution')
 
+    if (varNumIt is None) and (VAR_NUM_SUB_EXCT < varNumSubs):
+
+        # Exact test with too many possible permutations to be held in memory.
+        # The permutations are enumerated in blocks, and the number of
+        # resampling cases with a maximum difference greater or equal to the
+        # empirical maximum is accumulated on the fly (see
+        # `perm_engine.exact_null`).
+        print('---Calculate p-value')
+        _, _, varP, varNumIt = exact_null(aryEmpDiff, vecNumInc,
+                                          aryEmpDiffMne)
+
+        # Convert count of cases into p-value:
+        varP = np.divide(float(varP), float(varNumIt))
+
+        if lgcSeq:
+            return varP, varNumIt
+        return varP
+
     # Random array that is used to permute condition labels within subjects, of
     # the form aryRnd[idxIteration, idxSub]. For each iteration and subject,
     # there is either a zero or a one. For instance, assume that conditions are
@@ -109,74 +175,66 @@ def permute_max(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000):
     # i.e. the actual 'PacMan Dynamic' value get assignet to the 'PacMan
     # Static' group, and vice versa.
     if not(varNumIt is None):
-        # Monte Carlo resampling:
-        aryRnd = np.random.randint(0, high=2, size=(varNumIt, varNumSubs))
+        # Monte Carlo resampling, in chunks of iterations (in parallel, see
+        # `perm_exec`). In case of a sequential test, the number of resampling
+        # cases with a maximum difference greater or equal to the empirical
+        # maximum is updated after each chunk, and resampling is stopped as
+        # soon as the p-value is decided.
+        lstPermDiff = []
+        varCnt = 0
+        varNumDrw = 0
+        objIter = perm_iter(perm_null, varNumSubs, varNumIt=varNumIt,
+                            lstArgs=(aryDpth01, aryDpth02, vecNumInc),
+                            dicKwargs={'strEngine': strEngine},
+                            varSeed=varSeed, varPar=varPar,
+                            varChnk=(VAR_CHNK_SEQ if lgcSeq else VAR_CHNK_MC))
+        for aryTmp in objIter:
+            lstPermDiff.append(aryTmp)
+            if lgcSeq:
+                varNumDrw += aryTmp.shape[0]
+                varCnt += int(np.sum(np.greater_equal(
+                    np.max(np.absolute(aryTmp), axis=1), varEmpDiffMneMax)))
+                if seq_stop(varCnt, varNumDrw, varAlpha=varAlpha,
+                            varConf=varConf):
+                    break
+        objIter.close()
+        del(objIter)
     else:
-        # In case of tractable number of permutations, create a list of all
-        # possible permutations (Bernoulli sequence).
-        lstBnl = list(itertools.product([0, 1], repeat=varNumSubs))
-        aryRnd = np.array(lstBnl)
-        # Number of resampling cases:
-        varNumIt = len(lstBnl)
-
-    # We need two versions of the randomisation array, one for sampling from
-    # the first input array (e.g. 'PacMan Dynamic'), and a second version to
-    # sample from the second input array (e.g. 'PacMan Static'). (I.e. the
-    # second version is the opposite of the first version.)
-    aryRnd01 = np.equal(aryRnd, 1)
-    aryRnd02 = np.equal(aryRnd, 0)
-    del(aryRnd)
-
-    # Arrays for permuted depth profiles for the two randomised groups:
-    aryDpthRnd01 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-    aryDpthRnd02 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-
-    # Loop through iterations:
-    for idxIt in range(0, varNumIt):
-
-        # Assign values from original group 1 to permutation group 1:
-        aryDpthRnd01[idxIt, aryRnd01[idxIt, :], :] = \
-            aryDpth01[aryRnd01[idxIt, :], :]
-
-        # Assign values from original group 2 to permutation group 1:
-        aryDpthRnd01[idxIt, aryRnd02[idxIt, :], :] = \
-            aryDpth02[aryRnd02[idxIt, :], :]
-
-        # Assign values from original group 1 to permutation group 2:
-        aryDpthRnd02[idxIt, aryRnd02[idxIt, :], :] = \
-            aryDpth01[aryRnd02[idxIt, :], :]
-
-        # Assign values from original group 2 to permutation group 2:
-        aryDpthRnd02[idxIt, aryRnd01[idxIt, :], :] = \
-            aryDpth02[aryRnd01[idxIt, :], :]
-
-    # Within-subject difference between conditions (separately for each
-    # iteration, subject, and depth level):
-    aryPermDiff = np.subtract(aryDpthRnd01, aryDpthRnd02)
+        # In case of tractable number of permutations, create an array of all
+        # possible permutations (Bernoulli sequence). Only the first half is
+        # needed (labels of first subject switched); the permutations of the
+        # second half switch all labels of the first half, and negate the
+        # difference (see below).
+        aryRnd = get_bnl(varNumSubs, varEnd=(2 ** (varNumSubs - 1)))
 
     # Mean condition difference across subjects (separately for each
-    # iteration and depth level):
-    # aryPermDiff = np.mean(aryPermDiff, axis=1)
-    aryPermDiff = np.average(aryPermDiff, weights=vecNumInc, axis=1)
+    # iteration and depth level). The within-subject difference of permuted
+    # conditions is the empirical difference, with the sign flipped for
+    # subjects with switched labels (see `perm_engine`).
+    if varNumIt is None:
+        aryPermDiff = perm_null(aryDpth01, aryDpth02, vecNumInc, aryRnd,
+                                strEngine=strEngine)
+        del(aryRnd)
+    else:
+        aryPermDiff = np.concatenate(lstPermDiff, axis=0)
+        del(lstPermDiff)
+        # Number of resampling cases (less than `varNumIt` if a sequential
+        # test was stopped):
+        varNumIt = aryPermDiff.shape[0]
+        if lgcSeq:
+            print(('------Sequential test, number of iterations: '
+                   + str(varNumIt)))
 
     # Maximum difference across cortical depth:
     vecPermDiffMax = np.max(np.absolute(aryPermDiff), axis=1)
 
-    # -------------------------------------------------------------------------
-    # *** Calculate empirical difference
-
-    print('---Calculate empirical parameter value')
-
-    # Empirical difference between conditions. First, calculate within-subject
-    # difference:
-    aryEmpDiff = np.subtract(aryDpth01, aryDpth02)
-
-    # Mean difference across subjects:
-    aryEmpDiffMne = np.average(aryEmpDiff, weights=vecNumInc, axis=0)
-
-    # Maximum difference across cortical depth:
-    # varEmpDiffMneMax = np.max(aryEmpDiffMne)
-    varEmpDiffMneMax = np.max(np.absolute(aryEmpDiffMne))
+    # Exact test, the second half of the permutations gives the negated
+    # differences of the first half, with the same maximum absolute difference
+    # (each maximum counts twice):
+    varNumRep = 1
+    if varNumIt is None:
+        varNumRep = 2
+        varNumIt = 2 ** varNumSubs
 
     # -------------------------------------------------------------------------
     # *** Calculate p-value
@@ -190,10 +248,12 @@ def permute_max(aryDpth01, aryDpth02, vecNumInc=None, varNumIt=10000):
                                    vecPermDiffMax,
                                    varEmpDiffMneMax
                                    )
-                  ).astype(np.float64)
+                  ).astype(np.float64) * float(varNumRep)
 
     # Convert count of cases into p-value:
     varP = np.divide(varP, float(varNumIt))
 
+    if lgcSeq:
+        return varP, varNumIt
     return varP
     # -------------------------------------------------------------------------
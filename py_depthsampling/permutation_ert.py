@@ -26,9 +26,10 @@ Inputs are pickle files containing event-related timecourses for each subject.
 
 
 import numpy as np
-from py_depthsampling.permutation.perm_max import permute_max
 import pandas as pd
-import pickle
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # -----------------------------------------------------------------------------
@@ -57,147 +58,97 @@ varNumIt = None
 
 # Time window within which to compare timecourses (volume indices):
 tplCmp = (7, 11)
-# -----------------------------------------------------------------------------
-
 
-# -----------------------------------------------------------------------------
-# *** Preparations
-
-# Number of comparisons:
-varNumDiff = len(lstDiff)
+# Number of CPUs & memory (MB) for all tests together (`None` for all CPUs & no
+# memory limit):
+varCpuMax = None
+varMemMax = None
 # -----------------------------------------------------------------------------
 
 
 # -----------------------------------------------------------------------------
 # *** Permutation test
 
-# Loop through models, ROIs, hemispheres, and conditions to create plots:
-for idxMtaCn in range(len(lstMetaCon)):  #noqa
-
-    # Array for p-values:
-    aryData = np.zeros((len(lstRoi), len(lstCon)))
-
-    # List for comparison labels:
-    lstLbls = [None] * len(lstDiff)
-
-    for idxRoi in range(len(lstRoi)):
-        for idxDiff in range(len(lstDiff)):
-
-            # Indices of conditions to compare on this iteration:
-            varIdxCon01 = lstDiff[idxDiff][0]
-            varIdxCon02 = lstDiff[idxDiff][1]
-
-            # Condition names:
-            strTmpCon01 = lstCon[varIdxCon01]
-            strTmpCon02 = lstCon[varIdxCon02]
-
-            # Path of timecourse:
-            strTmpPth = strPthErt.format(
-                lstMetaCon[idxMtaCn], lstRoi[idxRoi])
-
-            # Load previously prepared event-related timecourses from pickle:
-            dicAllSubsRoiErt = pickle.load(open(strTmpPth, 'rb'))
-
-            # Get subject IDs:
-            lstSubIds = list(dicAllSubsRoiErt.keys())
-
-            # Get number of volumes:
-            varNumVol = dicAllSubsRoiErt[lstSubIds[0]][0].shape[2]
-
-            # Get number of depth levels:
-            varNumDpth = dicAllSubsRoiErt[lstSubIds[0]][0].shape[1]
-
-            # Number of subjects:
-            varNumSub = len(lstSubIds)
-
-            # Arrays for single-subject timecourses for both conditions:
-            # aryErt01 = np.zeros((varNumSub, varNumVol))
-            # aryErt02 = np.zeros((varNumSub, varNumVol))
-            aryErt01 = np.zeros((varNumSub, varNumDpth))
-            aryErt02 = np.zeros((varNumSub, varNumDpth))
-
-            # Vector for number of vertices per subject (for weighter
-            # averaging across subjects):
-            vecNumInc = np.zeros(varNumSub)
-
-            # Access timecourses - condition 01:
-            for idxSub in range(varNumSub):
-
-                # Get ERT array for current subject, shape:
-                # aryErtTmp[condition, depth, time].
-                aryErtTmp = dicAllSubsRoiErt[lstSubIds[idxSub]][0]
-
-                # Access condition to compare (new shape
-                # aryErtTmp[depth, time]).
-                aryErtTmp = aryErtTmp[varIdxCon01]
-
-                # Mean over depth levels:
-                # aryErt01[idxSub] = np.mean(aryErtTmp, axis=0)
-                # Mean over time window:
-                aryErt01[idxSub] = np.mean(aryErtTmp[:, tplCmp[0]:tplCmp[1]],
-                                           axis=1)
-
-                # Number of vertices for current subject:
-                vecNumInc[idxSub] = dicAllSubsRoiErt[lstSubIds[idxSub]][1]
-
-            # Access timecourses - condition 02:
-            for idxSub in range(varNumSub):
-
-                # Get ERT array for current subject, shape:
-                # aryErtTmp[condition, depth, time].
-                aryErtTmp = dicAllSubsRoiErt[lstSubIds[idxSub]][0]
-
-                # Access condition to compare (new shape
-                # aryErtTmp[depth, time]).
-                aryErtTmp = aryErtTmp[varIdxCon02]
-
-                # Mean over depth levels:
-                # aryErt02[idxSub] = np.mean(aryErtTmp, axis=0)
-                # Mean over time window:
-                aryErt02[idxSub] = np.mean(aryErtTmp[:, tplCmp[0]:tplCmp[1]],
-                                           axis=1)
-
-            # Access time window for comparison:
-            # aryErt01 = aryErt01[:, tplCmp[0]:tplCmp[1]]
-            # aryErt02 = aryErt02[:, tplCmp[0]:tplCmp[1]]
-
-            # Run permutation test:
-            varP = permute_max(aryErt01,
-                               aryErt02,
-                               vecNumInc=vecNumInc,
-                               varNumIt=varNumIt)
-
-            # Put p-value of current ROI & comparison into array:
-            aryData[idxRoi, idxDiff] = varP
-
-            strMsg = ('---Permutation p-value \n'
-                      + '   Meta-condition: '
-                      + lstMetaCon[idxMtaCn]
-                      + '\n'
-                      + '   ROI: '
-                      + lstRoi[idxRoi]
-                      + '\n'
-                      + '   Condition: '
-                      + strTmpCon01
-                      + ' minus '
-                      + strTmpCon02
-                      + '\n'
-                      + '   p = '
-                      + str(varP))
-
-            print(strMsg)
-
-            # Comparison label:
-            strTmp = (strTmpCon01 + '-' + strTmpCon02)
-
-            # Column label for dataframe:
-            lstLbls[idxDiff] = strTmp
-
-    # p-values into dataframe:
-    dfData = pd.DataFrame(data=aryData,
-                          index=lstRoi,
-                          columns=lstLbls)
-    print('')
-    print(dfData)
-    print('')
+# One job per meta-condition and ROI (see `py_depthsampling.main.batch`). The
+# timecourses of a meta-condition & ROI are loaded once for all comparisons.
+# The p-values are combined into tables below, so all jobs are run (without
+# state file).
+dicSpec = {'jobs': [{
+    'function': 'perm_max_ert',
+    'params': {'strPthErt': strPthErt.format('${_strMetaCon}', '${_strRoi}'),
+               'lstDiff': lstDiff,
+               'tplCmp': tplCmp,
+               'varNumIt': varNumIt},
+    'loops': {'_strMetaCon': lstMetaCon,
+              '_strRoi': lstRoi}}]}
+
+if __name__ == "__main__":
+
+    # Run tests (in parallel, within CPU & memory budget):
+    lstJobs = expand_jobs(dicSpec)
+    lstRec = run_jobs(lstJobs, varCpuMax=varCpuMax, varMemMax=varMemMax)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
+
+    # p-values by job key:
+    dicP = {dicRec['key']: dicRec['result'] for dicRec in lstRec}
+
+    # Index of job (jobs are in the order of the loops):
+    idxJob = 0
+
+    for idxMtaCn in range(len(lstMetaCon)):
+
+        # Array for p-values:
+        aryData = np.zeros((len(lstRoi), len(lstDiff)))
+
+        # List for comparison labels:
+        lstLbls = [None] * len(lstDiff)
+
+        for idxRoi in range(len(lstRoi)):
+
+            # p-values of all comparisons for current ROI:
+            lstP = dicP[lstJobs[idxJob]['key']]
+            idxJob += 1
+
+            for idxDiff in range(len(lstDiff)):
+
+                # Condition names:
+                strTmpCon01 = lstCon[lstDiff[idxDiff][0]]
+                strTmpCon02 = lstCon[lstDiff[idxDiff][1]]
+
+                # Put p-value of current ROI & comparison into array:
+                varP = lstP[idxDiff]
+                aryData[idxRoi, idxDiff] = varP
+
+                strMsg = ('---Permutation p-value \n'
+                          + '   Meta-condition: '
+                          + lstMetaCon[idxMtaCn]
+                          + '\n'
+                          + '   ROI: '
+                          + lstRoi[idxRoi]
+                          + '\n'
+                          + '   Condition: '
+                          + strTmpCon01
+                          + ' minus '
+                          + strTmpCon02
+                          + '\n'
+                          + '   p = '
+                          + str(varP))
+                print(strMsg)
+
+                # Comparison label:
+                strTmp = (strTmpCon01 + '-' + strTmpCon02)
+
+                # Column label for dataframe:
+                lstLbls[idxDiff] = strTmp
+
+        # p-values into dataframe:
+        dfData = pd.DataFrame(data=aryData,
+                              index=lstRoi,
+                              columns=lstLbls)
+
+        print('')
+        print(dfData)
+        print('')
 # -----------------------------------------------------------------------------
@@ -29,8 +29,10 @@ Inputs are *.npz files containing depth profiles for each subject.
 
 
 import numpy as np
-from py_depthsampling.permutation.perm_max import permute_max
 import pandas as pd
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # -----------------------------------------------------------------------------
@@ -62,116 +64,109 @@ lstDiff = [(0, 1), (0, 2), (2, 1), (0, 3)]
 # Number of resampling iterations (set to `None` in case of small enough sample
 # size for exact test, otherwise Monte Carlo resampling is performed):
 varNumIt = None
-# -----------------------------------------------------------------------------
-
-
-# -----------------------------------------------------------------------------
-# *** Preparations
 
-# Number of comparisons:
-varNumDiff = len(lstDiff)
+# Number of CPUs & memory (MB) for all comparisons together (`None` for all
+# CPUs & no memory limit):
+varCpuMax = None
+varMemMax = None
 # -----------------------------------------------------------------------------
 
 
 # -----------------------------------------------------------------------------
 # *** Permutation test
 
-# Loop through models, ROIs, hemispheres, and conditions to create plots:
-for idxMtaCn in range(len(lstMetaCon)):  #noqa
-    for idxMdl in range(len(lstMdl)):  #noqa
-
-        # Array for p-values:
-        aryData = np.zeros((len(lstRoi), len(lstCon)))
-
-        # List for comparison labels:
-        lstLbls = [None] * len(lstDiff)
-
-        for idxRoi in range(len(lstRoi)):
-            for idxDiff in range(len(lstDiff)):
-
-                # Condition names:
-                strTmpCon01 = lstCon[lstDiff[idxDiff][0]]
-                strTmpCon02 = lstCon[lstDiff[idxDiff][1]]
-
-                # Path of first depth profile:
-                strTmpPth01 = strPthPrf.format(
-                    lstMetaCon[idxMtaCn], lstRoi[idxRoi], strTmpCon01,
-                    lstMdl[idxMdl])
-
-                # Path of second depth profile:
-                strTmpPth02 = strPthPrf.format(
-                    lstMetaCon[idxMtaCn], lstRoi[idxRoi], strTmpCon02,
-                    lstMdl[idxMdl])
-
-                # Load single subject depth profiles (shape
-                # aryDpth[subject, depth]):
-                objNpz01 = np.load(strTmpPth01)
-                aryDpth01 = objNpz01['arySubDpthMns']
-                objNpz02 = np.load(strTmpPth02)
-                aryDpth02 = objNpz02['arySubDpthMns']
-
-                # Array with number of vertices (for weighted averaging
-                # across subjects), shape: vecNumInc[subjects].
-                vecNumInc01 = objNpz01['vecNumInc']
-                vecNumInc02 = objNpz02['vecNumInc']
-
-                # Because of asymetric ROIs in the surface experiment (between
-                # 'Kanizsa square' and 'Kanizsa rotated' conditions), there
-                # may be a slight discrepancy in number of vertices across
-                # ROIs. We take the mean.
-                vecNumInc = np.around(
-                                      np.multiply(
-                                                  np.add(vecNumInc01,
-                                                         vecNumInc02
-                                                         ).astype(np.float32),
-                                                  0.5)
-                                      ).astype(np.int32)
-
-                # Run permutation test:
-                varP = permute_max(aryDpth01,
-                                   aryDpth02,
-                                   vecNumInc=vecNumInc,
-                                   varNumIt=varNumIt)
-
-                # Put p-value of current ROI & comparison into array:
-                aryData[idxRoi, idxDiff] = varP
-
-                strMsg = ('---Permutation p-value \n'
-                          + '   Model: '
-                          + lstMdl[idxMdl]
-                          + '\n'
-                          + '   Meta-condition: '
-                          + lstMetaCon[idxMtaCn]
-                          + '\n'
-                          + '   ROI: '
-                          + lstRoi[idxRoi]
-                          + '\n'
-                          + '   Condition: '
-                          + strTmpCon01
-                          + ' minus '
-                          + strTmpCon02
-                          + '\n'
-                          + '   p = '
-                          + str(varP))
-
-                print(strMsg)
-
-                # Comparison label:
-                strTmp = (strTmpCon01 + '-' + strTmpCon02)
-
-                # Abbreviate condition labels:
-                strTmp = strTmp.replace('bright_square_sst_pe', 'BS')
-                strTmp = strTmp.replace('kanizsa_sst_pe', 'KS')
-                strTmp = strTmp.replace('kanizsa_rotated_sst_pe', 'KR')
-
-                # Column label for dataframe:
-                lstLbls[idxDiff] = strTmp
-
-        # p-values into dataframe:
-        dfData = pd.DataFrame(data=aryData,
-                              index=lstRoi,
-                              columns=lstLbls)
-        print('')
-        print(dfData)
-        print('')
+# One job per meta-condition, model, ROI, and comparison (see
+# `py_depthsampling.main.batch`). The p-values are combined into tables below,
+# so all jobs are run (without state file).
+dicSpec = {'jobs': [{
+    'function': 'perm_max_prf',
+    'params': {'strPthPrf01': strPthPrf.format('${_strMetaCon}', '${_strRoi}',
+                                               '${_strCon01}', '${_strMdl}'),
+               'strPthPrf02': strPthPrf.format('${_strMetaCon}', '${_strRoi}',
+                                               '${_strCon02}', '${_strMdl}'),
+               'varNumIt': varNumIt},
+    'loops': {'_strMetaCon': lstMetaCon,
+              'mdl': [{'_strMdl': strMdl, '_name': (strMdl or 'none')}
+                      for strMdl in lstMdl],
+              '_strRoi': lstRoi,
+              'diff': [{'_strCon01': lstCon[tplDiff[0]],
+                        '_strCon02': lstCon[tplDiff[1]],
+                        '_name': (lstCon[tplDiff[0]] + '_min_'
+                                  + lstCon[tplDiff[1]])}
+                       for tplDiff in lstDiff]}}]}
+
+if __name__ == "__main__":
+
+    # Run comparisons (in parallel, within CPU & memory budget):
+    lstJobs = expand_jobs(dicSpec)
+    lstRec = run_jobs(lstJobs, varCpuMax=varCpuMax, varMemMax=varMemMax)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
+
+    # p-values by job key:
+    dicP = {dicRec['key']: dicRec['result'] for dicRec in lstRec}
+
+    # Index of job (jobs are in the order of the loops):
+    idxJob = 0
+
+    for idxMtaCn in range(len(lstMetaCon)):  #noqa
+        for idxMdl in range(len(lstMdl)):  #noqa
+
+            # Array for p-values:
+            aryData = np.zeros((len(lstRoi), len(lstDiff)))
+
+            # List for comparison labels:
+            lstLbls = [None] * len(lstDiff)
+
+            for idxRoi in range(len(lstRoi)):
+                for idxDiff in range(len(lstDiff)):
+
+                    # Condition names:
+                    strTmpCon01 = lstCon[lstDiff[idxDiff][0]]
+                    strTmpCon02 = lstCon[lstDiff[idxDiff][1]]
+
+                    # p-value of current ROI & comparison:
+                    varP = dicP[lstJobs[idxJob]['key']]
+                    idxJob += 1
+                    aryData[idxRoi, idxDiff] = varP
+
+                    strMsg = ('---Permutation p-value \n'
+                              + '   Model: '
+                              + lstMdl[idxMdl]
+                              + '\n'
+                              + '   Meta-condition: '
+                              + lstMetaCon[idxMtaCn]
+                              + '\n'
+                              + '   ROI: '
+                              + lstRoi[idxRoi]
+                              + '\n'
+                              + '   Condition: '
+                              + strTmpCon01
+                              + ' minus '
+                              + strTmpCon02
+                              + '\n'
+                              + '   p = '
+                              + str(varP))
+                    print(strMsg)
+
+                    # Comparison label:
+                    strTmp = (strTmpCon01 + '-' + strTmpCon02)
+
+                    # Abbreviate condition labels:
+                    strTmp = strTmp.replace('bright_square_sst_pe', 'BS')
+                    strTmp = strTmp.replace('kanizsa_sst_pe', 'KS')
+                    strTmp = strTmp.replace('kanizsa_rotated_sst_pe', 'KR')
+
+                    # Column label for dataframe:
+                    lstLbls[idxDiff] = strTmp
+
+            # p-values into dataframe:
+            dfData = pd.DataFrame(data=aryData,
+                                  index=lstRoi,
+                                  columns=lstLbls)
+
+            print('')
+            print(dfData)
+            print('')
 # -----------------------------------------------------------------------------
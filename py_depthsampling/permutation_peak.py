@@ -54,7 +54,9 @@ Function of the depth sampling pipeline.
 
 import numpy as np
 import pandas as pd
-from py_depthsampling.permutation.peak_pos_perm_diff import peak_diff
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # -----------------------------------------------------------------------------
@@ -86,6 +88,11 @@ lstDiff = [[(0, 1), (0, 2)],
 # Number of resampling iterations (set to `None` in case of small enough sample
 # size for exact test, otherwise Monte Carlo resampling is performed):
 varNumIt = None
+
+# Number of CPUs & memory (MB) for all tests together (`None` for all CPUs & no
+# memory limit):
+varCpuMax = None
+varMemMax = None
 # -----------------------------------------------------------------------------
 
 
@@ -123,65 +130,86 @@ objDf.astype(dicType)
 # -----------------------------------------------------------------------------
 # *** Loop through ROIs / conditions
 
-print('-Peak position permutation test')
-
-# Counter for samples:
-idxSmpl = 0
-
-# Loop through metaconditions, models, ROIs, hemispheres, and comparisons:
-for idxMtaCn in range(len(lstMetaCon)):
-    for idxMdl in range(len(lstMdl)):
-        for idxRoi in range(len(lstRoi)):
-            for idxDiff in range(len(lstDiff)):
-
-                # Permutation test:
-                varTmpP, varTmpDiff, lgcTmpA, lgcTmpB, varEmpPeaksA, \
-                    varEmpPeaksB, varTmpRatioPeak = \
-                    peak_diff(strPthData.format(lstMetaCon[idxMtaCn],
-                                                lstRoi[idxRoi],
-                                                '{}',
-                                                lstMdl[idxMdl]),
-                              lstDiff[idxDiff],
-                              lstCon,
-                              varNumIt=varNumIt)
-
-                # Current comparison:
-                strTmp = (lstCon[lstDiff[idxDiff][0][0]]
-                          + '-'
-                          + lstCon[lstDiff[idxDiff][0][1]]
-                          + '_vs_'
-                          + lstCon[lstDiff[idxDiff][1][0]]
-                          + '-'
-                          + lstCon[lstDiff[idxDiff][1][1]])
-
-                # Abbreviate condition labels:
-                strTmp = strTmp.replace('bright_square_sst_pe', 'BS')
-                strTmp = strTmp.replace('kanizsa_rotated_sst_pe', 'KR')
-                strTmp = strTmp.replace('kanizsa_sst_pe', 'KS')
-
-                # Result to data frame:
-                objDf.at[idxSmpl, 'ROI'] = lstRoi[idxRoi].upper()
-                if lstMdl[idxMdl] == '':
-                    objDf.at[idxSmpl, 'Deconvolution'] = 'No'
-                else:
-                    objDf.at[idxSmpl, 'Deconvolution'] = 'Yes'
-                objDf.at[idxSmpl, 'pRF-position'] = lstMetaCon[idxMtaCn]
-                objDf.at[idxSmpl, 'Contrast'] = strTmp
-                objDf.at[idxSmpl, 'Emp.-peak-pos.-diff.'] = varTmpDiff
-                objDf.at[idxSmpl, 'Emp.-peak-A?'] = lgcTmpA
-                objDf.at[idxSmpl, 'Emp.-peak-pos-A'] = varEmpPeaksA
-                objDf.at[idxSmpl, 'Emp.-peak-B?'] = lgcTmpB
-                objDf.at[idxSmpl, 'Emp.-peak-pos-B'] = varEmpPeaksB
-                objDf.at[idxSmpl, 'Perm.-peak-ratio[%]'] = varTmpRatioPeak
-                objDf.at[idxSmpl, 'p-value'] = varTmpP
-
-                # Increment counter:
-                idxSmpl += 1
-
-print(' ')
-print(objDf)
-print(' ')
-
-# ----------------------------------------------------------------------------
-
-print('-Done.')
+# One job per meta-condition, model, ROI, and comparison (see
+# `py_depthsampling.main.batch`). The results are combined into a table below,
+# so all jobs are run (without state file).
+dicSpec = {'jobs': [{
+    'function': 'peak_diff',
+    'params': {'strPthData': strPthData.format('${_strMetaCon}', '${_strRoi}',
+                                               '{}', '${_strMdl}'),
+               'lstCon': lstCon,
+               'varNumIt': varNumIt},
+    'loops': {'_strMetaCon': lstMetaCon,
+              'mdl': [{'_strMdl': strMdl, '_name': (strMdl or 'none')}
+                      for strMdl in lstMdl],
+              '_strRoi': lstRoi,
+              'diff': [{'lstDiff': lstTmp} for lstTmp in lstDiff]}}]}
+
+if __name__ == "__main__":
+
+    print('-Peak position permutation test')
+
+    # Run permutation tests (in parallel, within CPU & memory budget):
+    lstJobs = expand_jobs(dicSpec)
+    lstRec = run_jobs(lstJobs, varCpuMax=varCpuMax, varMemMax=varMemMax)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
+
+    # Results by job key:
+    dicRes = {dicRec['key']: dicRec['result'] for dicRec in lstRec}
+
+    # Counter for samples (jobs are in the order of the loops):
+    idxSmpl = 0
+
+    # Loop through metaconditions, models, ROIs, hemispheres, and comparisons:
+    for idxMtaCn in range(len(lstMetaCon)):
+        for idxMdl in range(len(lstMdl)):
+            for idxRoi in range(len(lstRoi)):
+                for idxDiff in range(len(lstDiff)):
+
+                    # Result of permutation test:
+                    varTmpP, varTmpDiff, lgcTmpA, lgcTmpB, varEmpPeaksA, \
+                        varEmpPeaksB, varTmpRatioPeak = \
+                        dicRes[lstJobs[idxSmpl]['key']]
+
+                    # Current comparison:
+                    strTmp = (lstCon[lstDiff[idxDiff][0][0]]
+                              + '-'
+                              + lstCon[lstDiff[idxDiff][0][1]]
+                              + '_vs_'
+                              + lstCon[lstDiff[idxDiff][1][0]]
+                              + '-'
+                              + lstCon[lstDiff[idxDiff][1][1]])
+
+                    # Abbreviate condition labels:
+                    strTmp = strTmp.replace('bright_square_sst_pe', 'BS')
+                    strTmp = strTmp.replace('kanizsa_rotated_sst_pe', 'KR')
+                    strTmp = strTmp.replace('kanizsa_sst_pe', 'KS')
+
+                    # Result to data frame:
+                    objDf.at[idxSmpl, 'ROI'] = lstRoi[idxRoi].upper()
+                    if lstMdl[idxMdl] == '':
+                        objDf.at[idxSmpl, 'Deconvolution'] = 'No'
+                    else:
+                        objDf.at[idxSmpl, 'Deconvolution'] = 'Yes'
+                    objDf.at[idxSmpl, 'pRF-position'] = lstMetaCon[idxMtaCn]
+                    objDf.at[idxSmpl, 'Contrast'] = strTmp
+                    objDf.at[idxSmpl, 'Emp.-peak-pos.-diff.'] = varTmpDiff
+                    objDf.at[idxSmpl, 'Emp.-peak-A?'] = lgcTmpA
+                    objDf.at[idxSmpl, 'Emp.-peak-pos-A'] = varEmpPeaksA
+                    objDf.at[idxSmpl, 'Emp.-peak-B?'] = lgcTmpB
+                    objDf.at[idxSmpl, 'Emp.-peak-pos-B'] = varEmpPeaksB
+                    objDf.at[idxSmpl, 'Perm.-peak-ratio[%]'] = varTmpRatioPeak
+                    objDf.at[idxSmpl, 'p-value'] = varTmpP
+
+                    # Increment counter:
+                    idxSmpl += 1
+
+    print(' ')
+    print(objDf)
+    print(' ')
+
+    # -------------------------------------------------------------------------
+
+    print('-Done.')
@@ -18,7 +18,9 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from py_depthsampling.project.project_main import project
+from py_depthsampling.main.batch import check_jobs
+from py_depthsampling.main.batch import expand_jobs
+from py_depthsampling.main.batch import run_jobs
 
 
 # -----------------------------------------------------------------------------
@@ -86,6 +88,14 @@ lstCon = ['feat_level_2_kanizsa_flicker_sst_pe',
           'pRF_results_x_pos',
           'pRF_results_y_pos']
 
+# Design of each condition with parameter estimates, for conversion to percent
+# signal change (see `py_depthsampling.main.psc`):
+dicDsgn = {'feat_level_2_kanizsa_flicker_sst_pe': 'sst',
+           'feat_level_2_kanizsa_static_sst_pe': 'sst',
+           'feat_level_2_rotated_flicker_sst_pe': 'sst',
+           'feat_level_2_rotated_static_sst_pe': 'sst',
+           'feat_level_2_target_pe': 'target'}
+
 # Path of vtk mesh with data to project into visual space (e.g. parameter
 # estimates; subject ID, hemisphere, and contion level left open).
 strPthData = '/media/sf_D_DRIVE/MRI_Data_PhD/10_kanizsa/{}/cbs/{}/{}.vtk'  #noqa
@@ -138,42 +148,87 @@ varExtYmax = 5.19
 # not considered for plot):
 varThrR2 = 0.15
 
+# Resume after a crash, i.e. skip projections that have been completed with
+# identical parameters and input files (see `py_depthsampling.main.checkpoint`;
+# if `False`, existing npy files are used):
+lgcResume = False
+
 # Number of bins for visual space representation in x- and y-direction (ratio
 # of number of x and y bins should correspond to ratio of size of visual space
 # in x- and y-directions).
 varNumX = 320
 varNumY = 200
+
+# Number of CPUs per analysis (i.e. per depth level, ROI, and condition;
+# `project` loads the data with one process per subject, and projects them
+# with 10 processes), and number of CPUs & memory (MB) for all analyses
+# together (`None` for all CPUs & no memory limit):
+varPar = 10
+varCpuMax = None
+varMemMax = None
+
+# State file for resuming the batch after a crash (records of finished
+# analyses; `None` to always run all analyses):
+strState = None
 # -----------------------------------------------------------------------------
 
 
 # -----------------------------------------------------------------------------
 # *** Parent loop
 
-print('-Project parametric map into visual space')
-
-# Loop through depth levels, ROIs, and conditions:
-for idxDpth in range(len(lstDpth)):  #noqa
-    for idxRoi in range(len(lstRoi)):
-        for idxCon in range(len(lstCon)):
-
-            # Adjust colour bar:
-            if '_pe' in lstCon[idxCon]:
-                # Fixed colour bar for GLM parameter estimates:
-                varMin = -4.0
-                varMax = 4.0
-            else:
-                # Adjust colour bars based on data range:
-                varMin = None
-                varMax = None
-
-            # Number of subjects:
-            varNumSub = len(lstSubIds)
-
-            project(lstRoi[idxRoi], lstCon[idxCon], lstDpth[idxDpth],
-                    lstDpthLbl[idxDpth], strPthNpy, varNumSub,
-                    lstSubIds, strPthData, strPthMneEpi, strPthR2, strPthX,
-                    strPthY, strPthSd, strCsvRoi, varNumDpth, varThrR2,
-                    varNumX, varNumY, varExtXmin, varExtXmax, varExtYmin,
-                    varExtYmax, strPthPltOt, strFlTp, varMin=varMin,
-                    varMax=varMax)
+# Adjust colour bar - fixed colour bar for GLM parameter estimates, otherwise
+# based on data range:
+dicLimCon = {}
+for strCon in lstCon:
+    if '_pe' in strCon:
+        dicLimCon[strCon] = {'varMin': -4.0, 'varMax': 4.0}
+    else:
+        dicLimCon[strCon] = {'varMin': None, 'varMax': None}
+
+# One job per depth level, ROI, and condition (see
+# `py_depthsampling.main.batch`). The vtk meshes of the subjects (mean EPI,
+# pRF parameters) are the same for all conditions, and are only parsed once
+# for all jobs.
+dicSpec = {'jobs': [{
+    'function': 'project',
+    'resources': {'cpus': varPar},
+    'params': {'strPthNpy': strPthNpy,
+               'varNumSub': len(lstSubIds),
+               'lstSubIds': lstSubIds,
+               'strPthData': strPthData,
+               'strPthMneEpi': strPthMneEpi,
+               'strPthR2': strPthR2,
+               'strPthX': strPthX,
+               'strPthY': strPthY,
+               'strPthSd': strPthSd,
+               'strCsvRoi': strCsvRoi,
+               'varNumDpth': varNumDpth,
+               'varThrR2': varThrR2,
+               'varNumX': varNumX,
+               'varNumY': varNumY,
+               'varExtXmin': varExtXmin,
+               'varExtXmax': varExtXmax,
+               'varExtYmin': varExtYmin,
+               'varExtYmax': varExtYmax,
+               'strPthPltOt': strPthPltOt,
+               'strFlTp': strFlTp,
+               'dicDsgn': dicDsgn,
+               'lgcResume': lgcResume},
+    'loops': {'dpth': [{'strDpth': strDpth, 'strDpthLbl': strDpthLbl,
+                        '_name': strDpthLbl}
+                       for strDpth, strDpthLbl in zip(lstDpth, lstDpthLbl)],
+              'strRoi': lstRoi,
+              'strCon': lstCon},
+    'match': {'strCon': dicLimCon}}]}
+
+if __name__ == "__main__":
+
+    print('-Project parametric map into visual space')
+
+    # Run analyses (in parallel, within CPU & memory budget):
+    lstRec = run_jobs(expand_jobs(dicSpec), varCpuMax=varCpuMax,
+                      varMemMax=varMemMax, strState=strState)
+
+    # List failed jobs (their errors are printed by `run_jobs`):
+    check_jobs(lstRec)
 # -----------------------------------------------------------------------------
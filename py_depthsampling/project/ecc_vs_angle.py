@@ -22,6 +22,10 @@ import os
 import numpy as np
 import multiprocessing as mp
 from py_depthsampling.project.load_par import load_par
+from py_depthsampling.project.load_par import gather_par
+from py_depthsampling.main.shm_arrays import shm_free
+from py_depthsampling.main.shm_arrays import shm_get
+from py_depthsampling.main.shm_arrays import shm_init
 from py_depthsampling.project.plot import plot
 
 
@@ -147,6 +151,10 @@ for idxRoi in range(len(lstRoi)):  #noqa
             # Number of processes to run in parallel:
             varPar = varNumSub
 
+            # Start resource tracker before the processes, which place their
+            # results in shared memory (see `shm_init`):
+            shm_init()
+
             # Create a queue to put the results in:
             queOut = mp.Queue()
 
@@ -185,7 +193,8 @@ for idxRoi in range(len(lstRoi)):  #noqa
             for idxPrc in range(varPar):
                 lstPrcs[idxPrc].start()
 
-            # Collect results from queue:
+            # Collect results from queue (descriptions of shared memory
+            # arrays):
             for idxPrc in range(varPar):
                 lstRes[idxPrc] = queOut.get(True)
 
@@ -193,48 +202,16 @@ for idxRoi in range(len(lstRoi)):  #noqa
             for idxPrc in range(varPar):
                 lstPrcs[idxPrc].join()
 
-            # List for single-subject data vectors:
-            lstData = [None] * varPar
-
-            # List of single subject R2 vectors:
-            lstR2 = [None] * varPar
-
-            # List for single subject SD vectors (pRF sizes):
-            lstSd = [None] * varPar
-
-            # List for single subject x-position vectors:
-            lstAngl = [None] * varPar
-
-            # List for single subject y-position vectors:
-            lstEcc = [None] * varPar
-
-            # Put output into correct order (unnecessary in this context but
-            # kept for consistency):
-            for idxRes in range(varPar):
-
-                # Index of results (first item in output list):
-                varTmpIdx = lstRes[idxRes][0]
-
-                # Put fitting results into list, in correct order:
-                lstData[varTmpIdx] = lstRes[idxRes][1]
-                lstR2[varTmpIdx] = lstRes[idxRes][2]
-                lstSd[varTmpIdx] = lstRes[idxRes][3]
-                lstAngl[varTmpIdx] = lstRes[idxRes][4]
-                lstEcc[varTmpIdx] = lstRes[idxRes][5]
-
-            # Concatenate arrays from all subjects:
-            vecData = np.concatenate(lstData[:])
-            vecR2 = np.concatenate(lstR2[:])
-            vecSd = np.concatenate(lstSd[:])
-            vecAngl = np.concatenate(lstAngl[:])
-            vecEcc = np.concatenate(lstEcc[:])
-
-            # Delete original lists:
-            del(lstData)
-            del(lstR2)
-            del(lstSd)
-            del(lstAngl)
-            del(lstEcc)
+            # Concatenate arrays from all subjects (see `load_par`):
+            dicShmData = gather_par(lstRes)
+            aryData = shm_get(dicShmData)
+            shm_free(dicShmData)
+            vecData = aryData[0, :]
+            vecR2 = aryData[1, :]
+            vecSd = aryData[2, :]
+            vecAngl = aryData[3, :]
+            vecEcc = aryData[4, :]
+            del(aryData)
 
             # Save data to disk:
             np.savez(strPthNpzTmp,
@@ -20,6 +20,11 @@
 
 import numpy as np
 from py_depthsampling.project.utilities import get_data
+from py_depthsampling.main.shm_arrays import shm_attach
+from py_depthsampling.main.shm_arrays import shm_create
+from py_depthsampling.main.shm_arrays import shm_detach
+from py_depthsampling.main.shm_arrays import shm_free
+from py_depthsampling.main.shm_arrays import shm_put
 
 
 def load_par(strSub, strCon, strRoi, strPthData, strPthMneEpi, strPthR2,
@@ -30,8 +35,12 @@ def load_par(strSub, strCon, strRoi, strPthData, strPthMneEpi, strPthR2,
 
     Notes
     -----
-    The list with results is not returned directly, but placed on a
-    multiprocessing queue.
+    The results (data, mean EPI, R2, SD, x-position, and y-position, shape
+    aryOut[6, vertex]) are copied into a shared memory array, and a list with
+    the process ID and the description of the shared memory array is placed
+    on the multiprocessing queue (see `gather_par`). If `queOut` is `None`,
+    the list with results (process ID followed by the six vectors) is
+    returned directly.
     """
     # Temporary input paths for left hemisphere:
     if '.npy' in strPthData:
@@ -83,8 +92,85 @@ def load_par(strSub, strCon, strRoi, strPthData, strPthMneEpi, strPthR2,
     vecX = np.concatenate([vecLhX, vecRhX])
     vecY = np.concatenate([vecLhY, vecRhY])
 
-    # Create list containing subject data, and the process ID:
-    lstOut = [idxPrc, vecData, vecMneEpi, vecR2, vecSd, vecX, vecY]
+    if queOut is None:
+        # Return list containing the process ID and subject data:
+        return [idxPrc, vecData, vecMneEpi, vecR2, vecSd, vecX, vecY]
 
-    # Put output to queue:
-    queOut.put(lstOut)
+    # Put subject data into shared memory, and only pass the description of
+    # the shared memory array (and the process ID) through the queue:
+    dicShm = shm_put(np.stack([vecData, vecMneEpi, vecR2, vecSd, vecX, vecY]))
+    queOut.put([idxPrc, dicShm])
+
+
+def par_paths(lstSubIds, strCon, strRoi, strPthData, strPthMneEpi, strPthR2,
+              strPthX, strPthY, strPthSd, strCsvRoi):
+    """
+    Get paths of all input files loaded by `load_par` for several subjects.
+
+    Returns
+    -------
+    lstPth : list
+        Paths of input files (data, mean EPI, R2, SD, x-position, y-position,
+        and ROI csv file), for all subjects and both hemispheres (e.g. as
+        parameter of a checkpoint, see `py_depthsampling.main.checkpoint`).
+    """
+    lstPth = []
+    for strSub in lstSubIds:
+        for strHmsph in ['lh', 'rh']:
+            if '.npy' in strPthData:
+                lstPth.append(strPthData.format(strSub, strHmsph, strCon,
+                                                strCon))
+            else:
+                lstPth.append(strPthData.format(strSub, strHmsph, strCon))
+            lstPth += [strPth.format(strSub, strHmsph)
+                       for strPth in [strPthMneEpi, strPthR2, strPthSd,
+                                      strPthX, strPthY]]
+            lstPth.append(strCsvRoi.format(strSub, strHmsph, strRoi))
+    return lstPth
+
+
+def gather_par(lstRes):
+    """
+    Concatenate single subject data placed in shared memory by `load_par`.
+
+    Parameters
+    ----------
+    lstRes : list
+        Lists placed on the queue by `load_par` (process ID and description of
+        shared memory array), in any order.
+
+    Returns
+    -------
+    dicShm : dict
+        Description of shared memory array with data from all subjects
+        (concatenated in the order of the process IDs), shape
+        aryData[6, vertex] (see `load_par`). Needs to be removed by the caller
+        (`shm_free`).
+
+    Notes
+    -----
+    The shared memory arrays of the single subjects are removed.
+    """
+    # Sort results by process ID:
+    lstShm = [lstTmp[1] for lstTmp in sorted(lstRes, key=lambda lst: lst[0])]
+
+    varNumRow = lstShm[0]['shape'][0]
+    varNumVrtx = sum([dicTmp['shape'][1] for dicTmp in lstShm])
+
+    dicShm = shm_create((varNumRow, varNumVrtx), strDtype=lstShm[0]['dtype'],
+                        lgcZero=False)
+    aryData = shm_attach(dicShm)
+
+    varIdx = 0
+    for dicTmp in lstShm:
+        aryTmp = shm_attach(dicTmp)
+        aryData[:, varIdx:(varIdx + aryTmp.shape[1])] = aryTmp
+        varIdx += aryTmp.shape[1]
+        del(aryTmp)
+        shm_detach(dicTmp)
+        shm_free(dicTmp)
+
+    del(aryData)
+    shm_detach(dicShm)
+
+    return dicShm
@@ -22,7 +22,21 @@ import os
 import numpy as np
 import multiprocessing as mp
 from py_depthsampling.project.load_par import load_par
-from py_depthsampling.project.project_par import project_par
+from py_depthsampling.project.load_par import gather_par
+from py_depthsampling.project.load_par import par_paths
+from py_depthsampling.project.project_par import project_shm
+from py_depthsampling.main.shm_arrays import shm_attach
+from py_depthsampling.main.shm_arrays import shm_create
+from py_depthsampling.main.shm_arrays import shm_detach
+from py_depthsampling.main.shm_arrays import shm_free
+from py_depthsampling.main.shm_arrays import shm_get
+from py_depthsampling.main.shm_arrays import shm_init
+from py_depthsampling.main.checkpoint import ckpt_load
+from py_depthsampling.main.checkpoint import ckpt_save
+from py_depthsampling.main.checkpoint import get_ckpt_dir
+from py_depthsampling.main.checkpoint import save_atomic
+from py_depthsampling.main.psc import get_ppheight
+from py_depthsampling.main.psc import psc_cnv
 from py_depthsampling.project.plot import plot
 
 
@@ -31,14 +45,54 @@ def project(strRoi, strCon, strDpth, strDpthLbl, strPthNpy, varNumSub,
             lstSubIds, strPthData, strPthMneEpi, strPthR2, strPthX, strPthY,
             strPthSd, strCsvRoi, varNumDpth, varThrR2, varNumX, varNumY,
             varExtXmin, varExtXmax, varExtYmin, varExtYmax, strPthPltOt,
-            strFlTp, varMin=-3.0, varMax=3.0, varTr=None):
-    """Project parameter estimates into a visual space representation."""
+            strFlTp, varMin=-3.0, varMax=3.0, varTr=None, dicDsgn=None,
+            lgcResume=False):
+    """
+    Project parameter estimates into a visual space representation.
+
+    If `lgcResume` is `True`, the projection of each ROI, condition, and depth
+    level (and volume, in case of time series) is recorded in a checkpoint
+    together with its npy file (see `py_depthsampling.main.checkpoint`), and
+    is not repeated unless a parameter or input file changes. Otherwise, an
+    existing npy file is used.
+
+    FSL parameter estimates are converted to percent signal change with the
+    peak-peak height of the regressor of the design of the condition
+    (`dicDsgn`, condition: design, see `py_depthsampling.main.psc`). If the
+    data are parameter estimates and the design of `strCon` is not specified,
+    a `ValueError` is raised.
+    """
+    # Design of condition (for conversion to percent signal change):
+    if dicDsgn is None:
+        dicDsgn = {}
+    strDsgn = dicDsgn.get(strCon)
+
     # File name of npy file for current condition:
     strPthNpyTmp = strPthNpy.format(strRoi,
                                     strCon,
                                     strDpthLbl)
 
-    if os.path.isfile(strPthNpyTmp):
+    # Unit of work and parameters of checkpoint:
+    dicUnit = {'roi': strRoi,
+               'condition': strCon,
+               'depth': strDpthLbl,
+               'volume': varTr}
+    dicPrm = {'lstPth': par_paths(lstSubIds[:varNumSub], strCon, strRoi,
+                                  strPthData, strPthMneEpi, strPthR2, strPthX,
+                                  strPthY, strPthSd, strCsvRoi),
+              'strDpth': strDpth,
+              'varNumDpth': varNumDpth,
+              'varThrR2': varThrR2,
+              'strDsgn': strDsgn,
+              'tplBin': [varNumX, varNumY, varExtXmin, varExtXmax,
+                         varExtYmin, varExtYmax]}
+
+    if get_ckpt_dir(lgcResume=lgcResume) is None:
+        lgcDone = os.path.isfile(strPthNpyTmp)
+    else:
+        lgcDone = ckpt_load(dicUnit, dicPrm, lgcResume=True) is not None
+
+    if lgcDone:
 
         print('--Load existing visual field projection')
 
@@ -55,6 +109,10 @@ def project(strRoi, strCon, strDpth, strDpthLbl, strPthNpy, varNumSub,
         # Number of processes to run in parallel:
         varPar = varNumSub
 
+        # Start resource tracker before the processes, which place their
+        # results in shared memory (see `shm_init`):
+        shm_init()
+
         # Create a queue to put the results in:
         queOut = mp.Queue()
 
@@ -94,7 +152,7 @@ def project(strRoi, strCon, strDpth, strDpthLbl, strPthNpy, varNumSub,
         for idxPrc in range(varPar):
             lstPrcs[idxPrc].start()
 
-        # Collect results from queue:
+        # Collect results from queue (descriptions of shared memory arrays):
         for idxPrc in range(varPar):
             lstRes[idxPrc] = queOut.get(True)
 
@@ -102,93 +160,22 @@ def project(strRoi, strCon, strDpth, strDpthLbl, strPthNpy, varNumSub,
         for idxPrc in range(varPar):
             lstPrcs[idxPrc].join()
 
-        # List for single-subject data vectors:
-        lstData = [None] * varPar
-
-        # List for single-subject mean EPI vectors:
-        lstMneEpi = [None] * varPar
-
-        # List of single subject R2 vectors:
-        lstR2 = [None] * varPar
-
-        # List for single subject SD vectors (pRF sizes):
-        lstSd = [None] * varPar
-
-        # List for single subject x-position vectors:
-        lstX = [None] * varPar
-
-        # List for single subject y-position vectors:
-        lstY = [None] * varPar
-
-        # Put output into correct order (unnecessary in this context
-        # but kept for consistency):
-        for idxRes in range(varPar):
-
-            # Index of results (first item in output list):
-            varTmpIdx = lstRes[idxRes][0]
-
-            # Put fitting results into list, in correct order:
-            lstData[varTmpIdx] = lstRes[idxRes][1]
-            lstMneEpi[varTmpIdx] = lstRes[idxRes][2]
-            lstR2[varTmpIdx] = lstRes[idxRes][3]
-            lstSd[varTmpIdx] = lstRes[idxRes][4]
-            lstX[varTmpIdx] = lstRes[idxRes][5]
-            lstY[varTmpIdx] = lstRes[idxRes][6]
-
-        # Concatenate arrays from all subjects:
-        vecData = np.concatenate(lstData[:])
-        vecMneEpi = np.concatenate(lstMneEpi[:])
-        vecR2 = np.concatenate(lstR2[:])
-        vecSd = np.concatenate(lstSd[:])
-        vecX = np.concatenate(lstX[:])
-        vecY = np.concatenate(lstY[:])
-
-        # Delete original lists:
-        del(lstData)
-        del(lstMneEpi)
-        del(lstR2)
-        del(lstSd)
-        del(lstX)
-        del(lstY)
+        # Concatenate data from all subjects, in a shared memory array of the
+        # form aryData[6, vertex] (data, mean EPI, R2, SD, x-position, and
+        # y-position, see `load_par`):
+        dicShmData = gather_par(lstRes)
+        aryData = shm_attach(dicShmData)
+        vecData = aryData[0, :]
+        vecMneEpi = aryData[1, :]
 
         # ---------------------------------------------------------------------
         # *** Convert cope to percent signal change
 
-        # According to the FSL documentation
-        # (https://fsl.fmrib.ox.ac.uk/fsl/fslwiki/FEAT/UserGuide), the PEs can
-        # be scaled to signal change with respect to the mean (over time within
-        # voxel): "This is achieved by scaling the PE or COPE values by (100*)
-        # the peak-peak height of the regressor (or effective regressor in the
-        # case of COPEs) and then by dividing by mean_func (the mean over time
-        # of filtered_func_data)."
-
-        # Only perform scaling if the data is from an FSL cope file:
+        # Only perform scaling if the data is from an FSL cope file (in place,
+        # in the shared memory array, see `py_depthsampling.main.psc`):
         if (('cope' in strCon) or ('_pe' in strCon)):
             print('--Convert cope to percent signal change.')
-
-            # The peak-peak height depends on the predictor (i.e.
-            # condition).
-            if 'sst' in strCon:
-                varPpheight = 1.268049
-            elif 'trn' in strCon:
-                varPpheight = 0.2269044
-            elif 'target' in strCon:
-                varPpheight = 0.2261552
-
-            # In order to avoid division by zero, avoid zero-voxels:
-            lgcTmp = np.not_equal(vecData, 0.0)
-
-            # Apply PSC scaling, as described above:
-            vecData[lgcTmp] = \
-                np.multiply(
-                            np.divide(
-                                      np.multiply(
-                                                  vecData[lgcTmp],
-                                                  (100.0 * varPpheight)
-                                                  ),
-                                      vecMneEpi[lgcTmp]),
-                            1.0  # 1.4
-                            )
+            psc_cnv(vecData, vecMneEpi, get_ppheight(strDsgn, strCon=strCon))
 
         # ---------------------------------------------------------------------
         # *** Project data into visual space
@@ -198,39 +185,42 @@ def project(strRoi, strCon, strDpth, strDpthLbl, strPthNpy, varNumSub,
         # Number of processes to run in parallel:
         varPar = 10
 
-        # Split data into chunks:
-        lstData = np.array_split(vecData, varPar)
-        lstR2 = np.array_split(vecR2, varPar)
-        lstSd = np.array_split(vecSd, varPar)
-        lstX = np.array_split(vecX, varPar)
-        lstY = np.array_split(vecY, varPar)
+        # Number of vertices (the data are not needed in this process
+        # anymore):
+        varNumVrtx = aryData.shape[1]
+        del(aryData)
+        del(vecData)
+        del(vecMneEpi)
+        shm_detach(dicShmData)
 
-        # Create a queue to put the results in:
-        queOut = mp.Queue()
+        # Split data into chunks of vertices (as `np.array_split`). The
+        # processes read their chunk from the shared memory array:
+        varChnk, varRem = divmod(varNumVrtx, varPar)
+        vecIdxChnk = [(idxPrc * varChnk + min(idxPrc, varRem))
+                      for idxPrc in range(varPar + 1)]
+
+        # Shared memory array for results (visual space arrays and
+        # normalisation arrays), of the form aryRes[process, 2, x, y]:
+        dicShmRes = shm_create((varPar, 2, varNumX, varNumY))
 
         # Empty list for processes:
         lstPrcs = [None] * varPar
 
-        # Empty list for results of parallel processes:
-        lstRes = [None] * varPar
-
         # Create processes:
         for idxPrc in range(varPar):
-            lstPrcs[idxPrc] = mp.Process(target=project_par,
+            lstPrcs[idxPrc] = mp.Process(target=project_shm,
                                          args=(idxPrc,
-                                               lstData[idxPrc],
-                                               lstX[idxPrc],
-                                               lstY[idxPrc],
-                                               lstSd[idxPrc],
-                                               lstR2[idxPrc],
-                                               varThrR2,
-                                               varNumX,
-                                               varNumY,
-                                               varExtXmin,
-                                               varExtXmax,
-                                               varExtYmin,
-                                               varExtYmax,
-                                               queOut)
+                                               dicShmData,
+                                               vecIdxChnk[idxPrc],
+                                               vecIdxChnk[idxPrc + 1],
+                                               dicShmRes,
+                                               [varThrR2,
+                                                varNumX,
+                                                varNumY,
+                                                varExtXmin,
+                                                varExtXmax,
+                                                varExtYmin,
+                                                varExtYmax])
                                          )
 
             # Daemon (kills processes when exiting):
@@ -240,29 +230,19 @@ def project(strRoi, strCon, strDpth, strDpthLbl, strPthNpy, varNumSub,
         for idxPrc in range(varPar):
             lstPrcs[idxPrc].start()
 
-        # Collect results from queue:
-        for idxPrc in range(varPar):
-            lstRes[idxPrc] = queOut.get(True)
-
         # Join processes:
         for idxPrc in range(varPar):
             lstPrcs[idxPrc].join()
 
-        # List for results after re-ordering (visual space arrays and
-        # normalisation arrays):
-        lstVslSpc = [None] * varPar
-        lstNorm = [None] * varPar
+        aryRes = shm_get(dicShmRes)
+        shm_free(dicShmRes)
+        shm_free(dicShmData)
 
-        # Put output into correct order (unnecessary in this context but kept
-        # for consistency):
-        for idxRes in range(varPar):
-
-            # Index of results (first item in output list):
-            varTmpIdx = lstRes[idxRes][0]
-
-            # Put fitting results into list, in correct order:
-            lstVslSpc[varTmpIdx] = lstRes[idxRes][1]
-            lstNorm[varTmpIdx] = lstRes[idxRes][2]
+        for idxPrc in range(varPar):
+            if lstPrcs[idxPrc].exitcode != 0:
+                strErrMsg = ('ERROR. Projection into visual space failed in '
+                             + 'parallel process ' + str(idxPrc) + '.')
+                raise ValueError(strErrMsg)
 
         # Visual space array (2D array with bins of locations in visual space):
         aryVslSpc = np.zeros((varNumX, varNumY))
@@ -274,14 +254,17 @@ def project(strRoi, strCon, strDpth, strDpthLbl, strPthNpy, varNumSub,
 
         # Add up results from separate processes:
         for idxPrc in range(varPar):
-            aryVslSpc = np.add(lstVslSpc[idxPrc], aryVslSpc)
-            aryNorm = np.add(lstNorm[idxPrc], aryNorm)
+            aryVslSpc = np.add(aryRes[idxPrc, 0, :, :], aryVslSpc)
+            aryNorm = np.add(aryRes[idxPrc, 1, :, :], aryNorm)
 
         # Normalise:
         aryVslSpc = np.divide(aryVslSpc, aryNorm)
 
-        # Save results to disk:
-        np.save(strPthNpyTmp, aryVslSpc)
+        # Save results to disk (via temporary file), and record completed
+        # projection:
+        strPthNpyTmp = save_atomic(strPthNpyTmp, aryVslSpc)
+        ckpt_save(dicUnit, dicPrm, lstOt=[strPthNpyTmp],
+                  lgcResume=lgcResume)
 
     # -------------------------------------------------------------------------
     # *** Plot results
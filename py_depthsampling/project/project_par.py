@@ -20,6 +20,8 @@
 
 import numpy as np
 from py_depthsampling.project.utilities import crt_gauss
+from py_depthsampling.main.shm_arrays import shm_attach
+from py_depthsampling.main.shm_arrays import shm_detach
 
 
 def project_par(idxPrc, vecData, vecX, vecY, vecSd, vecR2, varThrR2, varNumX,
@@ -31,7 +33,7 @@ def project_par(idxPrc, vecData, vecX, vecY, vecSd, vecR2, varThrR2, varNumX,
     Notes
     -----
     The list with results is not returned directly, but placed on a
-    multiprocessing queue.
+    multiprocessing queue (unless `queOut` is `None`).
     """
     # Visual space array (2D array with bins of locations in visual
     # space):
@@ -97,5 +99,50 @@ def project_par(idxPrc, vecData, vecX, vecY, vecSd, vecR2, varThrR2, varNumX,
     # Create list containing subject data, and the process ID:
     lstOut = [idxPrc, aryVslSpc, aryNorm]
 
+    # Return output directly if there is no queue (e.g. when results are
+    # placed in shared memory by the caller):
+    if queOut is None:
+        return lstOut
+
     # Put output to queue:
     queOut.put(lstOut)
+
+
+def project_shm(idxPrc, dicShmData, varIdxSrt, varIdxEnd, dicShmRes,
+                lstPrm):
+    """
+    Project chunk of vertices from shared memory, in parallel.
+
+    Parameters
+    ----------
+    idxPrc : int
+        Process ID.
+    dicShmData : dict
+        Description of shared memory array with vertex data, of the form
+        aryData[6, vertex] (data, mean EPI, R2, SD, x-position, and
+        y-position, see `load_par`).
+    varIdxSrt, varIdxEnd : int
+        First and last (exclusive) vertex of current chunk.
+    dicShmRes : dict
+        Description of shared memory array for results, of the form
+        aryRes[process, 2, x, y] (visual space array and normalisation
+        array).
+    lstPrm : list
+        Further arguments of `project_par` (from `varThrR2` onwards).
+    """
+    aryData = shm_attach(dicShmData)
+    aryChnk = aryData[:, varIdxSrt:varIdxEnd]
+
+    # Data, x-position, y-position, SD, and R2 of current chunk:
+    lstOut = project_par(idxPrc, aryChnk[0, :], aryChnk[4, :], aryChnk[5, :],
+                         aryChnk[3, :], aryChnk[2, :], *lstPrm, None)
+
+    del(aryChnk)
+    del(aryData)
+    shm_detach(dicShmData)
+
+    aryRes = shm_attach(dicShmRes)
+    aryRes[idxPrc, 0, ...] = lstOut[1]
+    aryRes[idxPrc, 1, ...] = lstOut[2]
+    del(aryRes)
+    shm_detach(dicShmRes)
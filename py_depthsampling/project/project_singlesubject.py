@@ -23,6 +23,11 @@ import numpy as np
 import multiprocessing as mp
 from py_depthsampling.project.load_par import load_par
 from py_depthsampling.project.project_par import project_par
+from py_depthsampling.main.shm_arrays import shm_free
+from py_depthsampling.main.shm_arrays import shm_get
+from py_depthsampling.main.shm_arrays import shm_init
+from py_depthsampling.main.psc import get_ppheight
+from py_depthsampling.main.psc import psc_cnv
 from py_depthsampling.project.plot import plot
 
 
@@ -71,6 +76,12 @@ varDpi = 80.0
 # lstCon = ['polar_angle', 'x_pos', 'y_pos', 'SD', 'R2']
 lstCon = ['Pd_sst', 'Cd_sst', 'Ps_sst']
 
+# Design of each condition, for conversion of parameter estimates to percent
+# signal change (see `py_depthsampling.main.psc`):
+dicDsgn = {'Pd_sst': 'sst',
+           'Cd_sst': 'sst',
+           'Ps_sst': 'sst'}
+
 # Path of vtk mesh with data to project into visual space (e.g. parameter
 # estimates; subject ID, hemisphere, and contion level left open).
 strPthData = '/media/sf_D_DRIVE/MRI_Data_PhD/05_PacMan/{}/cbs/{}/feat_level_2_{}_cope.vtk'  #noqa
@@ -171,6 +182,10 @@ for idxDpth in range(len(lstDpth)):  #noqa
 
                 print('--Load data from vtk meshes')
 
+                # Start resource tracker before the processes, which place their
+                # results in shared memory (see `shm_init`):
+                shm_init()
+
                 # Create a queue to put the results in:
                 queOut = mp.Queue()
 
@@ -240,13 +255,18 @@ for idxDpth in range(len(lstDpth)):  #noqa
                     # Index of results (first item in output list):
                     varTmpIdx = lstRes[idxSub][0]
 
+                    # Subject data, from shared memory array (see
+                    # `load_par`):
+                    aryTmp = shm_get(lstRes[idxSub][1])
+                    shm_free(lstRes[idxSub][1])
+
                     # Put fitting results into list, in correct order:
-                    lstData[varTmpIdx] = lstRes[idxSub][1]
-                    lstMneEpi[varTmpIdx] = lstRes[idxSub][2]
-                    lstR2[varTmpIdx] = lstRes[idxSub][3]
-                    lstSd[varTmpIdx] = lstRes[idxSub][4]
-                    lstX[varTmpIdx] = lstRes[idxSub][5]
-                    lstY[varTmpIdx] = lstRes[idxSub][6]
+                    lstData[varTmpIdx] = aryTmp[0, :]
+                    lstMneEpi[varTmpIdx] = aryTmp[1, :]
+                    lstR2[varTmpIdx] = aryTmp[2, :]
+                    lstSd[varTmpIdx] = aryTmp[3, :]
+                    lstX[varTmpIdx] = aryTmp[4, :]
+                    lstY[varTmpIdx] = aryTmp[5, :]
 
                 # Concatenate arrays from all subjects:
                 # vecData = np.concatenate(lstData[:])
@@ -267,52 +287,18 @@ for idxDpth in range(len(lstDpth)):  #noqa
                 # -------------------------------------------------------------
                 # *** Convert cope to percent signal change
 
-                # According to the FSL documentation
-                # (https://fsl.fmrib.ox.ac.uk/fsl/fslwiki/FEAT/UserGuide), the
-                # PEs can be scaled to signal change with respect to the mean
-                # (over time within voxel): "This is achieved by scaling the PE
-                # or COPE values by (100*) the peak-peak height of the
-                # regressor (or effective regressor in the case of COPEs) and
-                # then by dividing by mean_func (the mean over time of
-                # filtered_func_data)."
-
-                # Only perform scaling if the data is from an FSL cope file:
+                # Only perform scaling if the data is from an FSL cope file (in
+                # place, see `py_depthsampling.main.psc`):
                 if 'cope' in strPthData:
                     print('--Convert cope to percent signal change.')
 
-                    # The peak-peak height depends on the predictor (i.e.
-                    # condition).
-                    if 'sst' in lstCon[idxCon]:
-                        varPpheight = 1.268049
-                    elif 'trn' in lstCon[idxCon]:
-                        varPpheight = 0.2269044
+                    # Peak-peak height of the regressor:
+                    varPpheight = get_ppheight(dicDsgn.get(lstCon[idxCon]),
+                                               strCon=lstCon[idxCon])
 
                     # Loop through subjects:
                     for idxSub in range(varNumSub):
-
-                        # Get data vectors from list:
-                        vecData = lstData[idxSub]
-                        vecMneEpi = lstMneEpi[idxSub]
-
-                        # In order to avoid division by zero, avoid
-                        # zero-voxels:
-                        lgcTmp = np.not_equal(vecData, 0.0)
-
-                        # Apply PSC scaling, as described above:
-                        vecData[lgcTmp] = \
-                            np.multiply(
-                                        np.divide(
-                                                  np.multiply(
-                                                              vecData[lgcTmp],
-                                                              (100.0
-                                                               * varPpheight)
-                                                              ),
-                                                  vecMneEpi[lgcTmp]),
-                                        1.0  # 1.4
-                                        )
-
-                        # Put PSC-scaled data back into list:
-                        lstData[idxSub] = np.copy(vecData)
+                        psc_cnv(lstData[idxSub], lstMneEpi[idxSub], varPpheight)
 
                 # -------------------------------------------------------------
                 # *** Project data into visual space
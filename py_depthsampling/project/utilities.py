@@ -87,6 +87,11 @@ def get_data(strData, strPthMneEpi, strPthR2, strPthSd, strPthX, strPthY,
     # -------------------------------------------------------------------------
     # *** Load data
 
+    # Import CSV file with ROI definition. Only the indicies of the vertices
+    # contained in the ROI are needed. Only vertices that are contained in the
+    # ROI are loaded from the vtk meshes.
+    vecRoiIdx = load_csv_roi(strCsvRoi, varNumHdrRoi, strCol='index')
+
     if '.npy' in strData:
 
         # Load time series data from npy file:
@@ -112,61 +117,52 @@ def get_data(strData, strPthMneEpi, strPthR2, strPthSd, strPthX, strPthY,
         # New shape: aryData[idxVertex, idxDepth]
         aryData = aryData[:, varTr, :].T
 
+        # Only keep vertices that are contained in the ROI:
+        aryData = aryData[vecRoiIdx, :]
+
     else:
 
         # Load data to be projected from vtk mesh:
         aryData = load_vtk_multi(strData,
                                  strPrcdData,
                                  varNumLne,
-                                 varNumDpth)
+                                 varNumDpth,
+                                 vecIdx=vecRoiIdx)
 
     # Load mean EPI:
     aryMneEpi = load_vtk_multi(strPthMneEpi,
                                strPrcdData,
                                varNumLne,
-                               varNumDpth)
+                               varNumDpth,
+                               vecIdx=vecRoiIdx)
 
     # Load R2 map:
     aryR2 = load_vtk_multi(strPthR2,
                            strPrcdData,
                            varNumLne,
-                           varNumDpth)
+                           varNumDpth,
+                           vecIdx=vecRoiIdx)
 
     # Load SD map:
     arySd = load_vtk_multi(strPthSd,
                            strPrcdData,
                            varNumLne,
-                           varNumDpth)
+                           varNumDpth,
+                           vecIdx=vecRoiIdx)
 
     # Load x position map:
     aryX = load_vtk_multi(strPthX,
                           strPrcdData,
                           varNumLne,
-                          varNumDpth)
+                          varNumDpth,
+                          vecIdx=vecRoiIdx)
 
     # Load y position map:
     aryY = load_vtk_multi(strPthY,
                           strPrcdData,
                           varNumLne,
-                          varNumDpth)
-
-    # Import CSV file with ROI definition
-    aryRoiVrtx = load_csv_roi(strCsvRoi, varNumHdrRoi)
-
-    # -------------------------------------------------------------------------
-    # *** Apply ROI mask
-
-    # The second column of the array "aryRoiVrtx" contains the indicies of
-    # the vertices contained in the ROI. We extract that information:
-    vecRoiIdx = aryRoiVrtx[:, 1].astype(np.int64)
-
-    # Only keep vertices that are contained in the ROI:
-    aryData = aryData[vecRoiIdx, :]
-    aryMneEpi = aryMneEpi[vecRoiIdx, :]
-    aryR2 = aryR2[vecRoiIdx, :]
-    arySd = arySd[vecRoiIdx, :]
-    aryX = aryX[vecRoiIdx, :]
-    aryY = aryY[vecRoiIdx, :]
+                          varNumDpth,
+                          vecIdx=vecRoiIdx)
 
     # -------------------------------------------------------------------------
     # *** Average across depth levels
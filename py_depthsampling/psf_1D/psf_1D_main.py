@@ -24,7 +24,21 @@ import pandas as pd
 import seaborn as sns
 import multiprocessing as mp
 from py_depthsampling.project.load_par import load_par
-from py_depthsampling.psf_1D.project_ecc_par import project_ecc_par
+from py_depthsampling.project.load_par import gather_par
+from py_depthsampling.project.load_par import par_paths
+from py_depthsampling.psf_1D.project_ecc_par import project_ecc_shm
+from py_depthsampling.main.shm_arrays import shm_attach
+from py_depthsampling.main.shm_arrays import shm_create
+from py_depthsampling.main.shm_arrays import shm_detach
+from py_depthsampling.main.shm_arrays import shm_free
+from py_depthsampling.main.shm_arrays import shm_get
+from py_depthsampling.main.shm_arrays import shm_init
+from py_depthsampling.main.checkpoint import ckpt_load
+from py_depthsampling.main.checkpoint import ckpt_save
+from py_depthsampling.main.checkpoint import get_ckpt_dir
+from py_depthsampling.main.checkpoint import save_atomic
+from py_depthsampling.main.psc import get_ppheight
+from py_depthsampling.main.psc import psc_cnv
 from py_depthsampling.plot.plt_psf import plt_psf
 from py_depthsampling.psf_1D.fit_model import fitGauss
 from py_depthsampling.psf_1D.fit_model import fitLin
@@ -89,6 +103,17 @@ varDpi = 80.0
 # lstCon = ['polar_angle', 'x_pos', 'y_pos', 'SD', 'R2']
 lstCon = ['Pd_sst', 'Cd_sst', 'Ps_sst']
 
+# Design of each condition, for conversion of parameter estimates to percent
+# signal change (see `py_depthsampling.main.psc`):
+dicDsgn = {'Pd_sst': 'sst',
+           'Cd_sst': 'sst',
+           'Ps_sst': 'sst'}
+
+# Resume after a crash, i.e. skip projections that have been completed with
+# identical parameters and input files (see `py_depthsampling.main.checkpoint`;
+# if `False`, existing npz files are used):
+lgcResume = False
+
 # Path of vtk mesh with data to project into visual space (e.g. parameter
 # estimates; subject ID, hemisphere, and contion level left open).
 strPthData = '/media/sf_D_DRIVE/MRI_Data_PhD/05_PacMan/{}/cbs/{}/feat_level_2_{}_cope.vtk'  #noqa
@@ -205,7 +230,31 @@ for idxDpth in range(len(lstDpth)):  #noqa
                                             lstCon[idxCon],
                                             lstDpthLbl[idxDpth])
 
-            if os.path.isfile(strPthNpyTmp):
+            # Unit of work and parameters of checkpoint (projections are not
+            # repeated unless a parameter or input file changes, see
+            # `py_depthsampling.main.checkpoint`):
+            dicUnit = {'roi': lstRoi[idxRoi],
+                       'condition': lstCon[idxCon],
+                       'depth': lstDpthLbl[idxDpth]}
+            dicPrm = {'lstPth': par_paths(lstSubIds, lstCon[idxCon],
+                                          lstRoi[idxRoi], strPthData,
+                                          strPthMneEpi, strPthR2, strPthX,
+                                          strPthY, strPthSd, strCsvRoi),
+                      'lstDpth': lstDpth[idxDpth],
+                      'varNumDpth': varNumDpth,
+                      'varThrR2': varThrR2,
+                      'varNumEcc': varNumEcc,
+                      'tplExt': [varExtXmin, varExtXmax, varExtYmin,
+                                 varExtYmax]}
+
+            # Unless resuming with checkpoints, an existing npz file is used:
+            if get_ckpt_dir(lgcResume=lgcResume) is None:
+                lgcDone = os.path.isfile(strPthNpyTmp)
+            else:
+                lgcDone = ckpt_load(dicUnit, dicPrm,
+                                    lgcResume=True) is not None
+
+            if lgcDone:
 
                 print('--Load existing visual field projection')
 
@@ -224,6 +273,10 @@ for idxDpth in range(len(lstDpth)):  #noqa
                 # Number of processes to run in parallel:
                 varPar = varNumSub
 
+                # Start resource tracker before the processes, which place their
+                # results in shared memory (see `shm_init`):
+                shm_init()
+
                 # Create a queue to put the results in:
                 queOut = mp.Queue()
 
@@ -263,7 +316,8 @@ for idxDpth in range(len(lstDpth)):  #noqa
                 for idxPrc in range(varPar):
                     lstPrcs[idxPrc].start()
 
-                # Collect results from queue:
+                # Collect results from queue (descriptions of shared memory
+                # arrays):
                 for idxPrc in range(varPar):
                     lstRes[idxPrc] = queOut.get(True)
 
@@ -271,92 +325,28 @@ for idxDpth in range(len(lstDpth)):  #noqa
                 for idxPrc in range(varPar):
                     lstPrcs[idxPrc].join()
 
-                # List for single-subject data vectors:
-                lstData = [None] * varPar
-
-                # List for single-subject mean EPI vectors:
-                lstMneEpi = [None] * varPar
-
-                # List of single subject R2 vectors:
-                lstR2 = [None] * varPar
-
-                # List for single subject SD vectors (pRF sizes):
-                lstSd = [None] * varPar
-
-                # List for single subject x-position vectors:
-                lstX = [None] * varPar
-
-                # List for single subject y-position vectors:
-                lstY = [None] * varPar
-
-                # Put output into correct order (unnecessary in this context
-                # but kept for consistency):
-                for idxRes in range(varPar):
-
-                    # Index of results (first item in output list):
-                    varTmpIdx = lstRes[idxRes][0]
-
-                    # Put fitting results into list, in correct order:
-                    lstData[varTmpIdx] = lstRes[idxRes][1]
-                    lstMneEpi[varTmpIdx] = lstRes[idxRes][2]
-                    lstR2[varTmpIdx] = lstRes[idxRes][3]
-                    lstSd[varTmpIdx] = lstRes[idxRes][4]
-                    lstX[varTmpIdx] = lstRes[idxRes][5]
-                    lstY[varTmpIdx] = lstRes[idxRes][6]
-
-                # Concatenate arrays from all subjects:
-                vecData = np.concatenate(lstData[:])
-                vecMneEpi = np.concatenate(lstMneEpi[:])
-                vecR2 = np.concatenate(lstR2[:])
-                vecSd = np.concatenate(lstSd[:])
-                vecX = np.concatenate(lstX[:])
-                vecY = np.concatenate(lstY[:])
-
-                # Delete original lists:
-                del(lstData)
-                del(lstMneEpi)
-                del(lstR2)
-                del(lstSd)
-                del(lstX)
-                del(lstY)
+                # Concatenate data from all subjects, in a shared memory array
+                # of the form aryData[6, vertex] (data, mean EPI, R2, SD,
+                # x-position, and y-position, see `load_par`):
+                dicShmData = gather_par(lstRes)
+                aryData = shm_attach(dicShmData)
+                vecData = aryData[0, :]
+                vecMneEpi = aryData[1, :]
 
                 # -------------------------------------------------------------
                 # *** Convert cope to percent signal change
 
-                # According to the FSL documentation
-                # (https://fsl.fmrib.ox.ac.uk/fsl/fslwiki/FEAT/UserGuide), the
-                # PEs can be scaled to signal change with respect to the mean
-                # (over time within voxel): "This is achieved by scaling the PE
-                # or COPE values by (100*) the peak-peak height of the
-                # regressor (or effective regressor in the case of COPEs) and
-                # then by dividing by mean_func (the mean over time of
-                # filtered_func_data)."
-
-                # Only perform scaling if the data is from an FSL cope file:
+                # Only perform scaling if the data is from an FSL cope file (in
+                # place, in the shared memory array, see
+                # `py_depthsampling.main.psc`):
                 if 'cope' in strPthData:
                     print('--Convert cope to percent signal change.')
 
-                    # The peak-peak height depends on the predictor (i.e.
-                    # condition).
-                    if 'sst' in lstCon[idxCon]:
-                        varPpheight = 1.268049
-                    elif 'trn' in lstCon[idxCon]:
-                        varPpheight = 0.2269044
-
-                    # In order to avoid division by zero, avoid zero-voxels:
-                    lgcTmp = np.not_equal(vecData, 0.0)
-
-                    # Apply PSC scaling, as described above:
-                    vecData[lgcTmp] = \
-                        np.multiply(
-                                    np.divide(
-                                              np.multiply(
-                                                          vecData[lgcTmp],
-                                                          (100.0 * varPpheight)
-                                                          ),
-                                              vecMneEpi[lgcTmp]),
-                                    1.0  # 1.4
-                                    )
+                    # Peak-peak height of the regressor:
+                    varPpheight = get_ppheight(dicDsgn.get(lstCon[idxCon]),
+                                               strCon=lstCon[idxCon])
+
+                    psc_cnv(vecData, vecMneEpi, varPpheight)
 
                 # -------------------------------------------------------------
                 # *** Project data into visual space
@@ -366,38 +356,42 @@ for idxDpth in range(len(lstDpth)):  #noqa
                 # Number of processes to run in parallel:
                 varPar = 11
 
-                # Split data into chunks:
-                lstData = np.array_split(vecData, varPar)
-                lstR2 = np.array_split(vecR2, varPar)
-                lstSd = np.array_split(vecSd, varPar)
-                lstX = np.array_split(vecX, varPar)
-                lstY = np.array_split(vecY, varPar)
-
-                # Create a queue to put the results in:
-                queOut = mp.Queue()
+                # Number of vertices (the data are not needed in this process
+                # anymore):
+                varNumVrtx = aryData.shape[1]
+                del(aryData)
+                del(vecData)
+                del(vecMneEpi)
+                shm_detach(dicShmData)
+
+                # Split data into chunks of vertices (as `np.array_split`).
+                # The processes read their chunk from the shared memory array:
+                varChnk, varRem = divmod(varNumVrtx, varPar)
+                vecIdxChnk = [(idxPrc * varChnk + min(idxPrc, varRem))
+                              for idxPrc in range(varPar + 1)]
+
+                # Shared memory array for results (visual space vectors and
+                # normalisation vectors), of the form aryRes[process, 2,
+                # eccentricity]:
+                dicShmRes = shm_create((varPar, 2, varNumEcc))
 
                 # Empty list for processes:
                 lstPrcs = [None] * varPar
 
-                # Empty list for results of parallel processes:
-                lstRes = [None] * varPar
-
                 # Create processes:
                 for idxPrc in range(varPar):
-                    lstPrcs[idxPrc] = mp.Process(target=project_ecc_par,
+                    lstPrcs[idxPrc] = mp.Process(target=project_ecc_shm,
                                                  args=(idxPrc,
-                                                       lstData[idxPrc],
-                                                       lstX[idxPrc],
-                                                       lstY[idxPrc],
-                                                       lstSd[idxPrc],
-                                                       lstR2[idxPrc],
-                                                       varThrR2,
-                                                       varNumEcc,
-                                                       varExtXmin,
-                                                       varExtXmax,
-                                                       varExtYmin,
-                                                       varExtYmax,
-                                                       queOut)
+                                                       dicShmData,
+                                                       vecIdxChnk[idxPrc],
+                                                       vecIdxChnk[idxPrc + 1],
+                                                       dicShmRes,
+                                                       [varThrR2,
+                                                        varNumEcc,
+                                                        varExtXmin,
+                                                        varExtXmax,
+                                                        varExtYmin,
+                                                        varExtYmax])
                                                  )
 
                     # Daemon (kills processes when exiting):
@@ -407,29 +401,20 @@ for idxDpth in range(len(lstDpth)):  #noqa
                 for idxPrc in range(varPar):
                     lstPrcs[idxPrc].start()
 
-                # Collect results from queue:
-                for idxPrc in range(varPar):
-                    lstRes[idxPrc] = queOut.get(True)
-
                 # Join processes:
                 for idxPrc in range(varPar):
                     lstPrcs[idxPrc].join()
 
-                # List for results after re-ordering (visual space arrays and
-                # normalisation arrays):
-                lstVslSpc = [None] * varPar
-                lstNorm = [None] * varPar
+                aryRes = shm_get(dicShmRes)
+                shm_free(dicShmRes)
+                shm_free(dicShmData)
 
-                # Put output into correct order (unnecessary in this context
-                # but kept for consistency):
-                for idxRes in range(varPar):
-
-                    # Index of results (first item in output list):
-                    varTmpIdx = lstRes[idxRes][0]
-
-                    # Put fitting results into list, in correct order:
-                    lstVslSpc[varTmpIdx] = lstRes[idxRes][1]
-                    lstNorm[varTmpIdx] = lstRes[idxRes][2]
+                for idxPrc in range(varPar):
+                    if lstPrcs[idxPrc].exitcode != 0:
+                        strErrMsg = ('ERROR. Projection into visual space '
+                                     + 'failed in parallel process '
+                                     + str(idxPrc) + '.')
+                        raise ValueError(strErrMsg)
 
                 # Visual space array (2D array with bins of locations in visual
                 # space):
@@ -442,16 +427,19 @@ for idxDpth in range(len(lstDpth)):  #noqa
 
                 # Add up results from separate processes:
                 for idxPrc in range(varPar):
-                    vecVslSpc = np.add(lstVslSpc[idxPrc], vecVslSpc)
-                    vecNorm = np.add(lstNorm[idxPrc], vecNorm)
+                    vecVslSpc = np.add(aryRes[idxPrc, 0, :], vecVslSpc)
+                    vecNorm = np.add(aryRes[idxPrc, 1, :], vecNorm)
 
                 # Normalise:
                 vecVslSpc = np.divide(vecVslSpc, vecNorm)
 
-                # Save results to disk:
-                np.savez(strPthNpyTmp,
-                         vecVslSpc=vecVslSpc,
-                         vecNorm=vecNorm)
+                # Save results to disk (via temporary file), and record
+                # completed projection:
+                strPthNpyTmp = save_atomic(strPthNpyTmp,
+                                           vecVslSpc=vecVslSpc,
+                                           vecNorm=vecNorm)
+                ckpt_save(dicUnit, dicPrm, lstOt=[strPthNpyTmp],
+                          lgcResume=lgcResume)
 
             # -----------------------------------------------------------------
             # *** Plot results
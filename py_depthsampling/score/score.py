@@ -22,8 +22,10 @@ Function of the depth sampling pipeline.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import itertools
 import numpy as np
+from py_depthsampling.permutation.perm_engine import get_num_perm
+from py_depthsampling.permutation.perm_engine import iter_perm
+from py_depthsampling.permutation.perm_engine import perm_avg
 
 
 # ----------------------------------------------------------------------------
@@ -146,119 +148,63 @@ varDiff = np.absolute(np.subtract(varScr01, varScr02))
 
 print('---Create permutation samples')
 
-# Random array that is used to permute V1 and V2 labels within subjects, of the
-# form aryRnd[idxIteration, idxSub]. For each iteration and subject, there is
-# either a zero or a one. 'Zero' means that the actual V1 value gets assigned
-# to the permuted 'V1' group and the actual V2 value gets assigned to the
-# permuted 'V2' group. 'One' means that the labels are switched, i.e. the
-# actual V1 label get assignet to the 'V2' group and vice versa.
-if not(varNumIt is None):
-    # Monte Carlo resampling:
-    aryRnd = np.random.randint(0, high=2, size=(varNumIt, varNumSubs))
-else:
-    # In case of tractable number of permutations, create a list of all
-    # possible permutations (Bernoulli sequence).
-    lstBnl = list(itertools.product([0, 1], repeat=varNumSubs))
-    aryRnd = np.array(lstBnl)
-    # Number of resampling cases:
-    varNumIt = len(lstBnl)
+# Exact test (all possible permutations)?
+lgcExct = varNumIt is None
+
+# Number of resampling cases:
+if lgcExct:
     print('------Testing complete set of possible resampling combinations.')
+varNumIt = get_num_perm(varNumSubs, varNumIt=varNumIt)
 print(('------Number of combinations: ' + str(varNumIt)))
 
-# We need two versions of the randomisation array, one for sampling from the
-# first input array (e.g. V1), and a second version to sample from the second
-# input array (e.g. V2). (I.e. the second version is the opposite of the first
-# version.)
-aryRnd01 = np.equal(aryRnd, 1)
-aryRnd02 = np.equal(aryRnd, 0)
-del(aryRnd)
-
-# Arrays with permuted depth profiles for the two randomised groups:
-aryDpthRnd01 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-aryDpthRnd02 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-
-# Arrays for number of vertices for randomised groups:
-aryNumIncRnd01 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-aryNumIncRnd02 = np.zeros((varNumIt, varNumSubs, varNumDpt))
-
-# Loop through iterations:
-for idxIt in range(varNumIt):
-
-    # Assign values from original group 1 to permutation group 1:
-    aryDpthRnd01[idxIt, aryRnd01[idxIt, :], :] = \
-        aryCtrRoi01[aryRnd01[idxIt, :], :]
-
-    # Assign values from original group 2 to permutation group 1:
-    aryDpthRnd01[idxIt, aryRnd02[idxIt, :], :] = \
-        aryCtrRoi02[aryRnd02[idxIt, :], :]
-
-    # Assign values from original group 1 to permutation group 2:
-    aryDpthRnd02[idxIt, aryRnd02[idxIt, :], :] = \
-        aryCtrRoi01[aryRnd02[idxIt, :], :]
-
-    # Assign values from original group 2 to permutation group 2:
-    aryDpthRnd02[idxIt, aryRnd01[idxIt, :], :] = \
-        aryCtrRoi02[aryRnd01[idxIt, :], :]
-
-    # Assign number of vertices from original group 1 to permutation group 1:
-    aryNumIncRnd01[idxIt, aryRnd01[idxIt, :], :] = \
-        vecNumIncRoi01[aryRnd01[idxIt, :], None]
-
-    # Assign number of vertices from original group 2 to permutation group 1:
-    aryNumIncRnd01[idxIt, aryRnd02[idxIt, :], :] = \
-        vecNumIncRoi02[aryRnd02[idxIt, :], None]
-
-    # Assign number of vertices from original group 1 to permutation group 2:
-    aryNumIncRnd02[idxIt, aryRnd02[idxIt, :], :] = \
-        vecNumIncRoi01[aryRnd02[idxIt, :], None]
-
-    # Assign number of vertices from original group 2 to permutation group 2:
-    aryNumIncRnd02[idxIt, aryRnd01[idxIt, :], :] = \
-        vecNumIncRoi02[aryRnd01[idxIt, :], None]
-
-# Take mean across subjects in permutation samples:
-aryDpthRnd01 = np.average(aryDpthRnd01, axis=1, weights=aryNumIncRnd01)
-aryDpthRnd02 = np.average(aryDpthRnd02, axis=1, weights=aryNumIncRnd02)
-
-a1 = aryDpthRnd01.T
-a2 = aryDpthRnd02.T
-
-
-# ----------------------------------------------------------------------------
-# *** Permutation granularity score
-
 print('---Compute granularity score on resampled depth profiles')
 
-# The agranularity score on the empirical depth profiles will be compared with
-# the permutation null distribution.
-
-# Mean signal in granular compartment, first randomised ROI:
-vecGrn01 = np.mean(aryDpthRnd01[:, lstGrn], axis=1)
-
-# Mean signal in granular compartment, second randomised ROI:
-vecGrn02 = np.mean(aryDpthRnd02[:, lstGrn], axis=1)
-
-# Mean signal in agranular compartment, first randomised ROI:
-vecAgr01 = np.mean(aryDpthRnd01[:, lstAgr], axis=1)
-
-# Mean signal in agranular compartment, second randomised ROI:
-vecAgr02 = np.mean(aryDpthRnd02[:, lstAgr], axis=1)
-
-# Granularity score - first ROI:
-vecScr01 = np.subtract(vecGrn01, vecAgr01)
-
-# Granularity score - second ROI:
-vecScr02 = np.subtract(vecGrn02, vecAgr02)
-
-
-# -------------------------------------------------------------------------
-# *** Create null distribution
-
-print('---Create null distribution')
-
 # The absolute difference in granularity scores from the two resampled groups
 # is the null distribution:
-vecNull = np.absolute(np.subtract(vecScr01, vecScr02))
+vecNull = np.zeros((varNumIt))
+
+# Permutation samples are created (and granularity scores are computed) in
+# blocks of iterations, so that memory usage does not depend on the number of
+# iterations. Random array that is used to permute V1 and V2 labels within
+# subjects, of the form aryRnd[idxIteration, idxSub]. For each iteration and
+# subject, there is either a zero or a one. 'One' means that the actual V1
+# value (and number of vertices) gets assigned to the permuted 'V1' group and
+# the actual V2 value gets assigned to the permuted 'V2' group. 'Zero' means
+# that the labels are switched, i.e. the actual V1 label get assignet to the
+# 'V2' group and vice versa. In case of small enough sample size, all possible
+# permutations (Bernoulli sequences) are enumerated.
+for idxStrt, aryRnd in iter_perm(varNumSubs,
+                                 varNumIt=(None if lgcExct else varNumIt)):
+
+    idxEnd = idxStrt + aryRnd.shape[0]
+
+    # Weighted mean across subjects in permutation samples (with number of
+    # vertices from the original group of each depth profile):
+    aryDpthRnd01 = perm_avg(aryCtrRoi01, aryCtrRoi02, aryRnd, vecNumIncRoi01,
+                            vecNumIncRoi02)
+    aryDpthRnd02 = perm_avg(aryCtrRoi01, aryCtrRoi02, np.subtract(1, aryRnd),
+                            vecNumIncRoi01, vecNumIncRoi02)
+
+    # Mean signal in granular compartment, first randomised ROI:
+    vecGrn01 = np.mean(aryDpthRnd01[:, lstGrn], axis=1)
+
+    # Mean signal in granular compartment, second randomised ROI:
+    vecGrn02 = np.mean(aryDpthRnd02[:, lstGrn], axis=1)
+
+    # Mean signal in agranular compartment, first randomised ROI:
+    vecAgr01 = np.mean(aryDpthRnd01[:, lstAgr], axis=1)
+
+    # Mean signal in agranular compartment, second randomised ROI:
+    vecAgr02 = np.mean(aryDpthRnd02[:, lstAgr], axis=1)
+
+    # Granularity score - first ROI:
+    vecScr01 = np.subtract(vecGrn01, vecAgr01)
+
+    # Granularity score - second ROI:
+    vecScr02 = np.subtract(vecGrn02, vecAgr02)
+
+    # Absolute difference in granularity scores:
+    vecNull[idxStrt:idxEnd] = np.absolute(np.subtract(vecScr01, vecScr02))
 
 
 # ----------------------------------------------------------------------------
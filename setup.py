@@ -17,6 +17,7 @@ setup(name='py_depthsampling',
       # author_email='ingo.marquardt@gmx.de',
       license='GNU General Public License Version 3',
       install_requires=['numpy', 'scipy', 'nibabel', 'matplotlib'],
+      extras_require={'pack': ['h5py'], 'batch': ['pyyaml']},
       # setup_requires=['numpy'],
       # keywords=['fMRI'],
       # long_description=long_description,